@@ -0,0 +1,74 @@
+"""
+Ambiente Alembic: stesso database (DATABASE_URL) e stessi modelli dell'applicazione.
+
+- Una transazione per migrazione
+- Su PostgreSQL lock_timeout limita l'attesa dei lock DDL: una migrazione
+  che non ottiene il lock fallisce invece di accodare tutte le query
+- Su SQLite (sviluppo) le ALTER passano dalla modalità batch
+- L'avvio dell'app passa la propria connessione in config.attributes
+- Gli indici trigrammi della 0012 (su espressioni, solo PostgreSQL) non sono
+  nei modelli: esclusi dal confronto di autogenerate / alembic check
+"""
+
+from logging.config import fileConfig
+
+from alembic import context
+
+import app.models  # noqa: F401  registra tutti i modelli su Base.metadata
+from app.database import Base, engine
+from app.migrazioni import MIGRAZIONI_LOCK_TIMEOUT
+
+target_metadata = Base.metadata
+
+# Log della configurazione solo da riga di comando: all'avvio dell'app restano quelli dell'app
+if context.config.config_file_name is not None and "connection" not in context.config.attributes:
+    fileConfig(context.config.config_file_name, disable_existing_loggers=False)
+
+
+def includi_oggetto(oggetto, nome, tipo, riflesso, confronto) -> bool:
+    """Confronto modelli/database senza gli indici gestiti solo dalle migrazioni"""
+    return not (tipo == "index" and riflesso and nome.endswith("_trgm"))
+
+
+def run_migrations_offline() -> None:
+    """Genera lo SQL senza connettersi (alembic upgrade head --sql)"""
+    context.configure(
+        url=engine.url.render_as_string(hide_password=False),
+        target_metadata=target_metadata,
+        literal_binds=True,
+        transaction_per_migration=True,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def _esegui_migrazioni(connessione) -> None:
+    if connessione.dialect.name == "postgresql":
+        connessione.exec_driver_sql(f"SET lock_timeout = '{MIGRAZIONI_LOCK_TIMEOUT}'")
+        connessione.commit()
+
+    context.configure(
+        connection=connessione,
+        target_metadata=target_metadata,
+        transaction_per_migration=True,
+        render_as_batch=connessione.dialect.name == "sqlite",
+        include_object=includi_oggetto,
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online() -> None:
+    connessione = context.config.attributes.get("connection")
+    if connessione is not None:
+        _esegui_migrazioni(connessione)
+        return
+
+    with engine.connect() as connessione:
+        _esegui_migrazioni(connessione)
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
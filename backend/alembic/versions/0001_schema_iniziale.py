@@ -0,0 +1,170 @@
+"""Schema iniziale (ex crea_db.sql)
+
+Revision ID: 0001
+Revises:
+Create Date: 2025-01-15
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0001"
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "clienti",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("nome", sa.String(255), nullable=False),
+        sa.Column("partita_iva", sa.String(20)),
+        sa.Column("indirizzo_consegna", sa.Text),
+        sa.Column("telefono_fisso", sa.String(30)),
+        sa.Column("cellulare", sa.String(30)),
+        sa.Column("email", sa.String(255)),
+        sa.Column("referente", sa.String(255)),
+        sa.Column("pedana_standard", sa.String(10)),
+        sa.Column("riba", sa.Boolean, server_default=sa.false()),
+        sa.Column("note", sa.Text),
+        sa.Column("creato_il", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index("idx_clienti_nome", "clienti", ["nome"])
+
+    op.create_table(
+        "mulini",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("nome", sa.String(255), nullable=False),
+        sa.Column("indirizzo_ritiro", sa.Text),
+        sa.Column("telefono", sa.String(30)),
+        sa.Column("email1", sa.String(255)),
+        sa.Column("email2", sa.String(255)),
+        sa.Column("email3", sa.String(255)),
+        sa.Column("note", sa.Text),
+    )
+    op.create_index("idx_mulini_nome", "mulini", ["nome"])
+
+    op.create_table(
+        "prodotti",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("nome", sa.String(255), nullable=False),
+        sa.Column(
+            "mulino_id", sa.Integer,
+            sa.ForeignKey("mulini.id", ondelete="RESTRICT"), nullable=False
+        ),
+        sa.Column("tipologia", sa.String(50)),
+        sa.Column("tipo_provvigione", sa.String(20), server_default="percentuale"),
+        sa.Column("valore_provvigione", sa.Numeric(10, 2), server_default="3"),
+        sa.Column("note", sa.Text),
+    )
+    op.create_index("idx_prodotti_nome", "prodotti", ["nome"])
+    op.create_index("idx_prodotti_mulino", "prodotti", ["mulino_id"])
+
+    op.create_table(
+        "trasportatori",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("nome", sa.String(255), nullable=False),
+        sa.Column("telefono", sa.String(30)),
+        sa.Column("note", sa.Text),
+    )
+    op.create_index("idx_trasportatori_nome", "trasportatori", ["nome"])
+
+    # Carichi nel formato originale: tipo_carico / data_carico, stati aperto/ritirato
+    op.create_table(
+        "carichi",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column(
+            "trasportatore_id", sa.Integer,
+            sa.ForeignKey("trasportatori.id", ondelete="SET NULL")
+        ),
+        sa.Column("tipo_carico", sa.String(20), nullable=False),
+        sa.Column("data_carico", sa.Date),
+        sa.Column("stato", sa.String(20), server_default="aperto"),
+        sa.Column("note", sa.Text),
+        sa.Column("creato_il", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index("idx_carichi_stato", "carichi", ["stato"])
+    op.create_index("idx_carichi_tipo", "carichi", ["tipo_carico"])
+
+    op.create_table(
+        "ordini",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column(
+            "cliente_id", sa.Integer,
+            sa.ForeignKey("clienti.id", ondelete="RESTRICT"), nullable=False
+        ),
+        sa.Column("data_ordine", sa.Date, nullable=False),
+        sa.Column("data_ritiro", sa.Date),
+        sa.Column("data_incasso_mulino", sa.Date),
+        sa.Column("tipo_ordine", sa.String(20), nullable=False),
+        sa.Column(
+            "trasportatore_id", sa.Integer,
+            sa.ForeignKey("trasportatori.id", ondelete="SET NULL")
+        ),
+        sa.Column(
+            "carico_id", sa.Integer,
+            sa.ForeignKey("carichi.id", ondelete="SET NULL")
+        ),
+        sa.Column("stato", sa.String(20), server_default="inserito"),
+        sa.Column("note", sa.Text),
+        sa.Column("creato_il", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index("idx_ordini_cliente", "ordini", ["cliente_id"])
+    op.create_index("idx_ordini_data", "ordini", ["data_ordine"])
+    op.create_index("idx_ordini_stato", "ordini", ["stato"])
+    op.create_index("idx_ordini_carico", "ordini", ["carico_id"])
+    op.create_index("idx_ordini_incasso", "ordini", ["data_incasso_mulino"])
+
+    op.create_table(
+        "righe_ordine",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column(
+            "ordine_id", sa.Integer,
+            sa.ForeignKey("ordini.id", ondelete="CASCADE"), nullable=False
+        ),
+        sa.Column(
+            "prodotto_id", sa.Integer,
+            sa.ForeignKey("prodotti.id", ondelete="RESTRICT"), nullable=False
+        ),
+        sa.Column(
+            "mulino_id", sa.Integer,
+            sa.ForeignKey("mulini.id", ondelete="RESTRICT"), nullable=False
+        ),
+        sa.Column("pedane", sa.Numeric(10, 2)),
+        sa.Column("quintali", sa.Numeric(10, 2), nullable=False),
+        sa.Column("prezzo_quintale", sa.Numeric(10, 2), nullable=False),
+        sa.Column("prezzo_totale", sa.Numeric(12, 2), nullable=False),
+    )
+    op.create_index("idx_righe_ordine", "righe_ordine", ["ordine_id"])
+    op.create_index("idx_righe_prodotto", "righe_ordine", ["prodotto_id"])
+    op.create_index("idx_righe_mulino", "righe_ordine", ["mulino_id"])
+
+    op.create_table(
+        "storico_prezzi",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column(
+            "cliente_id", sa.Integer,
+            sa.ForeignKey("clienti.id", ondelete="CASCADE"), nullable=False
+        ),
+        sa.Column(
+            "prodotto_id", sa.Integer,
+            sa.ForeignKey("prodotti.id", ondelete="CASCADE"), nullable=False
+        ),
+        sa.Column("prezzo", sa.Numeric(10, 2), nullable=False),
+        sa.Column("creato_il", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index("idx_storico_cliente", "storico_prezzi", ["cliente_id"])
+    op.create_index("idx_storico_prodotto", "storico_prezzi", ["prodotto_id"])
+    op.create_index("idx_storico_data", "storico_prezzi", ["creato_il"])
+
+
+def downgrade() -> None:
+    for tabella in (
+        "storico_prezzi", "righe_ordine", "ordini", "carichi",
+        "trasportatori", "prodotti", "mulini", "clienti",
+    ):
+        op.drop_table(tabella)
@@ -0,0 +1,179 @@
+"""Gestione carichi avanzata (ex migration.sql, 2025-02)
+
+Carichi: mulino_id obbligatorio, total_quantita cached, nuovi stati,
+tipo_carico -> tipo e data_carico -> data_ritiro.
+Ordini: stato_logistico popolato dallo stato dei carichi.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2025-02-10
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0002"
+down_revision: Union[str, Sequence[str], None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # === 1. Carichi: nuove colonne e rinomine ===
+    with op.batch_alter_table("carichi") as batch:
+        batch.add_column(sa.Column("mulino_id", sa.Integer))
+        batch.add_column(sa.Column(
+            "total_quantita", sa.Numeric(10, 2), server_default="0", nullable=False
+        ))
+        batch.add_column(sa.Column(
+            "aggiornato_il", sa.DateTime(timezone=True), server_default=sa.func.now()
+        ))
+        batch.alter_column("tipo_carico", new_column_name="tipo")
+        batch.alter_column("data_carico", new_column_name="data_ritiro")
+
+    # === 2. mulino_id: mulino con più quintali tra gli ordini del carico ===
+    op.execute("""
+        UPDATE carichi
+        SET mulino_id = (
+            SELECT ro.mulino_id
+            FROM ordini o
+            JOIN righe_ordine ro ON ro.ordine_id = o.id
+            WHERE o.carico_id = carichi.id
+            GROUP BY ro.mulino_id
+            ORDER BY SUM(ro.quintali) DESC
+            LIMIT 1
+        )
+        WHERE mulino_id IS NULL
+        AND EXISTS (SELECT 1 FROM ordini WHERE carico_id = carichi.id)
+    """)
+    # Carichi senza ordini: primo mulino disponibile
+    op.execute("""
+        UPDATE carichi
+        SET mulino_id = (SELECT id FROM mulini ORDER BY id LIMIT 1)
+        WHERE mulino_id IS NULL
+    """)
+
+    # === 3. total_quantita dalle righe degli ordini ===
+    op.execute("""
+        UPDATE carichi
+        SET total_quantita = COALESCE((
+            SELECT SUM(ro.quintali)
+            FROM ordini o
+            JOIN righe_ordine ro ON ro.ordine_id = o.id
+            WHERE o.carico_id = carichi.id
+        ), 0)
+    """)
+
+    # === 4. Stati nel nuovo formato, vincoli e FK ===
+    op.execute("UPDATE carichi SET stato = 'bozza' WHERE stato = 'aperto'")
+    op.execute("UPDATE carichi SET stato = 'consegnato' WHERE stato = 'ritirato'")
+
+    with op.batch_alter_table("carichi") as batch:
+        batch.alter_column("mulino_id", existing_type=sa.Integer, nullable=False)
+        batch.create_foreign_key("carichi_mulino_id_fkey", "mulini", ["mulino_id"], ["id"])
+        batch.create_check_constraint("check_tipo_carico", "tipo IN ('sfuso', 'pedane')")
+        batch.create_check_constraint(
+            "check_stato_carico",
+            "stato IN ('bozza', 'assegnato', 'ritirato', 'consegnato')"
+        )
+        batch.create_check_constraint("check_max_quantita", "total_quantita <= 300")
+
+    # === 5. Ordini: stato_logistico ===
+    with op.batch_alter_table("ordini") as batch:
+        batch.add_column(sa.Column(
+            "stato_logistico", sa.String(20), server_default="aperto", nullable=False
+        ))
+        batch.add_column(sa.Column(
+            "aggiornato_il", sa.DateTime(timezone=True), server_default=sa.func.now()
+        ))
+        batch.create_check_constraint(
+            "check_stato_logistico",
+            "stato_logistico IN ('aperto', 'in_cluster', 'in_carico', 'spedito')"
+        )
+        batch.create_check_constraint("check_tipo_ordine", "tipo_ordine IN ('sfuso', 'pedane')")
+
+    # === 6. stato_logistico dallo stato dei carichi ===
+    for stato_logistico, stati_carico in (
+        ("in_carico", "('assegnato')"),
+        ("in_cluster", "('bozza')"),
+        ("spedito", "('ritirato', 'consegnato')"),
+    ):
+        op.execute(f"""
+            UPDATE ordini
+            SET stato_logistico = '{stato_logistico}'
+            WHERE carico_id IS NOT NULL
+            AND EXISTS (
+                SELECT 1 FROM carichi c
+                WHERE c.id = ordini.carico_id
+                AND c.stato IN {stati_carico}
+            )
+        """)
+    # Ordini con stato legacy 'ritirato' senza carico
+    op.execute("""
+        UPDATE ordini SET stato_logistico = 'spedito'
+        WHERE stato = 'ritirato' AND carico_id IS NULL
+    """)
+
+    # === 7. Indici ===
+    op.create_index("idx_carichi_mulino_id", "carichi", ["mulino_id"])
+    op.create_index("idx_carichi_mulino_tipo_stato", "carichi", ["mulino_id", "tipo", "stato"])
+    op.create_index("idx_carichi_stato_data", "carichi", ["stato", "data_ritiro"])
+    op.create_index("idx_ordini_carico_stato", "ordini", ["carico_id", "stato_logistico"])
+    op.create_index("idx_ordini_tipo_stato_logistico", "ordini", ["tipo_ordine", "stato_logistico"])
+    op.create_index("idx_righe_ordine_mulino", "righe_ordine", ["ordine_id", "mulino_id"])
+
+    # === 8. Trigger aggiornato_il (solo PostgreSQL) ===
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("""
+            CREATE OR REPLACE FUNCTION update_aggiornato_il()
+            RETURNS TRIGGER AS $$
+            BEGIN
+                NEW.aggiornato_il = NOW();
+                RETURN NEW;
+            END;
+            $$ LANGUAGE plpgsql
+        """)
+        for tabella in ("carichi", "ordini"):
+            op.execute(f"""
+                CREATE TRIGGER trigger_{tabella}_aggiornato_il
+                BEFORE UPDATE ON {tabella}
+                FOR EACH ROW
+                EXECUTE FUNCTION update_aggiornato_il()
+            """)
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name == "postgresql":
+        op.execute("DROP TRIGGER IF EXISTS trigger_ordini_aggiornato_il ON ordini")
+        op.execute("DROP TRIGGER IF EXISTS trigger_carichi_aggiornato_il ON carichi")
+        op.execute("DROP FUNCTION IF EXISTS update_aggiornato_il()")
+
+    op.drop_index("idx_righe_ordine_mulino", "righe_ordine")
+    op.drop_index("idx_ordini_tipo_stato_logistico", "ordini")
+    op.drop_index("idx_ordini_carico_stato", "ordini")
+    op.drop_index("idx_carichi_stato_data", "carichi")
+    op.drop_index("idx_carichi_mulino_tipo_stato", "carichi")
+    op.drop_index("idx_carichi_mulino_id", "carichi")
+
+    with op.batch_alter_table("ordini") as batch:
+        batch.drop_constraint("check_tipo_ordine", type_="check")
+        batch.drop_constraint("check_stato_logistico", type_="check")
+        batch.drop_column("aggiornato_il")
+        batch.drop_column("stato_logistico")
+
+    op.execute("UPDATE carichi SET stato = 'aperto' WHERE stato IN ('bozza', 'assegnato')")
+    op.execute("UPDATE carichi SET stato = 'ritirato' WHERE stato = 'consegnato'")
+
+    with op.batch_alter_table("carichi") as batch:
+        batch.drop_constraint("check_max_quantita", type_="check")
+        batch.drop_constraint("check_stato_carico", type_="check")
+        batch.drop_constraint("check_tipo_carico", type_="check")
+        batch.drop_constraint("carichi_mulino_id_fkey", type_="foreignkey")
+        batch.alter_column("data_ritiro", new_column_name="data_carico")
+        batch.alter_column("tipo", new_column_name="tipo_carico")
+        batch.drop_column("aggiornato_il")
+        batch.drop_column("total_quantita")
+        batch.drop_column("mulino_id")
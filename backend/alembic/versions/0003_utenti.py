@@ -0,0 +1,63 @@
+"""Utenti (autenticazione) e allineamento ai modelli
+
+Tabella utenti con l'utente admin di default se vuota (prima lo creava
+seed_admin_user a ogni avvio). Indici dei modelli mancanti rispetto a
+crea_db.sql; gli indici idx_* di crea_db.sql restano, dichiarati con lo
+stesso nome nei modelli.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2025-03-01
+
+"""
+import logging
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0003"
+down_revision: Union[str, Sequence[str], None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+logger = logging.getLogger("alembic.runtime.migration")
+
+# Hash bcrypt (costo 12) della password di default dell'admin: la migrazione
+# non dipende dal codice dell'app; al primo login viene riscritto se
+# BCRYPT_ROUNDS è diverso
+HASH_PASSWORD_ADMIN = "$2b$12$DBk2Au3K6/xooD/8wG8Z3Obqh.bzvOAFEEvLQY6lcSWAUveomj8ZC"
+
+
+def upgrade() -> None:
+    utenti = op.create_table(
+        "utenti",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("username", sa.String(100), nullable=False),
+        sa.Column("hashed_password", sa.String(255), nullable=False),
+        sa.Column("creato_il", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+    op.create_index("ix_utenti_id", "utenti", ["id"])
+    op.create_index("ix_utenti_username", "utenti", ["username"], unique=True)
+
+    # Utente admin di default (password da cambiare al primo accesso)
+    op.bulk_insert(utenti, [{"username": "admin", "hashed_password": HASH_PASSWORD_ADMIN}])
+    logger.warning("Creato l'utente 'admin' con la password di default: cambiarla al primo accesso")
+
+    with op.batch_alter_table("carichi") as batch:
+        batch.alter_column(
+            "stato", existing_type=sa.String(20), server_default="bozza", nullable=False
+        )
+    op.create_index("ix_ordini_stato_logistico", "ordini", ["stato_logistico"])
+    op.create_index("ix_ordini_trasportatore_id", "ordini", ["trasportatore_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_ordini_trasportatore_id", "ordini")
+    op.drop_index("ix_ordini_stato_logistico", "ordini")
+    with op.batch_alter_table("carichi") as batch:
+        batch.alter_column(
+            "stato", existing_type=sa.String(20), server_default="aperto", nullable=True
+        )
+    op.drop_table("utenti")
@@ -0,0 +1,26 @@
+"""Ordini: data di invio email al mulino
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2025-03-20
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0004"
+down_revision: Union[str, Sequence[str], None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column("ordini", sa.Column("email_inviata_il", sa.DateTime(timezone=True)))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("ordini") as batch:
+        batch.drop_column("email_inviata_il")
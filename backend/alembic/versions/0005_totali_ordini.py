@@ -0,0 +1,67 @@
+"""Ordini: totali denormalizzati e mulino principale
+
+Colonne sincronizzate dalle righe in scrittura (ordine_service),
+popolate qui con una UPDATE per l'intero storico.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2025-04-01
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0005"
+down_revision: Union[str, Sequence[str], None] = "0004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("ordini") as batch:
+        batch.add_column(sa.Column(
+            "totale_quintali", sa.Numeric(12, 2), server_default="0", nullable=False,
+            comment="Somma quintali delle righe - aggiornata da crea/aggiorna ordine"
+        ))
+        batch.add_column(sa.Column(
+            "totale_importo", sa.Numeric(14, 2), server_default="0", nullable=False,
+            comment="Somma importi delle righe - aggiornata da crea/aggiorna ordine"
+        ))
+        batch.add_column(sa.Column(
+            "mulino_principale_id", sa.Integer, nullable=True,
+            comment="Mulino con più quintali nell'ordine - NULL se senza righe"
+        ))
+        batch.create_foreign_key(
+            "ordini_mulino_principale_id_fkey", "mulini", ["mulino_principale_id"], ["id"]
+        )
+    op.create_index("ix_ordini_mulino_principale_id", "ordini", ["mulino_principale_id"])
+
+    # Backfill: somme delle righe e mulino con più quintali (a parità l'id minore)
+    op.execute("""
+        UPDATE ordini
+        SET totale_quintali = COALESCE((
+                SELECT SUM(r.quintali) FROM righe_ordine r WHERE r.ordine_id = ordini.id
+            ), 0),
+            totale_importo = COALESCE((
+                SELECT SUM(r.prezzo_totale) FROM righe_ordine r WHERE r.ordine_id = ordini.id
+            ), 0),
+            mulino_principale_id = (
+                SELECT r.mulino_id FROM righe_ordine r
+                WHERE r.ordine_id = ordini.id
+                GROUP BY r.mulino_id
+                ORDER BY SUM(r.quintali) DESC, r.mulino_id
+                LIMIT 1
+            )
+    """)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_ordini_mulino_principale_id", "ordini")
+    with op.batch_alter_table("ordini") as batch:
+        batch.drop_constraint("ordini_mulino_principale_id_fkey", type_="foreignkey")
+        batch.drop_column("mulino_principale_id")
+        batch.drop_column("totale_importo")
+        batch.drop_column("totale_quintali")
@@ -0,0 +1,28 @@
+"""Indici per la paginazione keyset delle liste
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2025-04-15
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+revision: str = "0006"
+down_revision: Union[str, Sequence[str], None] = "0005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index("idx_ordini_data_id", "ordini", ["data_ordine", "id"])
+    op.create_index("idx_clienti_nome_id", "clienti", ["nome", "id"])
+    op.create_index("idx_carichi_creato_id", "carichi", ["creato_il", "id"])
+
+
+def downgrade() -> None:
+    op.drop_index("idx_carichi_creato_id", "carichi")
+    op.drop_index("idx_clienti_nome_id", "clienti")
+    op.drop_index("idx_ordini_data_id", "ordini")
@@ -0,0 +1,44 @@
+"""Rollup trimestrale delle provvigioni
+
+Tabella pre-aggregata per (anno, trimestre, mulino), popolata qui dallo
+storico; poi mantenuta in modo incrementale dai router.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2025-05-01
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+
+revision: str = "0007"
+down_revision: Union[str, Sequence[str], None] = "0006"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "provvigioni_rollup",
+        sa.Column("anno", sa.Integer, primary_key=True),
+        sa.Column("trimestre", sa.Integer, primary_key=True),
+        sa.Column("mulino_id", sa.Integer, sa.ForeignKey("mulini.id"), primary_key=True),
+        sa.Column("totale_quintali", sa.Numeric(14, 2), nullable=False),
+        sa.Column("totale_incassato", sa.Numeric(16, 2), nullable=False),
+        sa.Column("totale_provvigione", sa.Numeric(24, 8), nullable=False),
+        sa.Column("num_ordini", sa.Integer, nullable=False),
+        sa.Column("aggiornato_il", sa.DateTime(timezone=True), server_default=sa.func.now()),
+    )
+
+    # Popolamento iniziale con le stesse query del calcolo incrementale
+    from app.services import provvigioni
+
+    provvigioni.ricostruisci_rollup(Session(bind=op.get_bind()))
+
+
+def downgrade() -> None:
+    op.drop_table("provvigioni_rollup")
@@ -0,0 +1,46 @@
+"""Coda persistente delle email in uscita
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2025-05-20
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0008"
+down_revision: Union[str, Sequence[str], None] = "0007"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "email_outbox",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column(
+            "ordine_id", sa.Integer,
+            sa.ForeignKey("ordini.id", ondelete="SET NULL"), nullable=True
+        ),
+        sa.Column("destinatario", sa.String(255), nullable=False),
+        sa.Column("oggetto", sa.String(500), nullable=False),
+        sa.Column("corpo", sa.Text, nullable=False),
+        sa.Column("stato", sa.String(20), nullable=False),
+        sa.Column("tentativi", sa.Integer, nullable=False),
+        sa.Column("prossimo_tentativo_il", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("ultimo_errore", sa.Text),
+        sa.Column("creato_il", sa.DateTime(timezone=True), server_default=sa.func.now()),
+        sa.Column("inviata_il", sa.DateTime(timezone=True)),
+    )
+    op.create_index("ix_email_outbox_id", "email_outbox", ["id"])
+    op.create_index("ix_email_outbox_ordine_id", "email_outbox", ["ordine_id"])
+    op.create_index(
+        "idx_email_outbox_stato_prossimo", "email_outbox", ["stato", "prossimo_tentativo_il"]
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("email_outbox")
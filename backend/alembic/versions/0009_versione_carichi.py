@@ -0,0 +1,33 @@
+"""Versione dei carichi (controllo di concorrenza ottimistico)
+
+Carichi: colonna versione incrementata a ogni UPDATE dall'ORM
+(version_id_col): una modifica basata su dati non più attuali fallisce
+invece di sovrascrivere quella concorrente.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2025-06-05
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0009"
+down_revision: Union[str, Sequence[str], None] = "0008"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table("carichi") as batch:
+        batch.add_column(sa.Column(
+            "versione", sa.Integer, server_default="1", nullable=False
+        ))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("carichi") as batch:
+        batch.drop_column("versione")
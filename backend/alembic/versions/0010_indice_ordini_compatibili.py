@@ -0,0 +1,34 @@
+"""Indice composto per gli ordini compatibili con un carico
+
+idx_ordini_compatibili (tipo_ordine, stato_logistico, mulino_principale_id,
+totale_quintali): la ricerca degli ordini aggiungibili a un carico diventa
+un range scan. Sostituisce idx_ordini_tipo_stato_logistico, suo prefisso.
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2025-06-12
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+revision: str = "0010"
+down_revision: Union[str, Sequence[str], None] = "0009"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "idx_ordini_compatibili",
+        "ordini",
+        ["tipo_ordine", "stato_logistico", "mulino_principale_id", "totale_quintali"]
+    )
+    op.drop_index("idx_ordini_tipo_stato_logistico", "ordini")
+
+
+def downgrade() -> None:
+    op.create_index("idx_ordini_tipo_stato_logistico", "ordini", ["tipo_ordine", "stato_logistico"])
+    op.drop_index("idx_ordini_compatibili", "ordini")
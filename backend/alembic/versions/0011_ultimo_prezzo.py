@@ -0,0 +1,75 @@
+"""Ultimo prezzo per cliente/prodotto e indice composto sullo storico
+
+Tabella ultimo_prezzo (chiave cliente_id, prodotto_id) popolata qui dallo
+storico, poi aggiornata con un upsert a ogni scrittura di prezzi.
+idx_storico_cliente_prodotto_data sostituisce idx_storico_cliente, suo prefisso.
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2025-06-19
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0011"
+down_revision: Union[str, Sequence[str], None] = "0010"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(
+        "idx_storico_cliente_prodotto_data",
+        "storico_prezzi",
+        ["cliente_id", "prodotto_id", "creato_il"]
+    )
+    op.drop_index("idx_storico_cliente", "storico_prezzi")
+
+    op.create_table(
+        "ultimo_prezzo",
+        sa.Column(
+            "cliente_id", sa.Integer,
+            sa.ForeignKey("clienti.id", ondelete="CASCADE"), primary_key=True
+        ),
+        sa.Column(
+            "prodotto_id", sa.Integer,
+            sa.ForeignKey("prodotti.id", ondelete="CASCADE"), primary_key=True
+        ),
+        sa.Column("prezzo", sa.Numeric(10, 2), nullable=False),
+        sa.Column(
+            "registrato_il", sa.DateTime(timezone=True),
+            server_default=sa.func.now(), nullable=False
+        ),
+        sa.Column("num_registrazioni", sa.Integer, nullable=False),
+    )
+
+    # Backfill: ultima riga di storico di ogni coppia (per data, a parità per id)
+    # e numero di righe della coppia; SQL autonomo, indipendente dai modelli
+    op.execute("""
+        INSERT INTO ultimo_prezzo (cliente_id, prodotto_id, prezzo, registrato_il, num_registrazioni)
+        SELECT cliente_id, prodotto_id, prezzo, registrato_il, num_registrazioni
+        FROM (
+            SELECT
+                cliente_id,
+                prodotto_id,
+                prezzo,
+                COALESCE(creato_il, CURRENT_TIMESTAMP) AS registrato_il,
+                COUNT(*) OVER (PARTITION BY cliente_id, prodotto_id) AS num_registrazioni,
+                ROW_NUMBER() OVER (
+                    PARTITION BY cliente_id, prodotto_id
+                    ORDER BY creato_il DESC, id DESC
+                ) AS posizione
+            FROM storico_prezzi
+        ) classificati
+        WHERE posizione = 1
+    """)
+
+
+def downgrade() -> None:
+    op.drop_table("ultimo_prezzo")
+    op.create_index("idx_storico_cliente", "storico_prezzi", ["cliente_id"])
+    op.drop_index("idx_storico_cliente_prodotto_data", "storico_prezzi")
@@ -0,0 +1,62 @@
+"""Ricerca per trigrammi (pg_trgm) su clienti, prodotti, mulini e trasportatori
+
+Funzione normalizza_ricerca (minuscolo, senza accenti, IMMUTABLE per poterla
+indicizzare) e indici GIN gin_trgm_ops sui nomi normalizzati: servono sia
+LIKE '%testo%' sia la somiglianza tra parole (<%) usate da app.services.ricerca.
+Solo PostgreSQL: su SQLite le stesse funzioni sono registrate in Python.
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2025-06-26
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+revision: str = "0012"
+down_revision: Union[str, Sequence[str], None] = "0011"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Coppie di caratteri di translate(), uguali a quelle di app.services.ricerca
+CARATTERI_ACCENTATI = "àáâäãåèéêëìíîïòóôöõùúûüýÿçñÀÁÂÄÃÅÈÉÊËÌÍÎÏÒÓÔÖÕÙÚÛÜÝÇÑ"
+CARATTERI_SEMPLICI = "aaaaaaeeeeiiiiooooouuuuyycnaaaaaaeeeeiiiiooooouuuuycn"
+
+INDICI_TRIGRAMMI = (
+    ("idx_clienti_nome_trgm", "clienti", "nome"),
+    ("idx_clienti_referente_trgm", "clienti", "referente"),
+    ("idx_prodotti_nome_trgm", "prodotti", "nome"),
+    ("idx_mulini_nome_trgm", "mulini", "nome"),
+    ("idx_trasportatori_nome_trgm", "trasportatori", "nome"),
+)
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute(f"""
+        CREATE OR REPLACE FUNCTION normalizza_ricerca(testo text)
+        RETURNS text
+        LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE
+        AS $$ SELECT translate(lower(testo), '{CARATTERI_ACCENTATI}', '{CARATTERI_SEMPLICI}') $$
+    """)
+    for nome, tabella, colonna in INDICI_TRIGRAMMI:
+        op.execute(
+            f"CREATE INDEX {nome} ON {tabella} "
+            f"USING gin (normalizza_ricerca({colonna}) gin_trgm_ops)"
+        )
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    for nome, tabella, _ in INDICI_TRIGRAMMI:
+        op.drop_index(nome, tabella)
+    op.execute("DROP FUNCTION IF EXISTS normalizza_ricerca(text)")
+    # L'estensione pg_trgm resta: può servire ad altro nel database
@@ -0,0 +1,61 @@
+"""Commenti delle colonne di carichi e ordini (allineamento ai modelli)
+
+I modelli documentano alcune colonne con comment=, che le migrazioni 0001
+e 0002 non riportavano: senza, 'alembic check' su PostgreSQL segnala la
+differenza e ogni autogenerate la ripropone. Solo PostgreSQL: SQLite non
+conserva i commenti.
+
+Revision ID: 0013
+Revises: 0012
+Create Date: 2025-07-03
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0013"
+down_revision: Union[str, Sequence[str], None] = "0012"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# (tabella, colonna, tipo, commento): stessi testi dei modelli
+COMMENTI = (
+    ("carichi", "mulino_id", sa.Integer(),
+     "Mulino di ritiro - tutti gli ordini devono appartenere a questo mulino"),
+    ("carichi", "tipo", sa.String(20), "Tipo carico: sfuso o pedane"),
+    ("carichi", "trasportatore_id", sa.Integer(),
+     "Trasportatore assegnato - può essere NULL in stato BOZZA"),
+    ("carichi", "data_ritiro", sa.Date(), "Data prevista ritiro - può essere NULL in stato BOZZA"),
+    ("carichi", "stato", sa.String(20), "Stato: bozza, assegnato, ritirato, consegnato"),
+    ("carichi", "total_quantita", sa.Numeric(10, 2),
+     "Totale quintali cached - sincronizzato quando cambiano ordini"),
+    ("carichi", "versione", sa.Integer(),
+     "Incrementata a ogni modifica: UPDATE su versione non più attuale -> conflitto"),
+    ("ordini", "tipo_ordine", sa.String(20), "Tipo: pedane o sfuso"),
+    ("ordini", "carico_id", sa.Integer(), "FK al carico - NULL se ordine non assegnato"),
+    ("ordini", "stato", sa.String(20), "Stato ordine legacy: inserito, ritirato"),
+    ("ordini", "stato_logistico", sa.String(20),
+     "Stato logistico: aperto, in_cluster, in_carico, spedito"),
+)
+
+
+def upgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    for tabella, colonna, tipo, commento in COMMENTI:
+        op.alter_column(tabella, colonna, existing_type=tipo, comment=commento)
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != "postgresql":
+        return
+
+    for tabella, colonna, tipo, commento in COMMENTI:
+        op.alter_column(
+            tabella, colonna, existing_type=tipo, comment=None, existing_comment=commento
+        )
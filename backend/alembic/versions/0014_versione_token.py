@@ -0,0 +1,33 @@
+"""Utenti: versione dei token, per revocarli al cambio password
+
+utenti.versione_token: i token portano la versione con cui sono stati
+emessi (claim "ver"); il cambio password la incrementa e get_current_user
+rifiuta quelli con versione diversa.
+
+Revision ID: 0014
+Revises: 0013
+Create Date: 2025-07-10
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+revision: str = "0014"
+down_revision: Union[str, Sequence[str], None] = "0013"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "utenti",
+        sa.Column("versione_token", sa.Integer(), nullable=False, server_default="0")
+    )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table("utenti") as batch:
+        batch.drop_column("versione_token")
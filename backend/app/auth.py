@@ -1,8 +1,16 @@
+import asyncio
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
+from typing import Optional
 
 import bcrypt
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import JWTError, jwt
 from sqlalchemy.orm import Session
@@ -15,18 +23,167 @@ SECRET_KEY = os.getenv("SECRET_KEY", "chiave-segreta-gestionale-farina-cambiare-
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_DAYS = 30
 
+# Cache dell'utente autenticato per token (0 = disattivata).
+# Con più processi l'invalidazione è locale: negli altri processi un token
+# revocato (cambio password, utente eliminato) resta valido fino a AUTH_CACHE_TTL_S.
+AUTH_CACHE_TTL_S = float(os.getenv("AUTH_CACHE_TTL_S", "60"))
+AUTH_CACHE_MAX = int(os.getenv("AUTH_CACHE_MAX", "1024"))
+# Se attivo, id e username sono presi dai claim firmati del token (claim "uid"),
+# senza query: nessuna revoca, un utente eliminato o con la password cambiata
+# resta valido fino alla scadenza del token (ACCESS_TOKEN_EXPIRE_DAYS).
+AUTH_FIDATI_CLAIMS = os.getenv("AUTH_FIDATI_CLAIMS", "false").lower() in ("1", "true", "yes")
+
+# Hashing password: costo bcrypt (i vecchi hash vengono riscritti al login),
+# thread dedicati all'hashing e login concorrenti ammessi prima del 429
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+AUTH_HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", "2"))
+AUTH_LOGIN_CONCORRENTI = int(os.getenv("AUTH_LOGIN_CONCORRENTI", "4"))
+AUTH_LOGIN_ATTESA_S = float(os.getenv("AUTH_LOGIN_ATTESA_S", "5"))
+
 # Security scheme
 security = HTTPBearer()
 
 
 def get_password_hash(password: str) -> str:
-    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode()
 
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return bcrypt.checkpw(plain_password.encode(), hashed_password.encode())
 
 
+def richiede_rehash(hashed_password: str) -> bool:
+    """True se l'hash è stato calcolato con un costo diverso da BCRYPT_ROUNDS"""
+    try:
+        return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+
+# === HASHING FUORI DAL THREADPOOL DELLE RICHIESTE ===
+
+_executor_hash: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor_hash() -> ThreadPoolExecutor:
+    global _executor_hash
+    if _executor_hash is None:
+        _executor_hash = ThreadPoolExecutor(max_workers=AUTH_HASH_WORKERS, thread_name_prefix="bcrypt")
+    return _executor_hash
+
+
+def chiudi_executor_hash() -> None:
+    """Chiude i thread di hashing (shutdown applicazione)"""
+    global _executor_hash
+    if _executor_hash is not None:
+        _executor_hash.shutdown(wait=False, cancel_futures=True)
+        _executor_hash = None
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password sull'executor dedicato (bcrypt rilascia il GIL)"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor_hash(), verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor_hash(), get_password_hash, password)
+
+
+class LimitatoreLogin:
+    """
+    Limita i login contemporanei: oltre `concorrenti` si attende fino a
+    `attesa_s`, poi 429. Chi attende non occupa thread.
+
+    Una istanza per applicazione, creata nel lifespan (app.state.limitatore_login):
+    il semaforo appartiene all'event loop che serve le richieste.
+    """
+
+    def __init__(self, concorrenti: int = AUTH_LOGIN_CONCORRENTI, attesa_s: float = AUTH_LOGIN_ATTESA_S):
+        self.attesa_s = attesa_s
+        self._semaforo = asyncio.Semaphore(concorrenti)
+
+    @asynccontextmanager
+    async def posto(self):
+        try:
+            await asyncio.wait_for(self._semaforo.acquire(), timeout=self.attesa_s)
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Troppi login in corso, riprovare tra poco",
+                headers={"Retry-After": str(int(self.attesa_s) or 1)},
+            )
+        try:
+            yield
+        finally:
+            self._semaforo.release()
+
+
+def get_limitatore_login(request: Request) -> LimitatoreLogin:
+    """Dependency: limitatore dell'applicazione (creato nel lifespan)"""
+    return request.app.state.limitatore_login
+
+
+@dataclass(frozen=True)
+class UtenteAutenticato:
+    """Utente autenticato della richiesta (non legato a una sessione DB)"""
+    id: int
+    username: str
+
+
+class _CachePrincipal:
+    """Cache LRU con TTL token -> UtenteAutenticato, thread-safe"""
+
+    def __init__(self, ttl_s: float, max_voci: int):
+        self.ttl_s = ttl_s
+        self.max_voci = max_voci
+        self._voci: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[UtenteAutenticato]:
+        with self._lock:
+            voce = self._voci.get(token)
+            if voce is None:
+                return None
+            utente, scade = voce
+            if scade <= time.monotonic():
+                del self._voci[token]
+                return None
+            self._voci.move_to_end(token)
+            return utente
+
+    def put(self, token: str, utente: UtenteAutenticato, exp: Optional[float]) -> None:
+        if self.ttl_s <= 0:
+            return
+        scade = time.monotonic() + self.ttl_s
+        if exp is not None:
+            # Mai oltre la scadenza del token
+            scade = min(scade, time.monotonic() + (exp - time.time()))
+        with self._lock:
+            self._voci[token] = (utente, scade)
+            self._voci.move_to_end(token)
+            while len(self._voci) > self.max_voci:
+                self._voci.popitem(last=False)
+
+    def invalida_utente(self, username: str) -> None:
+        with self._lock:
+            for token in [t for t, (u, _) in self._voci.items() if u.username == username]:
+                del self._voci[token]
+
+    def svuota(self) -> None:
+        with self._lock:
+            self._voci.clear()
+
+
+_cache_principal = _CachePrincipal(AUTH_CACHE_TTL_S, AUTH_CACHE_MAX)
+
+
+def invalida_utente(username: str) -> None:
+    """Da chiamare quando un utente viene eliminato o cambia password"""
+    _cache_principal.invalida_utente(username)
+
+
 def create_access_token(data: dict) -> str:
     to_encode = data.copy()
     expire = datetime.now(timezone.utc) + timedelta(days=ACCESS_TOKEN_EXPIRE_DAYS)
@@ -34,11 +191,25 @@ def create_access_token(data: dict) -> str:
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
 
+def token_utente(user: Utente) -> str:
+    """Token di accesso con la versione corrente dei token dell'utente"""
+    return create_access_token(data={"sub": user.username, "uid": user.id, "ver": user.versione_token})
+
+
 def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
     db: Session = Depends(get_db),
-) -> Utente:
+) -> UtenteAutenticato:
+    """
+    Risolve l'utente dal token JWT.
+    Ordine: cache per token, claim firmati (se AUTH_FIDATI_CLAIMS), query su utenti.
+    Con la query sono rifiutati anche i token emessi prima dell'ultimo cambio password.
+    """
     token = credentials.credentials
+    utente = _cache_principal.get(token)
+    if utente is not None:
+        return utente
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Token non valido o scaduto",
@@ -52,7 +223,15 @@ def get_current_user(
     except JWTError:
         raise credentials_exception
 
-    user = db.query(Utente).filter(Utente.username == username).first()
-    if user is None:
-        raise credentials_exception
-    return user
+    uid = payload.get("uid")
+    if AUTH_FIDATI_CLAIMS and isinstance(uid, int):
+        utente = UtenteAutenticato(id=uid, username=username)
+    else:
+        user = db.query(Utente).filter(Utente.username == username).first()
+        # Token emesso prima dell'ultimo cambio password: revocato
+        if user is None or payload.get("ver", 0) != user.versione_token:
+            raise credentials_exception
+        utente = UtenteAutenticato(id=user.id, username=user.username)
+
+    _cache_principal.put(token, utente, payload.get("exp"))
+    return utente
@@ -1,61 +1,44 @@
 from contextlib import asynccontextmanager
 
-from fastapi import Depends, FastAPI
+from fastapi import Depends, FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm.exc import StaleDataError
 
-from app.auth import get_current_user, get_password_hash
-from app.database import Base, SessionLocal, engine
-from app.models.utente import Utente
+from app import migrazioni
+from app.auth import LimitatoreLogin, chiudi_executor_hash, get_current_user
+from app.database import ASYNC_DB_ABILITATO, chiudi_async_engine, errore_di_concorrenza
 from app.routers import (
     carichi,
     clienti,
     composizione_carichi,
+    interno,
     mulini,
     ordini,
     pagamenti,
     prodotti,
+    ricerca,
     trasportatori,
 )
 from app.routers import auth as auth_router
-
-
-def seed_admin_user():
-    """Crea utente admin di default se non esiste nessun utente."""
-    db = SessionLocal()
-    try:
-        if db.query(Utente).count() == 0:
-            admin = Utente(
-                username="admin",
-                hashed_password=get_password_hash("admin"),
-            )
-            db.add(admin)
-            db.commit()
-            print("Utente admin creato (username: admin, password: admin)")
-    finally:
-        db.close()
-
-
-def run_migrations():
-    """Aggiunge colonne mancanti alle tabelle esistenti (no Alembic)."""
-    from sqlalchemy import inspect, text
-    inspector = inspect(engine)
-    # Ordini: email_inviata_il
-    if "ordini" in inspector.get_table_names():
-        columns = [c["name"] for c in inspector.get_columns("ordini")]
-        if "email_inviata_il" not in columns:
-            with engine.begin() as conn:
-                conn.execute(text(
-                    "ALTER TABLE ordini ADD COLUMN email_inviata_il TIMESTAMPTZ"
-                ))
+from app.services import composizione_service, email, paginazione
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: crea tabelle e seed admin
-    Base.metadata.create_all(bind=engine)
-    run_migrations()
-    seed_admin_user()
+    # Startup: schema alla head delle migrazioni Alembic (una SELECT su alembic_version)
+    migrazioni.verifica_schema()
+    email.avvia_invio_email()
+    # Semaforo dei login legato all'event loop del server
+    app.state.limitatore_login = LimitatoreLogin()
     yield
+    # Shutdown: ferma l'invio email, chiude i thread bcrypt, il pool del piano carichi
+    # e le connessioni dell'engine asincrono
+    email.ferma_invio_email()
+    chiudi_executor_hash()
+    composizione_service.chiudi_pool_piano()
+    await chiudi_async_engine()
 
 
 app = FastAPI(
@@ -78,8 +61,30 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Paginazione keyset: cursore e totale viaggiano negli header
+    expose_headers=[paginazione.HEADER_CURSORE, paginazione.HEADER_TOTALE],
 )
 
+# Conflitti tra scritture concorrenti: 409, il client ricarica e riprova
+# (la sessione viene chiusa da get_db, la transazione annullata)
+@app.exception_handler(StaleDataError)
+async def conflitto_versione(request: Request, exc: StaleDataError):
+    return JSONResponse(
+        status_code=409,
+        content={"detail": "Dati modificati da un'altra operazione: ricaricare e riprovare"}
+    )
+
+
+@app.exception_handler(DBAPIError)
+async def conflitto_transazioni(request: Request, exc: DBAPIError):
+    if not errore_di_concorrenza(exc):
+        raise
+    return JSONResponse(
+        status_code=409,
+        content={"detail": "Operazione in conflitto con un'altra in corso: riprovare"}
+    )
+
+
 # Router pubblico (auth)
 app.include_router(auth_router.router, prefix="/api/auth", tags=["Auth"])
 
@@ -93,6 +98,15 @@ app.include_router(ordini.router, prefix="/api/ordini", tags=["Ordini"], depende
 app.include_router(carichi.router, prefix="/api/carichi", tags=["Carichi"], dependencies=auth_deps)
 app.include_router(pagamenti.router, prefix="/api/pagamenti", tags=["Pagamenti"], dependencies=auth_deps)
 app.include_router(composizione_carichi.router, prefix="/api/composizione-carichi", tags=["Composizione Carichi"], dependencies=auth_deps)
+app.include_router(ricerca.router, prefix="/api/search", tags=["Ricerca"], dependencies=auth_deps)
+app.include_router(interno.router, prefix="/api/internal", tags=["Interno"], dependencies=auth_deps)
+
+# Letture asincrone (opt-in con DATABASE_ASYNC / DATABASE_ASYNC_URL): stessi endpoint
+# delle versioni sincrone sotto /api/async, le due sessioni convivono durante la migrazione
+if ASYNC_DB_ABILITATO:
+    app.include_router(ordini.router_async, prefix="/api/async/ordini", tags=["Async"], dependencies=auth_deps)
+    app.include_router(carichi.router_async, prefix="/api/async/carichi", tags=["Async"], dependencies=auth_deps)
+    app.include_router(composizione_carichi.router_async, prefix="/api/async/composizione-carichi", tags=["Async"], dependencies=auth_deps)
 
 
 @app.get("/", tags=["Root"])
@@ -0,0 +1,226 @@
+"""
+Comandi di manutenzione del database.
+
+Uso (dalla cartella backend):
+    python -m app.manage migra-schema
+    python -m app.manage adotta-schema
+    python -m app.manage verifica-totali-ordini
+    python -m app.manage ripara-totali-ordini
+    python -m app.manage ricostruisci-rollup-provvigioni
+    python -m app.manage ricostruisci-ultimi-prezzi
+    python -m app.manage compatta-storico-prezzi [--giorni 730] [--max-per-coppia 50]
+    python -m app.manage benchmark-async --url http://localhost:8000 --username admin --password ...
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from app import migrazioni
+from app.database import SessionLocal
+from app.services import ordine_service, prezzi, provvigioni
+
+
+def migra_schema(args) -> int:
+    """Porta il database alla head delle migrazioni (da eseguire una volta prima del riavvio dei worker)"""
+    try:
+        migrazioni.aggiorna_schema()
+    except migrazioni.SchemaNonAggiornato as e:
+        print(e, file=sys.stderr)
+        return 1
+    print(f"Schema alla revisione {migrazioni.revisione_corrente()}")
+    return 0
+
+
+def adotta_schema(args) -> int:
+    """Registra la revisione di un database creato prima di Alembic"""
+    revisione = migrazioni.adotta_schema()
+    if revisione is None:
+        print("Database vuoto: nulla da adottare, eseguire migra-schema")
+        return 1
+    print(f"Database registrato alla revisione {revisione}: eseguire migra-schema per completare")
+    return 0
+
+
+def verifica_totali_ordini(args) -> int:
+    """Elenca gli ordini con totali denormalizzati non allineati alle righe"""
+    db = SessionLocal()
+    try:
+        incoerenti = ordine_service.trova_totali_incoerenti(db)
+    finally:
+        db.close()
+
+    for i in incoerenti[:args.max_righe]:
+        print(f"Ordine {i['ordine_id']}: salvato {i['salvato']} - calcolato {i['calcolato']}")
+    if len(incoerenti) > args.max_righe:
+        print(f"... e altri {len(incoerenti) - args.max_righe}")
+
+    print(f"Ordini incoerenti: {len(incoerenti)}")
+    return 1 if incoerenti else 0
+
+
+def ripara_totali_ordini(args) -> int:
+    """Ricalcola i totali denormalizzati degli ordini dalle righe"""
+    db = SessionLocal()
+    try:
+        corretti = ordine_service.ripara_totali_ordini(db)
+        db.commit()
+    finally:
+        db.close()
+
+    print(f"Ordini corretti: {corretti}")
+    return 0
+
+
+def ricostruisci_rollup_provvigioni(args) -> int:
+    """Ricostruisce da zero il rollup trimestrale delle provvigioni"""
+    db = SessionLocal()
+    try:
+        scritte = provvigioni.ricostruisci_rollup(db)
+        db.commit()
+    finally:
+        db.close()
+
+    print(f"Chiavi (anno, trimestre, mulino) scritte: {scritte}")
+    return 0
+
+
+def ricostruisci_ultimi_prezzi(args) -> int:
+    """Ricalcola dallo storico l'ultimo prezzo di ogni coppia cliente/prodotto"""
+    db = SessionLocal()
+    try:
+        scritte = prezzi.ricostruisci_ultimi_prezzi(db)
+        db.commit()
+    finally:
+        db.close()
+
+    print(f"Coppie cliente/prodotto scritte: {scritte}")
+    return 0
+
+
+def compatta_storico_prezzi(args) -> int:
+    """Compatta lo storico prezzi (ripetizioni e retenzione) e riallinea gli ultimi prezzi"""
+    db = SessionLocal()
+    try:
+        compattate = prezzi.compatta_storico(db)
+        scadute = prezzi.applica_retenzione(db, args.giorni, args.max_per_coppia)
+        coppie = prezzi.ricostruisci_ultimi_prezzi(db)
+        db.commit()
+    finally:
+        db.close()
+
+    print(f"Ripetizioni eliminate: {compattate}")
+    print(f"Righe oltre la retenzione eliminate: {scadute}")
+    print(f"Coppie cliente/prodotto riallineate: {coppie}")
+    return 0
+
+
+# Endpoint confrontati: percorso sincrono e gemello asincrono sotto /api/async
+ENDPOINT_BENCHMARK = [
+    ("ordini", "/ordini/?limit=100"),
+    ("carichi", "/carichi/?limit=100"),
+    ("composizione", "/composizione-carichi/ordini-disponibili"),
+]
+
+
+def _token_benchmark(args) -> str:
+    if args.token:
+        return args.token
+    richiesta = urllib.request.Request(
+        f"{args.url}/api/auth/login",
+        data=json.dumps({"username": args.username, "password": args.password}).encode(),
+        headers={"Content-Type": "application/json"}
+    )
+    with urllib.request.urlopen(richiesta, timeout=30) as risposta:
+        return json.load(risposta)["access_token"]
+
+
+def _misura(url: str, token: str, richieste: int, concorrenza: int) -> dict:
+    """richieste GET su url con `concorrenza` client in parallelo -> throughput e latenze"""
+    def una_richiesta(_) -> float:
+        inizio = time.perf_counter()
+        richiesta = urllib.request.Request(url, headers={"Authorization": f"Bearer {token}"})
+        with urllib.request.urlopen(richiesta, timeout=60) as risposta:
+            risposta.read()
+        return time.perf_counter() - inizio
+
+    inizio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concorrenza) as pool:
+        latenze = sorted(pool.map(una_richiesta, range(richieste)))
+    durata = time.perf_counter() - inizio
+
+    return {
+        "req_s": richieste / durata,
+        "p50_ms": statistics.median(latenze) * 1000,
+        "p95_ms": latenze[min(len(latenze) - 1, int(len(latenze) * 0.95))] * 1000,
+    }
+
+
+def benchmark_async(args) -> int:
+    """Confronta sotto carico concorrente le letture sincrone e quelle asincrone"""
+    token = _token_benchmark(args)
+
+    print(f"{'endpoint':<14}{'percorso':<10}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}")
+    for nome, percorso in ENDPOINT_BENCHMARK:
+        for etichetta, prefisso in (("sync", "/api"), ("async", "/api/async")):
+            url = args.url + prefisso + percorso
+            # Riscaldamento: pool di connessioni e cache dell'utente autenticato
+            _misura(url, token, args.concorrenza, args.concorrenza)
+            r = _misura(url, token, args.richieste, args.concorrenza)
+            print(f"{nome:<14}{etichetta:<10}{r['req_s']:>9.1f}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}")
+    return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m app.manage", description=__doc__.splitlines()[1])
+    comandi = parser.add_subparsers(dest="comando", required=True)
+
+    p = comandi.add_parser("migra-schema", help=migra_schema.__doc__)
+    p.set_defaults(func=migra_schema)
+
+    p = comandi.add_parser("adotta-schema", help=adotta_schema.__doc__)
+    p.set_defaults(func=adotta_schema)
+
+    p = comandi.add_parser("verifica-totali-ordini", help=verifica_totali_ordini.__doc__)
+    p.add_argument("--max-righe", type=int, default=50, help="Ordini incoerenti da mostrare")
+    p.set_defaults(func=verifica_totali_ordini)
+
+    p = comandi.add_parser("ripara-totali-ordini", help=ripara_totali_ordini.__doc__)
+    p.set_defaults(func=ripara_totali_ordini)
+
+    p = comandi.add_parser("ricostruisci-rollup-provvigioni", help=ricostruisci_rollup_provvigioni.__doc__)
+    p.set_defaults(func=ricostruisci_rollup_provvigioni)
+
+    p = comandi.add_parser("ricostruisci-ultimi-prezzi", help=ricostruisci_ultimi_prezzi.__doc__)
+    p.set_defaults(func=ricostruisci_ultimi_prezzi)
+
+    p = comandi.add_parser("compatta-storico-prezzi", help=compatta_storico_prezzi.__doc__)
+    p.add_argument(
+        "--giorni", type=int, default=prezzi.STORICO_PREZZI_GIORNI,
+        help="Età massima delle righe di storico (0 = nessun limite)"
+    )
+    p.add_argument(
+        "--max-per-coppia", type=int, default=prezzi.STORICO_PREZZI_MAX_PER_COPPIA,
+        help="Righe più recenti da tenere per cliente/prodotto (0 = nessun limite)"
+    )
+    p.set_defaults(func=compatta_storico_prezzi)
+
+    p = comandi.add_parser("benchmark-async", help=benchmark_async.__doc__)
+    p.add_argument("--url", default="http://localhost:8000", help="Indirizzo del backend in esecuzione")
+    p.add_argument("--token", help="Token JWT (in alternativa a username/password)")
+    p.add_argument("--username", default="admin")
+    p.add_argument("--password", default="")
+    p.add_argument("--richieste", type=int, default=500, help="Richieste per endpoint e percorso")
+    p.add_argument("--concorrenza", type=int, default=32, help="Client in parallelo")
+    p.set_defaults(func=benchmark_async)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""
+Migrazioni dello schema (Alembic) all'avvio
+
+- verifica_schema: una SELECT su alembic_version confrontata con la head
+  degli script (letta dai file): nessuna introspezione del catalogo
+- Schema non aggiornato: avvio bloccato con l'indicazione del comando,
+  oppure con DB_AUTO_MIGRATE=true migrazione automatica sotto advisory lock
+  PostgreSQL (un solo processo migra, gli altri attendono e ricontrollano)
+- Database creati prima di Alembic (create_all + run_migrations):
+  adotta_schema riconosce la revisione raggiunta e la registra (stamp)
+"""
+
+import logging
+import os
+from pathlib import Path
+from typing import Optional
+
+from alembic import command
+from alembic.config import Config
+from alembic.runtime.migration import MigrationContext
+from alembic.script import ScriptDirectory
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import DBAPIError
+
+from app.database import engine
+
+logger = logging.getLogger(__name__)
+
+DB_AUTO_MIGRATE = os.getenv("DB_AUTO_MIGRATE", "false").lower() in ("1", "true", "yes")
+# Attesa massima dei lock DDL per ogni statement di migrazione (PostgreSQL)
+MIGRAZIONI_LOCK_TIMEOUT = os.getenv("MIGRAZIONI_LOCK_TIMEOUT", "5s")
+
+ALEMBIC_INI = Path(__file__).resolve().parent.parent / "alembic.ini"
+
+# Chiave dell'advisory lock che serializza le migrazioni tra processi
+_CHIAVE_LOCK_MIGRAZIONI = 4_422_016
+
+
+class SchemaNonAggiornato(RuntimeError):
+    """Il database non è alla revisione richiesta dal codice"""
+
+
+def config_alembic(connessione=None) -> Config:
+    """Config Alembic del progetto, eventualmente su una connessione già aperta"""
+    cfg = Config(str(ALEMBIC_INI))
+    if connessione is not None:
+        cfg.attributes["connection"] = connessione
+    return cfg
+
+
+def revisione_head() -> str:
+    """Ultima revisione degli script di migrazione"""
+    return ScriptDirectory.from_config(config_alembic()).get_current_head()
+
+
+def revisione_corrente() -> Optional[str]:
+    """Revisione registrata nel database (None se non gestito da Alembic)"""
+    with engine.connect() as conn:
+        try:
+            return conn.execute(text("SELECT version_num FROM alembic_version")).scalar()
+        except DBAPIError:
+            return None
+
+
+# === AVVIO ===
+
+def verifica_schema() -> None:
+    """
+    Controllo all'avvio: database alla head degli script.
+
+    Raises:
+        SchemaNonAggiornato: schema indietro e DB_AUTO_MIGRATE disattivo
+    """
+    head = revisione_head()
+    corrente = revisione_corrente()
+    if corrente == head:
+        return
+
+    if not DB_AUTO_MIGRATE:
+        raise SchemaNonAggiornato(
+            f"Schema alla revisione {corrente or 'nessuna'}, richiesta {head}: "
+            f"eseguire 'alembic upgrade head' dalla cartella backend "
+            f"(o avviare con DB_AUTO_MIGRATE=true)"
+        )
+
+    aggiorna_schema()
+
+
+def aggiorna_schema() -> None:
+    """
+    Porta il database alla head. Su PostgreSQL sotto advisory lock:
+    i processi avviati insieme migrano uno alla volta e gli altri,
+    ottenuto il lock, trovano lo schema già aggiornato.
+    """
+    with engine.connect() as conn:
+        postgres = conn.dialect.name == "postgresql"
+        if postgres:
+            conn.execute(text("SELECT pg_advisory_lock(:k)"), {"k": _CHIAVE_LOCK_MIGRAZIONI})
+            conn.commit()
+        try:
+            corrente = MigrationContext.configure(conn).get_current_revision()
+            conn.commit()
+            if corrente is None and inspect(conn).has_table("ordini"):
+                raise SchemaNonAggiornato(
+                    "Database creato senza Alembic: eseguire prima "
+                    "'python -m app.manage adotta-schema'"
+                )
+            if corrente != revisione_head():
+                logger.info("Migrazione schema da %s a head", corrente or "database vuoto")
+                command.upgrade(config_alembic(conn), "head")
+                conn.commit()
+        finally:
+            if postgres:
+                conn.execute(text("SELECT pg_advisory_unlock(:k)"), {"k": _CHIAVE_LOCK_MIGRAZIONI})
+                conn.commit()
+
+
+# === ADOZIONE DI DATABASE ESISTENTI ===
+
+def _colonne(ispettore, tabella: str) -> set:
+    return {c["name"] for c in ispettore.get_columns(tabella)} if ispettore.has_table(tabella) else set()
+
+
+def _indici(ispettore, tabella: str) -> set:
+    return {i["name"] for i in ispettore.get_indexes(tabella)} if ispettore.has_table(tabella) else set()
+
+
+def _commento(ispettore, tabella: str, colonna: str) -> Optional[str]:
+    colonne = ispettore.get_columns(tabella) if ispettore.has_table(tabella) else []
+    return next((c.get("comment") for c in colonne if c["name"] == colonna), None)
+
+
+# Per ogni revisione, l'oggetto che la caratterizza (in ordine di catena)
+_CONTROLLI_ADOZIONE = (
+    ("0001", lambda i: i.has_table("ordini")),
+    ("0002", lambda i: "mulino_id" in _colonne(i, "carichi")),
+    ("0003", lambda i: i.has_table("utenti")),
+    ("0004", lambda i: "email_inviata_il" in _colonne(i, "ordini")),
+    ("0005", lambda i: "totale_quintali" in _colonne(i, "ordini")),
+    ("0006", lambda i: "idx_ordini_data_id" in _indici(i, "ordini")),
+    ("0007", lambda i: i.has_table("provvigioni_rollup")),
+    ("0008", lambda i: i.has_table("email_outbox")),
+    ("0009", lambda i: "versione" in _colonne(i, "carichi")),
+    ("0010", lambda i: "idx_ordini_compatibili" in _indici(i, "ordini")),
+    ("0011", lambda i: i.has_table("ultimo_prezzo")),
+    ("0012", lambda i: "idx_clienti_nome_trgm" in _indici(i, "clienti")),
+    ("0013", lambda i: _commento(i, "carichi", "versione") is not None),
+    ("0014", lambda i: "versione_token" in _colonne(i, "utenti")),
+)
+
+
+def rileva_revisione_esistente(conn) -> Optional[str]:
+    """Ultima revisione i cui oggetti sono già presenti (introspezione una tantum)"""
+    ispettore = inspect(conn)
+    trovata = None
+    for revisione, presente in _CONTROLLI_ADOZIONE:
+        if not presente(ispettore):
+            break
+        trovata = revisione
+    return trovata
+
+
+def adotta_schema() -> Optional[str]:
+    """
+    Registra in alembic_version la revisione già raggiunta da un database
+    creato con create_all / run_migrations / migration.sql.
+    Le migrazioni successive si applicano poi con 'alembic upgrade head'.
+
+    Returns:
+        Revisione registrata (None: database vuoto, nulla da adottare)
+    """
+    with engine.connect() as conn:
+        if MigrationContext.configure(conn).get_current_revision() is not None:
+            raise SchemaNonAggiornato("Database già gestito da Alembic")
+        revisione = rileva_revisione_esistente(conn)
+        conn.commit()
+        if revisione is not None:
+            command.stamp(config_alembic(conn), revisione)
+            conn.commit()
+    return revisione
@@ -4,8 +4,11 @@ from app.models.prodotto import Prodotto
 from app.models.trasportatore import Trasportatore
 from app.models.ordine import Ordine, RigaOrdine
 from app.models.storico_prezzo import StoricoPrezzo
+from app.models.ultimo_prezzo import UltimoPrezzo
 from app.models.carico import Carico
 from app.models.utente import Utente
+from app.models.provvigione_rollup import ProvvigioneRollup
+from app.models.email_outbox import EmailOutbox, StatoEmail
 
 __all__ = [
     "Cliente",
@@ -15,6 +18,10 @@ __all__ = [
     "Ordine",
     "RigaOrdine",
     "StoricoPrezzo",
+    "UltimoPrezzo",
     "Carico",
     "Utente",
+    "ProvvigioneRollup",
+    "EmailOutbox",
+    "StatoEmail",
 ]
\ No newline at end of file
@@ -5,6 +5,7 @@ Versione aggiornata con:
 - mulino_id obbligatorio (vincolo: stesso mulino per tutti gli ordini)
 - total_quantita cached per performance
 - Stati: BOZZA, ASSEGNATO, RITIRATO, CONSEGNATO
+- versione per il controllo di concorrenza ottimistico
 """
 
 from sqlalchemy import (
@@ -13,6 +14,7 @@ from sqlalchemy import (
 )
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
+from datetime import datetime, timezone
 from decimal import Decimal
 from enum import Enum
 from app.database import Base
@@ -46,14 +48,13 @@ class Carico(Base):
     __tablename__ = "carichi"
 
     # === Campi principali ===
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     
     # Vincolo mulino (NUOVO - tutti gli ordini stesso mulino)
     mulino_id = Column(
         Integer, 
         ForeignKey("mulini.id"), 
         nullable=False,
-        index=True,
         comment="Mulino di ritiro - tutti gli ordini devono appartenere a questo mulino"
     )
     
@@ -67,7 +68,7 @@ class Carico(Base):
     # Trasportatore (nullable per stato BOZZA)
     trasportatore_id = Column(
         Integer, 
-        ForeignKey("trasportatori.id"), 
+        ForeignKey("trasportatori.id", ondelete="SET NULL"), 
         nullable=True,
         comment="Trasportatore assegnato - può essere NULL in stato BOZZA"
     )
@@ -84,7 +85,6 @@ class Carico(Base):
         String(20), 
         default=StatoCarico.BOZZA.value,
         nullable=False,
-        index=True,
         comment="Stato: bozza, assegnato, ritirato, consegnato"
     )
     
@@ -99,8 +99,22 @@ class Carico(Base):
     # Note
     note = Column(Text, nullable=True)
     
-    # Timestamp
-    creato_il = Column(DateTime(timezone=True), server_default=func.now())
+    # Versione (NUOVO - concorrenza ottimistica)
+    versione = Column(
+        Integer,
+        nullable=False,
+        server_default="1",
+        comment="Incrementata a ogni modifica: UPDATE su versione non più attuale -> conflitto"
+    )
+    
+    # Timestamp. creato_il è chiave della paginazione keyset: valorizzato anche
+    # lato Python, così su SQLite ha lo stesso formato del cursore (con i
+    # microsecondi) e il confronto tra stringhe resta coerente
+    creato_il = Column(
+        DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        server_default=func.now()
+    )
     aggiornato_il = Column(
         DateTime(timezone=True), 
         server_default=func.now(), 
@@ -116,6 +130,9 @@ class Carico(Base):
         lazy="dynamic"  # Per query efficienti su molti ordini
     )
 
+    # Ogni UPDATE dall'ORM verifica e incrementa la versione (StaleDataError se cambiata)
+    __mapper_args__ = {"version_id_col": versione}
+
     # === Costanti di dominio ===
     MAX_QUINTALI = Decimal("300")
     SOGLIA_MINIMA_QUINTALI = Decimal("280")
@@ -123,10 +140,15 @@ class Carico(Base):
 
     # === Indici composti per performance ===
     __table_args__ = (
+        Index('idx_carichi_mulino_id', 'mulino_id'),
+        Index('idx_carichi_stato', 'stato'),
+        Index('idx_carichi_tipo', 'tipo'),
         # Indice per ricerche frequenti
         Index('idx_carichi_mulino_tipo_stato', 'mulino_id', 'tipo', 'stato'),
         # Indice per lista carichi aperti
         Index('idx_carichi_stato_data', 'stato', 'data_ritiro'),
+        # Indice per paginazione keyset della lista carichi
+        Index('idx_carichi_creato_id', 'creato_il', 'id'),
         # Constraint: tipo deve essere sfuso o pedane
         CheckConstraint(
             "tipo IN ('sfuso', 'pedane')",
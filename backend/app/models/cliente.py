@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, Text, DateTime
+from sqlalchemy import Column, Integer, String, Boolean, Text, DateTime, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database import Base
@@ -7,8 +7,8 @@ from app.database import Base
 class Cliente(Base):
     __tablename__ = "clienti"
 
-    id = Column(Integer, primary_key=True, index=True)
-    nome = Column(String(255), nullable=False, index=True)
+    id = Column(Integer, primary_key=True)
+    nome = Column(String(255), nullable=False)
     partita_iva = Column(String(20), nullable=True)
     indirizzo_consegna = Column(Text, nullable=True)
     telefono_fisso = Column(String(30), nullable=True)
@@ -24,5 +24,11 @@ class Cliente(Base):
     ordini = relationship("Ordine", back_populates="cliente")
     storico_prezzi = relationship("StoricoPrezzo", back_populates="cliente")
 
+    __table_args__ = (
+        Index('idx_clienti_nome', 'nome'),
+        # Indice per paginazione keyset della lista clienti
+        Index('idx_clienti_nome_id', 'nome', 'id'),
+    )
+
     def __repr__(self):
         return f"<Cliente(id={self.id}, nome='{self.nome}')>"
\ No newline at end of file
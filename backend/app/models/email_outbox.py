@@ -0,0 +1,48 @@
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index
+from sqlalchemy.sql import func
+from enum import Enum
+from app.database import Base
+
+
+class StatoEmail(str, Enum):
+    """Stati di un messaggio nella coda di invio"""
+    IN_CODA = "in_coda"   # Da inviare (anche dopo un tentativo fallito)
+    IN_INVIO = "in_invio" # Prenotato da un processo, invio SMTP in corso
+    INVIATA = "inviata"   # Consegnata al server SMTP
+    ERRORE = "errore"     # Tentativi esauriti o destinatario rifiutato
+
+
+class EmailOutbox(Base):
+    """
+    Coda persistente delle email in uscita.
+    Le richieste accodano i messaggi; un thread in background li invia
+    riusando una connessione SMTP, con tentativi e backoff.
+    """
+    __tablename__ = "email_outbox"
+
+    id = Column(Integer, primary_key=True, index=True)
+    ordine_id = Column(
+        Integer,
+        ForeignKey("ordini.id", ondelete="SET NULL"),
+        nullable=True,
+        index=True
+    )
+    destinatario = Column(String(255), nullable=False)
+    oggetto = Column(String(500), nullable=False)
+    corpo = Column(Text, nullable=False)
+
+    stato = Column(String(20), nullable=False, default=StatoEmail.IN_CODA.value)
+    tentativi = Column(Integer, nullable=False, default=0)
+    prossimo_tentativo_il = Column(DateTime(timezone=True), server_default=func.now())
+    ultimo_errore = Column(Text, nullable=True)
+
+    creato_il = Column(DateTime(timezone=True), server_default=func.now())
+    inviata_il = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        # Indice per la selezione dei messaggi da inviare
+        Index('idx_email_outbox_stato_prossimo', 'stato', 'prossimo_tentativo_il'),
+    )
+
+    def __repr__(self):
+        return f"<EmailOutbox(id={self.id}, to='{self.destinatario}', stato='{self.stato}')>"
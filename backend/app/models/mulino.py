@@ -2,7 +2,7 @@
 Modello Mulino - Aggiornato con relazione Carichi
 """
 
-from sqlalchemy import Column, Integer, String, Text
+from sqlalchemy import Column, Integer, String, Text, Index
 from sqlalchemy.orm import relationship
 from app.database import Base
 
@@ -18,8 +18,8 @@ class Mulino(Base):
     """
     __tablename__ = "mulini"
 
-    id = Column(Integer, primary_key=True, index=True)
-    nome = Column(String(255), nullable=False, index=True)
+    id = Column(Integer, primary_key=True)
+    nome = Column(String(255), nullable=False)
     indirizzo_ritiro = Column(Text, nullable=True)
     telefono = Column(String(30), nullable=True)
     email1 = Column(String(255), nullable=True)
@@ -38,5 +38,9 @@ class Mulino(Base):
         lazy="dynamic"  # Per query efficienti su molti carichi
     )
 
+    __table_args__ = (
+        Index('idx_mulini_nome', 'nome'),
+    )
+
     def __repr__(self):
         return f"<Mulino(id={self.id}, nome='{self.nome}')>"
\ No newline at end of file
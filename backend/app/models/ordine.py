@@ -4,6 +4,7 @@ Modello Ordine - Aggiornato con stato logistico per integrazione Carichi
 Aggiunte:
 - stato_logistico: APERTO, IN_CLUSTER, IN_CARICO, SPEDITO
 - Indici per performance su carico_id e campi ricerca
+- Totali denormalizzati: totale_quintali, totale_importo, mulino_principale_id
 """
 
 from sqlalchemy import (
@@ -37,8 +38,8 @@ class Ordine(Base):
     __tablename__ = "ordini"
 
     # === Campi principali ===
-    id = Column(Integer, primary_key=True, index=True)
-    cliente_id = Column(Integer, ForeignKey("clienti.id"), nullable=False, index=True)
+    id = Column(Integer, primary_key=True)
+    cliente_id = Column(Integer, ForeignKey("clienti.id", ondelete="RESTRICT"), nullable=False)
     data_ordine = Column(Date, nullable=False)
     data_ritiro = Column(Date, nullable=True)
     data_incasso_mulino = Column(Date, nullable=True)  # Per calcolo provvigioni RIBA
@@ -51,7 +52,7 @@ class Ordine(Base):
     
     trasportatore_id = Column(
         Integer, 
-        ForeignKey("trasportatori.id"), 
+        ForeignKey("trasportatori.id", ondelete="SET NULL"), 
         nullable=True,
         index=True
     )
@@ -59,9 +60,8 @@ class Ordine(Base):
     # === Relazione con Carico ===
     carico_id = Column(
         Integer, 
-        ForeignKey("carichi.id"), 
+        ForeignKey("carichi.id", ondelete="SET NULL"), 
         nullable=True,
-        index=True,
         comment="FK al carico - NULL se ordine non assegnato"
     )
     
@@ -85,6 +85,29 @@ class Ordine(Base):
     # Email
     email_inviata_il = Column(DateTime(timezone=True), nullable=True)
 
+    # === Totali denormalizzati (sincronizzati dalle righe in scrittura) ===
+    totale_quintali = Column(
+        Numeric(12, 2),
+        default=Decimal("0"),
+        server_default="0",
+        nullable=False,
+        comment="Somma quintali delle righe - aggiornata da crea/aggiorna ordine"
+    )
+    totale_importo = Column(
+        Numeric(14, 2),
+        default=Decimal("0"),
+        server_default="0",
+        nullable=False,
+        comment="Somma importi delle righe - aggiornata da crea/aggiorna ordine"
+    )
+    mulino_principale_id = Column(
+        Integer,
+        ForeignKey("mulini.id"),
+        nullable=True,
+        index=True,
+        comment="Mulino con più quintali nell'ordine - NULL se senza righe"
+    )
+
     # Note e timestamp
     note = Column(Text, nullable=True)
     creato_il = Column(DateTime(timezone=True), server_default=func.now())
@@ -107,10 +130,21 @@ class Ordine(Base):
 
     # === Indici composti per performance ===
     __table_args__ = (
+        Index('idx_ordini_cliente', 'cliente_id'),
+        Index('idx_ordini_data', 'data_ordine'),
+        Index('idx_ordini_stato', 'stato'),
+        Index('idx_ordini_carico', 'carico_id'),
+        Index('idx_ordini_incasso', 'data_incasso_mulino'),
         # Indice per ricerca ordini disponibili per carico
         Index('idx_ordini_carico_stato', 'carico_id', 'stato_logistico'),
-        # Indice per composizione carichi (ordini non assegnati)
-        Index('idx_ordini_tipo_stato_logistico', 'tipo_ordine', 'stato_logistico'),
+        # Indice per ordini compatibili con un carico (tipo, stato, mulino, spazio residuo);
+        # il prefisso (tipo, stato) serve anche la composizione carichi
+        Index(
+            'idx_ordini_compatibili',
+            'tipo_ordine', 'stato_logistico', 'mulino_principale_id', 'totale_quintali'
+        ),
+        # Indice per paginazione keyset della lista ordini
+        Index('idx_ordini_data_id', 'data_ordine', 'id'),
         # Constraint: tipo_ordine deve essere valido
         CheckConstraint(
             "tipo_ordine IN ('sfuso', 'pedane')",
@@ -124,37 +158,6 @@ class Ordine(Base):
     )
 
     # === Properties ===
-    @property
-    def totale_quintali(self) -> Decimal:
-        """Somma quintali di tutte le righe"""
-        return sum((r.quintali or Decimal("0")) for r in self.righe)
-
-    @property
-    def totale_importo(self) -> Decimal:
-        """Somma importi di tutte le righe"""
-        return sum((r.prezzo_totale or Decimal("0")) for r in self.righe)
-
-    @property
-    def mulino_principale_id(self) -> int | None:
-        """
-        ID del mulino con più quintali nell'ordine.
-        Usato per determinare la compatibilità con un Carico.
-        """
-        if not self.righe:
-            return None
-        
-        # Raggruppa quintali per mulino
-        mulini_quintali: dict[int, Decimal] = {}
-        for riga in self.righe:
-            mulino_id = riga.mulino_id
-            mulini_quintali[mulino_id] = mulini_quintali.get(mulino_id, Decimal("0")) + (riga.quintali or Decimal("0"))
-        
-        if not mulini_quintali:
-            return None
-        
-        # Ritorna il mulino con più quintali
-        return max(mulini_quintali, key=mulini_quintali.get)
-
     @property
     def is_assegnabile_carico(self) -> bool:
         """True se l'ordine può essere assegnato a un carico"""
@@ -166,7 +169,7 @@ class Ordine(Base):
     @property
     def is_ordine_grande(self) -> bool:
         """True se l'ordine è >= 280q (diventa carico automaticamente)"""
-        return self.totale_quintali >= Decimal("280")
+        return (self.totale_quintali or Decimal("0")) >= Decimal("280")
 
     def __repr__(self):
         return (
@@ -180,10 +183,10 @@ class RigaOrdine(Base):
     """Riga dettaglio ordine - un prodotto con quantità e prezzo"""
     __tablename__ = "righe_ordine"
 
-    id = Column(Integer, primary_key=True, index=True)
-    ordine_id = Column(Integer, ForeignKey("ordini.id"), nullable=False, index=True)
-    prodotto_id = Column(Integer, ForeignKey("prodotti.id"), nullable=False, index=True)
-    mulino_id = Column(Integer, ForeignKey("mulini.id"), nullable=False, index=True)
+    id = Column(Integer, primary_key=True)
+    ordine_id = Column(Integer, ForeignKey("ordini.id", ondelete="CASCADE"), nullable=False)
+    prodotto_id = Column(Integer, ForeignKey("prodotti.id", ondelete="RESTRICT"), nullable=False)
+    mulino_id = Column(Integer, ForeignKey("mulini.id", ondelete="RESTRICT"), nullable=False)
     
     pedane = Column(Numeric(10, 2), nullable=True)  # Numero pedane (se ordine a pedane)
     quintali = Column(Numeric(10, 2), nullable=False)  # Quintali totali
@@ -195,8 +198,11 @@ class RigaOrdine(Base):
     prodotto = relationship("Prodotto", back_populates="righe_ordine")
     mulino = relationship("Mulino", back_populates="righe_ordine")
 
-    # Indice per query composizione carichi
     __table_args__ = (
+        Index('idx_righe_ordine', 'ordine_id'),
+        Index('idx_righe_prodotto', 'prodotto_id'),
+        Index('idx_righe_mulino', 'mulino_id'),
+        # Indice per query composizione carichi
         Index('idx_righe_ordine_mulino', 'ordine_id', 'mulino_id'),
     )
 
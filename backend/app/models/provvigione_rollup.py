@@ -0,0 +1,24 @@
+from sqlalchemy import Column, Integer, Numeric, ForeignKey, DateTime
+from sqlalchemy.sql import func
+from app.database import Base
+
+
+class ProvvigioneRollup(Base):
+    """
+    Totali provvigioni pre-aggregati per (anno, trimestre, mulino).
+    Aggiornati in modo incrementale quando cambiano le righe o la data incasso
+    di un ordine; ricostruibili con `python -m app.manage ricostruisci-rollup-provvigioni`.
+    """
+    __tablename__ = "provvigioni_rollup"
+
+    anno = Column(Integer, primary_key=True)
+    trimestre = Column(Integer, primary_key=True)
+    mulino_id = Column(Integer, ForeignKey("mulini.id"), primary_key=True)
+    totale_quintali = Column(Numeric(14, 2), nullable=False, default=0)
+    totale_incassato = Column(Numeric(16, 2), nullable=False, default=0)
+    totale_provvigione = Column(Numeric(24, 8), nullable=False, default=0)
+    num_ordini = Column(Integer, nullable=False, default=0)
+    aggiornato_il = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f"<ProvvigioneRollup({self.anno} Q{self.trimestre}, mulino_id={self.mulino_id})>"
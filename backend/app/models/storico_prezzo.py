@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Numeric, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, Numeric, ForeignKey, DateTime, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from app.database import Base
@@ -8,13 +8,14 @@ class StoricoPrezzo(Base):
     """
     Tiene traccia di tutti i prezzi applicati per ogni combinazione cliente/prodotto.
     Viene popolato automaticamente quando si inserisce un ordine.
-    Serve per suggerire l'ultimo prezzo e per consultazione storica.
+    Serve per consultazione storica; l'ultimo prezzo di ogni coppia
+    è mantenuto a parte in ultimo_prezzo.
     """
     __tablename__ = "storico_prezzi"
 
-    id = Column(Integer, primary_key=True, index=True)
-    cliente_id = Column(Integer, ForeignKey("clienti.id"), nullable=False)
-    prodotto_id = Column(Integer, ForeignKey("prodotti.id"), nullable=False)
+    id = Column(Integer, primary_key=True)
+    cliente_id = Column(Integer, ForeignKey("clienti.id", ondelete="CASCADE"), nullable=False)
+    prodotto_id = Column(Integer, ForeignKey("prodotti.id", ondelete="CASCADE"), nullable=False)
     prezzo = Column(Numeric(10, 2), nullable=False)  # Prezzo al quintale
     creato_il = Column(DateTime(timezone=True), server_default=func.now())
 
@@ -22,5 +23,12 @@ class StoricoPrezzo(Base):
     cliente = relationship("Cliente", back_populates="storico_prezzi")
     prodotto = relationship("Prodotto", back_populates="storico_prezzi")
 
+    __table_args__ = (
+        # Storico di una coppia cliente/prodotto in ordine di data
+        Index('idx_storico_cliente_prodotto_data', 'cliente_id', 'prodotto_id', 'creato_il'),
+        Index('idx_storico_prodotto', 'prodotto_id'),
+        Index('idx_storico_data', 'creato_il'),
+    )
+
     def __repr__(self):
         return f"<StoricoPrezzo(cliente_id={self.cliente_id}, prodotto_id={self.prodotto_id}, prezzo={self.prezzo})>"
\ No newline at end of file
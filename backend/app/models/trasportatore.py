@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text
+from sqlalchemy import Column, Integer, String, Text, Index
 from sqlalchemy.orm import relationship
 from app.database import Base
 
@@ -6,8 +6,8 @@ from app.database import Base
 class Trasportatore(Base):
     __tablename__ = "trasportatori"
 
-    id = Column(Integer, primary_key=True, index=True)
-    nome = Column(String(255), nullable=False, index=True)
+    id = Column(Integer, primary_key=True)
+    nome = Column(String(255), nullable=False)
     telefono = Column(String(30), nullable=True)
     note = Column(Text, nullable=True)
 
@@ -15,5 +15,9 @@ class Trasportatore(Base):
     ordini = relationship("Ordine", back_populates="trasportatore")
     carichi = relationship("Carico", back_populates="trasportatore")
 
+    __table_args__ = (
+        Index('idx_trasportatori_nome', 'nome'),
+    )
+
     def __repr__(self):
         return f"<Trasportatore(id={self.id}, nome='{self.nome}')>"
\ No newline at end of file
@@ -0,0 +1,23 @@
+from sqlalchemy import Column, Integer, Numeric, ForeignKey, DateTime
+from sqlalchemy.sql import func
+from app.database import Base
+
+
+class UltimoPrezzo(Base):
+    """
+    Ultimo prezzo applicato per ogni coppia cliente/prodotto.
+    Aggiornato (upsert) a ogni scrittura nello storico prezzi: il suggerimento
+    in inserimento ordine è una lettura per chiave primaria, qualunque sia
+    la dimensione dello storico. Ricostruibile con
+    `python -m app.manage ricostruisci-ultimi-prezzi`.
+    """
+    __tablename__ = "ultimo_prezzo"
+
+    cliente_id = Column(Integer, ForeignKey("clienti.id", ondelete="CASCADE"), primary_key=True)
+    prodotto_id = Column(Integer, ForeignKey("prodotti.id", ondelete="CASCADE"), primary_key=True)
+    prezzo = Column(Numeric(10, 2), nullable=False)  # Prezzo al quintale
+    registrato_il = Column(DateTime(timezone=True), server_default=func.now(), nullable=False)
+    num_registrazioni = Column(Integer, nullable=False, default=1)  # Righe di storico della coppia
+
+    def __repr__(self):
+        return f"<UltimoPrezzo(cliente_id={self.cliente_id}, prodotto_id={self.prodotto_id}, prezzo={self.prezzo})>"
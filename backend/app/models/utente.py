@@ -10,6 +10,8 @@ class Utente(Base):
     username = Column(String(100), unique=True, nullable=False, index=True)
     hashed_password = Column(String(255), nullable=False)
     creato_il = Column(DateTime(timezone=True), server_default=func.now())
+    # Versione dei token emessi (claim "ver"): il cambio password la incrementa
+    versione_token = Column(Integer, nullable=False, default=0, server_default="0")
 
     def __repr__(self):
         return f"<Utente(id={self.id}, username='{self.username}')>"
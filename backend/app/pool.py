@@ -0,0 +1,180 @@
+"""
+Pool di connessioni configurabile e con telemetria
+
+- Parametri del pool da env (DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT_S,
+  DB_POOL_RECYCLE_S, DB_POOL_PRE_PING), validi per l'engine sincrono e per
+  quello asincrono
+- QueuePoolTelemetria: QueuePool che misura ogni checkout (latenza in
+  istogramma, attese a pool esaurito, timeout, connessioni in overflow)
+- Le misure sono esposte da GET /api/internal/pool per dimensionare il pool
+  sul traffico reale: contatori cumulativi dall'avvio, una finestra di
+  misura è la differenza tra due letture
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT_S = float(os.getenv("DB_POOL_TIMEOUT_S", "30"))
+# Connessioni più vecchie di così vengono riaperte (-1 = mai)
+DB_POOL_RECYCLE_S = int(os.getenv("DB_POOL_RECYCLE_S", "1800"))
+# Verifica la connessione al checkout: scarta quelle chiuse dal server
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+# Limiti superiori (ms) dei bucket dell'istogramma di latenza del checkout
+BUCKET_LATENZA_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+
+class TelemetriaPool:
+    """Contatori dei checkout di un pool (thread-safe)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.azzera()
+
+    def azzera(self) -> None:
+        with self._lock:
+            self.dal = datetime.now(timezone.utc)
+            self.checkout = 0
+            self.attese = 0
+            self.timeout = 0
+            self.overflow = 0
+            self.picco_in_uso = 0
+            self.latenza_totale_ms = 0.0
+            self.latenza_max_ms = 0.0
+            # Un conteggio per bucket più l'ultimo per i valori oltre il limite
+            self.istogramma = [0] * (len(BUCKET_LATENZA_MS) + 1)
+
+    def registra_checkout(self, latenza_ms: float, attesa: bool, overflow: bool, in_uso: int) -> None:
+        with self._lock:
+            self.checkout += 1
+            self.attese += attesa
+            self.overflow += overflow
+            self.picco_in_uso = max(self.picco_in_uso, in_uso)
+            self.latenza_totale_ms += latenza_ms
+            self.latenza_max_ms = max(self.latenza_max_ms, latenza_ms)
+            self.istogramma[self._bucket(latenza_ms)] += 1
+
+    def registra_timeout(self) -> None:
+        with self._lock:
+            self.timeout += 1
+
+    @staticmethod
+    def _bucket(latenza_ms: float) -> int:
+        for i, limite in enumerate(BUCKET_LATENZA_MS):
+            if latenza_ms <= limite:
+                return i
+        return len(BUCKET_LATENZA_MS)
+
+    def riepilogo(self) -> dict:
+        with self._lock:
+            etichette = [f"<={b}ms" for b in BUCKET_LATENZA_MS] + [f">{BUCKET_LATENZA_MS[-1]}ms"]
+            return {
+                "dal": self.dal,
+                "checkout": self.checkout,
+                "attese": self.attese,
+                "timeout": self.timeout,
+                "overflow": self.overflow,
+                "picco_in_uso": self.picco_in_uso,
+                "latenza_media_ms": round(self.latenza_totale_ms / self.checkout, 3) if self.checkout else 0.0,
+                "latenza_max_ms": round(self.latenza_max_ms, 3),
+                "istogramma_latenza": dict(zip(etichette, self.istogramma)),
+            }
+
+
+class _MisuraCheckout:
+    """Mixin per QueuePool: misura ogni connect() (attesa, creazione e pre-ping)"""
+
+    telemetria: TelemetriaPool
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.telemetria = TelemetriaPool()
+
+    def connect(self):
+        # Pool esaurito: nessuna connessione libera e overflow al massimo
+        attesa = self.checkedin() == 0 and 0 <= self._max_overflow <= self.overflow()
+        overflow_prima = self.overflow()
+        inizio = time.perf_counter()
+        try:
+            connessione = super().connect()
+        except exc.TimeoutError:
+            self.telemetria.registra_timeout()
+            raise
+
+        self.telemetria.registra_checkout(
+            (time.perf_counter() - inizio) * 1000,
+            attesa,
+            self.overflow() > max(0, overflow_prima),
+            self.checkedout()
+        )
+        return connessione
+
+    def recreate(self):
+        # dispose() ricrea il pool: i contatori proseguono
+        nuovo = super().recreate()
+        nuovo.telemetria = self.telemetria
+        return nuovo
+
+    def stato(self) -> dict:
+        """Stato istantaneo del pool e contatori dei checkout"""
+        return {
+            "dimensione": self.size(),
+            "max_overflow": self._max_overflow,
+            "timeout_s": self._timeout,
+            "in_uso": self.checkedout(),
+            "libere": self.checkedin(),
+            "overflow_attuale": max(0, self.overflow()),
+            **self.telemetria.riepilogo(),
+        }
+
+
+class QueuePoolTelemetria(_MisuraCheckout, QueuePool):
+    """QueuePool con telemetria dei checkout (engine sincrono)"""
+
+
+class AsyncQueuePoolTelemetria(_MisuraCheckout, AsyncAdaptedQueuePool):
+    """AsyncAdaptedQueuePool con telemetria dei checkout (engine asincrono)"""
+
+
+def opzioni_pool(url: str, asincrono: bool = False) -> dict:
+    """
+    Argomenti di create_engine per il pool configurato da env.
+    SQLite in memoria resta sul pool di default (una sola connessione).
+    """
+    url_parsed = make_url(url)
+    if url_parsed.get_backend_name() == "sqlite" and url_parsed.database in (None, "", ":memory:"):
+        return {}
+
+    return {
+        "poolclass": AsyncQueuePoolTelemetria if asincrono else QueuePoolTelemetria,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT_S,
+        "pool_recycle": DB_POOL_RECYCLE_S,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+def _pool_con_telemetria(engine) -> Optional[_MisuraCheckout]:
+    """Pool di un engine (sincrono o asincrono) se ha la telemetria"""
+    if engine is None:
+        return None
+    pool = getattr(engine, "sync_engine", engine).pool
+    return pool if isinstance(pool, _MisuraCheckout) else None
+
+
+def stato_pool(engine) -> Optional[dict]:
+    """Stato del pool di un engine, None se il pool non ha telemetria"""
+    pool = _pool_con_telemetria(engine)
+    return pool.stato() if pool is not None else None
+
@@ -1,42 +1,113 @@
+from typing import Optional
+
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import update
 
-from app.database import get_db
+from app.database import SessionLocal
 from app.models.utente import Utente
-from app.auth import verify_password, create_access_token, get_current_user, get_password_hash
+from app.auth import (
+    LimitatoreLogin,
+    UtenteAutenticato,
+    get_current_user,
+    get_limitatore_login,
+    get_password_hash_async,
+    invalida_utente,
+    richiede_rehash,
+    token_utente,
+    verify_password_async,
+)
 from app.schemas.auth import LoginRequest, ChangePasswordRequest, TokenResponse, UserResponse
 
 router = APIRouter()
 
 
+# Endpoint async: bcrypt gira sull'executor dedicato e le query nel threadpool,
+# così un picco di login non blocca i worker delle altre richieste.
+# Ogni passaggio nel threadpool apre e chiude la propria sessione: nessuna
+# Session passa da un thread all'altro.
+
+def _credenziali(condizione) -> Optional[Utente]:
+    """Utente (staccato dalla sessione), None se non esiste"""
+    db = SessionLocal()
+    try:
+        user = db.query(Utente).filter(condizione).first()
+        if user is not None:
+            db.expunge(user)
+        return user
+    finally:
+        db.close()
+
+
+def _salva_hash(utente_id: int, vecchio_hash: str, nuovo_hash: str, revoca_token: bool = False) -> Optional[int]:
+    """
+    Sostituisce l'hash solo se è ancora quello letto; None se nel frattempo è cambiato.
+    Con revoca_token incrementa la versione dei token: quelli emessi finora
+    non sono più validi. Restituisce la versione dei token dopo la modifica.
+    """
+    valori = {"hashed_password": nuovo_hash}
+    if revoca_token:
+        valori["versione_token"] = Utente.versione_token + 1
+    db = SessionLocal()
+    try:
+        versione = db.execute(
+            update(Utente)
+            .where(Utente.id == utente_id, Utente.hashed_password == vecchio_hash)
+            .values(**valori)
+            .returning(Utente.versione_token)
+        ).scalar()
+        db.commit()
+        return versione
+    finally:
+        db.close()
+
+
 @router.post("/login", response_model=TokenResponse)
-def login(request: LoginRequest, db: Session = Depends(get_db)):
-    user = db.query(Utente).filter(Utente.username == request.username).first()
-    if not user or not verify_password(request.password, user.hashed_password):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Username o password non validi",
-        )
-    token = create_access_token(data={"sub": user.username})
-    return TokenResponse(access_token=token)
+async def login(
+    request: LoginRequest,
+    limitatore: LimitatoreLogin = Depends(get_limitatore_login),
+):
+    async with limitatore.posto():
+        user = await run_in_threadpool(_credenziali, Utente.username == request.username)
+        if not user or not await verify_password_async(request.password, user.hashed_password):
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Username o password non validi",
+            )
+        # Costo bcrypt cambiato: riscrive l'hash ora che la password è nota
+        if richiede_rehash(user.hashed_password):
+            nuovo_hash = await get_password_hash_async(request.password)
+            await run_in_threadpool(_salva_hash, user.id, user.hashed_password, nuovo_hash)
+    return TokenResponse(access_token=token_utente(user))
 
 
 @router.put("/password")
-def change_password(
+async def change_password(
     request: ChangePasswordRequest,
-    current_user: Utente = Depends(get_current_user),
-    db: Session = Depends(get_db),
+    current_user: UtenteAutenticato = Depends(get_current_user),
 ):
-    if not verify_password(request.current_password, current_user.hashed_password):
+    # L'utente autenticato può venire dalla cache: si rilegge per aggiornarlo
+    user = await run_in_threadpool(_credenziali, Utente.id == current_user.id)
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Utente non trovato")
+    if not await verify_password_async(request.current_password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Password attuale non corretta",
         )
-    current_user.hashed_password = get_password_hash(request.new_password)
-    db.commit()
-    return {"detail": "Password aggiornata"}
+    nuovo_hash = await get_password_hash_async(request.new_password)
+    versione = await run_in_threadpool(_salva_hash, user.id, user.hashed_password, nuovo_hash, True)
+    if versione is None:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Password modificata da un'altra operazione: riprovare",
+        )
+    # I token emessi finora sono revocati: il client prosegue con quello nuovo
+    invalida_utente(user.username)
+    user.versione_token = versione
+    return {"detail": "Password aggiornata", "access_token": token_utente(user)}
 
 
 @router.get("/me", response_model=UserResponse)
-def get_me(current_user: Utente = Depends(get_current_user)):
+def get_me(current_user: UtenteAutenticato = Depends(get_current_user)):
     return current_user
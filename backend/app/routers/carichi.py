@@ -8,14 +8,15 @@ Endpoint per gestione completa carichi:
 - Validazione e suggerimenti
 """
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from sqlalchemy import desc
 from typing import List, Optional
 from decimal import Decimal
 from datetime import date
 
-from app.database import get_db
+from app.database import get_async_db, get_db
 from app.models.carico import Carico, StatoCarico
 from app.models.ordine import Ordine, StatoLogisticoOrdine
 from app.models.mulino import Mulino
@@ -31,126 +32,180 @@ from app.schemas.carico import (
     CaricoAssignTransport,
     AddOrdineToCarico,
     RemoveOrdineFromCarico,
+    ModalitaOperazioni,
+    OperazioniCarichi,
+    RisultatoOperazioniCarichi,
     ValidazioneCaricoResult,
+    CandidatiCarico,
+    ValidazioneCandidato,
     OrdineInCarico
 )
 
-from app.services import carico_service
+from app.services import carico_service, paginazione
 
 router = APIRouter()
+# Versioni asincrone delle letture più frequenti (montate sotto /api/async se attive)
+router_async = APIRouter()
 
 
 # === HELPERS ===
 
-def _build_carico_read(db: Session, carico: Carico) -> dict:
-    """Costruisce la response per un carico con tutti i campi calcolati"""
-    mulino = db.query(Mulino).filter(Mulino.id == carico.mulino_id).first()
-    trasportatore = None
-    if carico.trasportatore_id:
-        trasportatore = db.query(Trasportatore).filter(
-            Trasportatore.id == carico.trasportatore_id
-        ).first()
-    
-    num_ordini = db.query(Ordine).filter(Ordine.carico_id == carico.id).count()
+CHIAVE_LISTA_CARICHI = (Carico.creato_il, Carico.id)
+
+
+def _serializza_carico(row) -> dict:
+    """
+    Riga della proiezione carichi -> dict con tutti i campi calcolati.
+    Va bene sia per CaricoRead che per CaricoList (i campi extra vengono scartati).
+    """
+    total_quantita = row.total_quantita or Decimal("0")
     
     return {
-        "id": carico.id,
-        "mulino_id": carico.mulino_id,
-        "mulino_nome": mulino.nome if mulino else None,
-        "tipo": carico.tipo,
-        "trasportatore_id": carico.trasportatore_id,
-        "trasportatore_nome": trasportatore.nome if trasportatore else None,
-        "data_ritiro": carico.data_ritiro,
-        "stato": carico.stato,
-        "total_quantita": carico.total_quantita or Decimal("0"),
-        "note": carico.note,
-        "creato_il": carico.creato_il,
-        "aggiornato_il": carico.aggiornato_il,
-        "num_ordini": num_ordini,
-        "quintali_disponibili": Decimal("300") - (carico.total_quantita or Decimal("0")),
+        "id": row.id,
+        "mulino_id": row.mulino_id,
+        "mulino_nome": row.mulino_nome,
+        "tipo": row.tipo,
+        "trasportatore_id": row.trasportatore_id,
+        "trasportatore_nome": row.trasportatore_nome,
+        "data_ritiro": row.data_ritiro,
+        "stato": row.stato,
+        "total_quantita": total_quantita,
+        "note": row.note,
+        "versione": row.versione,
+        "creato_il": row.creato_il,
+        "aggiornato_il": row.aggiornato_il,
+        "num_ordini": row.num_ordini,
+        "quintali_disponibili": Decimal("300") - total_quantita,
         "percentuale_completamento": min(
             Decimal("100"),
-            ((carico.total_quantita or Decimal("0")) / Decimal("300")) * 100
+            (total_quantita / Decimal("300")) * 100
         ),
-        "is_completo": (carico.total_quantita or Decimal("0")) >= Decimal("280")
+        "is_completo": total_quantita >= Decimal("280")
     }
 
 
-def _build_carico_list_item(db: Session, carico: Carico) -> dict:
-    """Costruisce item leggero per liste"""
-    mulino = db.query(Mulino).filter(Mulino.id == carico.mulino_id).first()
-    trasportatore = None
-    if carico.trasportatore_id:
-        trasportatore = db.query(Trasportatore).filter(
-            Trasportatore.id == carico.trasportatore_id
-        ).first()
+def _lista_carichi(db: Session, stmt) -> List[dict]:
+    """Esegue la proiezione carichi (una sola query) e serializza"""
+    return [_serializza_carico(row) for row in db.execute(stmt)]
+
+
+def _query_lista_carichi(
+    stato: Optional[str],
+    tipo: Optional[str],
+    mulino_id: Optional[int],
+    solo_aperti: bool
+):
+    """Proiezione carichi con i filtri della lista (senza paginazione)"""
+    stmt = carico_service.query_carichi_proiezione()
     
-    num_ordini = db.query(Ordine).filter(Ordine.carico_id == carico.id).count()
+    if stato is not None:
+        stmt = stmt.where(Carico.stato == stato)
+    elif solo_aperti:
+        stmt = stmt.where(Carico.stato.in_([
+            StatoCarico.BOZZA.value, 
+            StatoCarico.ASSEGNATO.value
+        ]))
+    
+    if tipo is not None:
+        stmt = stmt.where(Carico.tipo == tipo)
     
+    if mulino_id is not None:
+        stmt = stmt.where(Carico.mulino_id == mulino_id)
+    
+    return stmt
+
+
+def _esito_validazione(valido: bool, errori: List[str], info: dict) -> dict:
+    """Risposta di validazione: errori bloccanti, avvisi e info del carico"""
     return {
-        "id": carico.id,
-        "mulino_id": carico.mulino_id,
-        "mulino_nome": mulino.nome if mulino else None,
-        "tipo": carico.tipo,
-        "stato": carico.stato,
-        "data_ritiro": carico.data_ritiro,
-        "trasportatore_id": carico.trasportatore_id,
-        "trasportatore_nome": trasportatore.nome if trasportatore else None,
-        "total_quantita": carico.total_quantita or Decimal("0"),
-        "percentuale_completamento": min(
-            Decimal("100"),
-            ((carico.total_quantita or Decimal("0")) / Decimal("300")) * 100
-        ),
-        "is_completo": (carico.total_quantita or Decimal("0")) >= Decimal("280"),
-        "num_ordini": num_ordini
+        "valido": valido,
+        "errori": errori,
+        "warnings": carico_service.avvisi_carico(valido, info),
+        "totale_quintali": info['totale_quintali'],
+        "mulino_id": info['mulino_id'],
+        "tipo": info['tipo']
     }
 
 
+def _build_carico_read(db: Session, carico: Carico) -> dict:
+    """Costruisce la response per un carico con tutti i campi calcolati"""
+    stmt = carico_service.query_carichi_proiezione().where(Carico.id == carico.id)
+    return _serializza_carico(db.execute(stmt).one())
+
+
 # === ENDPOINT LISTA E DETTAGLIO ===
 
 @router.get("/", response_model=List[CaricoList])
 def lista_carichi(
+    response: Response,
     stato: Optional[str] = Query(default=None, description="Filtra per stato"),
     tipo: Optional[str] = Query(default=None, description="Filtra per tipo (sfuso/pedane)"),
     mulino_id: Optional[int] = Query(default=None, description="Filtra per mulino"),
     solo_aperti: bool = Query(default=False, description="Mostra solo BOZZA e ASSEGNATO"),
+    cursore: Optional[str] = Query(default=None, description="Cursore della pagina (header X-Next-Cursor)"),
+    limit: Optional[int] = Query(default=None, ge=1, description="Carichi per pagina (default: tutti)"),
+    con_totale: bool = Query(default=False, description="Totale approssimato nell'header X-Total-Approx"),
     db: Session = Depends(get_db)
 ):
     """
     Lista carichi con filtri.
     
     Stati possibili: bozza, assegnato, ritirato, consegnato
+    
+    Paginazione keyset su (creato_il, id) decrescente, attiva con limit:
+    cursore della pagina successiva nell'header X-Next-Cursor.
     """
-    query = db.query(Carico)
+    stmt = _query_lista_carichi(stato, tipo, mulino_id, solo_aperti)
+    totale = paginazione.conta_approssimata(db, stmt) if con_totale else None
     
-    if stato is not None:
-        query = query.filter(Carico.stato == stato)
-    elif solo_aperti:
-        query = query.filter(Carico.stato.in_([
-            StatoCarico.BOZZA.value, 
-            StatoCarico.ASSEGNATO.value
-        ]))
+    stmt = paginazione.applica_keyset(stmt, CHIAVE_LISTA_CARICHI, cursore, discendente=True)
     
-    if tipo is not None:
-        query = query.filter(Carico.tipo == tipo)
+    if limit is None:
+        paginazione.imposta_header_pagina(response, None, totale)
+        return _lista_carichi(db, stmt)
     
-    if mulino_id is not None:
-        query = query.filter(Carico.mulino_id == mulino_id)
+    carichi, cursore_successivo = paginazione.pagina_keyset(db, stmt, CHIAVE_LISTA_CARICHI, limit)
+    paginazione.imposta_header_pagina(response, cursore_successivo, totale)
+    return [_serializza_carico(row) for row in carichi]
+
+
+@router_async.get("/", response_model=List[CaricoList])
+async def lista_carichi_async(
+    response: Response,
+    stato: Optional[str] = Query(default=None, description="Filtra per stato"),
+    tipo: Optional[str] = Query(default=None, description="Filtra per tipo (sfuso/pedane)"),
+    mulino_id: Optional[int] = Query(default=None, description="Filtra per mulino"),
+    solo_aperti: bool = Query(default=False, description="Mostra solo BOZZA e ASSEGNATO"),
+    cursore: Optional[str] = Query(default=None, description="Cursore della pagina (header X-Next-Cursor)"),
+    limit: Optional[int] = Query(default=None, ge=1, description="Carichi per pagina (default: tutti)"),
+    con_totale: bool = Query(default=False, description="Totale approssimato nell'header X-Total-Approx"),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Come GET /api/carichi/, sull'engine asincrono (stesse query e risposta)"""
+    stmt = _query_lista_carichi(stato, tipo, mulino_id, solo_aperti)
+    totale = await paginazione.conta_approssimata_async(db, stmt) if con_totale else None
+    
+    stmt = paginazione.applica_keyset(stmt, CHIAVE_LISTA_CARICHI, cursore, discendente=True)
     
-    carichi = query.order_by(desc(Carico.creato_il)).all()
+    if limit is None:
+        paginazione.imposta_header_pagina(response, None, totale)
+        return [_serializza_carico(row) for row in await db.execute(stmt)]
     
-    return [_build_carico_list_item(db, c) for c in carichi]
+    carichi, cursore_successivo = await paginazione.pagina_keyset_async(
+        db, stmt, CHIAVE_LISTA_CARICHI, limit
+    )
+    paginazione.imposta_header_pagina(response, cursore_successivo, totale)
+    return [_serializza_carico(row) for row in carichi]
 
 
 @router.get("/aperti", response_model=List[CaricoList])
 def lista_carichi_aperti(db: Session = Depends(get_db)):
     """Lista rapida carichi aperti (BOZZA + ASSEGNATO) - ottimizzato per mobile"""
-    query = db.query(Carico).filter(
+    stmt = carico_service.query_carichi_proiezione().where(
         Carico.stato.in_([StatoCarico.BOZZA.value, StatoCarico.ASSEGNATO.value])
     ).order_by(desc(Carico.creato_il))
     
-    carichi = query.all()
-    return [_build_carico_list_item(db, c) for c in carichi]
+    return _lista_carichi(db, stmt)
 
 
 @router.get("/bozze", response_model=List[CaricoList])
@@ -160,16 +215,17 @@ def lista_carichi_bozza(
     db: Session = Depends(get_db)
 ):
     """Lista carichi in BOZZA - per composizione carichi"""
-    query = db.query(Carico).filter(Carico.stato == StatoCarico.BOZZA.value)
+    stmt = carico_service.query_carichi_proiezione().where(
+        Carico.stato == StatoCarico.BOZZA.value
+    )
     
     if mulino_id is not None:
-        query = query.filter(Carico.mulino_id == mulino_id)
+        stmt = stmt.where(Carico.mulino_id == mulino_id)
     
     if tipo is not None:
-        query = query.filter(Carico.tipo == tipo)
+        stmt = stmt.where(Carico.tipo == tipo)
     
-    carichi = query.order_by(desc(Carico.creato_il)).all()
-    return [_build_carico_list_item(db, c) for c in carichi]
+    return _lista_carichi(db, stmt.order_by(desc(Carico.creato_il)))
 
 
 @router.get("/{carico_id}", response_model=CaricoRead)
@@ -195,7 +251,6 @@ def ordini_del_carico(carico_id: int, db: Session = Depends(get_db)):
     for ordine in ordini:
         from app.models.cliente import Cliente
         cliente = db.query(Cliente).filter(Cliente.id == ordine.cliente_id).first()
-        totale = carico_service.calcola_totale_quintali_ordine(db, ordine.id)
         
         risultato.append({
             "id": ordine.id,
@@ -205,7 +260,7 @@ def ordini_del_carico(carico_id: int, db: Session = Depends(get_db)):
             "data_ritiro": ordine.data_ritiro,
             "tipo_ordine": ordine.tipo_ordine,
             "stato_logistico": ordine.stato_logistico,
-            "totale_quintali": totale
+            "totale_quintali": ordine.totale_quintali
         })
     
     return risultato
@@ -234,9 +289,10 @@ def crea_carico(carico: CaricoCreate, db: Session = Depends(get_db)):
         if not trasportatore:
             raise HTTPException(status_code=404, detail="Trasportatore non trovato")
     
-    # Valida ordini se specificati
+    # Valida ordini se specificati (bloccati fino al commit: nessuna assegnazione concorrente)
     totale_quintali = Decimal("0")
     if carico.ordini_ids:
+        carico_service.blocca_ordini(db, carico.ordini_ids)
         valido, errori, info = carico_service.validate_load_constraints(
             db, carico.ordini_ids
         )
@@ -324,11 +380,8 @@ def aggiorna_carico(
     db: Session = Depends(get_db)
 ):
     """Aggiorna campi carico (note, trasportatore, data)"""
-    carico = db.query(Carico).filter(Carico.id == carico_id).first()
-    if not carico:
-        raise HTTPException(status_code=404, detail="Carico non trovato")
-    
     update_data = data.model_dump(exclude_unset=True)
+    carico = carico_service.blocca_carico(db, carico_id, update_data.pop("versione", None))
     
     # Verifica trasportatore se specificato
     if "trasportatore_id" in update_data and update_data["trasportatore_id"]:
@@ -361,7 +414,8 @@ def assegna_trasporto(
         db,
         carico_id,
         data.trasportatore_id,
-        data.data_ritiro
+        data.data_ritiro,
+        data.versione
     )
     db.commit()
     db.refresh(carico)
@@ -378,7 +432,7 @@ def aggiungi_ordine(
     db: Session = Depends(get_db)
 ):
     """Aggiunge un ordine al carico"""
-    carico = carico_service.add_order_to_load(db, data.ordine_id, carico_id)
+    carico = carico_service.add_order_to_load(db, data.ordine_id, carico_id, data.versione)
     db.commit()
     db.refresh(carico)
     
@@ -389,6 +443,7 @@ def aggiungi_ordine(
 def rimuovi_ordine(
     carico_id: int,
     ordine_id: int,
+    versione: Optional[int] = Query(None, description="Versione letta del carico: se cambiata -> 409"),
     db: Session = Depends(get_db)
 ):
     """
@@ -397,18 +452,7 @@ def rimuovi_ordine(
     Se il carico rimane vuoto o con 1 ordine (e in bozza), viene eliminato.
     In quel caso ritorna null.
     """
-    # Verifica che l'ordine appartenga a questo carico
-    ordine = db.query(Ordine).filter(Ordine.id == ordine_id).first()
-    if not ordine:
-        raise HTTPException(status_code=404, detail="Ordine non trovato")
-    
-    if ordine.carico_id != carico_id:
-        raise HTTPException(
-            status_code=400, 
-            detail=f"Ordine {ordine_id} non appartiene al carico {carico_id}"
-        )
-    
-    carico = carico_service.remove_order_from_load(db, ordine_id)
+    carico = carico_service.remove_order_from_load(db, ordine_id, versione, carico_id=carico_id)
     db.commit()
     
     if carico:
@@ -420,38 +464,40 @@ def rimuovi_ordine(
 
 @router.get("/{carico_id}/ordini-disponibili", response_model=List[OrdineInCarico])
 def ordini_disponibili(carico_id: int, db: Session = Depends(get_db)):
-    """Lista ordini che possono essere aggiunti a questo carico"""
+    """
+    Lista ordini che possono essere aggiunti a questo carico,
+    dal più adatto a riempirlo (una query indicizzata, nomi cliente inclusi).
+    """
     ordini = carico_service.get_ordini_disponibili_per_carico(db, carico_id)
     
-    risultato = []
-    for ordine in ordini:
-        from app.models.cliente import Cliente
-        cliente = db.query(Cliente).filter(Cliente.id == ordine.cliente_id).first()
-        totale = carico_service.calcola_totale_quintali_ordine(db, ordine.id)
-        
-        risultato.append({
+    return [
+        {
             "id": ordine.id,
             "cliente_id": ordine.cliente_id,
-            "cliente_nome": cliente.nome if cliente else None,
+            "cliente_nome": ordine.cliente_nome,
             "data_ordine": ordine.data_ordine,
             "data_ritiro": ordine.data_ritiro,
             "tipo_ordine": ordine.tipo_ordine,
             "stato_logistico": ordine.stato_logistico,
-            "totale_quintali": totale
-        })
-    
-    return risultato
+            "totale_quintali": ordine.totale_quintali
+        }
+        for ordine in ordini
+    ]
 
 
 # === ENDPOINT TRANSIZIONI STATO ===
 
 @router.post("/{carico_id}/ritira", response_model=CaricoRead)
-def ritira_carico(carico_id: int, db: Session = Depends(get_db)):
+def ritira_carico(
+    carico_id: int,
+    versione: Optional[int] = Query(None, description="Versione letta del carico: se cambiata -> 409"),
+    db: Session = Depends(get_db)
+):
     """
     Segna il carico come ritirato.
     Transizione: ASSEGNATO -> RITIRATO
     """
-    carico = carico_service.mark_load_as_picked_up(db, carico_id)
+    carico = carico_service.mark_load_as_picked_up(db, carico_id, versione)
     db.commit()
     db.refresh(carico)
     
@@ -459,29 +505,98 @@ def ritira_carico(carico_id: int, db: Session = Depends(get_db)):
 
 
 @router.post("/{carico_id}/consegna", response_model=CaricoRead)
-def consegna_carico(carico_id: int, db: Session = Depends(get_db)):
+def consegna_carico(
+    carico_id: int,
+    versione: Optional[int] = Query(None, description="Versione letta del carico: se cambiata -> 409"),
+    db: Session = Depends(get_db)
+):
     """
     Segna il carico come consegnato.
     Transizione: RITIRATO -> CONSEGNATO
     """
-    carico = carico_service.mark_load_as_delivered(db, carico_id)
+    carico = carico_service.mark_load_as_delivered(db, carico_id, versione)
     db.commit()
     db.refresh(carico)
     
     return _build_carico_read(db, carico)
 
 
+# === ENDPOINT OPERAZIONI IN BLOCCO ===
+
+@router.post(
+    "/operazioni",
+    response_model=RisultatoOperazioniCarichi,
+    responses={
+        409: {"model": RisultatoOperazioniCarichi, "description": "Conflitto di versione su almeno un carico"},
+        422: {"model": RisultatoOperazioniCarichi, "description": "Operazioni fallite (annullate in tutto_o_niente)"},
+    }
+)
+def operazioni_in_blocco(
+    data: OperazioniCarichi,
+    response: Response,
+    db: Session = Depends(get_db)
+):
+    """
+    Esegue più operazioni (assegna, ritira, consegna, aggiungi/rimuovi ordine)
+    in un'unica transazione, con le stesse regole degli endpoint singoli.
+    
+    Transizioni consecutive dello stesso tipo diventano un UPDATE per tabella.
+    Modalità tutto_o_niente: al primo errore non viene applicato nulla;
+    best_effort: le operazioni fallite vengono saltate.
+    Ritorna l'esito per operazione e lo stato finale dei carichi coinvolti.
+    
+    Status: 200 se tutte le operazioni sono riuscite; con operazioni fallite
+    (e quindi, in tutto_o_niente, annullate) 409 se almeno un errore è un
+    conflitto di versione, altrimenti 422. Il corpo è lo stesso.
+    """
+    esiti, confermate = carico_service.esegui_operazioni(
+        db,
+        data.operazioni,
+        tutto_o_niente=data.modalita == ModalitaOperazioni.TUTTO_O_NIENTE
+    )
+    if confermate:
+        db.commit()
+    else:
+        db.rollback()
+    
+    # Stato finale dei carichi coinvolti con una sola proiezione
+    carico_ids = {esito["carico_id"] for esito in esiti}
+    carichi = _lista_carichi(
+        db,
+        carico_service.query_carichi_proiezione()
+        .where(Carico.id.in_(carico_ids))
+        .order_by(Carico.id)
+    )
+    
+    codici_errore = {
+        esito["status_code"] for esito in esiti if esito["esito"] == carico_service.ESITO_ERRORE
+    }
+    if codici_errore:
+        response.status_code = 409 if 409 in codici_errore else 422
+    
+    return {
+        "modalita": data.modalita,
+        "confermate": confermate,
+        "eseguite": sum(esito["esito"] == carico_service.ESITO_OK for esito in esiti),
+        "fallite": sum(esito["esito"] == carico_service.ESITO_ERRORE for esito in esiti),
+        "esiti": esiti,
+        "carichi": carichi,
+    }
+
+
 # === ENDPOINT ELIMINAZIONE ===
 
 @router.delete("/{carico_id}", status_code=204)
-def elimina_carico(carico_id: int, db: Session = Depends(get_db)):
+def elimina_carico(
+    carico_id: int,
+    versione: Optional[int] = Query(None, description="Versione letta del carico: se cambiata -> 409"),
+    db: Session = Depends(get_db)
+):
     """
     Elimina carico.
     Gli ordini vengono scollegati e tornano APERTO, non eliminati.
     """
-    carico = db.query(Carico).filter(Carico.id == carico_id).first()
-    if not carico:
-        raise HTTPException(status_code=404, detail="Carico non trovato")
+    carico = carico_service.blocca_carico(db, carico_id, versione)
     
     if carico.stato in [StatoCarico.RITIRATO.value, StatoCarico.CONSEGNATO.value]:
         raise HTTPException(
@@ -516,20 +631,20 @@ def valida_ordini_per_carico(
     Utile per preview drag&drop prima della creazione.
     """
     valido, errori, info = carico_service.validate_load_constraints(db, ordini_ids)
+    return _esito_validazione(valido, errori, info)
+
+
+@router.post("/valida-multipla", response_model=List[ValidazioneCandidato])
+def valida_candidati_carico(data: CandidatiCarico, db: Session = Depends(get_db)):
+    """
+    Valida molti insiemi di ordini in una sola chiamata.
     
-    warnings = []
-    if valido:
-        if info['totale_quintali'] < Decimal("280"):
-            warnings.append(f"Carico sotto soglia minima: {info['totale_quintali']}q < 280q")
-        elif info['totale_quintali'] < Decimal("300"):
-            mancanti = Decimal("300") - info['totale_quintali']
-            warnings.append(f"Possibile aggiungere ancora {mancanti}q")
-    
-    return {
-        "valido": valido,
-        "errori": errori,
-        "warnings": warnings,
-        "totale_quintali": info['totale_quintali'],
-        "mulino_id": info['mulino_id'],
-        "tipo": info['tipo']
-    }
\ No newline at end of file
+    Gli attributi di tutti gli ordini coinvolti si leggono con una query,
+    poi ogni candidato è verificato in memoria con le regole di /valida:
+    il frontend pre-valida l'intera board con un solo round-trip.
+    """
+    esiti = carico_service.valida_candidati(db, data.candidati, data.exclude_carico_id)
+    return [
+        {"indice": indice, "ordini_ids": candidato, **_esito_validazione(*esito)}
+        for indice, (candidato, esito) in enumerate(zip(data.candidati, esiti))
+    ]
\ No newline at end of file
@@ -1,38 +1,47 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import or_
+from sqlalchemy import select
 from typing import List, Optional
 
 from app.database import get_db
 from app.models.cliente import Cliente
-from app.models.storico_prezzo import StoricoPrezzo
-from app.models.prodotto import Prodotto
-from app.models.mulino import Mulino
 from app.schemas.cliente import ClienteCreate, ClienteUpdate, ClienteRead, ClienteList
 from app.schemas.storico_prezzo import UltimoPrezzoRead
+from app.services import paginazione, prezzi, ricerca
 
 router = APIRouter()
 
 
 @router.get("/", response_model=List[ClienteList])
 def lista_clienti(
+    response: Response,
     search: Optional[str] = Query(None, description="Cerca per nome"),
+    cursore: Optional[str] = Query(None, description="Cursore della pagina (header X-Next-Cursor)"),
+    con_totale: bool = Query(False, description="Totale approssimato nell'header X-Total-Approx"),
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1),
     db: Session = Depends(get_db)
 ):
-    """Lista tutti i clienti con ricerca opzionale"""
-    query = db.query(Cliente)
+    """
+    Lista tutti i clienti con ricerca opzionale.
+    
+    Paginazione keyset su (nome, id): cursore dall'header X-Next-Cursor.
+    """
+    query = select(Cliente)
     
     if search:
-        query = query.filter(
-            or_(
-                Cliente.nome.ilike(f"%{search}%"),
-                Cliente.referente.ilike(f"%{search}%")
-            )
-        )
+        query = query.where(ricerca.filtro_ricerca(db, (Cliente.nome, Cliente.referente), search, simili=False))
+    
+    totale = paginazione.conta_approssimata(db, query) if con_totale else None
     
-    return query.order_by(Cliente.nome).offset(skip).limit(limit).all()
+    chiave = (Cliente.nome, Cliente.id)
+    query = paginazione.applica_keyset(query, chiave, cursore)
+    if skip and not cursore:
+        query = query.offset(skip)
+    
+    clienti, cursore_successivo = paginazione.pagina_keyset(db, query, chiave, limit, scalari=True)
+    paginazione.imposta_header_pagina(response, cursore_successivo, totale)
+    return clienti
 
 
 @router.get("/{cliente_id}", response_model=ClienteRead)
@@ -97,36 +106,4 @@ def get_prezzi_cliente(cliente_id: int, db: Session = Depends(get_db)):
     if not cliente:
         raise HTTPException(status_code=404, detail="Cliente non trovato")
     
-    # Subquery per ottenere l'ultimo prezzo per ogni prodotto
-    from sqlalchemy import func, desc
-    
-    subq = db.query(
-        StoricoPrezzo.prodotto_id,
-        func.max(StoricoPrezzo.creato_il).label("max_data")
-    ).filter(
-        StoricoPrezzo.cliente_id == cliente_id
-    ).group_by(StoricoPrezzo.prodotto_id).subquery()
-    
-    risultati = db.query(
-        StoricoPrezzo.cliente_id,
-        StoricoPrezzo.prodotto_id,
-        Prodotto.nome.label("prodotto_nome"),
-        Prodotto.mulino_id,
-        Mulino.nome.label("mulino_nome"),
-        StoricoPrezzo.prezzo.label("ultimo_prezzo"),
-        StoricoPrezzo.creato_il.label("data_ultimo_ordine")
-    ).join(
-        subq,
-        (StoricoPrezzo.prodotto_id == subq.c.prodotto_id) &
-        (StoricoPrezzo.creato_il == subq.c.max_data)
-    ).join(
-        Prodotto, StoricoPrezzo.prodotto_id == Prodotto.id
-    ).join(
-        Mulino, Prodotto.mulino_id == Mulino.id
-    ).filter(
-        StoricoPrezzo.cliente_id == cliente_id
-    ).order_by(
-        Mulino.nome, Prodotto.nome
-    ).all()
-    
-    return risultati
\ No newline at end of file
+    return db.execute(prezzi.query_prezzi_cliente(cliente_id)).all()
\ No newline at end of file
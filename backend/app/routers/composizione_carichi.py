@@ -3,28 +3,36 @@ Router per la composizione intelligente dei carichi.
 Fornisce endpoint per:
 - Ordini non assegnati raggruppati per mulino e tipo
 - Suggerimenti automatici di combinazioni ottimali
+- Piano globale di carichi disgiunti
 """
 
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from decimal import Decimal
 from datetime import date, timedelta
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
-from app.database import get_db
-from app.models.ordine import Ordine, RigaOrdine
-from app.models.cliente import Cliente
+from app.database import get_async_db, get_db
 from app.models.mulino import Mulino
+from app.models.ordine import Ordine, RigaOrdine
 from app.models.carico import Carico
 
+from app.services import carico_service, composizione_service
+from app.services.composizione_service import (
+    OBIETTIVO_QUINTALI,
+    SOGLIA_MINIMA,
+    SOGLIA_MASSIMA,
+)
+
 router = APIRouter()
+# Versioni asincrone delle letture più frequenti (montate sotto /api/async se attive)
+router_async = APIRouter()
 
 # Costanti
-OBIETTIVO_QUINTALI = Decimal("300")
-SOGLIA_MINIMA = Decimal("280")
-SOGLIA_MASSIMA = Decimal("320")
 GIORNI_TOLLERANZA_DATA = 3  # Per suggerimenti: ordini entro X giorni
 
 
@@ -73,152 +81,69 @@ class RispostaComposizione(BaseModel):
     carichi_aperti: List[dict]  # Carichi esistenti ancora aperti
 
 
-# === HELPERS ===
+class CaricoPianificato(BaseModel):
+    """Carico proposto dal piano globale (ordini disgiunti)"""
+    ordini_ids: List[int]
+    totale_quintali: Decimal
+    data_piu_urgente: Optional[date]
+    spread_giorni: int  # Giorni tra la data di ritiro più vicina e la più lontana
 
-def calcola_totale_quintali_ordine(db: Session, ordine_id: int) -> Decimal:
-    """Calcola il totale quintali di un ordine dalle sue righe"""
-    result = db.query(
-        func.sum(RigaOrdine.quintali)
-    ).filter(RigaOrdine.ordine_id == ordine_id).scalar()
-    return result or Decimal("0")
 
+class PianoGruppo(BaseModel):
+    """Piano carichi per un gruppo mulino + tipo"""
+    mulino_id: int
+    mulino_nome: str
+    tipo: str
+    carichi: List[CaricoPianificato]
+    ordini_residui: List[int]  # Ordini che non entrano in nessun carico
+    quintali_residui: Decimal
 
-def get_mulino_principale_ordine(db: Session, ordine_id: int) -> tuple:
-    """
-    Restituisce (mulino_id, mulino_nome) del mulino con più quintali nell'ordine.
-    Un ordine può avere righe da più mulini, prendiamo quello predominante.
-    """
-    result = db.query(
-        RigaOrdine.mulino_id,
-        Mulino.nome,
-        func.sum(RigaOrdine.quintali).label("tot")
-    ).join(Mulino).filter(
-        RigaOrdine.ordine_id == ordine_id
-    ).group_by(
-        RigaOrdine.mulino_id, Mulino.nome
-    ).order_by(
-        func.sum(RigaOrdine.quintali).desc()
-    ).first()
-    
-    if result:
-        return result.mulino_id, result.nome
-    return None, None
+
+class RispostaPiano(BaseModel):
+    """Piano globale: partizione degli ordini aperti in carichi"""
+    gruppi: List[PianoGruppo]
+    num_carichi: int
+    quintali_residui: Decimal
 
 
-def genera_suggerimenti(ordini: List[dict], max_suggerimenti: int = 5) -> List[SuggerimentoCombinazione]:
+class ConfermaPiano(BaseModel):
+    """Carichi del piano da creare in BOZZA in un'unica transazione"""
+    carichi: List[List[int]] = Field(..., min_length=1, description="Lista di ordini_ids, uno per carico")
+    note: Optional[str] = None
+
+
+class RispostaConfermaPiano(BaseModel):
+    carichi_ids: List[int]
+
+
+# === HELPERS ===
+
+def genera_suggerimenti(
+    ordini: List[dict],
+    max_suggerimenti: int = 5,
+    tempo_max_ms: Optional[int] = None
+) -> List[SuggerimentoCombinazione]:
     """
     Genera suggerimenti di combinazioni ottimali.
-    Usa un algoritmo greedy per trovare combinazioni che si avvicinano a 280-300 q.li
+    Delega al motore di packing: combinazioni di qualsiasi dimensione
+    tra 280 e 320 q.li, entro il budget di tempo.
     """
-    if not ordini:
-        return []
-    
-    suggerimenti = []
-    ordini_disponibili = sorted(ordini, key=lambda x: x["data_ritiro"] or date.max)
-    
-    # Strategia 1: Trova coppie che sommano vicino a 300
-    for i, o1 in enumerate(ordini_disponibili):
-        for o2 in ordini_disponibili[i+1:]:
-            totale = o1["totale_quintali"] + o2["totale_quintali"]
-            
-            # Accetta combinazioni tra 280 e 320
-            if SOGLIA_MINIMA <= totale <= SOGLIA_MASSIMA:
-                diff = abs(totale - OBIETTIVO_QUINTALI)
-                
-                # Calcola score: più vicino a 300 e date vicine = score più alto
-                date1 = o1["data_ritiro"] or o1["data_ordine"]
-                date2 = o2["data_ritiro"] or o2["data_ordine"]
-                giorni_diff = abs((date1 - date2).days) if date1 and date2 else 0
-                
-                # Score: penalizza distanza da 300 e giorni tra date
-                score = 100 - float(diff) - (giorni_diff * 2)
-                
-                suggerimenti.append(SuggerimentoCombinazione(
-                    ordini_ids=[o1["id"], o2["id"]],
-                    totale_quintali=totale,
-                    differenza_da_obiettivo=OBIETTIVO_QUINTALI - totale,
-                    data_piu_urgente=min(filter(None, [date1, date2]), default=None),
-                    score=score
-                ))
-    
-    # Strategia 2: Trova triple se necessario
-    for i, o1 in enumerate(ordini_disponibili):
-        for j, o2 in enumerate(ordini_disponibili[i+1:], i+1):
-            for o3 in ordini_disponibili[j+1:]:
-                totale = o1["totale_quintali"] + o2["totale_quintali"] + o3["totale_quintali"]
-                
-                if SOGLIA_MINIMA <= totale <= SOGLIA_MASSIMA:
-                    diff = abs(totale - OBIETTIVO_QUINTALI)
-                    dates = [o["data_ritiro"] or o["data_ordine"] for o in [o1, o2, o3]]
-                    valid_dates = [d for d in dates if d]
-                    
-                    score = 100 - float(diff) - 5  # Penalità per triple
-                    
-                    suggerimenti.append(SuggerimentoCombinazione(
-                        ordini_ids=[o1["id"], o2["id"], o3["id"]],
-                        totale_quintali=totale,
-                        differenza_da_obiettivo=OBIETTIVO_QUINTALI - totale,
-                        data_piu_urgente=min(valid_dates) if valid_dates else None,
-                        score=score
-                    ))
-    
-    # Ordina per score e restituisci i migliori
-    suggerimenti.sort(key=lambda x: x.score, reverse=True)
-    return suggerimenti[:max_suggerimenti]
-
+    combinazioni = composizione_service.trova_combinazioni(
+        ordini,
+        max_risultati=max_suggerimenti,
+        tempo_max_ms=tempo_max_ms
+    )
+    return [SuggerimentoCombinazione(**c) for c in combinazioni]
 
-# === ENDPOINTS ===
 
-@router.get("/ordini-disponibili", response_model=RispostaComposizione)
-def get_ordini_disponibili(
-    mulino_id: Optional[int] = Query(None, description="Filtra per mulino specifico"),
-    tipo: Optional[str] = Query(None, description="Filtra per tipo (pedane/sfuso)"),
-    db: Session = Depends(get_db)
-):
+def _componi_gruppi_e_suggerimenti(
+    ordini_completi: List[dict],
+    tempo_max_ms: Optional[int]
+) -> Tuple[List[dict], List[SuggerimentoCombinazione]]:
     """
-    Restituisce tutti gli ordini non ancora assegnati a un carico,
-    raggruppati per mulino e tipo, con suggerimenti di combinazione.
+    Raggruppa gli ordini per mulino e tipo e genera i suggerimenti
+    (max 10, ordinati per score). Solo CPU, nessun accesso al database.
     """
-    
-    # Query ordini non assegnati (carico_id IS NULL) e non ancora ritirati
-    query = db.query(Ordine).filter(
-        Ordine.carico_id.is_(None),
-        Ordine.stato == "inserito"
-    )
-    
-    if tipo:
-        query = query.filter(Ordine.tipo_ordine == tipo)
-    
-    ordini_db = query.all()
-    
-    # Costruisci lista ordini con info complete
-    ordini_completi = []
-    for ordine in ordini_db:
-        cliente = db.query(Cliente).filter(Cliente.id == ordine.cliente_id).first()
-        totale_q = calcola_totale_quintali_ordine(db, ordine.id)
-        mulino_id_ord, mulino_nome = get_mulino_principale_ordine(db, ordine.id)
-        
-        if not mulino_id_ord:
-            continue  # Salta ordini senza righe
-        
-        # Applica filtro mulino se specificato
-        if mulino_id and mulino_id_ord != mulino_id:
-            continue
-            
-        ordini_completi.append({
-            "id": ordine.id,
-            "cliente_id": ordine.cliente_id,
-            "cliente_nome": cliente.nome if cliente else "N/D",
-            "data_ordine": ordine.data_ordine,
-            "data_ritiro": ordine.data_ritiro,
-            "tipo_ordine": ordine.tipo_ordine,
-            "stato": ordine.stato,
-            "totale_quintali": totale_q,
-            "mulino_id": mulino_id_ord,
-            "mulino_nome": mulino_nome
-        })
-    
-    # Raggruppa per mulino e tipo
     gruppi_dict = {}
     for ordine in ordini_completi:
         key = (ordine["mulino_id"], ordine["mulino_nome"], ordine["tipo_ordine"])
@@ -238,6 +163,10 @@ def get_ordini_disponibili(
     gruppi = list(gruppi_dict.values())
     
     # Genera suggerimenti per ogni gruppo (stesso mulino + tipo)
+    # Il budget di tempo è ripartito tra i gruppi
+    if tempo_max_ms is None:
+        tempo_max_ms = composizione_service.TEMPO_MAX_MS
+    tempo_gruppo_ms = max(1, tempo_max_ms // max(1, len(gruppi)))
     tutti_suggerimenti = []
     for gruppo in gruppi:
         ordini_gruppo = [
@@ -249,23 +178,29 @@ def get_ordini_disponibili(
             }
             for o in gruppo["ordini"]
         ]
-        suggerimenti_gruppo = genera_suggerimenti(ordini_gruppo)
+        suggerimenti_gruppo = genera_suggerimenti(
+            ordini_gruppo, tempo_max_ms=tempo_gruppo_ms
+        )
         tutti_suggerimenti.extend(suggerimenti_gruppo)
     
     # Ordina suggerimenti globalmente per score
     tutti_suggerimenti.sort(key=lambda x: x.score, reverse=True)
     
-    # Ottieni carichi aperti esistenti
+    return gruppi, tutti_suggerimenti[:10]  # Max 10 suggerimenti
+
+
+def _carichi_aperti(db: Session) -> List[dict]:
+    """Carichi esistenti ancora aperti"""
     carichi_aperti_db = db.query(Carico).filter(Carico.stato == "aperto").all()
     carichi_aperti = []
     for carico in carichi_aperti_db:
         ordini_carico = db.query(Ordine).filter(Ordine.carico_id == carico.id).all()
-        totale_q = sum(calcola_totale_quintali_ordine(db, o.id) for o in ordini_carico)
+        totale_q = sum(o.totale_quintali for o in ordini_carico)
         
         # Trova mulino predominante del carico
         mulino_nome = None
         if ordini_carico:
-            _, mulino_nome = get_mulino_principale_ordine(db, ordini_carico[0].id)
+            _, mulino_nome = carico_service.get_mulino_principale_ordine(db, ordini_carico[0].id)
         
         carichi_aperti.append({
             "id": carico.id,
@@ -278,35 +213,174 @@ def get_ordini_disponibili(
             "mulino_nome": mulino_nome,
             "data_carico": carico.data_carico.isoformat() if carico.data_carico else None
         })
+    return carichi_aperti
+
+
+# === ENDPOINTS ===
+
+@router.get("/ordini-disponibili", response_model=RispostaComposizione)
+def get_ordini_disponibili(
+    mulino_id: Optional[int] = Query(None, description="Filtra per mulino specifico"),
+    tipo: Optional[str] = Query(None, description="Filtra per tipo (pedane/sfuso)"),
+    tempo_max_ms: Optional[int] = Query(
+        None, ge=1, description="Budget di tempo totale per i suggerimenti (ms)"
+    ),
+    db: Session = Depends(get_db)
+):
+    """
+    Restituisce tutti gli ordini non ancora assegnati a un carico,
+    raggruppati per mulino e tipo, con suggerimenti di combinazione.
+    """
+    ordini_completi = composizione_service.carica_ordini_non_assegnati(db, mulino_id, tipo)
+    gruppi, suggerimenti = _componi_gruppi_e_suggerimenti(ordini_completi, tempo_max_ms)
     
     return RispostaComposizione(
         gruppi=gruppi,
-        suggerimenti=tutti_suggerimenti[:10],  # Max 10 suggerimenti
-        carichi_aperti=carichi_aperti
+        suggerimenti=suggerimenti,
+        carichi_aperti=_carichi_aperti(db)
     )
 
 
-@router.get("/mulini-con-ordini")
-def get_mulini_con_ordini(db: Session = Depends(get_db)):
+@router_async.get("/ordini-disponibili", response_model=RispostaComposizione)
+async def get_ordini_disponibili_async(
+    mulino_id: Optional[int] = Query(None, description="Filtra per mulino specifico"),
+    tipo: Optional[str] = Query(None, description="Filtra per tipo (pedane/sfuso)"),
+    tempo_max_ms: Optional[int] = Query(
+        None, ge=1, description="Budget di tempo totale per i suggerimenti (ms)"
+    ),
+    db: AsyncSession = Depends(get_async_db)
+):
     """
-    Restituisce lista dei mulini che hanno ordini non assegnati.
-    Utile per il filtro nella UI.
+    Come GET /ordini-disponibili, sull'engine asincrono.
+    La ricerca dei suggerimenti (solo CPU) gira nel threadpool
+    per non bloccare l'event loop.
+    """
+    ordini_completi = await composizione_service.carica_ordini_non_assegnati_async(db, mulino_id, tipo)
+    gruppi, suggerimenti = await run_in_threadpool(
+        _componi_gruppi_e_suggerimenti, ordini_completi, tempo_max_ms
+    )
+    
+    return RispostaComposizione(
+        gruppi=gruppi,
+        suggerimenti=suggerimenti,
+        carichi_aperti=await db.run_sync(_carichi_aperti)
+    )
+
+@router.get("/piano-carichi", response_model=RispostaPiano)
+def get_piano_carichi(
+    mulino_id: Optional[int] = Query(None, description="Filtra per mulino specifico"),
+    tipo: Optional[str] = Query(None, description="Filtra per tipo (pedane/sfuso)"),
+    tempo_max_ms: Optional[int] = Query(
+        None, ge=1, description="Budget di tempo per gruppo (ms)"
+    ),
+    parallelo: bool = Query(True, description="Risolve i gruppi in processi paralleli"),
+    db: Session = Depends(get_db)
+):
     """
-    # Trova tutti i mulini_id dalle righe di ordini non assegnati
-    subquery = db.query(Ordine.id).filter(
-        Ordine.carico_id.is_(None),
-        Ordine.stato == "inserito"
-    ).subquery()
+    Piano globale: partiziona tutti gli ordini aperti di ogni gruppo
+    (mulino, tipo) nel maggior numero possibile di carichi disgiunti
+    tra 280 e 300 q.li, minimizzando quintali residui e spread delle date.
     
-    mulini_ids = db.query(RigaOrdine.mulino_id).filter(
-        RigaOrdine.ordine_id.in_(subquery)
-    ).distinct().all()
+    A differenza dei suggerimenti, i carichi proposti non si sovrappongono:
+    il piano si conferma in un colpo solo con POST /piano-carichi.
+    """
+    ordini = composizione_service.carica_ordini_non_assegnati(db, mulino_id, tipo)
     
-    mulini_ids = [m[0] for m in mulini_ids]
+    gruppi: dict = {}
+    nomi_mulini = {}
+    for ordine in ordini:
+        key = (ordine["mulino_id"], ordine["tipo_ordine"])
+        gruppi.setdefault(key, []).append({
+            "id": ordine["id"],
+            "totale_quintali": ordine["totale_quintali"],
+            "data_ordine": ordine["data_ordine"],
+            "data_ritiro": ordine["data_ritiro"]
+        })
+        nomi_mulini[ordine["mulino_id"]] = ordine["mulino_nome"]
+    
+    piani = composizione_service.pianifica_carichi(gruppi, tempo_max_ms, parallelo)
+    
+    risultato = []
+    for (gruppo_mulino_id, gruppo_tipo), piano in piani.items():
+        carichi = []
+        residui = list(piano["ordini_residui"])
+        # Stesse regole di creazione del carico (una query per gruppo): lo scarto finisce nei residui
+        esiti = carico_service.valida_candidati(db, [c["ordini_ids"] for c in piano["carichi"]])
+        for carico, (valido, _, info) in zip(piano["carichi"], esiti):
+            if not valido or info["totale_quintali"] < SOGLIA_MINIMA:
+                residui.extend(carico["ordini_ids"])
+                continue
+            carichi.append(CaricoPianificato(**carico))
+        
+        residui_set = set(residui)
+        risultato.append(PianoGruppo(
+            mulino_id=gruppo_mulino_id,
+            mulino_nome=nomi_mulini[gruppo_mulino_id],
+            tipo=gruppo_tipo,
+            carichi=carichi,
+            ordini_residui=sorted(residui_set),
+            quintali_residui=sum(
+                (o["totale_quintali"] for o in gruppi[(gruppo_mulino_id, gruppo_tipo)]
+                 if o["id"] in residui_set),
+                Decimal("0")
+            )
+        ))
     
-    if not mulini_ids:
-        return []
+    risultato.sort(key=lambda g: (g.mulino_nome, g.tipo))
     
-    mulini = db.query(Mulino).filter(Mulino.id.in_(mulini_ids)).all()
+    return RispostaPiano(
+        gruppi=risultato,
+        num_carichi=sum(len(g.carichi) for g in risultato),
+        quintali_residui=sum((g.quintali_residui for g in risultato), Decimal("0"))
+    )
+
+
+@router.post("/piano-carichi", response_model=RispostaConfermaPiano, status_code=201)
+def conferma_piano_carichi(data: ConfermaPiano, db: Session = Depends(get_db)):
+    """
+    Conferma il piano: crea tutti i carichi in BOZZA in un'unica transazione.
+    
+    Stesse validazioni del drag&drop (create_draft_load), eseguite
+    su tutti i carichi insieme da crea_carichi_bozza.
+    Se anche un solo carico non è valido non viene creato nulla.
+    """
+    ordini_ids = [ordine_id for carico in data.carichi for ordine_id in carico]
+    if len(ordini_ids) != len(set(ordini_ids)):
+        raise HTTPException(status_code=400, detail="Lo stesso ordine compare in più carichi")
     
-    return [{"id": m.id, "nome": m.nome} for m in mulini]
\ No newline at end of file
+    try:
+        carichi = carico_service.crea_carichi_bozza(db, data.carichi, data.note)
+    except HTTPException:
+        db.rollback()
+        raise
+    
+    db.commit()
+    
+    return RispostaConfermaPiano(carichi_ids=[c.id for c in carichi])
+
+
+@router.get("/mulini-con-ordini")
+def get_mulini_con_ordini(db: Session = Depends(get_db)):
+    """
+    Restituisce lista dei mulini che hanno ordini non assegnati.
+    Utile per il filtro nella UI.
+
+    Conta ogni mulino presente nelle righe degli ordini non assegnati,
+    non solo il mulino principale, in una sola query.
+    """
+    mulini = db.execute(
+        select(Mulino.id, Mulino.nome)
+        .where(
+            select(RigaOrdine.id)
+            .join(Ordine, Ordine.id == RigaOrdine.ordine_id)
+            .where(
+                RigaOrdine.mulino_id == Mulino.id,
+                Ordine.carico_id.is_(None),
+                Ordine.stato == "inserito"
+            )
+            .exists()
+        )
+        .order_by(Mulino.id)
+    ).all()
+
+    return [{"id": m.id, "nome": m.nome} for m in mulini]
@@ -0,0 +1,80 @@
+"""
+Router API interne (diagnostica)
+
+- Stato e telemetria dei pool di connessioni, per dimensionare
+  DB_POOL_SIZE / DB_MAX_OVERFLOW sul traffico reale
+- Stato della replica in lettura (raggiungibilità e ritardo)
+"""
+
+from fastapi import APIRouter
+from pydantic import BaseModel
+from typing import Dict, Optional
+from datetime import datetime
+
+from app.database import async_engine_attivo, engine, replica_engine, stato_replica
+from app.pool import stato_pool
+
+router = APIRouter()
+
+
+# === SCHEMAS ===
+
+class StatoPool(BaseModel):
+    """Stato istantaneo e contatori dei checkout di un pool"""
+    dimensione: int
+    max_overflow: int
+    timeout_s: float
+    in_uso: int
+    libere: int
+    overflow_attuale: int
+    dal: datetime  # Inizio dei contatori
+    checkout: int
+    attese: int  # Checkout arrivati a pool esaurito
+    timeout: int  # Checkout falliti per timeout
+    overflow: int  # Connessioni aperte oltre la dimensione del pool
+    picco_in_uso: int
+    latenza_media_ms: float
+    latenza_max_ms: float
+    istogramma_latenza: Dict[str, int]
+
+
+class RispostaPool(BaseModel):
+    sincrono: Optional[StatoPool]
+    asincrono: Optional[StatoPool]  # None se l'engine asincrono non è attivo
+    replica: Optional[StatoPool]  # None senza DATABASE_REPLICA_URL
+
+
+class StatoReplica(BaseModel):
+    """Esito dell'ultimo controllo della replica in lettura"""
+    configurata: bool
+    utilizzabile: bool  # False: i report leggono dal primario
+    lag_s: Optional[float] = None
+    lag_max_s: float
+    controllata_il: Optional[datetime] = None
+    errore: Optional[str] = None
+
+
+# === ENDPOINTS ===
+
+def _stato_pool_engine() -> RispostaPool:
+    return RispostaPool(
+        sincrono=stato_pool(engine),
+        asincrono=stato_pool(async_engine_attivo()),
+        replica=stato_pool(replica_engine)
+    )
+
+
+@router.get("/pool", response_model=RispostaPool)
+def get_stato_pool():
+    """
+    Connessioni in uso, attese, timeout, overflow e istogramma di latenza del checkout.
+    I contatori crescono dall'avvio del processo (campo dal): una finestra
+    di misura è la differenza tra due letture.
+    """
+    return _stato_pool_engine()
+
+
+@router.get("/replica", response_model=StatoReplica)
+def get_stato_replica():
+    """Replica in lettura: utilizzabile, ritardo misurato e ultimo errore"""
+    return stato_replica()
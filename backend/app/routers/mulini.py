@@ -7,6 +7,7 @@ from app.models.mulino import Mulino
 from app.models.prodotto import Prodotto
 from app.schemas.mulino import MulinoCreate, MulinoUpdate, MulinoRead
 from app.schemas.prodotto import ProdottoRead
+from app.services import ricerca
 
 router = APIRouter()
 
@@ -20,7 +21,7 @@ def lista_mulini(
     query = db.query(Mulino)
     
     if search:
-        query = query.filter(Mulino.nome.ilike(f"%{search}%"))
+        query = query.filter(ricerca.filtro_ricerca(db, (Mulino.nome,), search, simili=False))
     
     return query.order_by(Mulino.nome).all()
 
@@ -1,24 +1,25 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session, joinedload
-from sqlalchemy import func, desc
 from typing import List, Optional
 from datetime import date, datetime, timedelta, timezone
-from decimal import Decimal
 from pydantic import BaseModel
 
-from app.database import get_db
+from app.database import get_async_db, get_db
 from app.models.ordine import Ordine, RigaOrdine
 from app.models.cliente import Cliente
 from app.models.prodotto import Prodotto
 from app.models.mulino import Mulino
-from app.models.trasportatore import Trasportatore
-from app.models.storico_prezzo import StoricoPrezzo
 from app.schemas.ordine import (
     OrdineCreate, OrdineUpdate, OrdineRead, OrdineList, OrdineDettaglio
 )
-from app.services.email import send_email, MAIL_FROM
+from app.services.email import MAIL_FROM, accoda_email, email_in_coda, sveglia_invio
+from app.models.email_outbox import EmailOutbox
+from app.services import carico_service, ordine_service, paginazione, prezzi, provvigioni
 
 router = APIRouter()
+# Versioni asincrone delle letture più frequenti (montate sotto /api/async se attive)
+router_async = APIRouter()
 
 
 class EmailEntry(BaseModel):
@@ -36,6 +37,20 @@ class IncassoUpdate(BaseModel):
     data_incasso_mulino: Optional[date] = None
 
 
+class EmailOutboxRead(BaseModel):
+    id: int
+    destinatario: str
+    oggetto: str
+    stato: str
+    tentativi: int
+    ultimo_errore: Optional[str] = None
+    creato_il: Optional[datetime] = None
+    inviata_il: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
 def calcola_data_incasso_riba(data_consegna: date) -> date:
     """
     Calcola data incasso per clienti RIBA: +60 giorni fine mese dalla consegna.
@@ -54,16 +69,6 @@ def calcola_data_incasso_riba(data_consegna: date) -> date:
     return fine_mese + timedelta(days=60)
 
 
-def salva_storico_prezzo(db: Session, cliente_id: int, prodotto_id: int, prezzo: Decimal):
-    """Salva il prezzo nello storico per futura consultazione"""
-    storico = StoricoPrezzo(
-        cliente_id=cliente_id,
-        prodotto_id=prodotto_id,
-        prezzo=prezzo
-    )
-    db.add(storico)
-
-
 # ==========================================
 # ENDPOINT SPECIFICI (DEVONO STARE PRIMA DI /{ordine_id})
 # ==========================================
@@ -77,17 +82,14 @@ def get_ultimo_prezzo(cliente_id: int, prodotto_id: int, db: Session = Depends(g
     NOTA: Questo endpoint DEVE stare prima di /{ordine_id} per evitare
     che FastAPI interpreti "ultimo-prezzo" come un ordine_id.
     """
-    ultimo = db.query(StoricoPrezzo).filter(
-        StoricoPrezzo.cliente_id == cliente_id,
-        StoricoPrezzo.prodotto_id == prodotto_id
-    ).order_by(desc(StoricoPrezzo.creato_il)).first()
+    ultimo = prezzi.ultimo_prezzo(db, cliente_id, prodotto_id)
     
     if not ultimo:
         return {"prezzo": None, "messaggio": "Nessun prezzo precedente trovato"}
     
     return {
         "prezzo": float(ultimo.prezzo),
-        "data": ultimo.creato_il
+        "data": ultimo.registrato_il
     }
 
 
@@ -103,14 +105,20 @@ def aggiorna_incasso(ordine_id: int, body: IncassoUpdate, db: Session = Depends(
     db_ordine = db.query(Ordine).filter(Ordine.id == ordine_id).first()
     if not db_ordine:
         raise HTTPException(status_code=404, detail="Ordine non trovato")
+    chiavi_rollup = provvigioni.chiavi_rollup_ordini(db, [ordine_id])
     db_ordine.data_incasso_mulino = body.data_incasso_mulino
+    provvigioni.aggiorna_rollup_ordini(db, [ordine_id], chiavi_rollup)
     db.commit()
     return {"data_incasso_mulino": db_ordine.data_incasso_mulino}
 
 
-@router.post("/{ordine_id}/invia-email")
+@router.post("/{ordine_id}/invia-email", status_code=202)
 def invia_email_ordine(ordine_id: int, request: InviaEmailRequest, db: Session = Depends(get_db)):
-    """Invia email dell'ordine ai mulini"""
+    """
+    Accoda le email dell'ordine ai mulini e risponde subito.
+    L'invio avviene in background; email_inviata_il viene valorizzata
+    quando tutti i messaggi dell'ordine sono stati consegnati.
+    """
     ordine = db.query(Ordine).filter(Ordine.id == ordine_id).first()
     if not ordine:
         raise HTTPException(status_code=404, detail="Ordine non trovato")
@@ -118,102 +126,121 @@ def invia_email_ordine(ordine_id: int, request: InviaEmailRequest, db: Session =
     if ordine.email_inviata_il is not None:
         raise HTTPException(status_code=400, detail="Email già inviata per questo ordine")
 
-    for entry in request.emails:
-        send_email(to=entry.to, subject=entry.subject, body=entry.body)
+    if email_in_coda(db, ordine_id):
+        raise HTTPException(status_code=400, detail="Email già in coda di invio per questo ordine")
 
-    ordine.email_inviata_il = datetime.now(timezone.utc)
+    messaggi = [
+        accoda_email(db, to=entry.to, subject=entry.subject, body=entry.body, ordine_id=ordine_id)
+        for entry in request.emails
+    ]
     db.commit()
+    sveglia_invio()
 
-    return {"message": "Email inviate con successo", "email_inviata_il": ordine.email_inviata_il}
+    return {"message": "Email in coda di invio", "email_ids": [m.id for m in messaggi]}
+
+
+@router.get("/{ordine_id}/email", response_model=List[EmailOutboxRead])
+def stato_email_ordine(ordine_id: int, db: Session = Depends(get_db)):
+    """Stato di invio dei messaggi dell'ordine (in_coda, inviata, errore)"""
+    return db.query(EmailOutbox).filter(
+        EmailOutbox.ordine_id == ordine_id
+    ).order_by(EmailOutbox.id).all()
 
 
 # ==========================================
 # ENDPOINT LISTA
 # ==========================================
 
+CHIAVE_LISTA_ORDINI = (Ordine.data_ordine, Ordine.id)
+
+
+def _query_lista_ordini(
+    cliente_id: Optional[int],
+    stato: Optional[str],
+    data_da: Optional[date],
+    data_a: Optional[date]
+):
+    """Statement della lista ordini con i filtri richiesti (senza paginazione)"""
+    query = ordine_service.query_lista_ordini()
+    
+    if cliente_id:
+        query = query.where(Ordine.cliente_id == cliente_id)
+    
+    if stato:
+        query = query.where(Ordine.stato == stato)
+    
+    if data_da:
+        query = query.where(Ordine.data_ordine >= data_da)
+    
+    if data_a:
+        query = query.where(Ordine.data_ordine <= data_a)
+    
+    return query
+
+
+def _pagina_lista_ordini(query, cursore: Optional[str], skip: int):
+    """Keyset su (data_ordine, id) decrescente; skip solo senza cursore"""
+    query = paginazione.applica_keyset(query, CHIAVE_LISTA_ORDINI, cursore, discendente=True)
+    if skip and not cursore:
+        query = query.offset(skip)
+    return query
+
+
 @router.get("/", response_model=List[OrdineList])
 def lista_ordini(
+    response: Response,
     cliente_id: Optional[int] = Query(None, description="Filtra per cliente"),
     stato: Optional[str] = Query(None, description="Filtra per stato (inserito/ritirato)"),
     data_da: Optional[date] = Query(None, description="Data ordine da"),
     data_a: Optional[date] = Query(None, description="Data ordine a"),
+    cursore: Optional[str] = Query(None, description="Cursore della pagina (header X-Next-Cursor)"),
+    con_totale: bool = Query(False, description="Totale approssimato nell'header X-Total-Approx"),
     skip: int = 0,
-    limit: int = 100,
+    limit: int = Query(100, ge=1),
     db: Session = Depends(get_db)
 ):
-    """Lista ordini con filtri e righe dettagliate"""
-    query = db.query(
-        Ordine.id,
-        Ordine.cliente_id,
-        Cliente.nome.label("cliente_nome"),
-        Ordine.data_ordine,
-        Ordine.data_ritiro,
-        Ordine.data_incasso_mulino,
-        Ordine.tipo_ordine,
-        Ordine.stato,
-        Ordine.trasportatore_id,
-        Trasportatore.nome.label("trasportatore_nome"),
-        Ordine.carico_id
-    ).join(Cliente).outerjoin(Trasportatore)
-    
-    if cliente_id:
-        query = query.filter(Ordine.cliente_id == cliente_id)
-    
-    if stato:
-        query = query.filter(Ordine.stato == stato)
+    """
+    Lista ordini con filtri e righe dettagliate.
     
-    if data_da:
-        query = query.filter(Ordine.data_ordine >= data_da)
+    Paginazione keyset su (data_ordine, id) decrescente: passare come
+    cursore il valore dell'header X-Next-Cursor della pagina precedente.
+    skip resta supportato per compatibilità (ignorato con il cursore).
+    """
+    query = _query_lista_ordini(cliente_id, stato, data_da, data_a)
+    totale = paginazione.conta_approssimata(db, query) if con_totale else None
     
-    if data_a:
-        query = query.filter(Ordine.data_ordine <= data_a)
+    query = _pagina_lista_ordini(query, cursore, skip)
+    ordini, cursore_successivo = paginazione.pagina_keyset(db, query, CHIAVE_LISTA_ORDINI, limit)
+    paginazione.imposta_header_pagina(response, cursore_successivo, totale)
     
-    ordini = query.order_by(desc(Ordine.data_ordine)).offset(skip).limit(limit).all()
+    # Pagina + righe di tutta la pagina (prodotti e mulini in join): 2 query
+    return ordine_service.carica_lista_ordini(db, ordini)
+
+
+@router_async.get("/", response_model=List[OrdineList])
+async def lista_ordini_async(
+    response: Response,
+    cliente_id: Optional[int] = Query(None, description="Filtra per cliente"),
+    stato: Optional[str] = Query(None, description="Filtra per stato (inserito/ritirato)"),
+    data_da: Optional[date] = Query(None, description="Data ordine da"),
+    data_a: Optional[date] = Query(None, description="Data ordine a"),
+    cursore: Optional[str] = Query(None, description="Cursore della pagina (header X-Next-Cursor)"),
+    con_totale: bool = Query(False, description="Totale approssimato nell'header X-Total-Approx"),
+    skip: int = 0,
+    limit: int = Query(100, ge=1),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Come GET /api/ordini/, sull'engine asincrono (stesse query e risposta)"""
+    query = _query_lista_ordini(cliente_id, stato, data_da, data_a)
+    totale = await paginazione.conta_approssimata_async(db, query) if con_totale else None
     
-    # Calcola totali e righe per ogni ordine
-    risultati = []
-    for o in ordini:
-        totali = db.query(
-            func.sum(RigaOrdine.quintali).label("totale_quintali"),
-            func.sum(RigaOrdine.prezzo_totale).label("totale_importo")
-        ).filter(RigaOrdine.ordine_id == o.id).first()
-        
-        # Recupera righe con dettagli prodotto e mulino
-        righe_db = db.query(RigaOrdine).filter(RigaOrdine.ordine_id == o.id).all()
-        righe_lista = []
-        for riga in righe_db:
-            prodotto = db.query(Prodotto).filter(Prodotto.id == riga.prodotto_id).first()
-            mulino = db.query(Mulino).filter(Mulino.id == riga.mulino_id).first()
-            righe_lista.append({
-                "id": riga.id,
-                "pedane": riga.pedane,
-                "prodotto_nome": prodotto.nome if prodotto else None,
-                "prodotto_tipologia": prodotto.tipologia if prodotto else None,
-                "mulino_id": riga.mulino_id,
-                "mulino_nome": mulino.nome if mulino else None,
-                "quintali": riga.quintali,
-                "prezzo_quintale": riga.prezzo_quintale,
-                "prezzo_totale": riga.prezzo_totale
-            })
-        
-        risultati.append({
-            "id": o.id,
-            "cliente_id": o.cliente_id,
-            "cliente_nome": o.cliente_nome,
-            "data_ordine": o.data_ordine,
-            "data_ritiro": o.data_ritiro,
-            "data_incasso_mulino": o.data_incasso_mulino,
-            "tipo_ordine": o.tipo_ordine,
-            "stato": o.stato,
-            "trasportatore_id": o.trasportatore_id,
-            "trasportatore_nome": o.trasportatore_nome,
-            "carico_id": o.carico_id,
-            "totale_quintali": totali.totale_quintali or Decimal("0"),
-            "totale_importo": totali.totale_importo or Decimal("0"),
-            "righe": righe_lista
-        })
+    query = _pagina_lista_ordini(query, cursore, skip)
+    ordini, cursore_successivo = await paginazione.pagina_keyset_async(
+        db, query, CHIAVE_LISTA_ORDINI, limit
+    )
+    paginazione.imposta_header_pagina(response, cursore_successivo, totale)
     
-    return risultati
+    return await ordine_service.carica_lista_ordini_async(db, ordini)
 
 
 # ==========================================
@@ -268,6 +295,9 @@ def get_ordine(ordine_id: int, db: Session = Depends(get_db)):
         "note": ordine.note,
         "creato_il": ordine.creato_il,
         "email_inviata_il": ordine.email_inviata_il,
+        "totale_quintali": ordine.totale_quintali,
+        "totale_importo": ordine.totale_importo,
+        "mulino_principale_id": ordine.mulino_principale_id,
         "mail_from": MAIL_FROM,
         "righe": righe_dettaglio
     }
@@ -282,7 +312,7 @@ def crea_ordine(ordine: OrdineCreate, db: Session = Depends(get_db)):
     """
     Crea nuovo ordine con righe.
     - Se cliente ha flag RIBA e c'è data_ritiro, calcola automaticamente data_incasso_mulino
-    - Salva i prezzi nello storico per ogni riga
+    - Salva nello storico i prezzi delle righe diversi dall'ultimo applicato
     """
     # Verifica cliente
     cliente = db.query(Cliente).filter(Cliente.id == ordine.cliente_id).first()
@@ -302,6 +332,7 @@ def crea_ordine(ordine: OrdineCreate, db: Session = Depends(get_db)):
     db.flush()  # Per ottenere l'ID
     
     # Crea righe e salva storico prezzi
+    righe_create = []
     for riga_data in ordine.righe:
         # Verifica prodotto
         prodotto = db.query(Prodotto).filter(Prodotto.id == riga_data.prodotto_id).first()
@@ -314,14 +345,18 @@ def crea_ordine(ordine: OrdineCreate, db: Session = Depends(get_db)):
             **riga_data.model_dump()
         )
         db.add(db_riga)
-        
-        # Salva storico prezzo
-        salva_storico_prezzo(
-            db,
-            cliente_id=ordine.cliente_id,
-            prodotto_id=riga_data.prodotto_id,
-            prezzo=riga_data.prezzo_quintale
-        )
+        righe_create.append(db_riga)
+    
+    # Storico prezzi: un solo INSERT per l'ordine, solo i prezzi cambiati
+    prezzi.registra_prezzi(
+        db,
+        ordine.cliente_id,
+        [(r.prodotto_id, r.prezzo_quintale) for r in ordine.righe]
+    )
+    
+    # Totali denormalizzati e rollup provvigioni
+    ordine_service.aggiorna_totali_ordine(db_ordine, righe_create)
+    provvigioni.aggiorna_rollup_ordini(db, [db_ordine.id])
     
     db.commit()
     db.refresh(db_ordine)
@@ -343,6 +378,13 @@ def aggiorna_ordine(
         raise HTTPException(status_code=404, detail="Ordine non trovato")
 
     update_data = ordine.model_dump(exclude={"righe"}, exclude_unset=True)
+    chiavi_rollup = provvigioni.chiavi_rollup_ordini(db, [ordine_id])
+
+    # Ordine in un carico con righe o tipo modificati: prima il lock del
+    # carico (ordine carico -> ordini), poi la compatibilità va riverificata
+    carico = None
+    if db_ordine.carico_id is not None and (ordine.righe is not None or "tipo_ordine" in update_data):
+        carico = carico_service.blocca_carico(db, db_ordine.carico_id)
 
     # Update campi ordine
     for field, value in update_data.items():
@@ -350,25 +392,24 @@ def aggiorna_ordine(
 
     # ===== GESTIONE RIGHE =====
     if ordine.righe is not None:
+        # Righe per differenza: modificate, nuove ed eliminate in blocco
+        righe_scritte = ordine_service.aggiorna_righe_ordine(db, db_ordine, ordine.righe)
+
+        # Storico prezzi: solo le righe inserite o modificate
+        prezzi.registra_prezzi(
+            db,
+            db_ordine.cliente_id,
+            [(r["prodotto_id"], r["prezzo_quintale"]) for r in righe_scritte]
+        )
+
+    # Mulino, tipo e quintali ancora compatibili con il carico, poi il suo totale
+    if carico is not None:
+        db.flush()
+        carico_service.verifica_ordini_del_carico(db, carico)
+        carico_service.recalculate_load_total(db, carico.id)
 
-        # Cancella righe esistenti
-        db.query(RigaOrdine).filter(RigaOrdine.ordine_id == ordine_id).delete()
-
-        # Ricrea righe
-        for riga_data in ordine.righe:
-            db_riga = RigaOrdine(
-                ordine_id=ordine_id,
-                **riga_data.model_dump()
-            )
-            db.add(db_riga)
-
-            # Salva storico prezzo
-            salva_storico_prezzo(
-                db,
-                cliente_id=db_ordine.cliente_id,
-                prodotto_id=riga_data.prodotto_id,
-                prezzo=riga_data.prezzo_quintale
-            )
+    # Rollup provvigioni: chiavi precedenti e nuove (righe o data incasso cambiate)
+    provvigioni.aggiorna_rollup_ordini(db, [ordine_id], chiavi_rollup)
 
     db.commit()
     db.refresh(db_ordine)
@@ -385,6 +426,8 @@ def elimina_ordine(ordine_id: int, db: Session = Depends(get_db)):
     if not db_ordine:
         raise HTTPException(status_code=404, detail="Ordine non trovato")
     
+    chiavi_rollup = provvigioni.chiavi_rollup_ordini(db, [ordine_id])
     db.delete(db_ordine)
+    provvigioni.aggiorna_rollup(db, chiavi_rollup)
     db.commit()
     return None
\ No newline at end of file
@@ -6,11 +6,13 @@ from datetime import date
 from decimal import Decimal
 from pydantic import BaseModel
 
-from app.database import get_db
+from app.database import get_read_db
 from app.models.ordine import Ordine, RigaOrdine
 from app.models.cliente import Cliente
 from app.models.prodotto import Prodotto
 from app.models.mulino import Mulino
+from app.services import provvigioni
+from app.services.provvigioni import arrotonda_provvigione, get_trimestre_date
 
 router = APIRouter()
 
@@ -103,102 +105,32 @@ class RiepilogoTrimestre(BaseModel):
     provvigioni_per_mulino: List[ProvvigioneMulino]
 
 
-# --- Funzioni helper ---
-
-def get_trimestre_date(anno: int, trimestre: int):
-    """Restituisce data inizio e fine del trimestre"""
-    mese_inizio = (trimestre - 1) * 3 + 1
-    data_inizio = date(anno, mese_inizio, 1)
-    
-    if trimestre == 4:
-        data_fine = date(anno, 12, 31)
-    else:
-        mese_fine = trimestre * 3
-        if mese_fine in [1, 3, 5, 7, 8, 10, 12]:
-            giorno_fine = 31
-        elif mese_fine in [4, 6, 9, 11]:
-            giorno_fine = 30
-        else:
-            giorno_fine = 28 if anno % 4 != 0 else 29
-        data_fine = date(anno, mese_fine, giorno_fine)
-    
-    return data_inizio, data_fine
-
-
-def calcola_provvigione_riga(riga: RigaOrdine, prodotto: Prodotto) -> Decimal:
-    """Calcola la provvigione per una singola riga ordine"""
-    if prodotto.tipo_provvigione == "percentuale":
-        return riga.quintali * riga.prezzo_quintale * (prodotto.valore_provvigione / 100)
-    elif prodotto.tipo_provvigione == "fisso":
-        return riga.quintali * prodotto.valore_provvigione
-    return Decimal("0")
-
-
 # --- Endpoints ---
 
 @router.get("/provvigioni/trimestre", response_model=RiepilogoTrimestre)
 def provvigioni_trimestre(
     anno: int = Query(..., description="Anno"),
     trimestre: int = Query(..., ge=1, le=4, description="Trimestre (1-4)"),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Calcola le provvigioni per un trimestre.
     Le provvigioni sono calcolate sugli incassi del mulino (data_incasso_mulino).
+    Legge i totali pre-aggregati da provvigioni_rollup (chiave anno, trimestre, mulino).
     """
     data_inizio, data_fine = get_trimestre_date(anno, trimestre)
     
-    ordini = db.query(Ordine).filter(
-        Ordine.data_incasso_mulino >= data_inizio,
-        Ordine.data_incasso_mulino <= data_fine
-    ).all()
-    
-    mulini_stats = {}
-    totale_quintali = Decimal("0")
-    totale_incassato = Decimal("0")
-    totale_provvigioni = Decimal("0")
-    
-    for ordine in ordini:
-        righe = db.query(RigaOrdine).filter(RigaOrdine.ordine_id == ordine.id).all()
-        
-        for riga in righe:
-            prodotto = db.query(Prodotto).filter(Prodotto.id == riga.prodotto_id).first()
-            mulino = db.query(Mulino).filter(Mulino.id == riga.mulino_id).first()
-            
-            if not mulino or not prodotto:
-                continue
-            
-            provvigione = calcola_provvigione_riga(riga, prodotto)
-            
-            if mulino.id not in mulini_stats:
-                mulini_stats[mulino.id] = {
-                    "mulino_id": mulino.id,
-                    "mulino_nome": mulino.nome,
-                    "totale_quintali": Decimal("0"),
-                    "totale_incassato": Decimal("0"),
-                    "totale_provvigione": Decimal("0"),
-                    "ordini_ids": set()
-                }
-            
-            mulini_stats[mulino.id]["totale_quintali"] += riga.quintali
-            mulini_stats[mulino.id]["totale_incassato"] += riga.prezzo_totale
-            mulini_stats[mulino.id]["totale_provvigione"] += provvigione
-            mulini_stats[mulino.id]["ordini_ids"].add(ordine.id)
-            
-            totale_quintali += riga.quintali
-            totale_incassato += riga.prezzo_totale
-            totale_provvigioni += provvigione
-    
+    rollup = db.execute(provvigioni.query_rollup_trimestre(anno, trimestre)).all()
     provvigioni_per_mulino = [
         ProvvigioneMulino(
-            mulino_id=m["mulino_id"],
-            mulino_nome=m["mulino_nome"],
-            totale_quintali=m["totale_quintali"],
-            totale_incassato=m["totale_incassato"],
-            totale_provvigione=m["totale_provvigione"],
-            num_ordini=len(m["ordini_ids"])
+            mulino_id=m.mulino_id,
+            mulino_nome=m.mulino_nome,
+            totale_quintali=m.totale_quintali,
+            totale_incassato=m.totale_incassato,
+            totale_provvigione=arrotonda_provvigione(m.totale_provvigione),
+            num_ordini=m.num_ordini
         )
-        for m in mulini_stats.values()
+        for m in rollup
     ]
     
     return RiepilogoTrimestre(
@@ -206,9 +138,12 @@ def provvigioni_trimestre(
         anno=anno,
         data_inizio=data_inizio,
         data_fine=data_fine,
-        totale_quintali=totale_quintali,
-        totale_incassato=totale_incassato,
-        totale_provvigioni=totale_provvigioni,
+        totale_quintali=sum((m.totale_quintali for m in provvigioni_per_mulino), Decimal("0")),
+        totale_incassato=sum((m.totale_incassato for m in provvigioni_per_mulino), Decimal("0")),
+        # Totale sugli importi esatti, poi arrotondato
+        totale_provvigioni=arrotonda_provvigione(
+            sum((m.totale_provvigione for m in rollup), Decimal("0"))
+        ),
         provvigioni_per_mulino=sorted(provvigioni_per_mulino, key=lambda x: x.mulino_nome)
     )
 
@@ -218,7 +153,7 @@ def provvigioni_ordini(
     anno: int = Query(...),
     trimestre: int = Query(..., ge=1, le=4),
     mulino_id: Optional[int] = Query(None),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Lista ordini del trimestre con provvigioni calcolate per ogni riga.
@@ -226,85 +161,53 @@ def provvigioni_ordini(
     """
     data_inizio, data_fine = get_trimestre_date(anno, trimestre)
 
-    ordini_query = db.query(Ordine).filter(
-        Ordine.data_incasso_mulino >= data_inizio,
-        Ordine.data_incasso_mulino <= data_fine
-    )
+    # Due query: ordini con totali aggregati per ordine, righe con provvigione
+    ordini = db.execute(
+        provvigioni.query_provvigioni_per_ordine(data_inizio, data_fine, mulino_id)
+    ).all()
+    righe = db.execute(
+        provvigioni.query_righe_provvigione(data_inizio, data_fine, mulino_id)
+    ).all()
 
-    if mulino_id:
-        ordini_query = ordini_query.filter(
-            Ordine.righe.any(RigaOrdine.mulino_id == mulino_id)
-        )
+    righe_per_ordine = {}
+    for riga in righe:
+        righe_per_ordine.setdefault(riga.ordine_id, []).append(RigaProvvigione(
+            id=riga.id,
+            pedane=riga.pedane,
+            prodotto_nome=riga.prodotto_nome,
+            prodotto_tipologia=riga.prodotto_tipologia,
+            mulino_id=riga.mulino_id,
+            mulino_nome=riga.mulino_nome,
+            quintali=riga.quintali,
+            prezzo_quintale=riga.prezzo_quintale,
+            prezzo_totale=riga.prezzo_totale,
+            tipo_provvigione=riga.tipo_provvigione,
+            valore_provvigione=riga.valore_provvigione,
+            provvigione_calcolata=arrotonda_provvigione(riga.provvigione_calcolata)
+        ))
 
-    ordini = ordini_query.all()
-
-    totale_provvigioni = Decimal("0")
-    totale_incassato = Decimal("0")
-    totale_quintali = Decimal("0")
-    ordini_result = []
-
-    for ordine in ordini:
-        cliente = db.query(Cliente).filter(Cliente.id == ordine.cliente_id).first()
-        righe_result = []
-        ordine_provvigione = Decimal("0")
-        ordine_quintali = Decimal("0")
-        ordine_importo = Decimal("0")
-
-        righe = db.query(RigaOrdine).filter(RigaOrdine.ordine_id == ordine.id)
-        if mulino_id:
-            righe = righe.filter(RigaOrdine.mulino_id == mulino_id)
-        righe = righe.all()
-
-        for riga in righe:
-            prodotto = db.query(Prodotto).filter(Prodotto.id == riga.prodotto_id).first()
-            if not prodotto:
-                continue
-
-            mulino_riga = db.query(Mulino).filter(Mulino.id == riga.mulino_id).first()
-            provvigione = calcola_provvigione_riga(riga, prodotto)
-
-            righe_result.append(RigaProvvigione(
-                id=riga.id,
-                pedane=riga.pedane,
-                prodotto_nome=prodotto.nome,
-                prodotto_tipologia=prodotto.tipologia,
-                mulino_id=riga.mulino_id,
-                mulino_nome=mulino_riga.nome if mulino_riga else None,
-                quintali=riga.quintali,
-                prezzo_quintale=riga.prezzo_quintale,
-                prezzo_totale=riga.prezzo_totale,
-                tipo_provvigione=prodotto.tipo_provvigione,
-                valore_provvigione=prodotto.valore_provvigione,
-                provvigione_calcolata=provvigione
-            ))
-
-            ordine_provvigione += provvigione
-            ordine_quintali += riga.quintali
-            ordine_importo += riga.prezzo_totale
-
-        ordini_result.append(OrdineProvvigione(
+    ordini_result = [
+        OrdineProvvigione(
             id=ordine.id,
-            cliente_nome=cliente.nome if cliente else "?",
+            cliente_nome=ordine.cliente_nome or "?",
             data_ordine=ordine.data_ordine,
             data_ritiro=ordine.data_ritiro,
             data_incasso_mulino=ordine.data_incasso_mulino,
             tipo_ordine=ordine.tipo_ordine,
-            totale_quintali=ordine_quintali,
-            totale_importo=ordine_importo,
-            totale_provvigione=ordine_provvigione,
-            righe=righe_result
-        ))
-
-        totale_provvigioni += ordine_provvigione
-        totale_incassato += ordine_importo
-        totale_quintali += ordine_quintali
-
-    ordini_result.sort(key=lambda x: x.data_ordine, reverse=True)
+            totale_quintali=ordine.totale_quintali,
+            totale_importo=ordine.totale_importo,
+            totale_provvigione=arrotonda_provvigione(ordine.totale_provvigione),
+            righe=righe_per_ordine.get(ordine.id, [])
+        )
+        for ordine in ordini
+    ]
 
     return ProvvigioniOrdiniResponse(
-        totale_provvigioni=totale_provvigioni,
-        totale_incassato=totale_incassato,
-        totale_quintali=totale_quintali,
+        totale_provvigioni=arrotonda_provvigione(
+            sum((ordine.totale_provvigione for ordine in ordini), Decimal("0"))
+        ),
+        totale_incassato=sum((o.totale_importo for o in ordini_result), Decimal("0")),
+        totale_quintali=sum((o.totale_quintali for o in ordini_result), Decimal("0")),
         ordini=ordini_result
     )
 
@@ -314,40 +217,32 @@ def provvigioni_dettaglio_mulino(
     mulino_id: int,
     anno: int = Query(...),
     trimestre: int = Query(..., ge=1, le=4),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    """Dettaglio provvigioni per un mulino specifico nel trimestre"""
+    """Dettaglio provvigioni per un mulino specifico nel trimestre (una query)"""
     data_inizio, data_fine = get_trimestre_date(anno, trimestre)
-    
-    risultati = []
-    
-    righe = db.query(RigaOrdine).join(Ordine).filter(
-        RigaOrdine.mulino_id == mulino_id,
-        Ordine.data_incasso_mulino >= data_inizio,
-        Ordine.data_incasso_mulino <= data_fine
+
+    righe = db.execute(
+        provvigioni.query_dettaglio_mulino(data_inizio, data_fine, mulino_id)
     ).all()
-    
-    for riga in righe:
-        ordine = db.query(Ordine).filter(Ordine.id == riga.ordine_id).first()
-        cliente = db.query(Cliente).filter(Cliente.id == ordine.cliente_id).first()
-        prodotto = db.query(Prodotto).filter(Prodotto.id == riga.prodotto_id).first()
-        
-        provvigione = calcola_provvigione_riga(riga, prodotto)
-        
-        risultati.append(ProvvigioneDettaglio(
-            ordine_id=ordine.id,
-            cliente_nome=cliente.nome,
-            data_ordine=ordine.data_ordine,
-            data_incasso=ordine.data_incasso_mulino,
-            prodotto_nome=prodotto.nome,
+
+    risultati = [
+        ProvvigioneDettaglio(
+            ordine_id=riga.ordine_id,
+            cliente_nome=riga.cliente_nome,
+            data_ordine=riga.data_ordine,
+            data_incasso=riga.data_incasso_mulino,
+            prodotto_nome=riga.prodotto_nome,
             quintali=riga.quintali,
             prezzo_quintale=riga.prezzo_quintale,
             importo_riga=riga.prezzo_totale,
-            tipo_provvigione=prodotto.tipo_provvigione,
-            valore_provvigione=prodotto.valore_provvigione,
-            provvigione_calcolata=provvigione
-        ))
-    
+            tipo_provvigione=riga.tipo_provvigione,
+            valore_provvigione=riga.valore_provvigione,
+            provvigione_calcolata=arrotonda_provvigione(riga.provvigione_calcolata)
+        )
+        for riga in righe
+    ]
+
     return sorted(risultati, key=lambda x: x.data_incasso or x.data_ordine)
 
 
@@ -358,7 +253,7 @@ def incassato_per_mulino(
     data_a: Optional[date] = Query(None),
     anno: Optional[int] = Query(None),
     trimestre: Optional[int] = Query(None, ge=1, le=4),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """
     Recap incassato per un mulino in un periodo.
@@ -406,7 +301,7 @@ def venduto_per_cliente(
     data_da: Optional[date] = Query(None),
     data_a: Optional[date] = Query(None),
     limit: int = Query(50),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Classifica clienti per volume venduto"""
     query = db.query(
@@ -438,7 +333,7 @@ def venduto_per_prodotto(
     data_a: Optional[date] = Query(None),
     mulino_id: Optional[int] = Query(None),
     limit: int = Query(50),
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Classifica prodotti per volume venduto"""
     query = db.query(
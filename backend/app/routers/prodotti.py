@@ -6,6 +6,7 @@ from app.database import get_db
 from app.models.prodotto import Prodotto
 from app.models.mulino import Mulino
 from app.schemas.prodotto import ProdottoCreate, ProdottoUpdate, ProdottoRead, ProdottoConMulino
+from app.services import provvigioni, ricerca
 
 router = APIRouter()
 
@@ -30,7 +31,7 @@ def lista_prodotti(
     ).join(Mulino)
     
     if search:
-        query = query.filter(Prodotto.nome.ilike(f"%{search}%"))
+        query = query.filter(ricerca.filtro_ricerca(db, (Prodotto.nome,), search, simili=False))
     
     if mulino_id:
         query = query.filter(Prodotto.mulino_id == mulino_id)
@@ -97,6 +98,10 @@ def aggiorna_prodotto(
     for field, value in update_data.items():
         setattr(db_prodotto, field, value)
     
+    # Cambio provvigione: ricalcola i trimestri con righe del prodotto
+    if {"tipo_provvigione", "valore_provvigione"} & update_data.keys():
+        provvigioni.aggiorna_rollup(db, provvigioni.chiavi_rollup_prodotto(db, prodotto_id))
+    
     db.commit()
     db.refresh(db_prodotto)
     return db_prodotto
@@ -0,0 +1,50 @@
+"""
+Router ricerca unificata
+
+Un solo endpoint per la casella di ricerca (anche da telefono): clienti,
+prodotti, mulini e trasportatori per pertinenza, senza distinzione di
+accenti e con tolleranza agli errori di battitura (app.services.ricerca).
+"""
+
+from fastapi import APIRouter, Depends, Query
+from pydantic import BaseModel
+from sqlalchemy.orm import Session
+from typing import List, Optional
+
+from app.database import get_db
+from app.services import ricerca
+from app.services.ricerca import EntitaRicerca
+
+router = APIRouter()
+
+
+# === SCHEMAS ===
+
+class RisultatoRicerca(BaseModel):
+    id: int
+    nome: str
+    descrizione: Optional[str] = None  # Referente, mulino del prodotto, indirizzo o telefono
+
+    class Config:
+        from_attributes = True
+
+
+class RisultatiRicerca(BaseModel):
+    """Risultati per entità, dal più pertinente (entità non richieste: lista vuota)"""
+    clienti: List[RisultatoRicerca] = []
+    prodotti: List[RisultatoRicerca] = []
+    mulini: List[RisultatoRicerca] = []
+    trasportatori: List[RisultatoRicerca] = []
+
+
+# === ENDPOINT ===
+
+@router.get("/", response_model=RisultatiRicerca)
+def cerca(
+    q: str = Query(..., min_length=1, max_length=100, description="Testo da cercare"),
+    entita: Optional[List[EntitaRicerca]] = Query(None, description="Entità da interrogare (default tutte)"),
+    limite: int = Query(5, ge=1, le=50, description="Risultati massimi per entità"),
+    db: Session = Depends(get_db)
+):
+    """Ricerca per nome su clienti, prodotti, mulini e trasportatori"""
+    return ricerca.cerca(db, q, entita or list(EntitaRicerca), limite)
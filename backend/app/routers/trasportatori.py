@@ -5,6 +5,7 @@ from typing import List, Optional
 from app.database import get_db
 from app.models.trasportatore import Trasportatore
 from app.schemas.trasportatore import TrasportatoreCreate, TrasportatoreUpdate, TrasportatoreRead
+from app.services import ricerca
 
 router = APIRouter()
 
@@ -18,7 +19,7 @@ def lista_trasportatori(
     query = db.query(Trasportatore)
     
     if search:
-        query = query.filter(Trasportatore.nome.ilike(f"%{search}%"))
+        query = query.filter(ricerca.filtro_ricerca(db, (Trasportatore.nome,), search, simili=False))
     
     return query.order_by(Trasportatore.nome).all()
 
@@ -4,7 +4,7 @@ from app.schemas.prodotto import ProdottoCreate, ProdottoUpdate, ProdottoRead
 from app.schemas.trasportatore import TrasportatoreCreate, TrasportatoreUpdate, TrasportatoreRead
 from app.schemas.ordine import (
     OrdineCreate, OrdineUpdate, OrdineRead, OrdineList,
-    RigaOrdineCreate, RigaOrdineRead
+    RigaOrdineCreate, RigaOrdineUpdate, RigaOrdineRead
 )
 from app.schemas.carico import CaricoCreate, CaricoUpdate, CaricoRead
 from app.schemas.storico_prezzo import StoricoPrezzoRead, UltimoPrezzoRead
@@ -15,7 +15,7 @@ __all__ = [
     "ProdottoCreate", "ProdottoUpdate", "ProdottoRead",
     "TrasportatoreCreate", "TrasportatoreUpdate", "TrasportatoreRead",
     "OrdineCreate", "OrdineUpdate", "OrdineRead", "OrdineList",
-    "RigaOrdineCreate", "RigaOrdineRead",
+    "RigaOrdineCreate", "RigaOrdineUpdate", "RigaOrdineRead",
     "CaricoCreate", "CaricoUpdate", "CaricoRead",
     "StoricoPrezzoRead", "UltimoPrezzoRead",
 ]
\ No newline at end of file
@@ -5,6 +5,7 @@ Versione aggiornata con:
 - mulino_id obbligatorio
 - total_quantita
 - Stati: BOZZA, ASSEGNATO, RITIRATO, CONSEGNATO
+- versione: letta con il carico e rimandata nelle modifiche (409 se cambiata)
 """
 
 from pydantic import BaseModel, Field, field_validator, model_validator
@@ -28,6 +29,19 @@ class TipoCarico(str, Enum):
     PEDANE = "pedane"
 
 
+class TipoOperazioneCarico(str, Enum):
+    ASSEGNA = "assegna"
+    RITIRA = "ritira"
+    CONSEGNA = "consegna"
+    AGGIUNGI_ORDINE = "aggiungi_ordine"
+    RIMUOVI_ORDINE = "rimuovi_ordine"
+
+
+class ModalitaOperazioni(str, Enum):
+    TUTTO_O_NIENTE = "tutto_o_niente"  # Al primo errore non si applica nulla
+    BEST_EFFORT = "best_effort"        # Le operazioni fallite vengono saltate
+
+
 # === Schema base ===
 
 class CaricoBase(BaseModel):
@@ -79,12 +93,14 @@ class CaricoUpdate(BaseModel):
     data_ritiro: Optional[date] = None
     stato: Optional[StatoCarico] = None
     note: Optional[str] = None
+    versione: Optional[int] = Field(None, description="Versione letta: se indicata e cambiata -> 409")
 
 
 class CaricoAssignTransport(BaseModel):
     """Schema specifico per assegnare trasportatore e data a un carico BOZZA"""
     trasportatore_id: int = Field(..., description="ID trasportatore - obbligatorio")
     data_ritiro: date = Field(..., description="Data ritiro - obbligatoria")
+    versione: Optional[int] = Field(None, description="Versione letta: se indicata e cambiata -> 409")
     
     @field_validator('data_ritiro')
     @classmethod
@@ -100,6 +116,7 @@ class CaricoRead(CaricoBase):
     """Schema completo per lettura singolo carico"""
     id: int
     total_quantita: Decimal = Field(default=Decimal("0"), description="Totale quintali nel carico")
+    versione: int = Field(default=1, description="Versione per la concorrenza ottimistica")
     creato_il: datetime
     aggiornato_il: Optional[datetime] = None
     
@@ -129,6 +146,7 @@ class CaricoList(BaseModel):
     percentuale_completamento: Decimal = Decimal("0")
     is_completo: bool = False
     num_ordini: int = 0
+    versione: int = 1
 
     class Config:
         from_attributes = True
@@ -164,6 +182,7 @@ class OrdineInCarico(BaseModel):
 class AddOrdineToCarico(BaseModel):
     """Schema per aggiungere ordine a carico esistente"""
     ordine_id: int = Field(..., description="ID ordine da aggiungere")
+    versione: Optional[int] = Field(None, description="Versione letta del carico: se cambiata -> 409")
 
 
 class RemoveOrdineFromCarico(BaseModel):
@@ -177,6 +196,64 @@ class MoveOrdineToCarico(BaseModel):
     carico_destinazione_id: int = Field(..., description="ID carico destinazione")
 
 
+# === Schema per operazioni in blocco ===
+
+MAX_OPERAZIONI_BLOCCO = 500
+
+
+class OperazioneCarico(BaseModel):
+    """Singola operazione di POST /carichi/operazioni"""
+    tipo: TipoOperazioneCarico
+    carico_id: int
+    ordine_id: Optional[int] = Field(None, description="Per aggiungi_ordine / rimuovi_ordine")
+    trasportatore_id: Optional[int] = Field(None, description="Per assegna")
+    data_ritiro: Optional[date] = Field(None, description="Per assegna")
+    versione: Optional[int] = Field(None, description="Versione letta del carico: se cambiata -> errore 409")
+
+    @model_validator(mode='after')
+    def campi_richiesti(self):
+        if self.tipo in (TipoOperazioneCarico.AGGIUNGI_ORDINE, TipoOperazioneCarico.RIMUOVI_ORDINE):
+            if self.ordine_id is None:
+                raise ValueError(f"{self.tipo}: ordine_id obbligatorio")
+        if self.tipo == TipoOperazioneCarico.ASSEGNA:
+            if self.trasportatore_id is None or self.data_ritiro is None:
+                raise ValueError("assegna: trasportatore_id e data_ritiro obbligatori")
+            if self.data_ritiro < date.today():
+                raise ValueError("Data ritiro deve essere oggi o futura")
+        return self
+
+    class Config:
+        # tipo come stringa: il service non dipende dagli Enum degli schema
+        use_enum_values = True
+
+
+class OperazioniCarichi(BaseModel):
+    """Lista di operazioni eseguite in un'unica transazione"""
+    operazioni: List[OperazioneCarico] = Field(..., min_length=1, max_length=MAX_OPERAZIONI_BLOCCO)
+    modalita: ModalitaOperazioni = ModalitaOperazioni.TUTTO_O_NIENTE
+
+
+class EsitoOperazioneCarico(BaseModel):
+    """Esito di una operazione: ok, errore, annullata, non_eseguita"""
+    indice: int
+    tipo: str
+    carico_id: int
+    ordine_id: Optional[int] = None
+    esito: str
+    status_code: Optional[int] = None
+    errore: Optional[str] = None
+
+
+class RisultatoOperazioniCarichi(BaseModel):
+    """Risultato di POST /carichi/operazioni"""
+    modalita: ModalitaOperazioni
+    confermate: bool  # False: tutto o niente con almeno un errore, nulla applicato
+    eseguite: int
+    fallite: int
+    esiti: List[EsitoOperazioneCarico]
+    carichi: List[CaricoList]  # Stato finale dei carichi coinvolti
+
+
 # === Schema per validazione ===
 
 class ValidazioneCaricoResult(BaseModel):
@@ -189,6 +266,23 @@ class ValidazioneCaricoResult(BaseModel):
     tipo: Optional[str] = None
 
 
+MAX_CANDIDATI_VALIDAZIONE = 500
+
+
+class CandidatiCarico(BaseModel):
+    """Più insiemi di ordini da validare in una richiesta (anteprima di tutta la board)"""
+    candidati: List[List[int]] = Field(..., min_length=1, max_length=MAX_CANDIDATI_VALIDAZIONE)
+    exclude_carico_id: Optional[int] = Field(
+        None, description="Gli ordini già in questo carico non contano come assegnati"
+    )
+
+
+class ValidazioneCandidato(ValidazioneCaricoResult):
+    """Esito di un candidato di POST /carichi/valida-multipla"""
+    indice: int
+    ordini_ids: List[int]
+
+
 # === Schema per suggerimenti ===
 
 class SuggerimentoCarico(BaseModel):
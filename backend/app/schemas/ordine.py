@@ -19,6 +19,11 @@ class RigaOrdineCreate(RigaOrdineBase):
     pass
 
 
+class RigaOrdineUpdate(RigaOrdineBase):
+    """Riga in modifica ordine: con id aggiorna la riga esistente, senza id ne crea una nuova"""
+    id: Optional[int] = None
+
+
 class RigaOrdineRead(RigaOrdineBase):
     id: int
 
@@ -78,11 +83,14 @@ class OrdineUpdate(BaseModel):
     trasportatore_id: Optional[int] = None
     note: Optional[str] = None
 
-    righe: Optional[List[RigaOrdineCreate]] = None
+    righe: Optional[List[RigaOrdineUpdate]] = None
 
 class OrdineRead(OrdineBase):
     id: int
     creato_il: datetime
+    totale_quintali: Decimal = Decimal("0")
+    totale_importo: Decimal = Decimal("0")
+    mulino_principale_id: Optional[int] = None
     righe: List[RigaOrdineRead] = []
 
     class Config:
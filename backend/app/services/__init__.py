@@ -15,6 +15,7 @@ from app.services.carico_service import (
     
     # Creazione
     create_draft_load,
+    crea_carichi_bozza,
     create_load_from_large_order,
     
     # Assegnazione
@@ -32,6 +33,7 @@ from app.services.carico_service import (
     mark_load_as_delivered,
     
     # Query
+    query_carichi_proiezione,
     get_carichi_aperti_per_mulino,
     get_ordini_disponibili_per_carico,
     
@@ -50,6 +52,7 @@ __all__ = [
     
     # Creazione
     "create_draft_load",
+    "crea_carichi_bozza",
     "create_load_from_large_order",
     
     # Assegnazione
@@ -67,6 +70,7 @@ __all__ = [
     "mark_load_as_delivered",
     
     # Query
+    "query_carichi_proiezione",
     "get_carichi_aperti_per_mulino",
     "get_ordini_disponibili_per_carico",
     
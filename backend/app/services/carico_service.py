@@ -6,17 +6,28 @@ Logica di business centralizzata per:
 - Creazione/gestione carichi
 - Sincronizzazione total_quantita
 - Gestione stati ordini
+- Operazioni in blocco (transizioni set-based in un'unica transazione)
+
+Transizioni di stato set-based: un UPDATE per tabella (carichi, ordini del
+carico) indipendentemente dal numero di ordini, con la sessione allineata.
+
+Concorrenza: ogni mutazione blocca le righe che legge (SELECT ... FOR UPDATE),
+sempre nell'ordine carico -> ordini (per id), e decide sui valori riletti
+sotto lock. Carico.versione permette ai client di rifiutare modifiche basate
+su dati non più attuali (409).
 """
 
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import Select, func, select, update
 from decimal import Decimal
 from datetime import date
-from typing import List, Optional, Tuple
+from itertools import groupby
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
 from fastapi import HTTPException
 
 from app.models.carico import Carico, StatoCarico, TipoCarico
-from app.models.ordine import Ordine, RigaOrdine, StatoLogisticoOrdine
+from app.models.cliente import Cliente
+from app.models.ordine import Ordine, StatoLogisticoOrdine
 from app.models.mulino import Mulino
 from app.models.trasportatore import Trasportatore
 
@@ -27,24 +38,94 @@ SOGLIA_MINIMA_QUINTALI = Decimal("280")
 SOGLIA_ORDINE_SINGOLO = Decimal("280")  # Ordine >= 280 diventa carico automatico
 
 
+# === LOCK E VERSIONI ===
+
+def verifica_versione(carico: Carico, versione_attesa: Optional[int]) -> None:
+    """409 se il client ha letto il carico a una versione diversa da quella attuale"""
+    if versione_attesa is not None and carico.versione != versione_attesa:
+        raise HTTPException(
+            status_code=409,
+            detail=(
+                f"Carico {carico.id} modificato da un'altra operazione "
+                f"(versione {carico.versione}, attesa {versione_attesa}): ricaricare e riprovare"
+            )
+        )
+
+
+def blocca_carico(
+    db: Session,
+    carico_id: int,
+    versione_attesa: Optional[int] = None
+) -> Carico:
+    """
+    Carico bloccato fino a fine transazione (FOR UPDATE), con i valori
+    riletti dal database anche se già presenti nella sessione.
+    """
+    carico = db.execute(
+        select(Carico)
+        .where(Carico.id == carico_id)
+        .with_for_update(of=Carico)
+        .execution_options(populate_existing=True)
+    ).scalar_one_or_none()
+    if carico is None:
+        raise HTTPException(status_code=404, detail=f"Carico {carico_id} non trovato")
+    verifica_versione(carico, versione_attesa)
+    return carico
+
+
+def blocca_carichi(db: Session, carico_ids: Iterable[int]) -> Dict[int, Carico]:
+    """Più carichi bloccati in una sola query, in ordine di id (come blocca_carico)"""
+    carico_ids = sorted(set(carico_ids))
+    if not carico_ids:
+        return {}
+    carichi = db.execute(
+        select(Carico)
+        .where(Carico.id.in_(carico_ids))
+        .order_by(Carico.id)
+        .with_for_update(of=Carico)
+        .execution_options(populate_existing=True)
+    ).scalars()
+    return {carico.id: carico for carico in carichi}
+
+
+def blocca_ordini(db: Session, ordine_ids: List[int]) -> List[Ordine]:
+    """Ordini bloccati fino a fine transazione, in ordine di id (niente deadlock tra chiamanti)"""
+    if not ordine_ids:
+        return []
+    return list(db.execute(
+        select(Ordine)
+        .where(Ordine.id.in_(ordine_ids))
+        .order_by(Ordine.id)
+        .with_for_update(of=Ordine)
+        .execution_options(populate_existing=True)
+    ).unique().scalars())
+
+
+def blocca_ordini_del_carico(db: Session, carico_id: int) -> List[Ordine]:
+    """Ordini di un carico già bloccato (il lock sul carico ne fissa la composizione)"""
+    return list(db.execute(
+        select(Ordine)
+        .where(Ordine.carico_id == carico_id)
+        .order_by(Ordine.id)
+        .with_for_update(of=Ordine)
+        .execution_options(populate_existing=True)
+    ).unique().scalars())
+
+
 # === FUNZIONI DI VALIDAZIONE ===
 
 def get_mulino_principale_ordine(db: Session, ordine_id: int) -> Tuple[Optional[int], Optional[str]]:
     """
     Restituisce (mulino_id, mulino_nome) del mulino con più quintali nell'ordine.
+    Legge la colonna denormalizzata Ordine.mulino_principale_id.
     """
     result = db.query(
-        RigaOrdine.mulino_id,
-        Mulino.nome,
-        func.sum(RigaOrdine.quintali).label('totale')
+        Ordine.mulino_principale_id,
+        Mulino.nome
     ).join(
-        Mulino, RigaOrdine.mulino_id == Mulino.id
+        Mulino, Ordine.mulino_principale_id == Mulino.id
     ).filter(
-        RigaOrdine.ordine_id == ordine_id
-    ).group_by(
-        RigaOrdine.mulino_id, Mulino.nome
-    ).order_by(
-        func.sum(RigaOrdine.quintali).desc()
+        Ordine.id == ordine_id
     ).first()
     
     if result:
@@ -53,41 +134,75 @@ def get_mulino_principale_ordine(db: Session, ordine_id: int) -> Tuple[Optional[
 
 
 def calcola_totale_quintali_ordine(db: Session, ordine_id: int) -> Decimal:
-    """Calcola il totale quintali di un ordine dalle sue righe"""
+    """Totale quintali di un ordine (colonna denormalizzata)"""
     result = db.query(
-        func.sum(RigaOrdine.quintali)
-    ).filter(RigaOrdine.ordine_id == ordine_id).scalar()
+        Ordine.totale_quintali
+    ).filter(Ordine.id == ordine_id).scalar()
     return result or Decimal("0")
 
 
 def calcola_totale_quintali_carico(db: Session, carico_id: int) -> Decimal:
-    """Calcola il totale quintali di un carico sommando le righe degli ordini"""
+    """Calcola il totale quintali di un carico sommando i totali degli ordini"""
     result = db.query(
-        func.sum(RigaOrdine.quintali)
-    ).join(
-        Ordine, RigaOrdine.ordine_id == Ordine.id
+        func.sum(Ordine.totale_quintali)
     ).filter(
         Ordine.carico_id == carico_id
     ).scalar()
     return result or Decimal("0")
 
 
-def validate_load_constraints(
-    db: Session, 
+class AttributiOrdine(NamedTuple):
+    """Attributi di un ordine che decidono se può stare in un carico"""
+    id: int
+    tipo_ordine: str
+    mulino_id: Optional[int]
+    mulino_nome: Optional[str]
+    totale_quintali: Decimal
+    carico_id: Optional[int]
+
+
+def carica_attributi_ordini(db: Session, order_ids: Iterable[int]) -> Dict[int, AttributiOrdine]:
+    """
+    Matrice degli attributi per ordine (tipo, mulino principale, quintali,
+    carico) in una sola query: base comune per validare uno o molti candidati.
+    """
+    order_ids = set(order_ids)
+    if not order_ids:
+        return {}
+    
+    righe = db.execute(
+        select(
+            Ordine.id,
+            Ordine.tipo_ordine,
+            Ordine.mulino_principale_id,
+            Mulino.nome,
+            Ordine.totale_quintali,
+            Ordine.carico_id
+        )
+        .outerjoin(Mulino, Ordine.mulino_principale_id == Mulino.id)
+        .where(Ordine.id.in_(order_ids))
+    )
+    return {
+        riga.id: AttributiOrdine(
+            riga.id,
+            riga.tipo_ordine,
+            riga.mulino_principale_id,
+            riga.nome,
+            riga.totale_quintali or Decimal("0"),
+            riga.carico_id
+        )
+        for riga in righe
+    }
+
+
+def valida_candidato(
+    attributi: Dict[int, AttributiOrdine],
     order_ids: List[int],
     exclude_carico_id: Optional[int] = None
 ) -> Tuple[bool, List[str], dict]:
     """
-    Valida che gli ordini possano stare nello stesso carico.
-    
-    Vincoli:
-    - Stesso mulino
-    - Stesso tipo (sfuso/pedane)
-    - Somma quantità <= 300 quintali
-    
-    Returns:
-        (valido, lista_errori, info_dict)
-        info_dict contiene: mulino_id, mulino_nome, tipo, totale_quintali
+    Vincoli di validate_load_constraints su una matrice già caricata
+    (nessuna query): stesso risultato, errori e info.
     """
     errori = []
     info = {
@@ -100,8 +215,7 @@ def validate_load_constraints(
     if not order_ids:
         return False, ["Nessun ordine specificato"], info
     
-    # Carica ordini
-    ordini = db.query(Ordine).filter(Ordine.id.in_(order_ids)).all()
+    ordini = [attributi[i] for i in sorted(set(order_ids)) if i in attributi]
     
     if len(ordini) != len(order_ids):
         trovati = {o.id for o in ordini}
@@ -122,16 +236,10 @@ def validate_load_constraints(
     totale = Decimal("0")
     
     for ordine in ordini:
-        # Tipo ordine
         tipi.add(ordine.tipo_ordine)
-        
-        # Mulino principale dell'ordine
-        mulino_id, mulino_nome = get_mulino_principale_ordine(db, ordine.id)
-        if mulino_id:
-            mulini.add((mulino_id, mulino_nome))
-        
-        # Quintali
-        totale += calcola_totale_quintali_ordine(db, ordine.id)
+        if ordine.mulino_id:
+            mulini.add((ordine.mulino_id, ordine.mulino_nome))
+        totale += ordine.totale_quintali
     
     # Verifica stesso tipo
     if len(tipi) > 1:
@@ -156,6 +264,74 @@ def validate_load_constraints(
     return len(errori) == 0, errori, info
 
 
+def avvisi_carico(valido: bool, info: dict) -> List[str]:
+    """Avvisi (non bloccanti) per un carico valido: soglia minima e spazio residuo"""
+    if not valido:
+        return []
+    totale = info['totale_quintali']
+    if totale < SOGLIA_MINIMA_QUINTALI:
+        return [f"Carico sotto soglia minima: {totale}q < {SOGLIA_MINIMA_QUINTALI}q"]
+    if totale < MAX_QUINTALI_CARICO:
+        return [f"Possibile aggiungere ancora {MAX_QUINTALI_CARICO - totale}q"]
+    return []
+
+
+def validate_load_constraints(
+    db: Session, 
+    order_ids: List[int],
+    exclude_carico_id: Optional[int] = None
+) -> Tuple[bool, List[str], dict]:
+    """
+    Valida che gli ordini possano stare nello stesso carico.
+    
+    Vincoli:
+    - Stesso mulino
+    - Stesso tipo (sfuso/pedane)
+    - Somma quantità <= 300 quintali
+    
+    Returns:
+        (valido, lista_errori, info_dict)
+        info_dict contiene: mulino_id, mulino_nome, tipo, totale_quintali
+    """
+    return valida_candidato(
+        carica_attributi_ordini(db, order_ids), order_ids, exclude_carico_id
+    )
+
+
+def valida_candidati(
+    db: Session,
+    candidati: List[List[int]],
+    exclude_carico_id: Optional[int] = None
+) -> List[Tuple[bool, List[str], dict]]:
+    """
+    Valida molti insiemi di ordini con una sola query: la matrice degli
+    attributi copre l'unione degli ordini, poi ogni candidato è verificato in memoria.
+    """
+    attributi = carica_attributi_ordini(db, (i for candidato in candidati for i in candidato))
+    return [valida_candidato(attributi, candidato, exclude_carico_id) for candidato in candidati]
+
+
+def verifica_ordini_del_carico(db: Session, carico: Carico) -> None:
+    """
+    Dopo la modifica di un ordine già nel carico (righe o tipo): gli ordini
+    devono restare compatibili tra loro e con mulino e tipo del carico,
+    entro il limite di quintali. 400 altrimenti.
+    Da chiamare dopo il flush, con il carico bloccato.
+    """
+    order_ids = list(db.scalars(select(Ordine.id).where(Ordine.carico_id == carico.id)))
+    valido, errori, info = valida_candidato(
+        carica_attributi_ordini(db, order_ids), order_ids, exclude_carico_id=carico.id
+    )
+    if valido and info['tipo'] != carico.tipo:
+        errori.append(f"Tipo ordine '{info['tipo']}' incompatibile con carico '{carico.tipo}'")
+    if valido and info['mulino_id'] != carico.mulino_id:
+        errori.append(
+            f"Mulino ordine ({info['mulino_id']}) diverso da mulino carico ({carico.mulino_id})"
+        )
+    if errori:
+        raise HTTPException(status_code=400, detail="; ".join(errori))
+
+
 # === FUNZIONI DI SINCRONIZZAZIONE ===
 
 def recalculate_load_total(db: Session, carico_id: int) -> Decimal:
@@ -163,11 +339,14 @@ def recalculate_load_total(db: Session, carico_id: int) -> Decimal:
     Ricalcola e aggiorna total_quantita del carico.
     Deve essere chiamata ogni volta che cambiano gli ordini del carico.
     """
-    carico = db.query(Carico).filter(Carico.id == carico_id).first()
-    if not carico:
-        raise HTTPException(status_code=404, detail=f"Carico {carico_id} non trovato")
+    carico = blocca_carico(db, carico_id)
     
     nuovo_totale = calcola_totale_quintali_carico(db, carico_id)
+    if nuovo_totale > MAX_QUINTALI_CARICO:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Limite superato: {nuovo_totale}q > {MAX_QUINTALI_CARICO}q"
+        )
     carico.total_quantita = nuovo_totale
     db.flush()
     
@@ -200,30 +379,50 @@ def create_draft_load(
     
     Il carico eredita mulino e tipo dagli ordini (che devono essere compatibili).
     """
-    # Valida vincoli
-    valido, errori, info = validate_load_constraints(db, order_ids)
-    if not valido:
-        raise HTTPException(status_code=400, detail="; ".join(errori))
-    
-    # Crea carico
-    carico = Carico(
-        mulino_id=info['mulino_id'],
-        tipo=info['tipo'],
-        stato=StatoCarico.BOZZA.value,
-        total_quantita=info['totale_quintali'],
-        note=note
-    )
-    db.add(carico)
-    db.flush()  # Per ottenere l'ID
-    
-    # Assegna ordini al carico
-    for ordine_id in order_ids:
-        ordine = db.query(Ordine).filter(Ordine.id == ordine_id).first()
-        ordine.carico_id = carico.id
-        ordine.stato_logistico = StatoLogisticoOrdine.IN_CLUSTER.value
+    return crea_carichi_bozza(db, [order_ids], note)[0]
+
+
+def crea_carichi_bozza(
+    db: Session,
+    carichi_ordini_ids: List[List[int]],
+    note: Optional[str] = None
+) -> List[Carico]:
+    """
+    Crea più carichi in BOZZA con le regole di create_draft_load:
+    un solo lock sull'unione degli ordini e una sola validazione
+    (valida_candidati). 400 al primo carico non valido, senza creare nulla.
+    """
+    # Ordini bloccati: nessun'altra operazione può assegnarli prima del commit
+    blocca_ordini(db, [i for order_ids in carichi_ordini_ids for i in order_ids])
+    
+    # Valida vincoli (sui valori appena riletti sotto lock)
+    esiti = valida_candidati(db, carichi_ordini_ids)
+    for valido, errori, _ in esiti:
+        if not valido:
+            raise HTTPException(status_code=400, detail="; ".join(errori))
+    
+    carichi = []
+    for order_ids, (_, _, info) in zip(carichi_ordini_ids, esiti):
+        carico = Carico(
+            mulino_id=info['mulino_id'],
+            tipo=info['tipo'],
+            stato=StatoCarico.BOZZA.value,
+            total_quantita=info['totale_quintali'],
+            note=note
+        )
+        db.add(carico)
+        db.flush()  # Per ottenere l'ID
+        
+        # Assegna ordini al carico (un solo UPDATE, ordini in sessione allineati)
+        db.execute(
+            update(Ordine)
+            .where(Ordine.id.in_(order_ids))
+            .values(carico_id=carico.id, stato_logistico=StatoLogisticoOrdine.IN_CLUSTER.value)
+            .execution_options(synchronize_session="evaluate")
+        )
+        carichi.append(carico)
     
-    db.flush()
-    return carico
+    return carichi
 
 
 def create_load_from_large_order(
@@ -238,7 +437,7 @@ def create_load_from_large_order(
     A differenza di create_draft_load, questo crea direttamente
     un carico ASSEGNATO perché l'ordine da solo soddisfa la soglia minima.
     """
-    ordine = db.query(Ordine).filter(Ordine.id == ordine_id).first()
+    ordine = next(iter(blocca_ordini(db, [ordine_id])), None)
     if not ordine:
         raise HTTPException(status_code=404, detail=f"Ordine {ordine_id} non trovato")
     
@@ -248,7 +447,7 @@ def create_load_from_large_order(
             detail=f"Ordine già assegnato al carico {ordine.carico_id}"
         )
     
-    totale = calcola_totale_quintali_ordine(db, ordine_id)
+    totale = ordine.totale_quintali or Decimal("0")
     if totale < SOGLIA_ORDINE_SINGOLO:
         raise HTTPException(
             status_code=400,
@@ -263,7 +462,7 @@ def create_load_from_large_order(
         raise HTTPException(status_code=404, detail="Trasportatore non trovato")
     
     # Ottieni mulino
-    mulino_id, _ = get_mulino_principale_ordine(db, ordine_id)
+    mulino_id = ordine.mulino_principale_id
     
     # Crea carico già assegnato
     carico = Carico(
@@ -291,21 +490,15 @@ def assign_transport(
     db: Session,
     carico_id: int,
     trasportatore_id: int,
-    data_ritiro: date
+    data_ritiro: date,
+    versione_attesa: Optional[int] = None
 ) -> Carico:
     """
     Assegna trasportatore e data a un carico BOZZA.
     Transizione: BOZZA -> ASSEGNATO
     """
-    carico = db.query(Carico).filter(Carico.id == carico_id).first()
-    if not carico:
-        raise HTTPException(status_code=404, detail="Carico non trovato")
-    
-    if carico.stato != StatoCarico.BOZZA.value:
-        raise HTTPException(
-            status_code=400,
-            detail=f"Solo carichi in BOZZA possono essere assegnati (stato attuale: {carico.stato})"
-        )
+    carico = blocca_carico(db, carico_id, versione_attesa)
+    verifica_transizione(carico, "assegna")
     
     # Verifica trasportatore
     trasportatore = db.query(Trasportatore).filter(
@@ -314,17 +507,11 @@ def assign_transport(
     if not trasportatore:
         raise HTTPException(status_code=404, detail="Trasportatore non trovato")
     
-    # Aggiorna carico
-    carico.trasportatore_id = trasportatore_id
-    carico.data_ritiro = data_ritiro
-    carico.stato = StatoCarico.ASSEGNATO.value
-    
-    # Aggiorna stato ordini
-    ordini = db.query(Ordine).filter(Ordine.carico_id == carico_id).all()
-    for ordine in ordini:
-        ordine.stato_logistico = StatoLogisticoOrdine.IN_CARICO.value
-    
-    db.flush()
+    # Carico e stato ordini: un UPDATE ciascuno
+    applica_transizione(
+        db, [carico_id], "assegna",
+        {"trasportatore_id": trasportatore_id, "data_ritiro": data_ritiro}
+    )
     return carico
 
 
@@ -333,7 +520,8 @@ def assign_transport(
 def add_order_to_load(
     db: Session,
     ordine_id: int,
-    carico_id: int
+    carico_id: int,
+    versione_attesa: Optional[int] = None
 ) -> Carico:
     """
     Aggiunge un ordine a un carico esistente.
@@ -342,10 +530,12 @@ def add_order_to_load(
     - Compatibilità mulino e tipo
     - Limite quintali non superato
     - Carico in stato modificabile (BOZZA)
+    
+    Carico e ordine sono bloccati prima dei controlli: due aggiunte
+    concorrenti allo stesso carico si serializzano e la seconda vede
+    il totale aggiornato dalla prima.
     """
-    carico = db.query(Carico).filter(Carico.id == carico_id).first()
-    if not carico:
-        raise HTTPException(status_code=404, detail="Carico non trovato")
+    carico = blocca_carico(db, carico_id, versione_attesa)
     
     if carico.stato != StatoCarico.BOZZA.value:
         raise HTTPException(
@@ -353,7 +543,7 @@ def add_order_to_load(
             detail=f"Carico non modificabile: stato '{carico.stato}'"
         )
     
-    ordine = db.query(Ordine).filter(Ordine.id == ordine_id).first()
+    ordine = next(iter(blocca_ordini(db, [ordine_id])), None)
     if not ordine:
         raise HTTPException(status_code=404, detail="Ordine non trovato")
     
@@ -371,16 +561,16 @@ def add_order_to_load(
         )
     
     # Verifica compatibilità mulino
-    mulino_ordine, _ = get_mulino_principale_ordine(db, ordine_id)
+    mulino_ordine = ordine.mulino_principale_id
     if mulino_ordine != carico.mulino_id:
         raise HTTPException(
             status_code=400,
             detail=f"Mulino ordine ({mulino_ordine}) diverso da mulino carico ({carico.mulino_id})"
         )
     
-    # Verifica limite quintali
-    quintali_ordine = calcola_totale_quintali_ordine(db, ordine_id)
-    nuovo_totale = carico.total_quantita + quintali_ordine
+    # Verifica limite quintali: totale ricalcolato dagli ordini (composizione fissata dal lock)
+    quintali_ordine = ordine.totale_quintali or Decimal("0")
+    nuovo_totale = calcola_totale_quintali_carico(db, carico_id) + quintali_ordine
     
     if nuovo_totale > MAX_QUINTALI_CARICO:
         raise HTTPException(
@@ -401,10 +591,12 @@ def add_order_to_load(
 
 def remove_order_from_load(
     db: Session,
-    ordine_id: int
+    ordine_id: int,
+    versione_attesa: Optional[int] = None,
+    carico_id: Optional[int] = None
 ) -> Optional[Carico]:
     """
-    Rimuove un ordine dal suo carico.
+    Rimuove un ordine dal suo carico (se indicato carico_id, deve essere quello).
     
     Regole:
     - Se rimangono 0 ordini -> elimina carico
@@ -413,15 +605,31 @@ def remove_order_from_load(
     Returns:
         Il carico aggiornato, o None se è stato eliminato
     """
-    ordine = db.query(Ordine).filter(Ordine.id == ordine_id).first()
-    if not ordine:
+    riga = db.execute(
+        select(Ordine.carico_id).where(Ordine.id == ordine_id)
+    ).one_or_none()
+    if riga is None:
         raise HTTPException(status_code=404, detail="Ordine non trovato")
     
-    if not ordine.carico_id:
+    if carico_id is not None and riga.carico_id != carico_id:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Ordine {ordine_id} non appartiene al carico {carico_id}"
+        )
+    
+    carico_id = riga.carico_id
+    if not carico_id:
         raise HTTPException(status_code=400, detail="Ordine non assegnato a nessun carico")
     
-    carico_id = ordine.carico_id
-    carico = db.query(Carico).filter(Carico.id == carico_id).first()
+    # Lock nell'ordine carico -> ordini, poi verifica che l'ordine sia ancora lì
+    carico = blocca_carico(db, carico_id, versione_attesa)
+    ordini = blocca_ordini_del_carico(db, carico_id)
+    ordine = next((o for o in ordini if o.id == ordine_id), None)
+    if ordine is None:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Ordine {ordine_id} spostato da un'altra operazione: ricaricare e riprovare"
+        )
     
     if carico.stato not in [StatoCarico.BOZZA.value, StatoCarico.ASSEGNATO.value]:
         raise HTTPException(
@@ -434,8 +642,9 @@ def remove_order_from_load(
     ordine.stato_logistico = StatoLogisticoOrdine.APERTO.value
     db.flush()
     
-    # Conta ordini rimanenti
-    ordini_rimanenti = db.query(Ordine).filter(Ordine.carico_id == carico_id).count()
+    # Ordini rimanenti (già bloccati)
+    rimanenti = [o for o in ordini if o.id != ordine_id]
+    ordini_rimanenti = len(rimanenti)
     
     # Logica di eliminazione carico
     elimina_carico = False
@@ -447,10 +656,9 @@ def remove_order_from_load(
         # (un ordine singolo piccolo non ha senso come carico)
         elimina_carico = True
         # Scollega anche l'ultimo ordine
-        ultimo_ordine = db.query(Ordine).filter(Ordine.carico_id == carico_id).first()
-        if ultimo_ordine:
-            ultimo_ordine.carico_id = None
-            ultimo_ordine.stato_logistico = StatoLogisticoOrdine.APERTO.value
+        ultimo_ordine = rimanenti[0]
+        ultimo_ordine.carico_id = None
+        ultimo_ordine.stato_logistico = StatoLogisticoOrdine.APERTO.value
     
     if elimina_carico:
         db.delete(carico)
@@ -466,56 +674,323 @@ def remove_order_from_load(
 
 # === FUNZIONI DI TRANSIZIONE STATO ===
 
-def mark_load_as_picked_up(db: Session, carico_id: int) -> Carico:
-    """
-    Segna il carico come ritirato.
-    Transizione: ASSEGNATO -> RITIRATO
-    """
-    carico = db.query(Carico).filter(Carico.id == carico_id).first()
-    if not carico:
-        raise HTTPException(status_code=404, detail="Carico non trovato")
-    
-    if carico.stato != StatoCarico.ASSEGNATO.value:
+class Transizione(NamedTuple):
+    """Regola di una transizione di stato del carico e suo effetto sugli ordini"""
+    da: StatoCarico
+    a: StatoCarico
+    errore: str  # Messaggio se il carico non è nello stato di partenza
+    stato_logistico: Optional[StatoLogisticoOrdine] = None
+    stato_ordine: Optional[str] = None  # Stato legacy degli ordini
+
+
+TRANSIZIONI = {
+    "assegna": Transizione(
+        StatoCarico.BOZZA, StatoCarico.ASSEGNATO,
+        "Solo carichi in BOZZA possono essere assegnati (stato attuale: {stato})",
+        StatoLogisticoOrdine.IN_CARICO
+    ),
+    "ritira": Transizione(
+        StatoCarico.ASSEGNATO, StatoCarico.RITIRATO,
+        "Solo carichi ASSEGNATI possono essere ritirati (stato: {stato})",
+        StatoLogisticoOrdine.SPEDITO,
+        "ritirato"  # Mantiene compatibilità con stato legacy
+    ),
+    "consegna": Transizione(
+        StatoCarico.RITIRATO, StatoCarico.CONSEGNATO,
+        "Solo carichi RITIRATI possono essere consegnati (stato: {stato})"
+    ),
+}
+
+
+def verifica_transizione(carico: Carico, nome: str) -> Transizione:
+    """400 se il carico non è nello stato di partenza della transizione"""
+    transizione = TRANSIZIONI[nome]
+    if carico.stato != transizione.da.value:
         raise HTTPException(
             status_code=400,
-            detail=f"Solo carichi ASSEGNATI possono essere ritirati (stato: {carico.stato})"
+            detail=transizione.errore.format(stato=carico.stato)
         )
+    return transizione
+
+
+def applica_transizione(
+    db: Session,
+    carico_ids: List[int],
+    nome: str,
+    valori_carico: Optional[dict] = None
+) -> None:
+    """
+    Transizione set-based: un UPDATE su carichi e, se la transizione tocca
+    gli ordini, uno su ordini per tutti i carichi indicati. Gli oggetti già
+    nella sessione vengono allineati (synchronize_session).
     
-    carico.stato = StatoCarico.RITIRATO.value
+    Lo stato di partenza va verificato prima, sui carichi bloccati.
+    """
+    transizione = TRANSIZIONI[nome]
+    db.execute(
+        update(Carico)
+        .where(Carico.id.in_(carico_ids))
+        .values(
+            stato=transizione.a.value,
+            versione=Carico.versione + 1,
+            **(valori_carico or {})
+        )
+        .execution_options(synchronize_session="fetch")
+    )
     
-    # Aggiorna ordini
-    ordini = db.query(Ordine).filter(Ordine.carico_id == carico_id).all()
-    for ordine in ordini:
-        ordine.stato_logistico = StatoLogisticoOrdine.SPEDITO.value
-        ordine.stato = "ritirato"  # Mantiene compatibilità con stato legacy
+    valori_ordini = {}
+    if transizione.stato_logistico is not None:
+        valori_ordini["stato_logistico"] = transizione.stato_logistico.value
+    if transizione.stato_ordine is not None:
+        valori_ordini["stato"] = transizione.stato_ordine
+    if valori_ordini:
+        db.execute(
+            update(Ordine)
+            .where(Ordine.carico_id.in_(carico_ids))
+            .values(**valori_ordini)
+            .execution_options(synchronize_session="evaluate")
+        )
+
+def mark_load_as_picked_up(
+    db: Session,
+    carico_id: int,
+    versione_attesa: Optional[int] = None
+) -> Carico:
+    """
+    Segna il carico come ritirato.
+    Transizione: ASSEGNATO -> RITIRATO
+    """
+    carico = blocca_carico(db, carico_id, versione_attesa)
+    verifica_transizione(carico, "ritira")
     
-    db.flush()
+    # Carico e ordini (stato logistico e legacy): un UPDATE ciascuno
+    applica_transizione(db, [carico_id], "ritira")
     return carico
 
 
-def mark_load_as_delivered(db: Session, carico_id: int) -> Carico:
+def mark_load_as_delivered(
+    db: Session,
+    carico_id: int,
+    versione_attesa: Optional[int] = None
+) -> Carico:
     """
     Segna il carico come consegnato.
     Transizione: RITIRATO -> CONSEGNATO
     """
-    carico = db.query(Carico).filter(Carico.id == carico_id).first()
-    if not carico:
-        raise HTTPException(status_code=404, detail="Carico non trovato")
+    carico = blocca_carico(db, carico_id, versione_attesa)
+    verifica_transizione(carico, "consegna")
     
-    if carico.stato != StatoCarico.RITIRATO.value:
+    applica_transizione(db, [carico_id], "consegna")
+    return carico
+
+
+# === OPERAZIONI IN BLOCCO ===
+
+ESITO_OK = "ok"
+ESITO_ERRORE = "errore"
+ESITO_ANNULLATA = "annullata"        # Riuscita, ma annullata dal fallimento di un'altra
+ESITO_NON_ESEGUITA = "non_eseguita"  # Non tentata (tutto o niente dopo un errore)
+
+
+def _segna_errore(esito: dict, errore: HTTPException) -> None:
+    esito["esito"] = ESITO_ERRORE
+    esito["status_code"] = errore.status_code
+    esito["errore"] = errore.detail
+
+
+def _verifica_versione_iniziale(op, versioni: Dict[int, int]) -> None:
+    """La versione indicata dal client si confronta con quella di inizio richiesta"""
+    if op.versione is not None and op.carico_id in versioni and versioni[op.carico_id] != op.versione:
         raise HTTPException(
-            status_code=400,
-            detail=f"Solo carichi RITIRATI possono essere consegnati (stato: {carico.stato})"
+            status_code=409,
+            detail=(
+                f"Carico {op.carico_id} modificato da un'altra operazione "
+                f"(versione {versioni[op.carico_id]}, attesa {op.versione}): ricaricare e riprovare"
+            )
         )
+
+
+def _transizioni_in_blocco(
+    db: Session,
+    nome: str,
+    gruppo: List[tuple],
+    esiti: List[dict],
+    versioni: Dict[int, int],
+    trasportatori: set,
+    tutto_o_niente: bool
+) -> bool:
+    """
+    Operazioni consecutive della stessa transizione: verifica per carico,
+    poi un UPDATE per tabella per tutti i carichi validi
+    (per 'assegna' uno per coppia trasportatore/data).
+    """
+    carichi = blocca_carichi(db, [op.carico_id for _, op in gruppo])
+    validi = []
+    riuscito = True
+    for indice, op in gruppo:
+        try:
+            carico = carichi.get(op.carico_id)
+            if carico is None:
+                raise HTTPException(status_code=404, detail=f"Carico {op.carico_id} non trovato")
+            if any(altra.carico_id == op.carico_id for _, altra in validi):
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Carico {op.carico_id} ripetuto nella stessa transizione"
+                )
+            _verifica_versione_iniziale(op, versioni)
+            verifica_transizione(carico, nome)
+            if nome == "assegna" and op.trasportatore_id not in trasportatori:
+                raise HTTPException(status_code=404, detail="Trasportatore non trovato")
+        except HTTPException as e:
+            _segna_errore(esiti[indice], e)
+            riuscito = False
+            if tutto_o_niente:
+                return False
+            continue
+        validi.append((indice, op))
     
-    carico.stato = StatoCarico.CONSEGNATO.value
-    db.flush()
+    if not validi:
+        return riuscito
     
-    return carico
+    if nome == "assegna":
+        def chiave(voce):
+            return voce[1].trasportatore_id, voce[1].data_ritiro
+        
+        for (trasportatore_id, data_ritiro), voci in groupby(sorted(validi, key=chiave), key=chiave):
+            applica_transizione(
+                db, [op.carico_id for _, op in voci], nome,
+                {"trasportatore_id": trasportatore_id, "data_ritiro": data_ritiro}
+            )
+    else:
+        applica_transizione(db, [op.carico_id for _, op in validi], nome)
+    
+    for indice, _ in validi:
+        esiti[indice].update(esito=ESITO_OK, status_code=200)
+    return riuscito
+
+
+def esegui_operazioni(
+    db: Session,
+    operazioni: list,
+    tutto_o_niente: bool = True
+) -> Tuple[List[dict], bool]:
+    """
+    Esegue una lista di operazioni sui carichi nella transazione corrente.
+    
+    Operazioni (attributi tipo, carico_id, ordine_id, trasportatore_id,
+    data_ritiro, versione): 'assegna', 'ritira', 'consegna' con le regole di
+    TRANSIZIONI, set-based per gruppi consecutivi dello stesso tipo;
+    'aggiungi_ordine' e 'rimuovi_ordine' con add_order_to_load e
+    remove_order_from_load, ciascuna in un savepoint.
+    
+    tutto_o_niente: al primo errore si interrompe e le operazioni riuscite
+    risultano annullate (il chiamante deve fare rollback). Altrimenti le
+    operazioni fallite vengono saltate e le altre restano applicate.
+    
+    Returns:
+        (esiti per operazione, True se le modifiche vanno confermate)
+    """
+    esiti = [
+        {
+            "indice": indice,
+            "tipo": op.tipo,
+            "carico_id": op.carico_id,
+            "ordine_id": op.ordine_id,
+            "esito": ESITO_NON_ESEGUITA,
+            "status_code": None,
+            "errore": None,
+        }
+        for indice, op in enumerate(operazioni)
+    ]
+    
+    # Lock per tutta la transazione nell'ordine carico -> ordini, una query ciascuno
+    carichi = blocca_carichi(db, (op.carico_id for op in operazioni))
+    versioni = {carico_id: carico.versione for carico_id, carico in carichi.items()}
+    blocca_ordini(db, sorted({op.ordine_id for op in operazioni if op.ordine_id}))
+    
+    trasportatori_ids = {op.trasportatore_id for op in operazioni if op.trasportatore_id}
+    trasportatori = set(db.scalars(
+        select(Trasportatore.id).where(Trasportatore.id.in_(trasportatori_ids))
+    )) if trasportatori_ids else set()
+    
+    interrotta = False
+    for nome, gruppo in groupby(enumerate(operazioni), key=lambda voce: voce[1].tipo):
+        gruppo = list(gruppo)
+        if nome in TRANSIZIONI:
+            riuscito = _transizioni_in_blocco(
+                db, nome, gruppo, esiti, versioni, trasportatori, tutto_o_niente
+            )
+            if not riuscito and tutto_o_niente:
+                interrotta = True
+                break
+            continue
+        
+        for indice, op in gruppo:
+            try:
+                _verifica_versione_iniziale(op, versioni)
+                with db.begin_nested():
+                    if nome == "aggiungi_ordine":
+                        add_order_to_load(db, op.ordine_id, op.carico_id)
+                    else:
+                        remove_order_from_load(db, op.ordine_id, carico_id=op.carico_id)
+            except HTTPException as e:
+                _segna_errore(esiti[indice], e)
+                if tutto_o_niente:
+                    interrotta = True
+                    break
+                continue
+            esiti[indice].update(esito=ESITO_OK, status_code=200)
+        if interrotta:
+            break
+    
+    if interrotta:
+        for esito in esiti:
+            if esito["esito"] == ESITO_OK:
+                esito["esito"] = ESITO_ANNULLATA
+        return esiti, False
+    
+    db.flush()
+    return esiti, True
 
 
 # === FUNZIONI DI QUERY ===
 
+def query_carichi_proiezione() -> Select:
+    """
+    Proiezione carichi per liste e dettaglio: campi del carico, nome mulino,
+    nome trasportatore e numero ordini in un solo statement.
+    
+    Il conteggio ordini è una subquery correlata sull'indice ordini.carico_id.
+    Aggiungere filtri e ordinamento con .where() / .order_by().
+    """
+    num_ordini = select(
+        func.count(Ordine.id)
+    ).where(
+        Ordine.carico_id == Carico.id
+    ).correlate(Carico).scalar_subquery()
+    
+    return select(
+        Carico.id,
+        Carico.mulino_id,
+        Mulino.nome.label("mulino_nome"),
+        Carico.tipo,
+        Carico.trasportatore_id,
+        Trasportatore.nome.label("trasportatore_nome"),
+        Carico.data_ritiro,
+        Carico.stato,
+        Carico.total_quantita,
+        Carico.note,
+        Carico.versione,
+        Carico.creato_il,
+        Carico.aggiornato_il,
+        num_ordini.label("num_ordini")
+    ).outerjoin(
+        Mulino, Carico.mulino_id == Mulino.id
+    ).outerjoin(
+        Trasportatore, Carico.trasportatore_id == Trasportatore.id
+    )
+
+
 def get_carichi_aperti_per_mulino(
     db: Session, 
     mulino_id: int, 
@@ -536,41 +1011,76 @@ def get_carichi_aperti_per_mulino(
     return query.order_by(Carico.creato_il.desc()).all()
 
 
+def query_ordini_compatibili(carico: Carico, quintali_disponibili: Decimal) -> Select:
+    """
+    Ordini aggiungibili al carico: non assegnati, stesso tipo, stesso mulino
+    principale e quintali entro lo spazio residuo. Un range scan sull'indice
+    idx_ordini_compatibili (tipo, stato logistico, mulino, quintali), con
+    nome cliente; gli ordini che riempiono di più vengono per primi.
+    """
+    return (
+        select(
+            Ordine.id,
+            Ordine.cliente_id,
+            Cliente.nome.label("cliente_nome"),
+            Ordine.data_ordine,
+            Ordine.data_ritiro,
+            Ordine.tipo_ordine,
+            Ordine.stato_logistico,
+            Ordine.totale_quintali
+        )
+        .join(Cliente, Cliente.id == Ordine.cliente_id)
+        .where(
+            Ordine.tipo_ordine == carico.tipo,
+            Ordine.stato_logistico == StatoLogisticoOrdine.APERTO.value,
+            Ordine.mulino_principale_id == carico.mulino_id,
+            Ordine.totale_quintali <= quintali_disponibili,
+            Ordine.carico_id.is_(None)
+        )
+        .order_by(Ordine.totale_quintali.desc(), Ordine.id)
+    )
+
+
+def data_riferimento_carico(db: Session, carico: Carico) -> date:
+    """Data di ritiro del carico, o la più vicina tra i suoi ordini (bozza), o oggi"""
+    if carico.data_ritiro:
+        return carico.data_ritiro
+    prima = db.execute(
+        select(func.min(Ordine.data_ritiro)).where(Ordine.carico_id == carico.id)
+    ).scalar()
+    return prima or date.today()
+
+
 def get_ordini_disponibili_per_carico(
     db: Session,
     carico_id: int
-) -> List[Ordine]:
+) -> list:
     """
     Restituisce gli ordini che possono essere aggiunti a un carico.
     
-    Filtri:
+    Filtri (nella query, sull'indice composto):
     - Stesso mulino del carico
     - Stesso tipo del carico
     - Non assegnati ad altri carichi
     - Quantità totale non supererebbe 300q
+    
+    Ordinamento: prima chi riempie meglio lo spazio residuo, a parità
+    la data di ritiro più vicina a quella del carico (senza data in fondo).
     """
-    carico = db.query(Carico).filter(Carico.id == carico_id).first()
+    carico = db.get(Carico, carico_id)
     if not carico:
         return []
     
-    quintali_disponibili = MAX_QUINTALI_CARICO - carico.total_quantita
+    quintali_disponibili = MAX_QUINTALI_CARICO - (carico.total_quantita or Decimal("0"))
     
-    # Query ordini compatibili
-    ordini = db.query(Ordine).filter(
-        Ordine.carico_id.is_(None),
-        Ordine.tipo_ordine == carico.tipo,
-        Ordine.stato_logistico == StatoLogisticoOrdine.APERTO.value
-    ).all()
+    ordini = db.execute(query_ordini_compatibili(carico, quintali_disponibili)).all()
     
-    # Filtra per mulino e quintali
-    compatibili = []
-    for ordine in ordini:
-        mulino_ordine, _ = get_mulino_principale_ordine(db, ordine.id)
-        if mulino_ordine != carico.mulino_id:
-            continue
-        
-        quintali = calcola_totale_quintali_ordine(db, ordine.id)
-        if quintali <= quintali_disponibili:
-            compatibili.append(ordine)
+    riferimento = data_riferimento_carico(db, carico)
+    
+    def distanza_giorni(ordine) -> float:
+        if ordine.data_ritiro is None:
+            return float("inf")
+        return abs((ordine.data_ritiro - riferimento).days)
     
-    return compatibili
\ No newline at end of file
+    # sorted è stabile: a parità di quintali e distanza resta l'ordine per id della query
+    return sorted(ordini, key=lambda o: (quintali_disponibili - o.totale_quintali, distanza_giorni(o)))
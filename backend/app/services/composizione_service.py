@@ -0,0 +1,603 @@
+"""
+Service Layer per Composizione Carichi
+
+Motore di packing per i suggerimenti di combinazione ordini:
+- Lavora in unità intere (centesimi di quintale) per somme esatte
+- Branch-and-bound sulla finestra 280-320 quintali
+- Restituisce le migliori K combinazioni di qualsiasi dimensione
+  entro un budget di tempo configurabile
+- Piano globale: partizione degli ordini aperti in carichi disgiunti
+  (branch-and-bound sui piani completi), un gruppo (mulino, tipo) per processo
+- Snapshot degli ordini non assegnati in una sola query
+"""
+
+import bisect
+import itertools
+import math
+import os
+import time
+from datetime import date
+from decimal import Decimal
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import Select, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.models.cliente import Cliente
+from app.models.mulino import Mulino
+from app.models.ordine import Ordine
+
+
+# === COSTANTI DI DOMINIO ===
+OBIETTIVO_QUINTALI = Decimal("300")
+SOGLIA_MINIMA = Decimal("280")
+SOGLIA_MASSIMA = Decimal("320")
+
+# Punteggio: 100 - distanza da 300q - penalità
+PUNTEGGIO_BASE = 100.0
+PENALITA_GIORNO_COPPIA = 2   # Per giorno di distanza tra le date di una coppia
+PENALITA_ORDINE_EXTRA = 5    # Per ogni ordine oltre il secondo
+
+MIN_ORDINI_COMBINAZIONE = 2
+UNITA_PER_QUINTALE = 100  # Centesimi di quintale: quintali è Numeric(10, 2)
+
+# Piano globale: finestra più stretta (carico pieno senza eccedere 300q)
+SOGLIA_MASSIMA_PIANO = Decimal("300")
+CANDIDATI_ORDINATI_PIANO = 64  # Carichi del perno riordinati per peso prima di esplorarli
+
+# Configurabili da ambiente
+MAX_ORDINI_COMBINAZIONE = int(os.getenv("COMPOSIZIONE_MAX_ORDINI", "8"))
+TEMPO_MAX_MS = int(os.getenv("COMPOSIZIONE_TEMPO_MAX_MS", "500"))
+TEMPO_MAX_PIANO_MS = int(os.getenv("COMPOSIZIONE_TEMPO_MAX_PIANO_MS", "2000"))
+PROCESSI_PIANO = int(os.getenv("COMPOSIZIONE_PROCESSI", str(os.cpu_count() or 1)))
+
+_CONTROLLO_TEMPO_OGNI = 256  # Nodi visitati tra due controlli del budget
+
+
+class _TempoScaduto(Exception):
+    """Budget di tempo esaurito durante la ricerca"""
+
+
+# === SNAPSHOT ORDINI ===
+
+def query_ordini_non_assegnati(
+    mulino_id: Optional[int] = None,
+    tipo: Optional[str] = None
+) -> Select:
+    """
+    Statement unico per gli ordini non assegnati (carico_id IS NULL) e non
+    ancora ritirati, con nome cliente, totale quintali e mulino principale.
+
+    Totale e mulino principale sono colonne denormalizzate di ordini.
+    Gli ordini senza righe (mulino principale NULL) restano esclusi.
+    """
+    stmt = select(
+        Ordine.id,
+        Ordine.cliente_id,
+        Cliente.nome.label("cliente_nome"),
+        Ordine.data_ordine,
+        Ordine.data_ritiro,
+        Ordine.tipo_ordine,
+        Ordine.stato,
+        Ordine.totale_quintali,
+        Ordine.mulino_principale_id.label("mulino_id"),
+        Mulino.nome.label("mulino_nome")
+    ).join(
+        Mulino, Mulino.id == Ordine.mulino_principale_id
+    ).outerjoin(
+        Cliente, Cliente.id == Ordine.cliente_id
+    ).where(
+        Ordine.carico_id.is_(None),
+        Ordine.stato == "inserito"
+    )
+
+    if tipo:
+        stmt = stmt.where(Ordine.tipo_ordine == tipo)
+
+    if mulino_id:
+        stmt = stmt.where(Ordine.mulino_principale_id == mulino_id)
+
+    return stmt.order_by(Ordine.id)
+
+
+def serializza_ordine_non_assegnato(row) -> dict:
+    """Riga dello snapshot -> dict usato da composizione e piano"""
+    return {
+        "id": row.id,
+        "cliente_id": row.cliente_id,
+        "cliente_nome": row.cliente_nome or "N/D",
+        "data_ordine": row.data_ordine,
+        "data_ritiro": row.data_ritiro,
+        "tipo_ordine": row.tipo_ordine,
+        "stato": row.stato,
+        "totale_quintali": row.totale_quintali or Decimal("0"),
+        "mulino_id": row.mulino_id,
+        "mulino_nome": row.mulino_nome
+    }
+
+
+def carica_ordini_non_assegnati(
+    db: Session,
+    mulino_id: Optional[int] = None,
+    tipo: Optional[str] = None
+) -> List[dict]:
+    """Snapshot degli ordini non assegnati in un solo round-trip"""
+    rows = db.execute(query_ordini_non_assegnati(mulino_id, tipo)).all()
+    return [serializza_ordine_non_assegnato(row) for row in rows]
+
+
+async def carica_ordini_non_assegnati_async(
+    db: AsyncSession,
+    mulino_id: Optional[int] = None,
+    tipo: Optional[str] = None
+) -> List[dict]:
+    """Come carica_ordini_non_assegnati, su una sessione asincrona"""
+    rows = (await db.execute(query_ordini_non_assegnati(mulino_id, tipo))).all()
+    return [serializza_ordine_non_assegnato(row) for row in rows]
+
+
+# === HELPERS ===
+
+def _in_unita(quintali: Decimal) -> int:
+    """Converte quintali in centesimi di quintale (intero)"""
+    return int((quintali * UNITA_PER_QUINTALE).to_integral_value())
+
+
+def _data_riferimento(ordine: dict) -> Optional[date]:
+    """Data di riferimento per l'urgenza: ritiro se presente, altrimenti ordine"""
+    return ordine["data_ritiro"] or ordine["data_ordine"]
+
+
+def _score_massimo(num_ordini: int) -> float:
+    """Miglior punteggio ottenibile da una combinazione di num_ordini ordini"""
+    return PUNTEGGIO_BASE - PENALITA_ORDINE_EXTRA * max(0, num_ordini - 2)
+
+
+def calcola_score(totale: Decimal, date_ordini: List[Optional[date]]) -> float:
+    """
+    Punteggio qualità di una combinazione (più alto = migliore).
+
+    - Coppie: penalizza distanza da 300q e giorni tra le due date
+    - Tre o più ordini: penalizza distanza da 300q e ogni ordine extra
+    """
+    diff = abs(totale - OBIETTIVO_QUINTALI)
+
+    if len(date_ordini) == 2:
+        d1, d2 = date_ordini
+        giorni_diff = abs((d1 - d2).days) if d1 and d2 else 0
+        return PUNTEGGIO_BASE - float(diff) - giorni_diff * PENALITA_GIORNO_COPPIA
+
+    return _score_massimo(len(date_ordini)) - float(diff)
+
+
+# === MOTORE DI PACKING ===
+
+def trova_combinazioni(
+    ordini: List[dict],
+    max_risultati: int = 5,
+    max_ordini: Optional[int] = None,
+    tempo_max_ms: Optional[int] = None,
+    soglia_minima: Decimal = SOGLIA_MINIMA,
+    soglia_massima: Decimal = SOGLIA_MASSIMA,
+    min_ordini: int = MIN_ORDINI_COMBINAZIONE,
+    obiettivo: Decimal = OBIETTIVO_QUINTALI,
+    punteggio: Callable[[Decimal, List[Optional[date]]], float] = calcola_score,
+    score_massimo: Callable[[int], float] = _score_massimo,
+) -> List[dict]:
+    """
+    Trova le migliori combinazioni di ordini con totale nella finestra
+    [soglia_minima, soglia_massima].
+
+    Ogni ordine è un dict con: id, totale_quintali, data_ordine, data_ritiro.
+
+    Di default usa il punteggio dei suggerimenti (calcola_score, centrato su
+    300q). punteggio/score_massimo/obiettivo permettono altri criteri purché
+    score_massimo(k) - distanza da obiettivo sia un limite superiore del
+    punteggio di qualsiasi combinazione di k ordini.
+
+    La ricerca procede per dimensione crescente (2, 3, ... ordini). Per ogni
+    dimensione gli ordini sono esplorati in ordine di quintali con potatura
+    sulle somme parziali, e la finestra si restringe man mano che la top-K
+    si riempie: una combinazione di k ordini non può superare
+    score_massimo(k) - distanza da obiettivo. Appena score_massimo(k) non batte
+    il peggiore della top-K la ricerca si ferma.
+
+    A parità di score vince la combinazione con meno ordini e, a parità,
+    quella con date di ritiro più urgenti: stesso ordinamento della vecchia
+    enumerazione di coppie e triple.
+
+    Se il budget di tempo scade restituisce le migliori trovate fino a quel momento.
+
+    Returns:
+        Lista di dict: ordini_ids, totale_quintali, differenza_da_obiettivo,
+        data_piu_urgente, score - ordinata per score decrescente
+    """
+    if not ordini or max_risultati <= 0:
+        return []
+
+    if max_ordini is None:
+        max_ordini = MAX_ORDINI_COMBINAZIONE
+    if tempo_max_ms is None:
+        tempo_max_ms = TEMPO_MAX_MS
+
+    # Rango per urgenza (stabile): usato per ordinare gli id e per i pareggi
+    per_data = sorted(ordini, key=lambda o: o["data_ritiro"] or date.max)
+
+    # Elementi ordinati per quantità crescente: (unità, rango)
+    elementi = sorted(
+        ((_in_unita(o["totale_quintali"]), rango) for rango, o in enumerate(per_data)),
+        key=lambda e: e[0]
+    )
+    quantita = [e[0] for e in elementi]
+    n = len(elementi)
+
+    # Somme prefisse per i limiti di completamento
+    prefissi = [0]
+    for q in quantita:
+        prefissi.append(prefissi[-1] + q)
+
+    min_unita = _in_unita(soglia_minima)
+    max_unita = _in_unita(soglia_massima)
+    obiettivo_unita = _in_unita(obiettivo)
+
+    # Top-K ordinata per chiave (-score, num_ordini, ranghi)
+    migliori: List[Tuple[tuple, dict]] = []
+    scadenza = time.monotonic() + tempo_max_ms / 1000
+    nodi = 0
+
+    def soglia_score() -> Optional[float]:
+        if len(migliori) < max_risultati:
+            return None
+        return -migliori[-1][0][0]
+
+    def finestra(k: int) -> Tuple[int, int]:
+        """Finestra [lo, hi] in unità, ristretta dalla top-K corrente"""
+        peggiore = soglia_score()
+        if peggiore is None:
+            return min_unita, max_unita
+        margine = score_massimo(k) - peggiore
+        margine_unita = math.ceil(margine * UNITA_PER_QUINTALE)
+        return (
+            max(min_unita, obiettivo_unita - margine_unita),
+            min(max_unita, obiettivo_unita + margine_unita),
+        )
+
+    def registra(ranghi: List[int]):
+        scelti = [per_data[r] for r in sorted(ranghi)]
+        totale = sum((o["totale_quintali"] for o in scelti), Decimal("0"))
+        date_scelti = [_data_riferimento(o) for o in scelti]
+        score = punteggio(totale, date_scelti)
+
+        chiave = (-score, len(scelti), tuple(sorted(ranghi)))
+        if len(migliori) >= max_risultati and chiave >= migliori[-1][0]:
+            return
+
+        date_valide = [d for d in date_scelti if d]
+        bisect.insort(migliori, (chiave, {
+            "ordini_ids": [o["id"] for o in scelti],
+            "totale_quintali": totale,
+            "differenza_da_obiettivo": OBIETTIVO_QUINTALI - totale,
+            "data_piu_urgente": min(date_valide) if date_valide else None,
+            "score": score,
+        }))
+        del migliori[max_risultati:]
+
+    def esplora(inizio: int, da_scegliere: int, parziale: int, scelti: List[int], k: int):
+        nonlocal nodi
+        nodi += 1
+        if nodi % _CONTROLLO_TEMPO_OGNI == 0 and time.monotonic() > scadenza:
+            raise _TempoScaduto()
+
+        lo, hi = finestra(k)
+        if lo > hi:
+            return
+
+        if da_scegliere == 1:
+            # Ultimo ordine: intervallo ammesso trovato per bisezione
+            a = bisect.bisect_left(quantita, lo - parziale, inizio)
+            b = bisect.bisect_right(quantita, hi - parziale, a)
+            for i in range(a, b):
+                scelti.append(elementi[i][1])
+                registra(scelti)
+                scelti.pop()
+            return
+
+        for i in range(inizio, n - da_scegliere + 1):
+            # Minimo raggiungibile: i prossimi da_scegliere ordini più piccoli
+            minimo = parziale + prefissi[i + da_scegliere] - prefissi[i]
+            if minimo > hi:
+                break
+            # Massimo raggiungibile: questo ordine + i più grandi rimasti
+            massimo = parziale + quantita[i] + prefissi[n] - prefissi[n - da_scegliere + 1]
+            if massimo < lo:
+                continue
+
+            scelti.append(elementi[i][1])
+            esplora(i + 1, da_scegliere - 1, parziale + quantita[i], scelti, k)
+            scelti.pop()
+
+    try:
+        for k in range(min_ordini, min(max_ordini, n) + 1):
+            peggiore = soglia_score()
+            if peggiore is not None and score_massimo(k) <= peggiore:
+                break  # Nessuna combinazione più grande può entrare nella top-K
+            if prefissi[k] > max_unita:
+                break  # Anche i k ordini più piccoli superano la soglia massima
+            esplora(0, k, 0, [], k)
+    except _TempoScaduto:
+        pass
+
+    return [risultato for _, risultato in migliori]
+
+
+# === PIANO GLOBALE (PARTIZIONE) ===
+
+def _spread_giorni(date_ordini: List[Optional[date]]) -> int:
+    """Giorni tra la data più vicina e la più lontana"""
+    date_valide = [d for d in date_ordini if d]
+    if len(date_valide) < 2:
+        return 0
+    return (max(date_valide) - min(date_valide)).days
+
+
+def _valore_piano(carichi: List[List[dict]]) -> Tuple[int, int, int]:
+    """Obiettivo del piano (più alto = migliore): carichi, unità assegnate, -spread"""
+    return (
+        len(carichi),
+        sum(_in_unita(o["totale_quintali"]) for c in carichi for o in c),
+        -sum(_spread_giorni([_data_riferimento(o) for o in c]) for c in carichi),
+    )
+
+
+def _prima_i_leggeri(carichi: Iterator[Tuple[int, tuple]]) -> Iterator[Tuple[int, tuple]]:
+    """
+    I primi CANDIDATI_ORDINATI_PIANO carichi in ordine di peso crescente,
+    poi gli altri nell'ordine di generazione: un carico vicino a 280q lascia
+    più quintali per i successivi, senza enumerare tutti i candidati.
+    """
+    primi = list(itertools.islice(carichi, CANDIDATI_ORDINATI_PIANO))
+    primi.sort(key=lambda c: c[0])
+    yield from primi
+    yield from carichi
+
+
+def _cerca_partizione(ordini: List[dict], scadenza: float) -> List[List[dict]]:
+    """
+    Branch-and-bound sui piani completi.
+
+    Gli ordini sono considerati dal più grande: l'ordine più grande rimasto
+    (perno) entra in uno dei carichi ammessi che lo contengono, tra 280 e
+    300q, oppure resta fuori dal piano. I carichi del perno sono generati
+    in profondità sugli ordini decrescenti, per cui la prima discesa è un
+    first-fit decreasing e fornisce subito un piano completo. Ordini con
+    stessa quantità e data sono intercambiabili: si esplora una sola scelta.
+
+    Un ramo è potato se neanche usando tutti i quintali rimasti può battere
+    il miglior piano: al massimo rimasti // 280 carichi in più, tutti i
+    quintali assegnati, spread che non può diminuire.
+
+    Se il budget scade restituisce il miglior piano trovato fino a quel momento.
+    """
+    min_unita = _in_unita(SOGLIA_MINIMA)
+    max_unita = _in_unita(SOGLIA_MASSIMA_PIANO)
+
+    # (unità, data, ordine) per quantità decrescente; oltre 300q nessun carico li accoglie
+    elementi = sorted(
+        ((_in_unita(o["totale_quintali"]), _data_riferimento(o), o) for o in ordini),
+        key=lambda e: (-e[0], e[1] or date.max, e[2]["id"])
+    )
+    elementi = [e for e in elementi if e[0] <= max_unita]
+
+    migliore: List[List[dict]] = []
+    valore_migliore = (0, 0, 0)
+    piano: List[List[dict]] = []
+    nodi = 0
+
+    def conta_nodo():
+        nonlocal nodi
+        nodi += 1
+        if nodi % _CONTROLLO_TEMPO_OGNI == 0 and time.monotonic() > scadenza:
+            raise _TempoScaduto()
+
+    def carichi_del_perno(perno: int, altri: List[tuple]):
+        """Genera (unità, indici) dei sottoinsiemi di altri che completano un carico ammesso"""
+        lo, hi = min_unita - perno, max_unita - perno
+        suffissi = [0] * (len(altri) + 1)
+        for i in range(len(altri) - 1, -1, -1):
+            suffissi[i] = suffissi[i + 1] + altri[i][0]
+        negate = [-e[0] for e in altri]  # Crescenti, per la bisezione
+        scelti: List[int] = []
+
+        def estendi(inizio: int, parziale: int):
+            conta_nodo()
+            if parziale >= lo:
+                yield parziale, tuple(scelti)
+            # Salta gli ordini troppo grandi: dal primo che sta sotto il massimo
+            primo = bisect.bisect_left(negate, parziale - hi, inizio)
+            for i in range(primo, len(altri)):
+                if parziale + suffissi[i] < lo:
+                    break  # Neanche tutti i rimanenti raggiungono la soglia
+                if i > primo and altri[i][:2] == altri[i - 1][:2]:
+                    continue  # Equivalente all'ordine precedente, già esplorato
+                scelti.append(i)
+                yield from estendi(i + 1, parziale + altri[i][0])
+                scelti.pop()
+
+        return estendi(0, 0)
+
+    def valuta(rimasti: List[tuple], carichi: int, assegnate: int, spread: int, disponibili: int) -> bool:
+        """Aggiorna il miglior piano; False se il ramo è potato"""
+        nonlocal migliore, valore_migliore
+        conta_nodo()
+
+        valore = (carichi, assegnate, -spread)
+        if valore > valore_migliore:
+            migliore, valore_migliore = [list(c) for c in piano], valore
+
+        carichi_max = carichi + disponibili // min_unita
+        if carichi_max == carichi or carichi_max < valore_migliore[0]:
+            return False
+        if carichi_max == valore_migliore[0]:
+            assegnabili = min(disponibili, (carichi_max - carichi) * max_unita)
+            if (assegnate + assegnabili, -spread) <= valore_migliore[1:]:
+                return False
+        return True
+
+    # Visita in profondità con una pila esplicita, senza ricorsione: un livello
+    # per ogni carico del piano corrente. Un perno lasciato fuori sostituisce
+    # il proprio livello, per cui la pila non cresce con gli ordini esclusi.
+    # piano ha una voce per ogni livello sotto la cima, più quella della cima
+    # mentre se ne esplora un carico.
+    pila: List[tuple] = []
+    nodo: Optional[tuple] = (elementi, 0, 0, 0, sum(e[0] for e in elementi))
+    try:
+        while True:
+            if nodo is not None:
+                if valuta(*nodo):
+                    rimasti = nodo[0]
+                    perno, altri = rimasti[0][0], rimasti[1:]
+                    pila.append((_prima_i_leggeri(carichi_del_perno(perno, altri)), altri) + nodo)
+                nodo = None
+                continue
+            if not pila:
+                break
+
+            candidati, altri, rimasti, carichi, assegnate, spread, disponibili = pila[-1]
+            if len(piano) == len(pila):
+                piano.pop()
+            perno, data_perno, ordine = rimasti[0]
+
+            prossimo = next(candidati, None)
+            if prossimo is not None:
+                parziale, indici = prossimo
+                scelti = set(indici)
+                piano.append([ordine] + [altri[i][2] for i in indici])
+                nodo = (
+                    [e for i, e in enumerate(altri) if i not in scelti],
+                    carichi + 1,
+                    assegnate + perno + parziale,
+                    spread + _spread_giorni([data_perno] + [altri[i][1] for i in indici]),
+                    disponibili - perno - parziale
+                )
+                continue
+
+            # Il perno resta fuori dal piano, e con lui gli ordini equivalenti
+            pila.pop()
+            fuori = 1
+            while fuori < len(rimasti) and rimasti[fuori][:2] == rimasti[0][:2]:
+                fuori += 1
+            nodo = (rimasti[fuori:], carichi, assegnate, spread, disponibili - perno * fuori)
+    except _TempoScaduto:
+        pass
+
+    return migliore
+
+
+def partiziona_gruppo(ordini: List[dict], tempo_max_ms: Optional[int] = None) -> dict:
+    """
+    Partiziona gli ordini di un gruppo (stesso mulino e tipo) in carichi
+    disgiunti tra 280 e 300 quintali.
+
+    Obiettivo, in ordine di priorità: più carichi, meno quintali residui,
+    spread delle date di ritiro più stretto (somma sui carichi). Ricerca
+    branch-and-bound sui piani completi entro il budget: esatta se il budget
+    basta, altrimenti il miglior piano trovato. Alla fine gli ordini avanzati vengono aggiunti ai
+    carichi che hanno ancora spazio, per ridurre i quintali residui.
+
+    Funzione pura e picklable: può girare in un processo separato.
+
+    Returns:
+        dict con carichi (ordini_ids, totale_quintali, data_piu_urgente,
+        spread_giorni), ordini_residui e quintali_residui
+    """
+    if tempo_max_ms is None:
+        tempo_max_ms = TEMPO_MAX_PIANO_MS
+    scadenza = time.monotonic() + tempo_max_ms / 1000
+
+    carichi = _cerca_partizione(ordini, scadenza)
+    assegnati = {o["id"] for c in carichi for o in c}
+    rimasti = {o["id"]: o for o in ordini if o["id"] not in assegnati}
+
+    # Riempie i carichi con gli ordini avanzati, dal più grande al più piccolo
+    max_unita = _in_unita(SOGLIA_MASSIMA_PIANO)
+    totali = [sum(_in_unita(o["totale_quintali"]) for o in c) for c in carichi]
+    for ordine in sorted(rimasti.values(), key=lambda o: o["totale_quintali"], reverse=True):
+        quantita = _in_unita(ordine["totale_quintali"])
+        candidati = [i for i, t in enumerate(totali) if t + quantita <= max_unita]
+        if not candidati:
+            continue
+        # Preferisce il carico con le date più vicine a quelle dell'ordine
+        i = min(candidati, key=lambda i: _spread_giorni(
+            [_data_riferimento(o) for o in carichi[i]] + [_data_riferimento(ordine)]
+        ))
+        carichi[i].append(rimasti.pop(ordine["id"]))
+        totali[i] += quantita
+
+    risultato = []
+    for carico in carichi:
+        carico.sort(key=lambda o: o["data_ritiro"] or date.max)
+        date_carico = [_data_riferimento(o) for o in carico]
+        date_valide = [d for d in date_carico if d]
+        risultato.append({
+            "ordini_ids": [o["id"] for o in carico],
+            "totale_quintali": sum((o["totale_quintali"] for o in carico), Decimal("0")),
+            "data_piu_urgente": min(date_valide) if date_valide else None,
+            "spread_giorni": _spread_giorni(date_carico),
+        })
+
+    return {
+        "carichi": risultato,
+        "ordini_residui": sorted(rimasti),
+        "quintali_residui": sum((o["totale_quintali"] for o in rimasti.values()), Decimal("0")),
+    }
+
+
+_pool_piano: Optional[ProcessPoolExecutor] = None
+
+
+def _get_pool_piano() -> ProcessPoolExecutor:
+    """Pool di processi condiviso, creato al primo utilizzo"""
+    global _pool_piano
+    if _pool_piano is None:
+        _pool_piano = ProcessPoolExecutor(max_workers=PROCESSI_PIANO)
+    return _pool_piano
+
+
+def chiudi_pool_piano():
+    """Chiude il pool di processi (da chiamare allo shutdown dell'app)"""
+    global _pool_piano
+    if _pool_piano is not None:
+        _pool_piano.shutdown(cancel_futures=True)
+        _pool_piano = None
+
+
+def pianifica_carichi(
+    gruppi: Dict[tuple, List[dict]],
+    tempo_max_ms: Optional[int] = None,
+    parallelo: bool = True
+) -> Dict[tuple, dict]:
+    """
+    Calcola il piano di carichi per più gruppi (mulino, tipo).
+
+    I gruppi sono indipendenti: con parallelo=True e più di un gruppo
+    vengono risolti nel pool di processi, ognuno con il budget intero.
+    """
+    chiavi = list(gruppi)
+    if not chiavi:
+        return {}
+
+    if parallelo and len(chiavi) > 1 and PROCESSI_PIANO > 1:
+        piani = _get_pool_piano().map(
+            partiziona_gruppo,
+            [gruppi[k] for k in chiavi],
+            [tempo_max_ms] * len(chiavi)
+        )
+        return dict(zip(chiavi, piani))
+
+    # Sequenziale: il budget è ripartito tra i gruppi
+    if tempo_max_ms is None:
+        tempo_max_ms = TEMPO_MAX_PIANO_MS
+    tempo_gruppo_ms = max(1, tempo_max_ms // len(chiavi))
+    return {k: partiziona_gruppo(gruppi[k], tempo_gruppo_ms) for k in chiavi}
@@ -1,27 +1,340 @@
+"""
+Invio email
+
+- send_email: invio sincrono diretto (una connessione per messaggio)
+- Coda persistente (email_outbox): le richieste accodano con accoda_email e
+  rispondono subito; un thread in background invia i messaggi riusando una
+  sola connessione SMTP autenticata, con tentativi, backoff e stato per messaggio.
+  Ogni messaggio viene prenotato (stato in_invio, commit) prima dell'invio:
+  nessun lock resta aperto durante la conversazione SMTP e più processi
+  possono elaborare la stessa coda senza inviare due volte lo stesso messaggio
+- Configurazione da env: SMTP_STARTTLS=false e SMTP_USER vuoto permettono
+  di puntare a un server SMTP locale di prova (es. aiosmtpd) senza TLS né login
+"""
+
+import logging
 import smtplib
 import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
+from typing import Callable, Optional
 from dotenv import load_dotenv
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+
+from app.database import SessionLocal
+from app.models.email_outbox import EmailOutbox, StatoEmail
+from app.models.ordine import Ordine
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
 SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
 SMTP_USER = os.getenv("SMTP_USER", "")
 SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "true").lower() in ("1", "true", "yes")
+SMTP_TIMEOUT_S = float(os.getenv("SMTP_TIMEOUT_S", "30"))
 MAIL_FROM = os.getenv("MAIL_FROM", "")
 
+# Coda di invio
+EMAIL_MAX_TENTATIVI = int(os.getenv("EMAIL_MAX_TENTATIVI", "5"))
+EMAIL_BACKOFF_BASE_S = int(os.getenv("EMAIL_BACKOFF_BASE_S", "30"))
+EMAIL_BACKOFF_MAX_S = int(os.getenv("EMAIL_BACKOFF_MAX_S", "3600"))
+EMAIL_INTERVALLO_S = float(os.getenv("EMAIL_INTERVALLO_S", "5"))
+# Prenotazione di un messaggio in invio: se il processo termina durante l'invio,
+# scaduto questo tempo il messaggio torna inviabile (può quindi arrivare due volte)
+EMAIL_INVIO_SCADENZA_S = float(os.getenv("EMAIL_INVIO_SCADENZA_S", "300"))
+# Oltre questa inattività la connessione SMTP viene chiusa (i server la chiuderebbero comunque)
+SMTP_INATTIVITA_MAX_S = float(os.getenv("SMTP_INATTIVITA_MAX_S", "60"))
 
-def send_email(to: str, subject: str, body: str):
-    """Invia una email via SMTP. Sincrona (pochi ordini/giorno)."""
+
+# === INVIO DIRETTO ===
+
+def costruisci_messaggio(to: str, subject: str, body: str) -> MIMEMultipart:
     msg = MIMEMultipart()
     msg["From"] = MAIL_FROM
     msg["To"] = to
     msg["Subject"] = subject
     msg.attach(MIMEText(body, "plain", "utf-8"))
+    return msg
+
+
+def apri_connessione_smtp() -> smtplib.SMTP:
+    """Connessione SMTP pronta all'invio (STARTTLS e login se configurati)"""
+    server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT_S)
+    try:
+        if SMTP_STARTTLS:
+            server.starttls()
+        if SMTP_USER:
+            server.login(SMTP_USER, SMTP_PASSWORD)
+    except Exception:
+        server.close()
+        raise
+    return server
+
+
+def send_email(to: str, subject: str, body: str):
+    """Invia una email via SMTP. Sincrona, apre una connessione dedicata."""
+    with apri_connessione_smtp() as server:
+        server.send_message(costruisci_messaggio(to, subject, body))
+
+
+class ConnessioneSMTP:
+    """
+    Connessione SMTP riusata tra più messaggi.
+    Si apre al primo invio e si riapre una volta se il server l'ha chiusa.
+    """
+
+    def __init__(self, apri: Callable[[], smtplib.SMTP] = apri_connessione_smtp):
+        self._apri = apri
+        self._server: Optional[smtplib.SMTP] = None
+        self._ultimo_uso = 0.0
+
+    def invia(self, msg) -> None:
+        if self._server is None:
+            self._server = self._apri()
+        try:
+            self._server.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            self.chiudi()
+            self._server = self._apri()
+            self._server.send_message(msg)
+        self._ultimo_uso = time.monotonic()
+
+    def chiudi_se_inattiva(self) -> None:
+        if self._server is not None and time.monotonic() - self._ultimo_uso > SMTP_INATTIVITA_MAX_S:
+            self.chiudi()
+
+    def chiudi(self) -> None:
+        if self._server is None:
+            return
+        try:
+            self._server.quit()
+        except Exception:
+            self._server.close()
+        self._server = None
+
+
+# === CODA DI INVIO ===
+
+def accoda_email(
+    db: Session,
+    to: str,
+    subject: str,
+    body: str,
+    ordine_id: Optional[int] = None
+) -> EmailOutbox:
+    """Accoda un messaggio (il commit è del chiamante, poi sveglia_invio)"""
+    messaggio = EmailOutbox(
+        ordine_id=ordine_id,
+        destinatario=to,
+        oggetto=subject,
+        corpo=body,
+        stato=StatoEmail.IN_CODA.value,
+        tentativi=0,
+        prossimo_tentativo_il=datetime.now(timezone.utc)
+    )
+    db.add(messaggio)
+    return messaggio
+
+
+def email_in_coda(db: Session, ordine_id: int) -> bool:
+    """True se l'ordine ha messaggi ancora da inviare"""
+    return db.execute(
+        select(EmailOutbox.id).where(
+            EmailOutbox.ordine_id == ordine_id,
+            EmailOutbox.stato.in_([StatoEmail.IN_CODA.value, StatoEmail.IN_INVIO.value])
+        ).limit(1)
+    ).first() is not None
+
+
+def _backoff(tentativi: int) -> timedelta:
+    return timedelta(seconds=min(EMAIL_BACKOFF_MAX_S, EMAIL_BACKOFF_BASE_S * 2 ** (tentativi - 1)))
+
+
+def _errore_definitivo(errore: Exception) -> bool:
+    """Destinatario rifiutato o risposta 5xx: ritentare non serve"""
+    if isinstance(errore, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(errore, smtplib.SMTPResponseException) and 500 <= errore.smtp_code < 600
+
+
+def _prenota_messaggio(db: Session) -> Optional[EmailOutbox]:
+    """
+    Prenota il primo messaggio scaduto (in coda, o in invio con prenotazione scaduta)
+    e fa commit: stato IN_INVIO, tentativo contato, scadenza della prenotazione.
+
+    L'UPDATE è condizionato sullo stato letto, quindi la prenotazione è esclusiva
+    anche su SQLite, dove SKIP LOCKED non ha effetto: se un altro processo ha
+    prenotato lo stesso messaggio si passa al successivo.
+    """
+    while True:
+        adesso = datetime.now(timezone.utc)
+        riga = db.execute(
+            select(EmailOutbox.id, EmailOutbox.stato, EmailOutbox.tentativi)
+            .where(
+                EmailOutbox.stato.in_([StatoEmail.IN_CODA.value, StatoEmail.IN_INVIO.value]),
+                EmailOutbox.prossimo_tentativo_il <= adesso
+            )
+            .order_by(EmailOutbox.id)
+            .limit(1)
+            .with_for_update(skip_locked=True)
+        ).first()
+        if riga is None:
+            db.rollback()
+            return None
+
+        prenotato = db.execute(
+            update(EmailOutbox)
+            .where(
+                EmailOutbox.id == riga.id,
+                EmailOutbox.stato == riga.stato,
+                EmailOutbox.tentativi == riga.tentativi
+            )
+            .values(
+                stato=StatoEmail.IN_INVIO.value,
+                tentativi=riga.tentativi + 1,
+                prossimo_tentativo_il=adesso + timedelta(seconds=EMAIL_INVIO_SCADENZA_S)
+            )
+            .execution_options(synchronize_session=False)
+        ).rowcount == 1
+        db.commit()
+        if prenotato:
+            return db.get(EmailOutbox, riga.id)
+
+
+def _concludi_invio(db: Session, messaggio_id: int, tentativi: int, **valori) -> bool:
+    """
+    Esito dell'invio, solo se la prenotazione è ancora di questo processo
+    (stesso numero di tentativi). False se era scaduta e il messaggio è stato ripreso.
+    """
+    return db.execute(
+        update(EmailOutbox)
+        .where(
+            EmailOutbox.id == messaggio_id,
+            EmailOutbox.stato == StatoEmail.IN_INVIO.value,
+            EmailOutbox.tentativi == tentativi
+        )
+        .values(**valori)
+        .execution_options(synchronize_session=False)
+    ).rowcount == 1
+
+
+def _segna_ordine_inviato(db: Session, ordine_id: int, quando: datetime) -> None:
+    """Valorizza email_inviata_il quando non restano messaggi dell'ordine in coda"""
+    if email_in_coda(db, ordine_id):
+        return
+    ordine = db.get(Ordine, ordine_id)
+    if ordine is not None and ordine.email_inviata_il is None:
+        ordine.email_inviata_il = quando
+
+
+def elabora_coda(db: Session, connessione: ConnessioneSMTP, limite: int = 50) -> int:
+    """
+    Invia fino a `limite` messaggi scaduti.
+    Per ogni messaggio: prenotazione con commit, invio SMTP senza transazioni
+    aperte, esito con un secondo commit.
+
+    Returns:
+        Numero di messaggi elaborati (inviati o falliti)
+    """
+    elaborati = 0
+    while elaborati < limite:
+        messaggio = _prenota_messaggio(db)
+        if messaggio is None:
+            break
+
+        messaggio_id, tentativi, ordine_id = messaggio.id, messaggio.tentativi, messaggio.ordine_id
+        msg = costruisci_messaggio(messaggio.destinatario, messaggio.oggetto, messaggio.corpo)
+        db.rollback()  # Chiude la transazione di lettura prima dell'invio
+
+        adesso = datetime.now(timezone.utc)
+        try:
+            connessione.invia(msg)
+        except Exception as e:
+            valori = {"ultimo_errore": str(e)[:1000]}
+            if _errore_definitivo(e) or tentativi >= EMAIL_MAX_TENTATIVI:
+                valori["stato"] = StatoEmail.ERRORE.value
+            else:
+                valori["stato"] = StatoEmail.IN_CODA.value
+                valori["prossimo_tentativo_il"] = adesso + _backoff(tentativi)
+            # Dopo una risposta d'errore del server la sessione resta utilizzabile
+            if not isinstance(e, (smtplib.SMTPRecipientsRefused, smtplib.SMTPResponseException)):
+                connessione.chiudi()
+            logger.warning("Invio email %s fallito (tentativo %s): %s", messaggio_id, tentativi, e)
+            concluso = _concludi_invio(db, messaggio_id, tentativi, **valori)
+        else:
+            concluso = _concludi_invio(
+                db, messaggio_id, tentativi,
+                stato=StatoEmail.INVIATA.value, inviata_il=adesso, ultimo_errore=None
+            )
+            if concluso and ordine_id is not None:
+                _segna_ordine_inviato(db, ordine_id, adesso)
+
+        if not concluso:
+            logger.warning("Prenotazione dell'email %s scaduta durante l'invio", messaggio_id)
+        db.commit()
+        elaborati += 1
+
+    return elaborati
+
+
+# === THREAD DI INVIO ===
+
+_thread_invio: Optional[threading.Thread] = None
+_stop_invio = threading.Event()
+_sveglia = threading.Event()
+
+
+def _ciclo_invio() -> None:
+    connessione = ConnessioneSMTP()
+    try:
+        while not _stop_invio.is_set():
+            _sveglia.clear()
+            db = SessionLocal()
+            try:
+                elaborati = elabora_coda(db, connessione)
+            except Exception:
+                logger.exception("Errore nell'elaborazione della coda email")
+                db.rollback()
+                connessione.chiudi()
+                elaborati = 0
+            finally:
+                db.close()
+
+            if elaborati == 0:
+                connessione.chiudi_se_inattiva()
+                _sveglia.wait(EMAIL_INTERVALLO_S)
+    finally:
+        connessione.chiudi()
+
+
+def avvia_invio_email() -> None:
+    """Avvia il thread di invio (idempotente)"""
+    global _thread_invio
+    if _thread_invio is not None and _thread_invio.is_alive():
+        return
+    _stop_invio.clear()
+    _thread_invio = threading.Thread(target=_ciclo_invio, name="invio-email", daemon=True)
+    _thread_invio.start()
+
+
+def ferma_invio_email(timeout: float = 10) -> None:
+    """Ferma il thread di invio dopo il messaggio in corso"""
+    global _thread_invio
+    if _thread_invio is None:
+        return
+    _stop_invio.set()
+    _sveglia.set()
+    _thread_invio.join(timeout)
+    _thread_invio = None
+
 
-    with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
-        server.starttls()
-        server.login(SMTP_USER, SMTP_PASSWORD)
-        server.send_message(msg)
+def sveglia_invio() -> None:
+    """Da chiamare dopo il commit di nuovi messaggi: invio senza attendere il polling"""
+    _sveglia.set()
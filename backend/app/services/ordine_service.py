@@ -0,0 +1,341 @@
+"""
+Service Layer per Ordini
+
+Totali denormalizzati sulla tabella ordini:
+- totale_quintali, totale_importo, mulino_principale_id
+- Sincronizzati in scrittura da crea_ordine / aggiorna_ordine
+- Aggiornamento delle righe per differenza (UPDATE / INSERT / DELETE in blocco)
+- Verifica di coerenza e riparazione (backfill) dalle righe
+- Query della lista ordini (pagina + righe in un'unica IN-query)
+"""
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from fastapi import HTTPException
+from sqlalchemy import Select, delete, func, insert, select, update
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.models.ordine import Ordine, RigaOrdine
+from app.models.cliente import Cliente
+from app.models.prodotto import Prodotto
+from app.models.mulino import Mulino
+from app.models.trasportatore import Trasportatore
+
+
+Totali = Tuple[Decimal, Decimal, Optional[int]]
+
+
+# === CALCOLO TOTALI ===
+
+def _mulino_principale(quintali_per_mulino: Dict[int, Decimal]) -> Optional[int]:
+    """Mulino con più quintali; a parità vince l'id minore"""
+    if not quintali_per_mulino:
+        return None
+    return min(quintali_per_mulino, key=lambda m: (-quintali_per_mulino[m], m))
+
+
+def calcola_totali_righe(righe: Iterable) -> Totali:
+    """
+    Calcola (totale_quintali, totale_importo, mulino_principale_id)
+    da righe in memoria (RigaOrdine o schema con gli stessi campi).
+    """
+    totale_quintali = Decimal("0")
+    totale_importo = Decimal("0")
+    quintali_per_mulino: Dict[int, Decimal] = {}
+
+    for riga in righe:
+        quintali = riga.quintali or Decimal("0")
+        totale_quintali += quintali
+        totale_importo += riga.prezzo_totale or Decimal("0")
+        quintali_per_mulino[riga.mulino_id] = quintali_per_mulino.get(riga.mulino_id, Decimal("0")) + quintali
+
+    return totale_quintali, totale_importo, _mulino_principale(quintali_per_mulino)
+
+
+def aggiorna_totali_ordine(ordine: Ordine, righe: Iterable) -> Ordine:
+    """
+    Aggiorna i totali denormalizzati dell'ordine.
+    Da chiamare ogni volta che le righe dell'ordine vengono riscritte.
+    """
+    (
+        ordine.totale_quintali,
+        ordine.totale_importo,
+        ordine.mulino_principale_id,
+    ) = calcola_totali_righe(righe)
+    return ordine
+
+
+def calcola_totali_da_db(
+    db: Session,
+    ordine_ids: Optional[List[int]] = None
+) -> Dict[int, Totali]:
+    """
+    Totali calcolati dalle righe a DB, con una sola query GROUP BY.
+    Gli ordini senza righe non compaiono nel risultato.
+    """
+    query = db.query(
+        RigaOrdine.ordine_id,
+        RigaOrdine.mulino_id,
+        func.sum(RigaOrdine.quintali).label("quintali"),
+        func.sum(RigaOrdine.prezzo_totale).label("importo")
+    )
+    if ordine_ids is not None:
+        query = query.filter(RigaOrdine.ordine_id.in_(ordine_ids))
+
+    per_ordine: Dict[int, dict] = {}
+    for row in query.group_by(RigaOrdine.ordine_id, RigaOrdine.mulino_id):
+        dati = per_ordine.setdefault(row.ordine_id, {
+            "quintali": Decimal("0"), "importo": Decimal("0"), "mulini": {}
+        })
+        dati["quintali"] += row.quintali or Decimal("0")
+        dati["importo"] += row.importo or Decimal("0")
+        dati["mulini"][row.mulino_id] = row.quintali or Decimal("0")
+
+    return {
+        ordine_id: (d["quintali"], d["importo"], _mulino_principale(d["mulini"]))
+        for ordine_id, d in per_ordine.items()
+    }
+
+
+# === VERIFICA E RIPARAZIONE ===
+
+def trova_totali_incoerenti(
+    db: Session,
+    ordine_ids: Optional[List[int]] = None
+) -> List[dict]:
+    """
+    Confronta i totali salvati con quelli calcolati dalle righe.
+
+    Returns:
+        Lista di dict con ordine_id, salvato e calcolato
+        (tuple quintali, importo, mulino_principale_id)
+    """
+    calcolati = calcola_totali_da_db(db, ordine_ids)
+
+    query = db.query(
+        Ordine.id,
+        Ordine.totale_quintali,
+        Ordine.totale_importo,
+        Ordine.mulino_principale_id
+    )
+    if ordine_ids is not None:
+        query = query.filter(Ordine.id.in_(ordine_ids))
+
+    incoerenti = []
+    vuoto = (Decimal("0"), Decimal("0"), None)
+    for row in query.order_by(Ordine.id):
+        salvato = (
+            row.totale_quintali or Decimal("0"),
+            row.totale_importo or Decimal("0"),
+            row.mulino_principale_id
+        )
+        calcolato = calcolati.get(row.id, vuoto)
+        if salvato != calcolato:
+            incoerenti.append({
+                "ordine_id": row.id,
+                "salvato": salvato,
+                "calcolato": calcolato
+            })
+
+    return incoerenti
+
+
+def ripara_totali_ordini(
+    db: Session,
+    ordine_ids: Optional[List[int]] = None
+) -> int:
+    """
+    Riallinea i totali denormalizzati alle righe (backfill/riparazione).
+    Aggiorna solo gli ordini incoerenti, con un UPDATE bulk per chiave primaria.
+
+    Returns:
+        Numero di ordini corretti
+    """
+    incoerenti = trova_totali_incoerenti(db, ordine_ids)
+    if not incoerenti:
+        return 0
+
+    db.execute(update(Ordine), [
+        {
+            "id": i["ordine_id"],
+            "totale_quintali": i["calcolato"][0],
+            "totale_importo": i["calcolato"][1],
+            "mulino_principale_id": i["calcolato"][2],
+        }
+        for i in incoerenti
+    ])
+    db.flush()
+
+    return len(incoerenti)
+
+
+# === AGGIORNAMENTO RIGHE ===
+
+CAMPI_RIGA = ("prodotto_id", "mulino_id", "pedane", "quintali", "prezzo_quintale", "prezzo_totale")
+
+
+def aggiorna_righe_ordine(db: Session, ordine: Ordine, righe: Iterable) -> List[dict]:
+    """
+    Allinea le righe a DB a quelle ricevute, per differenza:
+    - righe con id: aggiornate solo se cambiate (id e identità conservati)
+    - righe senza id: inserite
+    - righe a DB non più presenti: eliminate
+    Al massimo un UPDATE (per chiave primaria), un INSERT e un DELETE;
+    poi ricalcola i totali denormalizzati dell'ordine.
+
+    Raises:
+        HTTPException 400: id non appartenente all'ordine o ripetuto
+
+    Returns:
+        Valori delle righe inserite o modificate
+    """
+    esistenti = {r.id: r for r in ordine.righe}
+
+    da_aggiornare: List[dict] = []
+    da_inserire: List[dict] = []
+    mantenute = set()
+    for riga in righe:
+        valori = {campo: getattr(riga, campo) for campo in CAMPI_RIGA}
+        if riga.id is None:
+            da_inserire.append({"ordine_id": ordine.id, **valori})
+            continue
+
+        esistente = esistenti.get(riga.id)
+        if esistente is None:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Riga {riga.id} non appartiene all'ordine {ordine.id}"
+            )
+        if riga.id in mantenute:
+            raise HTTPException(status_code=400, detail=f"Riga {riga.id} ripetuta")
+        mantenute.add(riga.id)
+
+        if any(getattr(esistente, campo) != valori[campo] for campo in CAMPI_RIGA):
+            da_aggiornare.append({"id": riga.id, **valori})
+
+    eliminate = [riga_id for riga_id in esistenti if riga_id not in mantenute]
+
+    if da_aggiornare:
+        db.execute(update(RigaOrdine), da_aggiornare)
+        for valori in da_aggiornare:
+            db.expire(esistenti[valori["id"]])
+    if da_inserire:
+        db.execute(insert(RigaOrdine), da_inserire)
+    if eliminate:
+        db.execute(delete(RigaOrdine).where(RigaOrdine.id.in_(eliminate)))
+
+    # Collezione riletta dal database con le righe scritte
+    db.expire(ordine, ["righe"])
+    aggiorna_totali_ordine(ordine, ordine.righe)
+
+    return da_aggiornare + da_inserire
+
+
+# === LISTA ORDINI ===
+
+def query_lista_ordini() -> Select:
+    """
+    Proiezione della lista ordini: campi ordine, nomi cliente/trasportatore
+    e totali denormalizzati. Filtri, ordinamento e paginazione a cura del chiamante.
+    """
+    return (
+        select(
+            Ordine.id,
+            Ordine.cliente_id,
+            Cliente.nome.label("cliente_nome"),
+            Ordine.data_ordine,
+            Ordine.data_ritiro,
+            Ordine.data_incasso_mulino,
+            Ordine.tipo_ordine,
+            Ordine.stato,
+            Ordine.trasportatore_id,
+            Trasportatore.nome.label("trasportatore_nome"),
+            Ordine.carico_id,
+            Ordine.totale_quintali,
+            Ordine.totale_importo,
+        )
+        .join(Cliente, Cliente.id == Ordine.cliente_id)
+        .outerjoin(Trasportatore, Trasportatore.id == Ordine.trasportatore_id)
+    )
+
+
+def query_righe_lista(ordine_ids: List[int]) -> Select:
+    """Righe degli ordini indicati con nomi prodotto e mulino, in un'unica IN-query"""
+    return (
+        select(
+            RigaOrdine.id,
+            RigaOrdine.ordine_id,
+            RigaOrdine.pedane,
+            Prodotto.nome.label("prodotto_nome"),
+            Prodotto.tipologia.label("prodotto_tipologia"),
+            RigaOrdine.mulino_id,
+            Mulino.nome.label("mulino_nome"),
+            RigaOrdine.quintali,
+            RigaOrdine.prezzo_quintale,
+            RigaOrdine.prezzo_totale,
+        )
+        .outerjoin(Prodotto, Prodotto.id == RigaOrdine.prodotto_id)
+        .outerjoin(Mulino, Mulino.id == RigaOrdine.mulino_id)
+        .where(RigaOrdine.ordine_id.in_(ordine_ids))
+        .order_by(RigaOrdine.ordine_id, RigaOrdine.id)
+    )
+
+
+def serializza_lista_ordini(ordini, righe) -> List[dict]:
+    """
+    Compone i dict della lista ordini (schema OrdineList)
+    a partire dalle righe delle due query sopra.
+    """
+    righe_per_ordine: Dict[int, List[dict]] = {}
+    for r in righe:
+        righe_per_ordine.setdefault(r.ordine_id, []).append({
+            "id": r.id,
+            "pedane": r.pedane,
+            "prodotto_nome": r.prodotto_nome,
+            "prodotto_tipologia": r.prodotto_tipologia,
+            "mulino_id": r.mulino_id,
+            "mulino_nome": r.mulino_nome,
+            "quintali": r.quintali,
+            "prezzo_quintale": r.prezzo_quintale,
+            "prezzo_totale": r.prezzo_totale
+        })
+
+    return [
+        {
+            "id": o.id,
+            "cliente_id": o.cliente_id,
+            "cliente_nome": o.cliente_nome,
+            "data_ordine": o.data_ordine,
+            "data_ritiro": o.data_ritiro,
+            "data_incasso_mulino": o.data_incasso_mulino,
+            "tipo_ordine": o.tipo_ordine,
+            "stato": o.stato,
+            "trasportatore_id": o.trasportatore_id,
+            "trasportatore_nome": o.trasportatore_nome,
+            "carico_id": o.carico_id,
+            "totale_quintali": o.totale_quintali or Decimal("0"),
+            "totale_importo": o.totale_importo or Decimal("0"),
+            "righe": righe_per_ordine.get(o.id, [])
+        }
+        for o in ordini
+    ]
+
+
+def carica_lista_ordini(db: Session, ordini: List) -> List[dict]:
+    """
+    Carica le righe di tutta la pagina ordini (già eseguita da query_lista_ordini)
+    con una sola query e compone la lista: 2 statement in tutto.
+    """
+    if not ordini:
+        return []
+    righe = db.execute(query_righe_lista([o.id for o in ordini])).all()
+    return serializza_lista_ordini(ordini, righe)
+
+
+async def carica_lista_ordini_async(db: AsyncSession, ordini: List) -> List[dict]:
+    """Come carica_lista_ordini, su una sessione asincrona"""
+    if not ordini:
+        return []
+    righe = (await db.execute(query_righe_lista([o.id for o in ordini]))).all()
+    return serializza_lista_ordini(ordini, righe)
@@ -0,0 +1,188 @@
+"""
+Paginazione keyset (a cursore) per le liste
+
+- Cursore opaco: base64 url-safe dei valori della chiave dell'ultima riga
+- Pagina successiva con confronto su tupla (es. (data_ordine, id) < cursore),
+  servito dall'indice composto sulla stessa chiave: nessun OFFSET da scorrere
+- Totale approssimato opzionale: stima del planner su PostgreSQL,
+  COUNT esatto sugli altri database (sviluppo)
+- Varianti *_async per le sessioni dell'engine asincrono
+
+Il cursore e il totale viaggiano negli header di risposta
+(X-Next-Cursor, X-Total-Approx), così il corpo delle liste resta invariato.
+"""
+
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, Response
+from sqlalchemy import Select, desc, func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+
+HEADER_CURSORE = "X-Next-Cursor"
+HEADER_TOTALE = "X-Total-Approx"
+
+
+# === CURSORE ===
+
+def _valore_json(valore: Any) -> Any:
+    if isinstance(valore, (date, datetime)):
+        return valore.isoformat()
+    if isinstance(valore, Decimal):
+        return str(valore)
+    return valore
+
+
+def _valore_python(valore: Any, colonna) -> Any:
+    if valore is None:
+        return None
+    tipo = colonna.type.python_type
+    if tipo is datetime:
+        return datetime.fromisoformat(valore)
+    if tipo is date:
+        return date.fromisoformat(valore)
+    if tipo is Decimal:
+        return Decimal(valore)
+    if not isinstance(valore, tipo):
+        raise ValueError(f"Valore {valore!r} non valido per {colonna.key}")
+    return valore
+
+
+def codifica_cursore(valori: Sequence[Any]) -> str:
+    """Valori della chiave -> cursore opaco"""
+    raw = json.dumps([_valore_json(v) for v in valori], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decodifica_cursore(cursore: str, colonne: Sequence) -> Tuple[Any, ...]:
+    """
+    Cursore opaco -> valori della chiave, tipizzati secondo le colonne.
+
+    Raises:
+        HTTPException 400: cursore malformato o non coerente con la lista
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursore + "=" * (-len(cursore) % 4))
+        valori = json.loads(raw)
+        if not isinstance(valori, list) or len(valori) != len(colonne):
+            raise ValueError("Numero di valori non coerente")
+        return tuple(_valore_python(v, c) for v, c in zip(valori, colonne))
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Cursore non valido: {e}")
+
+
+# === KEYSET ===
+
+def applica_keyset(
+    stmt: Select,
+    colonne: Sequence,
+    cursore: Optional[str] = None,
+    discendente: bool = False
+) -> Select:
+    """
+    Ordina stmt sulla chiave (colonne, con la PK per ultima) e,
+    se c'è un cursore, riparte dalla riga successiva.
+    """
+    if cursore:
+        valori = decodifica_cursore(cursore, colonne)
+        chiave = tuple_(*colonne)
+        stmt = stmt.where(chiave < tuple_(*valori) if discendente else chiave > tuple_(*valori))
+
+    ordinamento = [desc(c) for c in colonne] if discendente else list(colonne)
+    return stmt.order_by(*ordinamento)
+
+
+def pagina_keyset(
+    db: Session,
+    stmt: Select,
+    colonne: Sequence,
+    limit: int,
+    scalari: bool = False
+) -> Tuple[List, Optional[str]]:
+    """
+    Esegue stmt (già passato da applica_keyset) leggendo una riga in più
+    per sapere se esiste una pagina successiva.
+
+    Args:
+        scalari: True per select(Entità), restituisce le entità ORM
+
+    Returns:
+        (righe della pagina, cursore della pagina successiva o None)
+    """
+    stmt = stmt.limit(limit + 1)
+    righe = db.scalars(stmt).all() if scalari else db.execute(stmt).all()
+    return taglia_pagina(righe, colonne, limit)
+
+
+async def pagina_keyset_async(
+    db: AsyncSession,
+    stmt: Select,
+    colonne: Sequence,
+    limit: int,
+    scalari: bool = False
+) -> Tuple[List, Optional[str]]:
+    """Come pagina_keyset, su una sessione asincrona"""
+    stmt = stmt.limit(limit + 1)
+    righe = (await db.scalars(stmt)).all() if scalari else (await db.execute(stmt)).all()
+    return taglia_pagina(righe, colonne, limit)
+
+
+def taglia_pagina(righe: Sequence, colonne: Sequence, limit: int) -> Tuple[List, Optional[str]]:
+    """Righe lette con limit + 1 -> (pagina, cursore successivo o None)"""
+    if len(righe) <= limit:
+        return list(righe), None
+
+    righe = list(righe[:limit])
+    return righe, codifica_cursore([getattr(righe[-1], c.key) for c in colonne])
+
+
+# === TOTALE APPROSSIMATO ===
+
+def conta_approssimata(db: Session, stmt: Select) -> int:
+    """
+    Numero di righe di stmt (senza paginazione).
+
+    Su PostgreSQL usa la stima del planner (EXPLAIN, nessuna scansione):
+    precisa quanto le statistiche di ANALYZE. Altrove COUNT esatto.
+    """
+    base = stmt.order_by(None).limit(None).offset(None)
+
+    if db.get_bind().dialect.name == "postgresql":
+        compilato = base.compile(
+            dialect=db.get_bind().dialect,
+            compile_kwargs={"render_postcompile": True}
+        )
+        parametri = compilato.params
+        if compilato.positiontup is not None:
+            # Driver con parametri posizionali (es. asyncpg: $1, $2...)
+            parametri = tuple(parametri[nome] for nome in compilato.positiontup)
+        piano = db.connection().exec_driver_sql(
+            f"EXPLAIN (FORMAT JSON) {compilato}", parametri
+        ).scalar()
+        if isinstance(piano, str):
+            piano = json.loads(piano)
+        return int(piano[0]["Plan"]["Plan Rows"])
+
+    return db.execute(select(func.count()).select_from(base.subquery())).scalar_one()
+
+
+async def conta_approssimata_async(db: AsyncSession, stmt: Select) -> int:
+    """Come conta_approssimata, su una sessione asincrona"""
+    return await db.run_sync(conta_approssimata, stmt)
+
+
+def imposta_header_pagina(
+    response: Response,
+    cursore_successivo: Optional[str],
+    totale: Optional[int] = None
+) -> None:
+    """Scrive negli header di risposta cursore successivo e totale approssimato"""
+    if cursore_successivo:
+        response.headers[HEADER_CURSORE] = cursore_successivo
+    if totale is not None:
+        response.headers[HEADER_TOTALE] = str(totale)
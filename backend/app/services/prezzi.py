@@ -0,0 +1,274 @@
+"""
+Storico prezzi e ultimo prezzo per cliente/prodotto
+
+- registra_prezzi: i prezzi delle righe di un ordine in un solo INSERT,
+  scartando quelli uguali all'ultimo prezzo della coppia (lo storico
+  registra solo i cambi di prezzo), poi l'upsert dell'ultimo prezzo per
+  tutti i prezzi dell'ordine: registrato_il è la data dell'ultimo ordine
+  anche quando il prezzo non cambia
+- aggiorna_ultimi_prezzi: upsert (INSERT ... ON CONFLICT) di ultimo_prezzo,
+  un solo statement per più prodotti dello stesso cliente
+- Letture per chiave primaria su ultimo_prezzo: il suggerimento del prezzo
+  non dipende da quanto è cresciuto lo storico
+- Manutenzione: compattazione delle ripetizioni già presenti, retenzione
+  per età e per numero di righe della coppia, ricostruzione di ultimo_prezzo
+"""
+
+import os
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import Select, and_, case, delete, func, insert, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from app.models.mulino import Mulino
+from app.models.ordine import Ordine, RigaOrdine
+from app.models.prodotto import Prodotto
+from app.models.storico_prezzo import StoricoPrezzo
+from app.models.ultimo_prezzo import UltimoPrezzo
+
+
+# Retenzione dello storico (0 = nessun limite); l'ultima riga di ogni coppia resta sempre
+STORICO_PREZZI_GIORNI = int(os.getenv("STORICO_PREZZI_GIORNI", "730"))
+STORICO_PREZZI_MAX_PER_COPPIA = int(os.getenv("STORICO_PREZZI_MAX_PER_COPPIA", "50"))
+
+_INSERT_UPSERT = {
+    "postgresql": postgresql.insert,
+    "sqlite": sqlite.insert,
+}
+
+
+# === SCRITTURA ===
+
+def registra_prezzi(
+    db: Session,
+    cliente_id: int,
+    prezzi: Iterable[Tuple[int, Decimal]]
+) -> int:
+    """
+    Registra nello storico i (prodotto_id, prezzo) delle righe di un ordine,
+    con un solo INSERT. Un prezzo uguale all'ultimo della coppia (a DB o
+    appena registrato nello stesso ordine) non viene ripetuto nello storico,
+    ma aggiorna comunque la data di ultimo_prezzo.
+
+    Returns:
+        Numero di righe di storico inserite
+    """
+    prezzi = list(prezzi)
+    if not prezzi:
+        return 0
+
+    correnti = dict(db.execute(
+        select(UltimoPrezzo.prodotto_id, UltimoPrezzo.prezzo).where(
+            UltimoPrezzo.cliente_id == cliente_id,
+            UltimoPrezzo.prodotto_id.in_({prodotto_id for prodotto_id, _ in prezzi})
+        )
+    ).all())
+
+    nuovi: List[Tuple[int, Decimal]] = []
+    for prodotto_id, prezzo in prezzi:
+        if correnti.get(prodotto_id) == prezzo:
+            continue
+        correnti[prodotto_id] = prezzo
+        nuovi.append((prodotto_id, prezzo))
+
+    if nuovi:
+        db.execute(insert(StoricoPrezzo), [
+            {"cliente_id": cliente_id, "prodotto_id": prodotto_id, "prezzo": prezzo}
+            for prodotto_id, prezzo in nuovi
+        ])
+    aggiorna_ultimi_prezzi(db, cliente_id, prezzi, Counter(prodotto_id for prodotto_id, _ in nuovi))
+    return len(nuovi)
+
+
+def aggiorna_ultimi_prezzi(
+    db: Session,
+    cliente_id: int,
+    prezzi: Iterable[Tuple[int, Decimal]],
+    righe_storico: Optional[Dict[int, int]] = None
+) -> None:
+    """
+    Upsert di ultimo_prezzo per i (prodotto_id, prezzo) indicati, nell'ordine
+    di registrazione: per un prodotto ripetuto vale l'ultimo prezzo e
+    registrato_il diventa l'ora corrente. num_registrazioni cresce delle
+    righe di storico appena inserite per il prodotto (`righe_storico`;
+    se omesso, una per occorrenza).
+    """
+    prezzi = list(prezzi)
+    if righe_storico is None:
+        righe_storico = Counter(prodotto_id for prodotto_id, _ in prezzi)
+    per_prodotto: Dict[int, Tuple[Decimal, int]] = {
+        prodotto_id: (prezzo, righe_storico.get(prodotto_id, 0))
+        for prodotto_id, prezzo in prezzi
+    }
+    if not per_prodotto:
+        return
+
+    stmt = _INSERT_UPSERT[db.get_bind().dialect.name](UltimoPrezzo).values([
+        {
+            "cliente_id": cliente_id,
+            "prodotto_id": prodotto_id,
+            "prezzo": prezzo,
+            "registrato_il": func.now(),
+            "num_registrazioni": registrazioni,
+        }
+        for prodotto_id, (prezzo, registrazioni) in per_prodotto.items()
+    ])
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[UltimoPrezzo.cliente_id, UltimoPrezzo.prodotto_id],
+        set_={
+            "prezzo": stmt.excluded.prezzo,
+            "registrato_il": stmt.excluded.registrato_il,
+            "num_registrazioni": UltimoPrezzo.num_registrazioni + stmt.excluded.num_registrazioni,
+        }
+    ))
+
+
+def ricostruisci_ultimi_prezzi(db: Session) -> int:
+    """
+    Ricalcola da zero ultimo_prezzo dallo storico (ultima riga per data,
+    a parità di data la più recente per id). registrato_il è la data più
+    recente tra quella riga e gli ordini del cliente con il prodotto: gli
+    ordini allo stesso prezzo non lasciano righe nello storico.
+
+    Returns:
+        Numero di coppie cliente/prodotto scritte
+    """
+    coppia = (StoricoPrezzo.cliente_id, StoricoPrezzo.prodotto_id)
+    classificati = select(
+        StoricoPrezzo.cliente_id,
+        StoricoPrezzo.prodotto_id,
+        StoricoPrezzo.prezzo,
+        func.coalesce(StoricoPrezzo.creato_il, func.now()).label("registrato_il"),
+        func.count().over(partition_by=coppia).label("num_registrazioni"),
+        func.row_number().over(
+            partition_by=coppia,
+            order_by=(StoricoPrezzo.creato_il.desc(), StoricoPrezzo.id.desc())
+        ).label("posizione")
+    ).subquery()
+
+    ordini = (
+        select(
+            Ordine.cliente_id,
+            RigaOrdine.prodotto_id,
+            func.max(Ordine.creato_il).label("ultimo_ordine")
+        )
+        .join(RigaOrdine, RigaOrdine.ordine_id == Ordine.id)
+        .group_by(Ordine.cliente_id, RigaOrdine.prodotto_id)
+        .subquery()
+    )
+    registrato_il = case(
+        (ordini.c.ultimo_ordine > classificati.c.registrato_il, ordini.c.ultimo_ordine),
+        else_=classificati.c.registrato_il
+    )
+
+    db.execute(delete(UltimoPrezzo))
+    scritte = db.execute(insert(UltimoPrezzo).from_select(
+        ["cliente_id", "prodotto_id", "prezzo", "registrato_il", "num_registrazioni"],
+        select(
+            classificati.c.cliente_id,
+            classificati.c.prodotto_id,
+            classificati.c.prezzo,
+            registrato_il,
+            classificati.c.num_registrazioni
+        )
+        .outerjoin(ordini, and_(
+            ordini.c.cliente_id == classificati.c.cliente_id,
+            ordini.c.prodotto_id == classificati.c.prodotto_id
+        ))
+        .where(classificati.c.posizione == 1)
+    )).rowcount
+
+    db.flush()
+    return scritte
+
+
+# === MANUTENZIONE ===
+
+def compatta_storico(db: Session) -> int:
+    """
+    Elimina le ripetizioni dello storico: di ogni serie di righe consecutive
+    con lo stesso prezzo per una coppia resta la prima (quando il prezzo
+    è entrato in vigore).
+
+    Returns:
+        Numero di righe eliminate
+    """
+    coppia = (StoricoPrezzo.cliente_id, StoricoPrezzo.prodotto_id)
+    con_precedente = select(
+        StoricoPrezzo.id,
+        StoricoPrezzo.prezzo,
+        func.lag(StoricoPrezzo.prezzo).over(
+            partition_by=coppia,
+            order_by=(StoricoPrezzo.creato_il, StoricoPrezzo.id)
+        ).label("precedente")
+    ).subquery()
+
+    return db.execute(delete(StoricoPrezzo).where(StoricoPrezzo.id.in_(
+        select(con_precedente.c.id).where(con_precedente.c.prezzo == con_precedente.c.precedente)
+    ))).rowcount
+
+
+def applica_retenzione(
+    db: Session,
+    giorni: int = STORICO_PREZZI_GIORNI,
+    max_per_coppia: int = STORICO_PREZZI_MAX_PER_COPPIA
+) -> int:
+    """
+    Elimina le righe di storico più vecchie di `giorni` e quelle oltre le
+    `max_per_coppia` più recenti di ogni coppia (0 = limite disattivato).
+    L'ultima riga di ogni coppia non viene mai eliminata.
+
+    Returns:
+        Numero di righe eliminate
+    """
+    condizioni = []
+    classificati = select(
+        StoricoPrezzo.id,
+        StoricoPrezzo.creato_il,
+        func.row_number().over(
+            partition_by=(StoricoPrezzo.cliente_id, StoricoPrezzo.prodotto_id),
+            order_by=(StoricoPrezzo.creato_il.desc(), StoricoPrezzo.id.desc())
+        ).label("posizione")
+    ).subquery()
+
+    if giorni > 0:
+        limite = datetime.now(timezone.utc) - timedelta(days=giorni)
+        condizioni.append(classificati.c.creato_il < limite)
+    if max_per_coppia > 0:
+        condizioni.append(classificati.c.posizione > max_per_coppia)
+    if not condizioni:
+        return 0
+
+    return db.execute(delete(StoricoPrezzo).where(StoricoPrezzo.id.in_(
+        select(classificati.c.id).where(classificati.c.posizione > 1, or_(*condizioni))
+    ))).rowcount
+
+
+# === LETTURA ===
+
+def ultimo_prezzo(db: Session, cliente_id: int, prodotto_id: int) -> Optional[UltimoPrezzo]:
+    """Ultimo prezzo della coppia cliente/prodotto (lettura per chiave primaria)"""
+    return db.get(UltimoPrezzo, (cliente_id, prodotto_id))
+
+
+def query_prezzi_cliente(cliente_id: int) -> Select:
+    """Ultimi prezzi di ogni prodotto ordinato dal cliente, con prodotto e mulino"""
+    return (
+        select(
+            UltimoPrezzo.cliente_id,
+            UltimoPrezzo.prodotto_id,
+            Prodotto.nome.label("prodotto_nome"),
+            Prodotto.mulino_id,
+            Mulino.nome.label("mulino_nome"),
+            UltimoPrezzo.prezzo.label("ultimo_prezzo"),
+            UltimoPrezzo.registrato_il.label("data_ultimo_ordine")
+        )
+        .join(Prodotto, UltimoPrezzo.prodotto_id == Prodotto.id)
+        .join(Mulino, Prodotto.mulino_id == Mulino.id)
+        .where(UltimoPrezzo.cliente_id == cliente_id)
+        .order_by(Mulino.nome, Prodotto.nome)
+    )
@@ -1,5 +1,70 @@
-def calcola_provvigione(prodotto, quintali, prezzo_q):
+"""
+Calcolo provvigioni
+
+- calcola_provvigione: formula di riferimento in Python, riga per riga
+- espressione_provvigione: la stessa formula come CASE SQL su tipo_provvigione,
+  per aggregare le provvigioni direttamente nel database
+- Query aggregate del trimestre per mulino e per ordine (una query ciascuna);
+  gli importi sono esatti in SQL e arrotondati ai centesimi nelle risposte
+- Rollup (anno, trimestre, mulino) aggiornato in modo incrementale:
+  le scritture su ordini/prodotti ricalcolano solo le chiavi toccate
+"""
+
+from datetime import date
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import Numeric, Select, case, cast, delete, func, insert, literal, select, text
+from sqlalchemy.orm import Session
+
+from app.models.cliente import Cliente
+from app.models.mulino import Mulino
+from app.models.ordine import Ordine, RigaOrdine
+from app.models.prodotto import Prodotto
+from app.models.provvigione_rollup import ProvvigioneRollup
+
+
+# Scala sufficiente a rappresentare esattamente quintali * prezzo * valore / 100
+# con i tre fattori a 2 decimali (vedi colonne Numeric(10, 2))
+TIPO_PROVVIGIONE = Numeric(24, 8)
+# Scala degli importi restituiti dalle API (centesimi, come prezzo_totale)
+CENTESIMI = Decimal("0.01")
+
+
+ChiaveRollup = Tuple[int, int, int]  # (anno, trimestre, mulino_id)
+
+# Advisory lock PostgreSQL per chiave del rollup, nella forma a due interi:
+# (anno * 10 + trimestre, mulino_id)
+_SQL_BLOCCA_CHIAVE = text("SELECT pg_advisory_xact_lock(:trimestre, :mulino_id)")
+
+
+def get_trimestre_date(anno: int, trimestre: int):
+    """Restituisce data inizio e fine del trimestre"""
+    mese_inizio = (trimestre - 1) * 3 + 1
+    data_inizio = date(anno, mese_inizio, 1)
     
+    if trimestre == 4:
+        data_fine = date(anno, 12, 31)
+    else:
+        mese_fine = trimestre * 3
+        if mese_fine in [1, 3, 5, 7, 8, 10, 12]:
+            giorno_fine = 31
+        elif mese_fine in [4, 6, 9, 11]:
+            giorno_fine = 30
+        else:
+            giorno_fine = 28 if anno % 4 != 0 else 29
+        data_fine = date(anno, mese_fine, giorno_fine)
+    
+    return data_inizio, data_fine
+
+
+def trimestre_di(data: date) -> Tuple[int, int]:
+    """(anno, trimestre) a cui appartiene una data"""
+    return data.year, (data.month - 1) // 3 + 1
+
+
+def calcola_provvigione(prodotto, quintali, prezzo_q):
+
     if prodotto.tipo_provvigione == "percentuale":
         return quintali * prezzo_q * (prodotto.valore_provvigione / 100)
 
@@ -7,3 +72,307 @@ def calcola_provvigione(prodotto, quintali, prezzo_q):
         return quintali * prodotto.valore_provvigione
 
     return 0
+
+
+def arrotonda_provvigione(valore) -> Decimal:
+    """Provvigione esatta (scala 8) -> importo in centesimi per le risposte"""
+    return Decimal(valore or 0).quantize(CENTESIMI, rounding=ROUND_HALF_UP)
+
+
+# === ESPRESSIONE SQL ===
+
+def espressione_provvigione():
+    """
+    Provvigione di una riga ordine come espressione SQL (richiede join su Prodotto).
+    Equivalente a calcola_provvigione: percentuale sull'importo, fisso per quintale.
+    """
+    valore = func.coalesce(Prodotto.valore_provvigione, 0)
+    return cast(
+        case(
+            (
+                Prodotto.tipo_provvigione == "percentuale",
+                RigaOrdine.quintali * RigaOrdine.prezzo_quintale * valore / literal(100, Numeric(10, 0))
+            ),
+            (Prodotto.tipo_provvigione == "fisso", RigaOrdine.quintali * valore),
+            else_=literal(0, Numeric(10, 0))
+        ),
+        TIPO_PROVVIGIONE
+    )
+
+
+def _filtro_trimestre(stmt: Select, data_inizio: date, data_fine: date) -> Select:
+    return stmt.where(
+        Ordine.data_incasso_mulino >= data_inizio,
+        Ordine.data_incasso_mulino <= data_fine
+    )
+
+
+# === QUERY AGGREGATE ===
+
+def query_provvigioni_per_mulino(data_inizio: date, data_fine: date) -> Select:
+    """
+    Totali del periodo per mulino (incasso mulino nel periodo), in una sola query.
+    Le righe senza prodotto o mulino sono escluse.
+    """
+    stmt = (
+        select(
+            Mulino.id.label("mulino_id"),
+            Mulino.nome.label("mulino_nome"),
+            func.sum(RigaOrdine.quintali).label("totale_quintali"),
+            func.sum(RigaOrdine.prezzo_totale).label("totale_incassato"),
+            func.sum(espressione_provvigione()).label("totale_provvigione"),
+            func.count(func.distinct(RigaOrdine.ordine_id)).label("num_ordini"),
+        )
+        .select_from(RigaOrdine)
+        .join(Ordine, Ordine.id == RigaOrdine.ordine_id)
+        .join(Prodotto, Prodotto.id == RigaOrdine.prodotto_id)
+        .join(Mulino, Mulino.id == RigaOrdine.mulino_id)
+        .group_by(Mulino.id, Mulino.nome)
+    )
+    return _filtro_trimestre(stmt, data_inizio, data_fine)
+
+
+def query_provvigioni_per_ordine(
+    data_inizio: date,
+    data_fine: date,
+    mulino_id: Optional[int] = None
+) -> Select:
+    """
+    Ordini del periodo con totali e provvigione aggregati per ordine.
+    Con mulino_id: solo gli ordini con righe di quel mulino, totali sulle sole sue righe.
+    """
+    totali = (
+        select(
+            RigaOrdine.ordine_id,
+            func.sum(RigaOrdine.quintali).label("totale_quintali"),
+            func.sum(RigaOrdine.prezzo_totale).label("totale_importo"),
+            func.sum(espressione_provvigione()).label("totale_provvigione"),
+        )
+        .join(Prodotto, Prodotto.id == RigaOrdine.prodotto_id)
+        .group_by(RigaOrdine.ordine_id)
+    )
+    if mulino_id:
+        totali = totali.where(RigaOrdine.mulino_id == mulino_id)
+    totali = totali.subquery()
+
+    stmt = (
+        select(
+            Ordine.id,
+            Cliente.nome.label("cliente_nome"),
+            Ordine.data_ordine,
+            Ordine.data_ritiro,
+            Ordine.data_incasso_mulino,
+            Ordine.tipo_ordine,
+            func.coalesce(totali.c.totale_quintali, 0).label("totale_quintali"),
+            func.coalesce(totali.c.totale_importo, 0).label("totale_importo"),
+            func.coalesce(totali.c.totale_provvigione, 0).label("totale_provvigione"),
+        )
+        .outerjoin(Cliente, Cliente.id == Ordine.cliente_id)
+        .outerjoin(totali, totali.c.ordine_id == Ordine.id)
+        .order_by(Ordine.data_ordine.desc(), Ordine.id)
+    )
+    if mulino_id:
+        stmt = stmt.where(Ordine.righe.any(RigaOrdine.mulino_id == mulino_id))
+    return _filtro_trimestre(stmt, data_inizio, data_fine)
+
+
+def query_righe_provvigione(
+    data_inizio: date,
+    data_fine: date,
+    mulino_id: Optional[int] = None
+) -> Select:
+    """Righe degli ordini del periodo con prodotto, mulino e provvigione calcolata"""
+    stmt = (
+        select(
+            RigaOrdine.id,
+            RigaOrdine.ordine_id,
+            RigaOrdine.pedane,
+            Prodotto.nome.label("prodotto_nome"),
+            Prodotto.tipologia.label("prodotto_tipologia"),
+            RigaOrdine.mulino_id,
+            Mulino.nome.label("mulino_nome"),
+            RigaOrdine.quintali,
+            RigaOrdine.prezzo_quintale,
+            RigaOrdine.prezzo_totale,
+            Prodotto.tipo_provvigione,
+            Prodotto.valore_provvigione,
+            espressione_provvigione().label("provvigione_calcolata"),
+        )
+        .join(Ordine, Ordine.id == RigaOrdine.ordine_id)
+        .join(Prodotto, Prodotto.id == RigaOrdine.prodotto_id)
+        .outerjoin(Mulino, Mulino.id == RigaOrdine.mulino_id)
+        .order_by(RigaOrdine.ordine_id, RigaOrdine.id)
+    )
+    if mulino_id:
+        stmt = stmt.where(RigaOrdine.mulino_id == mulino_id)
+    return _filtro_trimestre(stmt, data_inizio, data_fine)
+
+
+def query_dettaglio_mulino(data_inizio: date, data_fine: date, mulino_id: int) -> Select:
+    """Righe del mulino nel periodo con provvigione, cliente e date dell'ordine"""
+    return (
+        query_righe_provvigione(data_inizio, data_fine, mulino_id)
+        .add_columns(
+            Cliente.nome.label("cliente_nome"),
+            Ordine.data_ordine,
+            Ordine.data_incasso_mulino,
+        )
+        .outerjoin(Cliente, Cliente.id == Ordine.cliente_id)
+    )
+
+
+# === ROLLUP TRIMESTRALE ===
+
+def query_rollup_trimestre(anno: int, trimestre: int) -> Select:
+    """Totali pre-aggregati del trimestre (lettura per chiave primaria)"""
+    return (
+        select(
+            ProvvigioneRollup.mulino_id,
+            Mulino.nome.label("mulino_nome"),
+            ProvvigioneRollup.totale_quintali,
+            ProvvigioneRollup.totale_incassato,
+            ProvvigioneRollup.totale_provvigione,
+            ProvvigioneRollup.num_ordini,
+        )
+        .join(Mulino, Mulino.id == ProvvigioneRollup.mulino_id)
+        .where(
+            ProvvigioneRollup.anno == anno,
+            ProvvigioneRollup.trimestre == trimestre
+        )
+    )
+
+
+def _chiavi_da_righe(righe) -> Set[ChiaveRollup]:
+    return {
+        (*trimestre_di(r.data_incasso_mulino), r.mulino_id)
+        for r in righe
+        if r.data_incasso_mulino is not None
+    }
+
+
+def chiavi_rollup_ordini(db: Session, ordine_ids: List[int]) -> Set[ChiaveRollup]:
+    """
+    Chiavi del rollup a cui contribuiscono gli ordini, secondo lo stato a DB.
+    Da leggere PRIMA di modificare righe o data incasso (chiavi da svuotare).
+    """
+    righe = db.execute(
+        select(Ordine.data_incasso_mulino, RigaOrdine.mulino_id)
+        .join(RigaOrdine, RigaOrdine.ordine_id == Ordine.id)
+        .where(Ordine.id.in_(ordine_ids))
+        .distinct()
+    )
+    return _chiavi_da_righe(righe)
+
+
+def chiavi_rollup_prodotto(db: Session, prodotto_id: int) -> Set[ChiaveRollup]:
+    """Chiavi del rollup che contengono righe del prodotto (cambio provvigione)"""
+    righe = db.execute(
+        select(Ordine.data_incasso_mulino, RigaOrdine.mulino_id)
+        .join(RigaOrdine, RigaOrdine.ordine_id == Ordine.id)
+        .where(RigaOrdine.prodotto_id == prodotto_id)
+        .distinct()
+    )
+    return _chiavi_da_righe(righe)
+
+
+def blocca_chiavi_rollup(db: Session, chiavi: Iterable[ChiaveRollup]) -> None:
+    """
+    Serializza gli aggiornamenti concorrenti delle stesse chiavi (PostgreSQL):
+    advisory lock fino alla fine della transazione, presi in ordine per non
+    andare in deadlock. Chi attende ricalcola dopo il commit dell'altro e
+    vede le sue righe. SQLite serializza già le scritture.
+    """
+    if db.connection().dialect.name != "postgresql":
+        return
+    for anno, trimestre, mulino_id in sorted(chiavi):
+        db.execute(_SQL_BLOCCA_CHIAVE, {"trimestre": anno * 10 + trimestre, "mulino_id": mulino_id})
+
+
+def aggiorna_rollup(db: Session, chiavi: Iterable[ChiaveRollup]) -> None:
+    """
+    Ricalcola dalle righe solo le chiavi indicate:
+    una query aggregata per trimestre toccato, ristretta ai mulini toccati.
+
+    Le chiavi sono bloccate prima del ricalcolo: due transazioni sulla stessa
+    chiave non possono leggere totali diversi e inserire la stessa riga.
+    """
+    chiavi = set(chiavi)
+    per_trimestre: Dict[Tuple[int, int], Set[int]] = {}
+    for anno, trimestre, mulino_id in chiavi:
+        per_trimestre.setdefault((anno, trimestre), set()).add(mulino_id)
+    if not per_trimestre:
+        return
+
+    db.flush()
+    blocca_chiavi_rollup(db, chiavi)
+    for (anno, trimestre), mulini in per_trimestre.items():
+        data_inizio, data_fine = get_trimestre_date(anno, trimestre)
+        totali = db.execute(
+            query_provvigioni_per_mulino(data_inizio, data_fine)
+            .where(RigaOrdine.mulino_id.in_(mulini))
+        ).all()
+
+        db.execute(delete(ProvvigioneRollup).where(
+            ProvvigioneRollup.anno == anno,
+            ProvvigioneRollup.trimestre == trimestre,
+            ProvvigioneRollup.mulino_id.in_(mulini)
+        ))
+        _inserisci_rollup(db, anno, trimestre, totali)
+
+
+def aggiorna_rollup_ordini(
+    db: Session,
+    ordine_ids: List[int],
+    chiavi_precedenti: Iterable[ChiaveRollup] = ()
+) -> None:
+    """
+    Aggiorna il rollup dopo la scrittura di ordini: ricalcola le chiavi
+    precedenti (da chiavi_rollup_ordini) e quelle nuove.
+    """
+    db.flush()
+    chiavi = set(chiavi_precedenti) | chiavi_rollup_ordini(db, ordine_ids)
+    aggiorna_rollup(db, chiavi)
+
+
+def ricostruisci_rollup(db: Session) -> int:
+    """
+    Ricostruisce da zero tutto il rollup dalle righe ordine.
+
+    Returns:
+        Numero di chiavi (anno, trimestre, mulino) scritte
+    """
+    db.execute(delete(ProvvigioneRollup))
+
+    date_incasso = db.execute(
+        select(Ordine.data_incasso_mulino)
+        .where(Ordine.data_incasso_mulino.is_not(None))
+        .distinct()
+    ).scalars()
+    trimestri = sorted({trimestre_di(d) for d in date_incasso})
+
+    scritte = 0
+    for anno, trimestre in trimestri:
+        data_inizio, data_fine = get_trimestre_date(anno, trimestre)
+        totali = db.execute(query_provvigioni_per_mulino(data_inizio, data_fine)).all()
+        scritte += _inserisci_rollup(db, anno, trimestre, totali)
+
+    db.flush()
+    return scritte
+
+
+def _inserisci_rollup(db: Session, anno: int, trimestre: int, totali) -> int:
+    if not totali:
+        return 0
+    db.execute(insert(ProvvigioneRollup), [
+        {
+            "anno": anno,
+            "trimestre": trimestre,
+            "mulino_id": t.mulino_id,
+            "totale_quintali": t.totale_quintali,
+            "totale_incassato": t.totale_incassato,
+            "totale_provvigione": t.totale_provvigione,
+            "num_ordini": t.num_ordini,
+        }
+        for t in totali
+    ])
+    return len(totali)
@@ -0,0 +1,204 @@
+"""
+Ricerca per nome su clienti, prodotti, mulini e trasportatori
+
+- Testo normalizzato (minuscolo, senza accenti) con normalizza_ricerca:
+  funzione SQL IMMUTABLE su PostgreSQL (migrazione 0012), stessa
+  trasformazione in Python per SQLite
+- PostgreSQL: indici GIN pg_trgm su normalizza_ricerca(colonna); sottostringa
+  (LIKE) e somiglianza tra parole (operatore <%) usano entrambi l'indice,
+  così la ricerca tollera errori di battitura senza scansioni sequenziali
+- SQLite (sviluppo e prove): normalizza_ricerca e word_similarity registrate
+  sulla connessione come funzioni Python, con trigrammi calcolati come pg_trgm
+- Ordinamento: prima chi contiene il testo, poi per somiglianza, poi per nome
+- Le liste (parametro search) filtrano solo per sottostringa, come prima
+  ma senza distinzione di accenti; la tolleranza agli errori di battitura
+  è della ricerca unificata (/api/search)
+"""
+
+import os
+import re
+from enum import Enum
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from sqlalchemy import ColumnElement, Select, case, func, literal, or_, select, text
+from sqlalchemy.orm import Session
+
+from app.models.cliente import Cliente
+from app.models.mulino import Mulino
+from app.models.prodotto import Prodotto
+from app.models.trasportatore import Trasportatore
+
+
+# Somiglianza minima tra il testo cercato e una parte del nome (0-1)
+RICERCA_SOGLIA = float(os.getenv("RICERCA_SOGLIA", "0.5"))
+
+# Stesse coppie di caratteri della funzione SQL normalizza_ricerca (migrazione 0012)
+CARATTERI_ACCENTATI = "àáâäãåèéêëìíîïòóôöõùúûüýÿçñÀÁÂÄÃÅÈÉÊËÌÍÎÏÒÓÔÖÕÙÚÛÜÝÇÑ"
+CARATTERI_SEMPLICI = "aaaaaaeeeeiiiiooooouuuuyycnaaaaaaeeeeiiiiooooouuuuycn"
+
+_SENZA_ACCENTI = str.maketrans(CARATTERI_ACCENTATI, CARATTERI_SEMPLICI)
+_PAROLA = re.compile(r"[^\W_]+")
+
+
+class EntitaRicerca(str, Enum):
+    """Entità interrogate dalla ricerca unificata"""
+    CLIENTI = "clienti"
+    PRODOTTI = "prodotti"
+    MULINI = "mulini"
+    TRASPORTATORI = "trasportatori"
+
+
+# === TRIGRAMMI (Python) ===
+
+def normalizza(testo: Optional[str]) -> Optional[str]:
+    """Minuscolo e senza accenti, come normalizza_ricerca in SQL"""
+    if testo is None:
+        return None
+    return testo.lower().translate(_SENZA_ACCENTI)
+
+
+def _trigrammi_parole(testo: str) -> List[str]:
+    """Trigrammi in ordine, parola per parola, con il padding di pg_trgm"""
+    trigrammi = []
+    for parola in _PAROLA.findall(testo):
+        parola = f"  {parola} "
+        trigrammi.extend(parola[i:i + 3] for i in range(len(parola) - 2))
+    return trigrammi
+
+
+def similarita_parola(cercato: Optional[str], testo: Optional[str]) -> float:
+    """
+    Somiglianza tra i trigrammi di `cercato` e il tratto contiguo di `testo`
+    che gli somiglia di più (come word_similarity di pg_trgm).
+    """
+    if not cercato or not testo:
+        return 0.0
+    trigrammi_cercato = set(_trigrammi_parole(normalizza(cercato)))
+    if not trigrammi_cercato:
+        return 0.0
+
+    trigrammi_testo = _trigrammi_parole(normalizza(testo))
+    migliore = 0.0
+    for inizio in range(len(trigrammi_testo)):
+        tratto = set()
+        for trigramma in trigrammi_testo[inizio:]:
+            tratto.add(trigramma)
+            comuni = len(trigrammi_cercato & tratto)
+            migliore = max(migliore, comuni / len(trigrammi_cercato | tratto))
+    return migliore
+
+
+# === ESPRESSIONI SQL ===
+
+def _prepara_connessione(db: Session) -> str:
+    """
+    Funzioni e soglia sulla connessione della sessione; restituisce il dialetto.
+    SQLite: registra le funzioni Python. PostgreSQL: soglia di <% per la transazione.
+    """
+    connessione = db.connection()
+    dialetto = connessione.dialect.name
+    if dialetto == "sqlite":
+        dbapi = connessione.connection.dbapi_connection
+        dbapi.create_function("normalizza_ricerca", 1, normalizza, deterministic=True)
+        dbapi.create_function("word_similarity", 2, similarita_parola, deterministic=True)
+    elif dialetto == "postgresql":
+        connessione.execute(
+            text("SELECT set_config('pg_trgm.word_similarity_threshold', :soglia, true)"),
+            {"soglia": str(RICERCA_SOGLIA)}
+        )
+    return dialetto
+
+
+def _pattern_contiene(cercato: str) -> str:
+    return "%" + re.sub(r"([\\%_])", r"\\\1", cercato) + "%"
+
+
+def filtro_ricerca(db: Session, colonne: Sequence, testo: str, simili: bool = True) -> ColumnElement:
+    """
+    Condizione WHERE: una delle colonne contiene il testo o, con simili,
+    gli somiglia (testo e colonne normalizzati). Su PostgreSQL servita
+    dagli indici trigrammi.
+    """
+    dialetto = _prepara_connessione(db)
+    cercato = normalizza(testo.strip())
+    pattern = _pattern_contiene(cercato)
+
+    condizioni = []
+    for colonna in colonne:
+        normalizzata = func.normalizza_ricerca(colonna)
+        condizioni.append(normalizzata.like(pattern, escape="\\"))
+        if not simili:
+            continue
+        if dialetto == "postgresql":
+            condizioni.append(literal(cercato).op("<%")(normalizzata))
+        else:
+            condizioni.append(func.word_similarity(cercato, normalizzata) >= RICERCA_SOGLIA)
+    return or_(*condizioni)
+
+
+def _ordinamento(colonne: Sequence, testo: str) -> List[ColumnElement]:
+    """Prima chi contiene il testo, poi la somiglianza migliore tra le colonne"""
+    cercato = normalizza(testo.strip())
+    pattern = _pattern_contiene(cercato)
+    contiene = or_(*(func.normalizza_ricerca(c).like(pattern, escape="\\") for c in colonne))
+    punteggi = [func.coalesce(func.word_similarity(cercato, func.normalizza_ricerca(c)), 0) for c in colonne]
+    punteggio = punteggi[0]
+    for altro in punteggi[1:]:
+        punteggio = case((altro > punteggio, altro), else_=punteggio)
+    return [case((contiene, 1), else_=0).desc(), punteggio.desc()]
+
+
+# === RICERCA UNIFICATA ===
+
+def _query_entita(entita: EntitaRicerca) -> tuple:
+    """(select di id, nome, descrizione; colonne su cui cercare)"""
+    if entita == EntitaRicerca.CLIENTI:
+        return (
+            select(Cliente.id, Cliente.nome, Cliente.referente.label("descrizione")),
+            (Cliente.nome, Cliente.referente)
+        )
+    if entita == EntitaRicerca.PRODOTTI:
+        return (
+            select(Prodotto.id, Prodotto.nome, Mulino.nome.label("descrizione"))
+            .join(Mulino, Prodotto.mulino_id == Mulino.id),
+            (Prodotto.nome,)
+        )
+    if entita == EntitaRicerca.MULINI:
+        return (
+            select(Mulino.id, Mulino.nome, Mulino.indirizzo_ritiro.label("descrizione")),
+            (Mulino.nome,)
+        )
+    return (
+        select(Trasportatore.id, Trasportatore.nome, Trasportatore.telefono.label("descrizione")),
+        (Trasportatore.nome,)
+    )
+
+
+def query_ricerca(db: Session, entita: EntitaRicerca, testo: str, limite: int) -> Select:
+    """Risultati di un'entità ordinati per pertinenza, al massimo `limite`"""
+    query, colonne = _query_entita(entita)
+    nome = query.selected_columns.nome
+    return (
+        query
+        .where(filtro_ricerca(db, colonne, testo))
+        .order_by(*_ordinamento(colonne, testo), nome, query.selected_columns.id)
+        .limit(limite)
+    )
+
+
+def cerca(
+    db: Session,
+    testo: str,
+    entita: Iterable[EntitaRicerca],
+    limite: int
+) -> Dict[str, list]:
+    """
+    Ricerca su più entità, una query ciascuna con il proprio limite.
+    Testo vuoto (dopo la normalizzazione): nessun risultato.
+    """
+    if not (normalizza(testo) or "").strip():
+        return {e.value: [] for e in entita}
+    return {
+        e.value: db.execute(query_ricerca(db, e, testo, limite)).all()
+        for e in entita
+    }
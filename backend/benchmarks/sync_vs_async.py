@@ -0,0 +1,113 @@
+"""
+Benchmark affiancato delle letture sincrone e asincrone
+
+Stessi endpoint di `python -m app.manage benchmark-async` (ENDPOINT_BENCHMARK),
+con le due varianti sulla stessa riga e il rapporto async/sync.
+Senza --url avvia un backend locale con DATABASE_ASYNC=true sul DATABASE_URL
+corrente (PostgreSQL alla head delle migrazioni, richiede asyncpg e uvicorn)
+e lo ferma alla fine.
+
+Uso (dalla cartella backend):
+    python benchmarks/sync_vs_async.py --username admin --password ...
+    python benchmarks/sync_vs_async.py --url http://localhost:8000 --token ... --json risultati.json
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from contextlib import contextmanager
+from pathlib import Path
+
+BACKEND = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND))
+
+from app.manage import ENDPOINT_BENCHMARK, _misura, _token_benchmark  # noqa: E402
+
+
+def _porta_libera() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def backend_locale(workers: int, attesa_s: float = 30):
+    """Backend uvicorn con le letture asincrone attive; restituisce l'URL"""
+    porta = _porta_libera()
+    ambiente = dict(os.environ, DATABASE_ASYNC="true")
+    processo = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app",
+         "--port", str(porta), "--workers", str(workers), "--log-level", "warning"],
+        cwd=BACKEND, env=ambiente
+    )
+    url = f"http://127.0.0.1:{porta}"
+    try:
+        scadenza = time.monotonic() + attesa_s
+        while True:
+            try:
+                urllib.request.urlopen(f"{url}/health", timeout=1).read()
+                break
+            except OSError:
+                if processo.poll() is not None or time.monotonic() > scadenza:
+                    raise RuntimeError("Il backend locale non è partito")
+                time.sleep(0.2)
+        yield url
+    finally:
+        processo.terminate()
+        processo.wait(10)
+
+
+def confronta(url: str, token: str, richieste: int, concorrenza: int) -> list:
+    """Per ogni endpoint: misure sync e async dopo un giro di riscaldamento ciascuna"""
+    risultati = []
+    for nome, percorso in ENDPOINT_BENCHMARK:
+        misure = {}
+        for etichetta, prefisso in (("sync", "/api"), ("async", "/api/async")):
+            indirizzo = url + prefisso + percorso
+            _misura(indirizzo, token, concorrenza, concorrenza)
+            misure[etichetta] = _misura(indirizzo, token, richieste, concorrenza)
+        risultati.append({"endpoint": nome, "percorso": percorso, **misure})
+    return risultati
+
+
+def stampa(risultati: list) -> None:
+    print(f"{'endpoint':<14}{'sync req/s':>12}{'async req/s':>13}{'async/sync':>12}"
+          f"{'sync p95':>10}{'async p95':>11}")
+    for r in risultati:
+        sync, asincrono = r["sync"], r["async"]
+        print(f"{r['endpoint']:<14}{sync['req_s']:>12.1f}{asincrono['req_s']:>13.1f}"
+              f"{asincrono['req_s'] / sync['req_s']:>11.2f}x"
+              f"{sync['p95_ms']:>10.1f}{asincrono['p95_ms']:>11.1f}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--url", help="Backend già in esecuzione con DATABASE_ASYNC attivo")
+    parser.add_argument("--workers", type=int, default=1, help="Worker uvicorn del backend locale")
+    parser.add_argument("--token", help="Token JWT (in alternativa a username/password)")
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--richieste", type=int, default=500, help="Richieste per endpoint e percorso")
+    parser.add_argument("--concorrenza", type=int, default=32, help="Client in parallelo")
+    parser.add_argument("--json", help="File in cui salvare i risultati")
+    args = parser.parse_args(argv)
+
+    if args.url:
+        risultati = confronta(args.url, _token_benchmark(args), args.richieste, args.concorrenza)
+    else:
+        with backend_locale(args.workers) as args.url:
+            risultati = confronta(args.url, _token_benchmark(args), args.richieste, args.concorrenza)
+
+    stampa(risultati)
+    if args.json:
+        Path(args.json).write_text(json.dumps(risultati, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
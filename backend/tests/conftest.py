@@ -0,0 +1,150 @@
+"""
+Fixture comuni dei test
+
+- Senza DATABASE_URL i test usano un database SQLite temporaneo; con
+  DATABASE_URL (PostgreSQL) girano sul database indicato, che viene
+  svuotato e ricreato a ogni test
+- Lo schema è creato dai modelli (create_all), che coincidono con la head
+  delle migrazioni (test_migrazioni); l'autenticazione è disattivata
+- I test marcati con @pytest.mark.postgresql girano solo su PostgreSQL
+"""
+
+import os
+import tempfile
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import event
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/test.db"
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import app.models  # noqa: E402,F401
+from app.auth import get_current_user  # noqa: E402
+from app.database import Base, SessionLocal, engine  # noqa: E402
+from app.main import app  # noqa: E402
+from app.models import Cliente, Mulino, Ordine, Prodotto, RigaOrdine  # noqa: E402
+from app.services import ordine_service  # noqa: E402
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "postgresql: richiede DATABASE_URL su PostgreSQL")
+
+
+def pytest_collection_modifyitems(config, items):
+    if engine.dialect.name == "postgresql":
+        return
+    salta = pytest.mark.skip(reason="richiede DATABASE_URL su PostgreSQL")
+    for item in items:
+        if "postgresql" in item.keywords:
+            item.add_marker(salta)
+
+
+@pytest.fixture(autouse=True)
+def schema():
+    """Schema vuoto per ogni test"""
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    yield
+    engine.dispose()
+
+
+@pytest.fixture
+def db():
+    sessione = SessionLocal()
+    try:
+        yield sessione
+    finally:
+        sessione.close()
+
+
+@pytest.fixture
+def client():
+    app.dependency_overrides[get_current_user] = lambda: None
+    try:
+        yield TestClient(app)
+    finally:
+        app.dependency_overrides.pop(get_current_user, None)
+
+
+@pytest.fixture
+def conta_query():
+    """Context manager che conta gli statement inviati al database nel blocco"""
+    @contextmanager
+    def _conta():
+        conteggio = {"query": 0}
+
+        def registra(*args):
+            conteggio["query"] += 1
+
+        event.listen(engine, "before_cursor_execute", registra)
+        try:
+            yield conteggio
+        finally:
+            event.remove(engine, "before_cursor_execute", registra)
+
+    return _conta
+
+
+@pytest.fixture
+def anagrafiche(db):
+    """Due mulini, un prodotto per mulino (percentuale e fisso) e un cliente"""
+    mulino_a = Mulino(nome="Molino A")
+    mulino_b = Mulino(nome="Molino B")
+    db.add_all([mulino_a, mulino_b])
+    db.flush()
+    prodotto_a = Prodotto(
+        nome="Farina 00", mulino_id=mulino_a.id,
+        tipo_provvigione="percentuale", valore_provvigione=Decimal("3")
+    )
+    prodotto_b = Prodotto(
+        nome="Farina 0", mulino_id=mulino_b.id,
+        tipo_provvigione="fisso", valore_provvigione=Decimal("1.5")
+    )
+    cliente = Cliente(nome="Panificio Rossi")
+    db.add_all([prodotto_a, prodotto_b, cliente])
+    db.commit()
+    return {
+        "mulini": [mulino_a, mulino_b],
+        "prodotti": [prodotto_a, prodotto_b],
+        "cliente": cliente,
+    }
+
+
+@pytest.fixture
+def crea_ordine(db, anagrafiche):
+    """
+    Crea un ordine con una riga per ogni (prodotto, quintali) e totali
+    denormalizzati allineati. Di default: prodotto del Molino A, sfuso.
+    Gli altri argomenti con nome sono campi dell'ordine.
+    """
+    def _crea(quintali, prodotto=None, tipo="sfuso", giorni=0, prezzo=Decimal("40"), **campi):
+        prodotto = prodotto or anagrafiche["prodotti"][0]
+        righe = quintali if isinstance(quintali, list) else [(prodotto, quintali)]
+        ordine = Ordine(
+            cliente_id=anagrafiche["cliente"].id,
+            data_ordine=date(2025, 1, 1),
+            data_ritiro=date(2025, 2, 1) + timedelta(days=giorni),
+            tipo_ordine=tipo,
+            **campi
+        )
+        db.add(ordine)
+        db.flush()
+        for prodotto_riga, q in righe:
+            q = Decimal(str(q))
+            db.add(RigaOrdine(
+                ordine_id=ordine.id, prodotto_id=prodotto_riga.id,
+                mulino_id=prodotto_riga.mulino_id, quintali=q,
+                prezzo_quintale=prezzo, prezzo_totale=q * prezzo
+            ))
+        db.flush()
+        db.refresh(ordine)
+        ordine_service.aggiorna_totali_ordine(ordine, ordine.righe)
+        db.commit()
+        return ordine
+
+    return _crea
@@ -0,0 +1,339 @@
+"""Login, hashing delle password, limitatore dei login e cache dell'utente autenticato"""
+
+import asyncio
+import threading
+import time
+
+import bcrypt
+import httpx
+import pytest
+from fastapi import HTTPException
+from fastapi.security import HTTPAuthorizationCredentials
+from fastapi.testclient import TestClient
+from jose import jwt
+from sqlalchemy import select
+
+from app import auth
+from app.auth import LimitatoreLogin
+from app.main import app
+from app.models.utente import Utente
+from app.routers.auth import _salva_hash
+
+PASSWORD = "farina-00"
+
+
+def _hash(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=rounds)).decode()
+
+
+def _costo(hashed_password: str) -> int:
+    return int(hashed_password.split("$")[2])
+
+
+@pytest.fixture(autouse=True)
+def cache_vuota(monkeypatch):
+    """Cache dell'utente autenticato nuova per ogni test"""
+    cache = auth._CachePrincipal(ttl_s=60, max_voci=1024)
+    monkeypatch.setattr(auth, "_cache_principal", cache)
+    return cache
+
+
+@pytest.fixture
+def utente(db, monkeypatch):
+    """Utente con hash a costo 4 (= BCRYPT_ROUNDS durante il test)"""
+    monkeypatch.setattr(auth, "BCRYPT_ROUNDS", 4)
+    utente = Utente(username="corrado", hashed_password=_hash(PASSWORD, 4))
+    db.add(utente)
+    db.commit()
+    return utente
+
+
+@pytest.fixture
+def client_auth():
+    """Client senza override dell'autenticazione, con il limitatore creato dal lifespan"""
+    app.state.limitatore_login = LimitatoreLogin()
+    try:
+        yield TestClient(app)
+    finally:
+        del app.state.limitatore_login
+
+
+def _login(client, password=PASSWORD):
+    return client.post("/api/auth/login", json={"username": "corrado", "password": password})
+
+
+def _hash_salvato(db) -> str:
+    db.expire_all()
+    return db.scalar(select(Utente.hashed_password).where(Utente.username == "corrado"))
+
+
+# === LOGIN ===
+
+def test_login_e_utente_corrente(client_auth, db, utente):
+    risposta = _login(client_auth)
+    assert risposta.status_code == 200
+    token = risposta.json()["access_token"]
+
+    me = client_auth.get("/api/auth/me", headers={"Authorization": f"Bearer {token}"})
+    assert me.json() == {"id": utente.id, "username": "corrado"}
+
+
+def test_login_con_password_errata(client_auth, utente):
+    assert _login(client_auth, "sbagliata").status_code == 401
+    risposta = client_auth.post("/api/auth/login", json={"username": "nessuno", "password": PASSWORD})
+    assert risposta.status_code == 401
+
+
+def test_login_riscrive_l_hash_con_il_costo_corrente(client_auth, db, utente, monkeypatch):
+    db.rollback()
+    monkeypatch.setattr(auth, "BCRYPT_ROUNDS", 5)
+
+    assert _login(client_auth).status_code == 200
+    riscritto = _hash_salvato(db)
+    assert _costo(riscritto) == 5 and auth.verify_password(PASSWORD, riscritto)
+    db.rollback()
+
+    # Costo già allineato: nessuna nuova scrittura
+    assert _login(client_auth).status_code == 200
+    assert _hash_salvato(db) == riscritto
+
+
+def test_login_errato_non_riscrive_l_hash(client_auth, db, utente, monkeypatch):
+    originale = utente.hashed_password
+    db.rollback()
+    monkeypatch.setattr(auth, "BCRYPT_ROUNDS", 5)
+
+    assert _login(client_auth, "sbagliata").status_code == 401
+    assert _hash_salvato(db) == originale
+
+
+def test_hash_salvato_solo_se_invariato(db, utente):
+    utente_id, originale = utente.id, utente.hashed_password
+    db.rollback()
+
+    assert _salva_hash(utente_id, "hash-non-piu-attuale", _hash("altra", 4)) is None
+    assert _hash_salvato(db) == originale
+
+
+def test_cambio_password_revoca_i_token_precedenti(client_auth, db, utente):
+    db.rollback()
+    vecchio = {"Authorization": f"Bearer {_login(client_auth).json()['access_token']}"}
+    assert client_auth.get("/api/auth/me", headers=vecchio).status_code == 200  # Ora in cache
+
+    risposta = client_auth.put("/api/auth/password", headers=vecchio, json={
+        "current_password": "sbagliata", "new_password": "segale-1"
+    })
+    assert risposta.status_code == 400
+
+    risposta = client_auth.put("/api/auth/password", headers=vecchio, json={
+        "current_password": PASSWORD, "new_password": "segale-1"
+    })
+    assert risposta.status_code == 200
+    nuovo = {"Authorization": f"Bearer {risposta.json()['access_token']}"}
+
+    assert client_auth.get("/api/auth/me", headers=vecchio).status_code == 401
+    assert client_auth.get("/api/auth/me", headers=nuovo).status_code == 200
+    assert _login(client_auth).status_code == 401
+    assert _login(client_auth, "segale-1").status_code == 200
+
+
+# === HASHING ===
+
+def test_verify_password_async_sui_thread_bcrypt(monkeypatch):
+    hashed = _hash(PASSWORD, 4)
+    thread = []
+    verifica = auth.verify_password
+
+    def verifica_e_registra(password, hashed_password):
+        thread.append(threading.current_thread().name)
+        return verifica(password, hashed_password)
+
+    monkeypatch.setattr(auth, "verify_password", verifica_e_registra)
+
+    async def verifica_entrambe():
+        return await asyncio.gather(
+            auth.verify_password_async(PASSWORD, hashed),
+            auth.verify_password_async("sbagliata", hashed),
+        )
+
+    try:
+        assert asyncio.run(verifica_entrambe()) == [True, False]
+    finally:
+        auth.chiudi_executor_hash()
+    assert len(thread) == 2 and all(nome.startswith("bcrypt") for nome in thread)
+
+
+def test_richiede_rehash(monkeypatch):
+    monkeypatch.setattr(auth, "BCRYPT_ROUNDS", 4)
+    assert auth.richiede_rehash(_hash(PASSWORD, 4)) is False
+    assert auth.richiede_rehash(_hash(PASSWORD, 5)) is True
+    assert auth.richiede_rehash("non-bcrypt") is True
+
+
+# === LIMITATORE ===
+
+async def _login_asgi(client: httpx.AsyncClient):
+    return await client.post("/api/auth/login", json={"username": "corrado", "password": PASSWORD})
+
+
+def test_login_oltre_il_limite_risponde_429(db, utente):
+    db.rollback()
+
+    async def scenario():
+        limitatore = LimitatoreLogin(concorrenti=1, attesa_s=0.05)
+        app.state.limitatore_login = limitatore
+        trasporto = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=trasporto, base_url="http://test") as client:
+            async with limitatore.posto():  # Un login già in corso occupa l'unico posto
+                occupato = await _login_asgi(client)
+            libero = await _login_asgi(client)
+        return occupato, libero
+
+    try:
+        occupato, libero = asyncio.run(scenario())
+    finally:
+        del app.state.limitatore_login
+
+    assert occupato.status_code == 429
+    assert occupato.headers["Retry-After"] == "1"
+    assert libero.status_code == 200
+
+
+def test_login_in_attesa_entra_quando_si_libera_un_posto(db, utente):
+    db.rollback()
+
+    async def scenario():
+        limitatore = LimitatoreLogin(concorrenti=1, attesa_s=5)
+        app.state.limitatore_login = limitatore
+        trasporto = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=trasporto, base_url="http://test") as client:
+            async with limitatore.posto():
+                in_attesa = asyncio.create_task(_login_asgi(client))
+                await asyncio.sleep(0.05)
+                assert not in_attesa.done()
+            return await in_attesa
+
+    try:
+        risposta = asyncio.run(scenario())
+    finally:
+        del app.state.limitatore_login
+
+    assert risposta.status_code == 200
+
+
+# === UTENTE AUTENTICATO E CACHE ===
+
+class _Orologio:
+    """Sostituto di time nel modulo auth: monotonic e time avanzano a comando"""
+
+    def __init__(self):
+        self.adesso = time.time()
+
+    def monotonic(self) -> float:
+        return self.adesso
+
+    def time(self) -> float:
+        return self.adesso
+
+
+def _credenziali(token: str) -> HTTPAuthorizationCredentials:
+    return HTTPAuthorizationCredentials(scheme="Bearer", credentials=token)
+
+
+def _token(utente) -> str:
+    return auth.token_utente(utente)
+
+
+def test_utente_dalla_cache_senza_query(db, utente, conta_query):
+    token = _token(utente)
+    primo = auth.get_current_user(_credenziali(token), db)
+
+    with conta_query() as conteggio:
+        secondo = auth.get_current_user(_credenziali(token), db)
+
+    assert secondo == primo == auth.UtenteAutenticato(id=utente.id, username="corrado")
+    assert conteggio["query"] == 0
+
+
+def test_utente_eliminato_rifiutato_dopo_l_invalidazione(db, utente):
+    token = _token(utente)
+    auth.get_current_user(_credenziali(token), db)
+    db.delete(utente)
+    db.commit()
+
+    assert auth.get_current_user(_credenziali(token), db).username == "corrado"  # Ancora in cache
+    auth.invalida_utente("corrado")
+    with pytest.raises(HTTPException) as errore:
+        auth.get_current_user(_credenziali(token), db)
+    assert errore.value.status_code == 401
+
+
+def test_token_di_una_versione_precedente_rifiutato(db, utente):
+    token = _token(utente)
+    utente.versione_token += 1
+    db.commit()
+
+    with pytest.raises(HTTPException):
+        auth.get_current_user(_credenziali(token), db)
+    assert auth.get_current_user(_credenziali(_token(utente)), db).id == utente.id
+    # Token senza claim "ver" (emessi prima della revoca): validi solo alla versione 0
+    senza_versione = jwt.encode({"sub": "corrado"}, auth.SECRET_KEY, algorithm=auth.ALGORITHM)
+    with pytest.raises(HTTPException):
+        auth.get_current_user(_credenziali(senza_versione), db)
+
+
+def test_cache_scade_dopo_il_ttl(monkeypatch):
+    orologio = _Orologio()
+    monkeypatch.setattr(auth, "time", orologio)
+    cache = auth._CachePrincipal(ttl_s=60, max_voci=10)
+    utente = auth.UtenteAutenticato(id=1, username="corrado")
+
+    cache.put("t", utente, exp=None)
+    orologio.adesso += 59
+    assert cache.get("t") == utente
+    orologio.adesso += 2
+    assert cache.get("t") is None
+
+
+def test_cache_mai_oltre_la_scadenza_del_token(monkeypatch):
+    orologio = _Orologio()
+    monkeypatch.setattr(auth, "time", orologio)
+    cache = auth._CachePrincipal(ttl_s=60, max_voci=10)
+    utente = auth.UtenteAutenticato(id=1, username="corrado")
+
+    cache.put("t", utente, exp=orologio.adesso + 10)
+    orologio.adesso += 9
+    assert cache.get("t") == utente
+    orologio.adesso += 2
+    assert cache.get("t") is None
+
+    cache.put("scaduto", utente, exp=orologio.adesso - 1)
+    assert cache.get("scaduto") is None
+
+
+def test_cache_lru_scarta_il_meno_usato():
+    cache = auth._CachePrincipal(ttl_s=60, max_voci=2)
+    a, b, c = (auth.UtenteAutenticato(id=i, username=f"u{i}") for i in range(3))
+
+    cache.put("a", a, exp=None)
+    cache.put("b", b, exp=None)
+    assert cache.get("a") == a  # "b" diventa il meno usato
+    cache.put("c", c, exp=None)
+
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (a, None, c)
+
+
+def test_cache_invalidazione_per_utente_e_ttl_zero():
+    cache = auth._CachePrincipal(ttl_s=60, max_voci=10)
+    corrado = auth.UtenteAutenticato(id=1, username="corrado")
+    altro = auth.UtenteAutenticato(id=2, username="altro")
+    cache.put("t1", corrado, exp=None)
+    cache.put("t2", corrado, exp=None)
+    cache.put("t3", altro, exp=None)
+
+    cache.invalida_utente("corrado")
+    assert (cache.get("t1"), cache.get("t2"), cache.get("t3")) == (None, None, altro)
+
+    disattivata = auth._CachePrincipal(ttl_s=0, max_voci=10)
+    disattivata.put("t", corrado, exp=None)
+    assert disattivata.get("t") is None
@@ -0,0 +1,386 @@
+"""Carichi: assegnazione ordini, transizioni di stato e operazioni in blocco"""
+
+import random
+import threading
+from collections import Counter
+from datetime import date
+from decimal import Decimal
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import func, select
+
+from app.models import Carico, Mulino, Ordine, Trasportatore
+from app.models.ordine import StatoLogisticoOrdine
+from app.schemas.carico import OperazioneCarico
+from app.services import carico_service
+from app.services.carico_service import MAX_QUINTALI_CARICO
+
+
+@pytest.fixture
+def trasportatore_id(db):
+    trasportatore = Trasportatore(nome="Autotrasporti Bianchi")
+    db.add(trasportatore)
+    db.commit()
+    return trasportatore.id
+
+
+@pytest.fixture
+def crea_bozza(db, crea_ordine):
+    """Carico in BOZZA con un ordine per ogni quantità indicata, nello stato richiesto"""
+    def _crea(*quintali, stato="bozza"):
+        carico = carico_service.create_draft_load(db, [crea_ordine(q).id for q in quintali])
+        carico.stato = stato
+        db.commit()
+        return carico.id
+    return _crea
+
+
+def _chiudi_lettura(db):
+    """
+    Chiude la transazione di lettura della sessione del test prima di una
+    richiesta che scrive: su SQLite il suo lock condiviso la bloccherebbe.
+    """
+    db.rollback()
+
+
+def _stati_ordini(db, carico_id):
+    return {
+        (ordine.stato_logistico, ordine.stato)
+        for ordine in db.scalars(select(Ordine).where(Ordine.carico_id == carico_id)).unique()
+    }
+
+
+# === TRANSIZIONI DI STATO ===
+
+def test_transizioni_legali_aggiornano_carico_ordini_e_versione(client, db, crea_bozza, trasportatore_id):
+    carico_id = crea_bozza(100, 50)
+    versione = db.get(Carico, carico_id).versione
+    _chiudi_lettura(db)
+
+    risposta = client.post(f"/api/carichi/{carico_id}/assegna", json={
+        "trasportatore_id": trasportatore_id, "data_ritiro": date.today().isoformat(), "versione": versione
+    })
+    assert risposta.status_code == 200
+    assert (risposta.json()["stato"], risposta.json()["versione"]) == ("assegnato", versione + 1)
+    assert _stati_ordini(db, carico_id) == {("in_carico", "inserito")}
+    _chiudi_lettura(db)
+
+    risposta = client.post(f"/api/carichi/{carico_id}/ritira", params={"versione": versione + 1})
+    assert risposta.status_code == 200
+    assert (risposta.json()["stato"], risposta.json()["versione"]) == ("ritirato", versione + 2)
+    assert _stati_ordini(db, carico_id) == {("spedito", "ritirato")}
+    _chiudi_lettura(db)
+
+    risposta = client.post(f"/api/carichi/{carico_id}/consegna")
+    assert risposta.status_code == 200
+    assert (risposta.json()["stato"], risposta.json()["versione"]) == ("consegnato", versione + 3)
+    assert _stati_ordini(db, carico_id) == {("spedito", "ritirato")}  # Consegna non tocca gli ordini
+
+
+@pytest.mark.parametrize("nome, stato", [
+    ("assegna", "ritirato"),
+    ("ritira", "bozza"),
+    ("consegna", "bozza"),
+    ("consegna", "assegnato"),
+])
+def test_transizioni_illegali_rifiutate(db, crea_bozza, trasportatore_id, nome, stato):
+    carico = db.get(Carico, crea_bozza(100, stato=stato))
+    versione = carico.versione
+
+    with pytest.raises(HTTPException) as errore:
+        carico_service.verifica_transizione(carico, nome)
+    assert errore.value.status_code == 400
+
+    esiti, confermate = carico_service.esegui_operazioni(db, [OperazioneCarico(
+        tipo=nome, carico_id=carico.id, trasportatore_id=trasportatore_id, data_ritiro=date.today()
+    )])
+    db.rollback()
+    assert not confermate
+    assert (esiti[0]["esito"], esiti[0]["status_code"]) == ("errore", 400)
+    assert (carico.stato, carico.versione) == (stato, versione)
+
+
+def test_applica_transizione_aggiorna_tutti_i_carichi(db, crea_bozza):
+    carichi = [db.get(Carico, crea_bozza(100, stato="assegnato")), db.get(Carico, crea_bozza(80, 20, stato="assegnato"))]
+    versioni = [carico.versione for carico in carichi]
+
+    carico_service.applica_transizione(db, [carico.id for carico in carichi], "ritira")
+    db.commit()
+
+    for carico, versione in zip(carichi, versioni):
+        assert (carico.stato, carico.versione) == ("ritirato", versione + 1)
+        assert _stati_ordini(db, carico.id) == {("spedito", "ritirato")}
+
+
+# === OPERAZIONI IN BLOCCO ===
+
+def test_operazioni_tutto_o_niente_non_applica_nulla(client, db, crea_bozza, crea_ordine, anagrafiche, trasportatore_id):
+    carico_id = crea_bozza(100)
+    altro_id = crea_bozza(60)
+    ordine_ok = crea_ordine(50).id
+    ordine_altro_mulino = crea_ordine(50, prodotto=anagrafiche["prodotti"][1]).id
+    _chiudi_lettura(db)
+
+    risposta = client.post("/api/carichi/operazioni", json={"operazioni": [
+        {"tipo": "aggiungi_ordine", "carico_id": carico_id, "ordine_id": ordine_ok},
+        {"tipo": "aggiungi_ordine", "carico_id": carico_id, "ordine_id": ordine_altro_mulino},
+        {"tipo": "assegna", "carico_id": altro_id, "trasportatore_id": trasportatore_id,
+         "data_ritiro": date.today().isoformat()},
+    ]})
+
+    assert risposta.status_code == 422
+    corpo = risposta.json()
+    assert corpo["confermate"] is False
+    assert [e["esito"] for e in corpo["esiti"]] == ["annullata", "errore", "non_eseguita"]
+    assert corpo["esiti"][1]["status_code"] == 400
+
+    assert db.get(Ordine, ordine_ok).carico_id is None
+    assert db.get(Ordine, ordine_altro_mulino).carico_id is None
+    assert db.get(Carico, carico_id).total_quantita == Decimal("100")
+    assert db.get(Carico, altro_id).stato == "bozza"
+
+
+def test_operazioni_best_effort_annulla_solo_le_fallite(client, db, crea_bozza, crea_ordine, anagrafiche):
+    carico_id = crea_bozza(100)
+    versione = db.get(Carico, carico_id).versione
+    ordini = [crea_ordine(50).id, crea_ordine(50, prodotto=anagrafiche["prodotti"][1]).id, crea_ordine(30).id]
+    _chiudi_lettura(db)
+
+    risposta = client.post("/api/carichi/operazioni", json={"modalita": "best_effort", "operazioni": [
+        {"tipo": "aggiungi_ordine", "carico_id": carico_id, "ordine_id": ordine_id}
+        for ordine_id in ordini
+    ]})
+
+    assert risposta.status_code == 422
+    corpo = risposta.json()
+    assert corpo["confermate"] is True
+    assert (corpo["eseguite"], corpo["fallite"]) == (2, 1)
+    assert [e["esito"] for e in corpo["esiti"]] == ["ok", "errore", "ok"]
+
+    # L'operazione fallita è annullata nel suo savepoint, le altre restano
+    assert [db.get(Ordine, ordine_id).carico_id for ordine_id in ordini] == [carico_id, None, carico_id]
+    carico = db.get(Carico, carico_id)
+    assert carico.total_quantita == Decimal("180")
+    assert carico.versione > versione
+
+
+def test_operazioni_versione_cambiata_409(client, db, crea_bozza):
+    carico_id = crea_bozza(100, stato="assegnato")
+    versione = db.get(Carico, carico_id).versione
+    _chiudi_lettura(db)
+
+    risposta = client.post("/api/carichi/operazioni", json={"operazioni": [
+        {"tipo": "ritira", "carico_id": carico_id, "versione": versione - 1},
+    ]})
+
+    assert risposta.status_code == 409
+    assert risposta.json()["esiti"][0]["status_code"] == 409
+    assert db.get(Carico, carico_id).stato == "assegnato"
+
+
+def test_operazioni_riuscite_200(client, db, crea_bozza):
+    carichi = [crea_bozza(100, stato="assegnato"), crea_bozza(120, stato="assegnato")]
+    _chiudi_lettura(db)
+
+    risposta = client.post("/api/carichi/operazioni", json={"operazioni": [
+        {"tipo": "ritira", "carico_id": carico_id} for carico_id in carichi
+    ]})
+
+    assert risposta.status_code == 200
+    assert risposta.json()["confermate"] is True
+    assert [c["stato"] for c in risposta.json()["carichi"]] == ["ritirato", "ritirato"]
+
+
+# === VALIDAZIONE DEI CANDIDATI ===
+
+def _valida_come_prima(db, order_ids, exclude_carico_id=None):
+    """validate_load_constraints com'era prima della matrice degli attributi (una query ORM)"""
+    info = {'mulino_id': None, 'mulino_nome': None, 'tipo': None, 'totale_quintali': Decimal("0")}
+    if not order_ids:
+        return False, ["Nessun ordine specificato"], info
+    righe = db.query(Ordine, Mulino.nome).outerjoin(
+        Mulino, Ordine.mulino_principale_id == Mulino.id
+    ).filter(Ordine.id.in_(order_ids)).all()
+    ordini = [ordine for ordine, _ in righe]
+    nomi_mulini = {ordine.id: nome for ordine, nome in righe}
+    if len(ordini) != len(order_ids):
+        return False, [f"Ordini non trovati: {set(order_ids) - {o.id for o in ordini}}"], info
+    errori = [
+        f"Ordine {o.id} già assegnato al carico {o.carico_id}"
+        for o in ordini if o.carico_id and o.carico_id != exclude_carico_id
+    ]
+    if errori:
+        return False, errori, info
+    tipi = {o.tipo_ordine for o in ordini}
+    mulini = {(o.mulino_principale_id, nomi_mulini[o.id]) for o in ordini if o.mulino_principale_id}
+    totale = sum((o.totale_quintali or Decimal("0") for o in ordini), Decimal("0"))
+    if len(tipi) > 1:
+        errori.append("Tipi ordine misti")
+    else:
+        info['tipo'] = next(iter(tipi), None)
+    if len(mulini) > 1:
+        errori.append("Mulini diversi")
+    elif mulini:
+        info['mulino_id'], info['mulino_nome'] = next(iter(mulini))
+    info['totale_quintali'] = totale
+    if totale > MAX_QUINTALI_CARICO:
+        errori.append("Superato limite quintali")
+    return not errori, errori, info
+
+
+def _tipo_errori(errori: list) -> list:
+    """Testo degli errori senza i dettagli (insiemi il cui ordine di stampa può variare)"""
+    return sorted(errore.split(":")[0].split(" non ammessi")[0] for errore in errori)
+
+
+def test_valida_candidati_come_la_validazione_del_singolo_candidato(db, anagrafiche, crea_ordine, crea_bozza, conta_query):
+    prodotto_a, prodotto_b = anagrafiche["prodotti"]
+    rnd = random.Random(7)
+    ordini = [
+        crea_ordine(rnd.choice([20, 50, 80, 120, 180]), prodotto=rnd.choice([prodotto_a, prodotto_a, prodotto_b]),
+                    tipo=rnd.choice(["sfuso", "sfuso", "pedane"])).id
+        for _ in range(14)
+    ]
+    ordini.append(crea_ordine([]).id)  # Senza righe: nessun mulino principale, 0q
+    carico_id = crea_bozza(60, 40)
+    in_carico = list(db.scalars(select(Ordine.id).where(Ordine.carico_id == carico_id)))
+    ordini += in_carico
+
+    candidati = [[], [in_carico[0]], [99999], [ordini[0], ordini[0]], in_carico + [in_carico[1]]]
+    for _ in range(200):
+        candidato = rnd.sample(ordini, rnd.randint(1, 5))
+        if rnd.random() < 0.2:
+            candidato.append(rnd.choice(candidato))  # Id ripetuto
+        if rnd.random() < 0.1:
+            candidato.append(99999)  # Ordine inesistente
+        candidati.append(candidato)
+
+    for escluso in (None, carico_id):
+        with conta_query() as conteggio:
+            risultati = carico_service.valida_candidati(db, candidati, exclude_carico_id=escluso)
+        assert conteggio["query"] == 1
+
+        assert len(risultati) == len(candidati)
+        for candidato, (valido, errori, info) in zip(candidati, risultati):
+            assert (valido, errori, info) == carico_service.validate_load_constraints(db, candidato, escluso)
+            atteso_valido, atteso_errori, atteso_info = _valida_come_prima(db, candidato, escluso)
+            assert (valido, info) == (atteso_valido, atteso_info), candidato
+            assert _tipo_errori(errori) == _tipo_errori(atteso_errori), candidato
+
+    # Casi coperti dal campione
+    esiti = [valido for valido, _, _ in carico_service.valida_candidati(db, candidati)]
+    assert any(esiti) and not all(esiti)
+    assert carico_service.valida_candidati(db, []) == []
+
+
+# === ORDINI DISPONIBILI PER UN CARICO ===
+
+def _disponibili_come_prima(db, carico):
+    """
+    Filtro in Python del servizio precedente (tutti gli ordini aperti del tipo,
+    poi mulino e quintali), ordinato per riempimento, distanza dalla data del carico e id.
+    """
+    disponibili = MAX_QUINTALI_CARICO - carico.total_quantita
+    compatibili = [
+        ordine for ordine in db.query(Ordine).filter(
+            Ordine.carico_id.is_(None),
+            Ordine.tipo_ordine == carico.tipo,
+            Ordine.stato_logistico == StatoLogisticoOrdine.APERTO.value
+        )
+        if ordine.mulino_principale_id == carico.mulino_id
+        and (ordine.totale_quintali or Decimal("0")) <= disponibili
+    ]
+    riferimento = carico_service.data_riferimento_carico(db, carico)
+    return [o.id for o in sorted(compatibili, key=lambda o: (
+        disponibili - o.totale_quintali,
+        abs((o.data_ritiro - riferimento).days) if o.data_ritiro else float("inf"),
+        o.id,
+    ))]
+
+
+def test_ordini_disponibili_come_il_filtro_precedente(client, db, anagrafiche, crea_ordine, crea_bozza):
+    prodotto_b = anagrafiche["prodotti"][1]
+    carico = db.get(Carico, crea_bozza(100))  # Molino A, sfuso, 200q liberi, ritiro dell'ordine: giorno 0
+    rnd = random.Random(3)
+    for _ in range(30):
+        crea_ordine(rnd.choice([40, 60, 60, 120, 200, 210]), giorni=rnd.choice([-5, -2, 0, 2, 5, 5]))
+    senza_data = crea_ordine(60)
+    senza_data.data_ritiro = None
+    crea_ordine(60, prodotto=prodotto_b)
+    crea_ordine(60, tipo="pedane")
+    crea_ordine(60, stato_logistico=StatoLogisticoOrdine.SPEDITO.value)
+    crea_bozza(60)  # Ordine compatibile ma già in un altro carico
+    db.commit()
+
+    attesi = _disponibili_come_prima(db, carico)
+    ordini = carico_service.get_ordini_disponibili_per_carico(db, carico.id)
+
+    assert [o.id for o in ordini] == attesi
+    da_60 = [o.id for o in ordini if o.totale_quintali == 60]
+    assert len(da_60) > 1 and da_60[-1] == senza_data.id  # Senza data: dopo gli altri da 60q
+    assert {o.totale_quintali for o in ordini} == {Decimal(q) for q in (40, 60, 120, 200)}
+
+    risposta = client.get(f"/api/carichi/{carico.id}/ordini-disponibili")
+    assert [o["id"] for o in risposta.json()] == attesi
+    assert {o["cliente_nome"] for o in risposta.json()} == {"Panificio Rossi"}
+
+    # Con la data del carico il riferimento cambia
+    carico.data_ritiro = date(2025, 2, 6)
+    db.commit()
+    attesi = _disponibili_come_prima(db, carico)
+    assert [o.id for o in carico_service.get_ordini_disponibili_per_carico(db, carico.id)] == attesi
+    assert carico_service.get_ordini_disponibili_per_carico(db, 99999) == []
+
+
+# === CONCORRENZA (PostgreSQL) ===
+
+@pytest.mark.postgresql
+def test_assegnazioni_concorrenti_rispettano_limite_e_unicita(client, db, crea_ordine):
+    carichi = []
+    for _ in range(2):
+        iniziali = [crea_ordine(50).id, crea_ordine(50).id]
+        carichi.append(carico_service.create_draft_load(db, iniziali).id)
+        db.commit()
+    # 10 ordini da 40q, ognuno conteso da due richieste (una per carico):
+    # al massimo 5 entrano in ciascun carico
+    contesi = [crea_ordine(40).id for _ in range(10)]
+
+    partenza = threading.Barrier(len(contesi) * len(carichi))
+    esiti = []
+
+    def assegna(carico_id: int, ordine_id: int):
+        partenza.wait()
+        risposta = client.post(f"/api/carichi/{carico_id}/ordini", json={"ordine_id": ordine_id})
+        esiti.append((carico_id, ordine_id, risposta.status_code))
+
+    threads = [
+        threading.Thread(target=assegna, args=(carico_id, ordine_id))
+        for ordine_id in contesi
+        for carico_id in carichi
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=60)
+
+    assert len(esiti) == len(threads)
+    assert {stato for _, _, stato in esiti} <= {200, 400, 409}
+    riusciti = Counter(ordine_id for _, ordine_id, stato in esiti if stato == 200)
+    assert all(n == 1 for n in riusciti.values())  # Nessun ordine assegnato due volte
+
+    db.expire_all()
+    for carico_id in carichi:
+        carico = db.get(Carico, carico_id)
+        totale = db.execute(
+            select(func.sum(Ordine.totale_quintali)).where(Ordine.carico_id == carico_id)
+        ).scalar()
+        assert totale <= MAX_QUINTALI_CARICO
+        assert carico.total_quantita == totale
+
+    for ordine_id in contesi:
+        # L'ordine è nel carico della richiesta riuscita, altrimenti in nessuno
+        assegnato = [c for c, o, stato in esiti if o == ordine_id and stato == 200]
+        assert db.get(Ordine, ordine_id).carico_id == (assegnato[0] if assegnato else None)
+    # Un ordine resta fuori solo se entrambi i carichi sono pieni (200q liberi = 5 ordini)
+    assert sum(riusciti.values()) == len(contesi)
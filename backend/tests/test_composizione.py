@@ -0,0 +1,153 @@
+"""Motore di packing della composizione carichi"""
+
+import itertools
+import random
+from datetime import date, timedelta
+from decimal import Decimal
+
+import pytest
+
+from app.services import composizione_service as cs
+
+
+def _ordini_casuali(rnd: random.Random, n: int) -> list:
+    ordini = []
+    for i in range(n):
+        ritiro = date(2025, 2, 1) + timedelta(days=rnd.randrange(15)) if rnd.random() < 0.9 else None
+        ordini.append({
+            "id": 100 + i,
+            "totale_quintali": Decimal(rnd.choice([30, 40, 50, 60, 75, 80, 90, 100, 120, 150, 180]))
+                + Decimal(rnd.choice(["0", "0", "0.5", "0.25"])),
+            "data_ordine": date(2025, 1, 1) + timedelta(days=rnd.randrange(10)),
+            "data_ritiro": ritiro,
+        })
+    return ordini
+
+
+def _oracolo(ordini: list, max_risultati: int, max_ordini: int) -> list:
+    """Enumerazione completa con itertools.combinations, stesso ordinamento del motore"""
+    per_data = sorted(ordini, key=lambda o: o["data_ritiro"] or date.max)
+    candidati = []
+    for k in range(cs.MIN_ORDINI_COMBINAZIONE, max_ordini + 1):
+        for ranghi in itertools.combinations(range(len(per_data)), k):
+            scelti = [per_data[r] for r in ranghi]
+            totale = sum((o["totale_quintali"] for o in scelti), Decimal("0"))
+            if not cs.SOGLIA_MINIMA <= totale <= cs.SOGLIA_MASSIMA:
+                continue
+            score = cs.calcola_score(totale, [cs._data_riferimento(o) for o in scelti])
+            candidati.append(((-score, k, ranghi), [o["id"] for o in scelti], totale, score))
+    candidati.sort(key=lambda c: c[0])
+    return [(ids, totale, score) for _, ids, totale, score in candidati[:max_risultati]]
+
+
+@pytest.mark.parametrize("seme", range(40))
+def test_trova_combinazioni_uguale_a_enumerazione_completa(seme):
+    rnd = random.Random(seme)
+    ordini = _ordini_casuali(rnd, rnd.randint(2, 11))
+    max_risultati = rnd.choice([1, 3, 5, 10])
+    max_ordini = rnd.choice([3, 4, 6])
+
+    risultati = cs.trova_combinazioni(
+        ordini, max_risultati=max_risultati, max_ordini=max_ordini, tempo_max_ms=60_000
+    )
+    attesi = _oracolo(ordini, max_risultati, max_ordini)
+
+    assert [(r["ordini_ids"], r["totale_quintali"], r["score"]) for r in risultati] == attesi
+
+
+def test_trova_combinazioni_senza_ordini():
+    assert cs.trova_combinazioni([]) == []
+    assert cs.trova_combinazioni(_ordini_casuali(random.Random(0), 5), max_risultati=0) == []
+
+
+# === PIANO GLOBALE ===
+
+def _ordini_piano(quintali: list) -> list:
+    return [
+        {
+            "id": i + 1,
+            "totale_quintali": Decimal(q),
+            "data_ordine": date(2025, 1, 1),
+            "data_ritiro": date(2025, 2, 1) + timedelta(days=i),
+        }
+        for i, q in enumerate(quintali)
+    ]
+
+
+def _verifica_piano(ordini: list, piano: dict):
+    """Carichi disgiunti nella finestra del piano, residui = ordini non assegnati"""
+    quintali = {o["id"]: o["totale_quintali"] for o in ordini}
+    assegnati = [i for c in piano["carichi"] for i in c["ordini_ids"]]
+    assert len(assegnati) == len(set(assegnati))
+    assert sorted(assegnati + piano["ordini_residui"]) == sorted(quintali)
+    for carico in piano["carichi"]:
+        assert carico["totale_quintali"] == sum(quintali[i] for i in carico["ordini_ids"])
+        assert cs.SOGLIA_MINIMA <= carico["totale_quintali"] <= cs.SOGLIA_MASSIMA_PIANO
+    assert piano["quintali_residui"] == sum(quintali[i] for i in piano["ordini_residui"])
+
+
+def test_partiziona_gruppo_massimizza_i_carichi():
+    # Il greedy sui carichi più leggeri trova 3 carichi e lascia 365q
+    ordini = _ordini_piano([100, 90, 95, 120, 180, 60, 150, 140, 200, 85])
+
+    piano = cs.partiziona_gruppo(ordini, tempo_max_ms=10_000)
+
+    _verifica_piano(ordini, piano)
+    assert len(piano["carichi"]) == 4
+    assert piano["quintali_residui"] == Decimal("60")
+
+
+def _oracolo_piano(ordini: list) -> tuple:
+    """Miglior (carichi, quintali assegnati) per enumerazione di tutte le partizioni"""
+    carichi_ammessi = [
+        frozenset(c)
+        for k in range(1, len(ordini) + 1)
+        for c in itertools.combinations(range(len(ordini)), k)
+        if cs.SOGLIA_MINIMA <= sum(ordini[i]["totale_quintali"] for i in c) <= cs.SOGLIA_MASSIMA_PIANO
+    ]
+
+    def migliore(liberi: frozenset) -> tuple:
+        risultato = (0, Decimal("0"))
+        for carico in carichi_ammessi:
+            if carico <= liberi:
+                n, q = migliore(liberi - carico)
+                risultato = max(risultato, (n + 1, q + sum(ordini[i]["totale_quintali"] for i in carico)))
+        return risultato
+
+    return migliore(frozenset(range(len(ordini))))
+
+
+@pytest.mark.parametrize("seme", range(15))
+def test_partiziona_gruppo_ottimo_su_gruppi_piccoli(seme):
+    rnd = random.Random(seme)
+    ordini = _ordini_piano([rnd.choice([40, 60, 75, 90, 100, 120, 140, 150, 180, 200]) for _ in range(rnd.randint(3, 9))])
+
+    piano = cs.partiziona_gruppo(ordini, tempo_max_ms=10_000)
+
+    _verifica_piano(ordini, piano)
+    assegnati = sum(c["totale_quintali"] for c in piano["carichi"])
+    assert (len(piano["carichi"]), assegnati) == _oracolo_piano(ordini)
+
+
+
+def test_partiziona_gruppo_con_molti_ordini_esclusi():
+    # Due ordini da 131-139q non arrivano a 280, tre superano 300: ogni ordine
+    # resta fuori dal piano, senza un livello di ricorsione per ciascuno
+    rnd = random.Random(7)
+    ordini = _ordini_piano([rnd.randint(131, 139) for _ in range(1200)])
+
+    piano = cs.partiziona_gruppo(ordini, tempo_max_ms=120_000)
+
+    _verifica_piano(ordini, piano)
+    assert piano["carichi"] == []
+    assert len(piano["ordini_residui"]) == 1200
+
+
+def test_partiziona_gruppo_con_molti_carichi():
+    rnd = random.Random(7)
+    ordini = _ordini_piano([rnd.randint(131, 139) for _ in range(600)] + [150] * 300)
+
+    piano = cs.partiziona_gruppo(ordini, tempo_max_ms=1_000)
+
+    _verifica_piano(ordini, piano)
+    assert len(piano["carichi"]) >= 150
@@ -0,0 +1,59 @@
+"""Endpoint della composizione carichi"""
+
+from sqlalchemy import select
+
+from app.models import Ordine
+from app.services import carico_service
+
+
+def test_mulini_con_ordini_include_i_mulini_secondari(client, db, anagrafiche, crea_ordine):
+    prodotto_a, prodotto_b = anagrafiche["prodotti"]
+    mulino_a, mulino_b = anagrafiche["mulini"]
+    # Molino B compare solo come riga secondaria: va comunque proposto nel filtro
+    crea_ordine([(prodotto_a, 200), (prodotto_b, 50)])
+
+    risposta = client.get("/api/composizione-carichi/mulini-con-ordini")
+
+    assert risposta.status_code == 200
+    assert risposta.json() == [
+        {"id": mulino_a.id, "nome": "Molino A"},
+        {"id": mulino_b.id, "nome": "Molino B"},
+    ]
+
+
+def test_mulini_con_ordini_esclude_ordini_assegnati(client, db, anagrafiche, crea_ordine):
+    prodotto_a, prodotto_b = anagrafiche["prodotti"]
+    crea_ordine(100, prodotto=prodotto_a)
+    assegnato = crea_ordine(100, prodotto=prodotto_b)
+    carico_service.create_draft_load(db, [assegnato.id])
+    db.commit()
+
+    risposta = client.get("/api/composizione-carichi/mulini-con-ordini")
+
+    assert [m["nome"] for m in risposta.json()] == ["Molino A"]
+
+
+def test_piano_carichi_confermato_in_blocco(client, db, anagrafiche, crea_ordine):
+    prodotto_a, prodotto_b = anagrafiche["prodotti"]
+    ids = [crea_ordine(145, prodotto=prodotto_a, giorni=i).id for i in range(6)]
+    fuori_mulino = crea_ordine(145, prodotto=prodotto_b).id
+    db.rollback()
+
+    piano = client.get("/api/composizione-carichi/piano-carichi", params={"parallelo": False}).json()
+    gruppo_a = next(g for g in piano["gruppi"] if g["mulino_nome"] == "Molino A")
+    carichi = [c["ordini_ids"] for c in gruppo_a["carichi"]]
+    assert len(carichi) == 3 and sorted(i for c in carichi for i in c) == ids
+
+    # Un carico non valido annulla tutto il piano
+    risposta = client.post("/api/composizione-carichi/piano-carichi", json={
+        "carichi": carichi[:2] + [carichi[2] + [fuori_mulino]]
+    })
+    assert risposta.status_code == 400
+    assert "Mulini diversi" in risposta.json()["detail"]
+
+    risposta = client.post("/api/composizione-carichi/piano-carichi", json={"carichi": carichi})
+    assert risposta.status_code == 201
+    carichi_ids = risposta.json()["carichi_ids"]
+    assert len(set(carichi_ids)) == 3
+    for carico_id, ordini_ids in zip(carichi_ids, carichi):
+        assert sorted(db.scalars(select(Ordine.id).where(Ordine.carico_id == carico_id))) == sorted(ordini_ids)
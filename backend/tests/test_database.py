@@ -0,0 +1,103 @@
+"""Instradamento delle letture sulla replica (get_read_db)"""
+
+from datetime import date
+from decimal import Decimal
+
+import pytest
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+
+from app import database
+from app.database import Base
+from app.models import Cliente, Mulino, Ordine, Prodotto, RigaOrdine
+
+VENDUTO = "/api/pagamenti/venduto-per-cliente"
+
+
+@pytest.fixture
+def replica(tmp_path, monkeypatch):
+    """
+    Replica su un secondo file SQLite, con un cliente che il primario non ha.
+    Ricontrollata a ogni richiesta; spegni() la rende irraggiungibile.
+    """
+    cartella = tmp_path / "replica"
+    cartella.mkdir()
+    replica_engine = create_engine(f"sqlite:///{cartella}/replica.db")
+    Base.metadata.create_all(bind=replica_engine)
+    SessionReplica = sessionmaker(autoflush=False, bind=replica_engine)
+
+    with SessionReplica() as sessione:
+        mulino = Mulino(nome="Molino Replica")
+        cliente = Cliente(nome="Forno Replica")
+        sessione.add_all([mulino, cliente])
+        sessione.flush()
+        prodotto = Prodotto(nome="Farina 1", mulino_id=mulino.id)
+        ordine = Ordine(cliente_id=cliente.id, data_ordine=date(2025, 1, 1), tipo_ordine="sfuso")
+        sessione.add_all([prodotto, ordine])
+        sessione.flush()
+        sessione.add(RigaOrdine(
+            ordine_id=ordine.id, prodotto_id=prodotto.id, mulino_id=mulino.id,
+            quintali=Decimal("10"), prezzo_quintale=Decimal("40"), prezzo_totale=Decimal("400")
+        ))
+        sessione.commit()
+
+    monkeypatch.setattr(database, "replica_engine", replica_engine)
+    monkeypatch.setattr(database, "SessionReplica", SessionReplica)
+    monkeypatch.setattr(database, "_stato_replica", database._StatoReplica())
+    monkeypatch.setattr(database, "REPLICA_CONTROLLO_S", 0)
+
+    def spegni():
+        replica_engine.dispose()
+        cartella.rename(tmp_path / "spenta")
+
+    yield {"sessione": SessionReplica, "spegni": spegni}
+    replica_engine.dispose()
+
+
+def _clienti_venduto(client) -> list:
+    risposta = client.get(VENDUTO)
+    assert risposta.status_code == 200
+    return [r["cliente_nome"] for r in risposta.json()]
+
+
+def test_senza_replica_le_letture_vanno_sul_primario(client, crea_ordine):
+    crea_ordine(100)
+
+    assert _clienti_venduto(client) == ["Panificio Rossi"]
+    assert client.get("/api/internal/replica").json()["configurata"] is False
+
+
+def test_report_letti_dalla_replica(client, crea_ordine, replica):
+    crea_ordine(100)
+
+    assert _clienti_venduto(client) == ["Forno Replica"]
+    stato = client.get("/api/internal/replica").json()
+    assert (stato["configurata"], stato["utilizzabile"], stato["lag_s"]) == (True, True, 0.0)
+
+
+def test_replica_irraggiungibile_torna_al_primario(client, crea_ordine, replica):
+    crea_ordine(100)
+    assert _clienti_venduto(client) == ["Forno Replica"]
+
+    replica["spegni"]()
+
+    assert _clienti_venduto(client) == ["Panificio Rossi"]
+    stato = client.get("/api/internal/replica").json()
+    assert stato["utilizzabile"] is False and stato["errore"]
+
+
+def test_replica_in_ritardo_torna_al_primario(client, crea_ordine, replica, monkeypatch):
+    crea_ordine(100)
+    monkeypatch.setattr(database, "REPLICA_LAG_MAX_S", -1)
+
+    assert _clienti_venduto(client) == ["Panificio Rossi"]
+    assert client.get("/api/internal/replica").json()["errore"].startswith("Ritardo")
+
+
+def test_scritture_sempre_sul_primario(client, db, replica):
+    risposta = client.post("/api/clienti/", json={"nome": "Nuovo Cliente"})
+    assert risposta.status_code == 201
+
+    assert db.scalar(select(Cliente.nome).where(Cliente.id == risposta.json()["id"])) == "Nuovo Cliente"
+    with replica["sessione"]() as sessione:
+        assert sessione.scalars(select(Cliente.nome)).all() == ["Forno Replica"]
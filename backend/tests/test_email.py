@@ -0,0 +1,257 @@
+"""Coda di invio email verso un server SMTP locale di prova"""
+
+import socketserver
+import threading
+from datetime import datetime, timedelta, timezone
+from email import message_from_bytes
+
+import pytest
+from sqlalchemy import select
+
+from app.database import SessionLocal
+from app.models import EmailOutbox, Ordine, StatoEmail
+from app.services import email
+
+
+class _ServerSMTP(socketserver.ThreadingTCPServer):
+    """
+    Server SMTP minimo (senza TLS né login) che conserva i messaggi ricevuti.
+    `errori`: codici da restituire al DATA dei prossimi messaggi, uno per messaggio.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), _GestoreSMTP)
+        self.messaggi = []
+        self.errori = []
+        self.connessioni = 0
+
+
+class _GestoreSMTP(socketserver.StreamRequestHandler):
+    def rispondi(self, riga: str):
+        self.wfile.write(riga.encode() + b"\r\n")
+
+    def handle(self):
+        server = self.server
+        server.connessioni += 1
+        self.rispondi("220 sink ESMTP")
+        while True:
+            riga = self.rfile.readline()
+            if not riga:
+                return
+            verbo = riga.decode().strip()[:4].upper()
+            if verbo in ("EHLO", "HELO"):
+                self.rispondi("250 sink")
+            elif verbo in ("MAIL", "RCPT", "RSET", "NOOP"):
+                self.rispondi("250 OK")
+            elif verbo == "DATA":
+                if server.errori:
+                    codice = server.errori.pop(0)
+                    self.rispondi(f"{codice} errore di prova")
+                    continue
+                self.rispondi("354 dati")
+                dati = b""
+                while (riga := self.rfile.readline()) not in (b".\r\n", b""):
+                    dati += riga
+                server.messaggi.append(message_from_bytes(dati))
+                self.rispondi("250 accettato")
+            elif verbo == "QUIT":
+                self.rispondi("221 ciao")
+                return
+            else:
+                self.rispondi("502 non implementato")
+
+
+@pytest.fixture
+def smtp(monkeypatch):
+    server = _ServerSMTP()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(email, "SMTP_HOST", "127.0.0.1")
+    monkeypatch.setattr(email, "SMTP_PORT", server.server_address[1])
+    monkeypatch.setattr(email, "SMTP_STARTTLS", False)
+    monkeypatch.setattr(email, "SMTP_USER", "")
+    monkeypatch.setattr(email, "MAIL_FROM", "ordini@example.com")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def connessione():
+    connessione = email.ConnessioneSMTP()
+    yield connessione
+    connessione.chiudi()
+
+
+def _in_utc(quando: datetime) -> datetime:
+    """SQLite restituisce datetime senza fuso: sono in UTC"""
+    return quando if quando.tzinfo else quando.replace(tzinfo=timezone.utc)
+
+
+def _rendi_scaduti(db):
+    """Come se il backoff fosse trascorso"""
+    for messaggio in db.query(EmailOutbox).all():
+        messaggio.prossimo_tentativo_il = datetime.now(timezone.utc) - timedelta(seconds=1)
+    db.commit()
+
+
+def test_invio_dei_messaggi_in_coda(db, smtp, connessione, crea_ordine):
+    ordine = crea_ordine(100)
+    for i in range(3):
+        email.accoda_email(db, f"cliente{i}@example.com", f"Ordine {i}", "Corpo", ordine_id=ordine.id)
+    db.commit()
+
+    assert email.elabora_coda(db, connessione) == 3
+
+    assert [m["To"] for m in smtp.messaggi] == [f"cliente{i}@example.com" for i in range(3)]
+    assert smtp.messaggi[0]["Subject"] == "Ordine 0"
+    assert smtp.connessioni == 1  # Una sola connessione per tutta la coda
+    assert {m.stato for m in db.query(EmailOutbox)} == {StatoEmail.INVIATA.value}
+    assert db.get(Ordine, ordine.id).email_inviata_il is not None
+
+
+def test_errore_temporaneo_ritentato_con_backoff(db, smtp, connessione, crea_ordine):
+    ordine = crea_ordine(100)
+    messaggio = email.accoda_email(db, "cliente@example.com", "Ordine", "Corpo", ordine_id=ordine.id)
+    db.commit()
+    smtp.errori = [451, 451]
+
+    prima = datetime.now(timezone.utc)
+    assert email.elabora_coda(db, connessione) == 1
+    db.refresh(messaggio)
+    assert messaggio.stato == StatoEmail.IN_CODA.value
+    assert messaggio.tentativi == 1
+    assert "451" in messaggio.ultimo_errore
+    assert _in_utc(messaggio.prossimo_tentativo_il) >= prima + timedelta(seconds=email.EMAIL_BACKOFF_BASE_S)
+    assert db.get(Ordine, ordine.id).email_inviata_il is None
+    # Backoff non trascorso: niente da inviare
+    assert email.elabora_coda(db, connessione) == 0
+
+    _rendi_scaduti(db)
+    prima = datetime.now(timezone.utc)
+    assert email.elabora_coda(db, connessione) == 1
+    db.refresh(messaggio)
+    assert messaggio.tentativi == 2
+    assert _in_utc(messaggio.prossimo_tentativo_il) >= prima + timedelta(seconds=2 * email.EMAIL_BACKOFF_BASE_S)
+    assert db.get(Ordine, ordine.id).email_inviata_il is None
+
+    _rendi_scaduti(db)
+    assert email.elabora_coda(db, connessione) == 1
+    db.refresh(messaggio)
+    assert messaggio.stato == StatoEmail.INVIATA.value
+    assert messaggio.ultimo_errore is None
+    assert len(smtp.messaggi) == 1
+    assert db.get(Ordine, ordine.id).email_inviata_il is not None
+
+
+def test_errore_definitivo_non_ritentato(db, smtp, connessione, crea_ordine):
+    ordine = crea_ordine(100)
+    messaggio = email.accoda_email(db, "inesistente@example.com", "Ordine", "Corpo", ordine_id=ordine.id)
+    db.commit()
+    smtp.errori = [550]
+
+    assert email.elabora_coda(db, connessione) == 1
+
+    db.refresh(messaggio)
+    assert messaggio.stato == StatoEmail.ERRORE.value
+    assert messaggio.tentativi == 1
+    assert smtp.messaggi == []
+    assert db.get(Ordine, ordine.id).email_inviata_il is None
+
+
+def test_ordine_segnato_solo_quando_tutti_i_messaggi_sono_inviati(db, smtp, connessione, crea_ordine):
+    ordine = crea_ordine(100)
+    email.accoda_email(db, "cliente@example.com", "Ordine", "Corpo", ordine_id=ordine.id)
+    email.accoda_email(db, "mulino@example.com", "Ordine", "Corpo", ordine_id=ordine.id)
+    db.commit()
+    smtp.errori = [451]  # Il primo fallisce, il secondo passa
+    email.elabora_coda(db, connessione, limite=1)
+    email.elabora_coda(db, connessione, limite=1)
+
+    assert len(smtp.messaggi) == 1
+    assert db.get(Ordine, ordine.id).email_inviata_il is None
+
+    _rendi_scaduti(db)
+    email.elabora_coda(db, connessione)
+    assert len(smtp.messaggi) == 2
+    assert db.get(Ordine, ordine.id).email_inviata_il is not None
+
+
+class _ConnessioneSonda:
+    """Al posto dell'SMTP: durante l'invio esegue `sonda`, poi registra il messaggio"""
+
+    def __init__(self, sonda=None):
+        self.sonda = sonda
+        self.inviati = []
+
+    def invia(self, msg) -> None:
+        if self.sonda is not None:
+            self.sonda(msg)
+        self.inviati.append(msg["To"])
+
+    def chiudi(self) -> None:
+        pass
+
+
+def test_nessun_lock_durante_l_invio(db, crea_ordine):
+    ordine = crea_ordine(100)
+    email.accoda_email(db, "cliente@example.com", "Ordine", "Corpo", ordine_id=ordine.id)
+    db.commit()
+    visti = []
+
+    def sonda(msg):
+        # Un'altra sessione legge la riga con lock e scrive mentre l'invio è in corso
+        altra = SessionLocal()
+        try:
+            visti.append(altra.execute(
+                select(EmailOutbox.stato).with_for_update(nowait=True)
+            ).scalar_one())
+            email.accoda_email(altra, "mulino@example.com", "Ordine", "Corpo")
+            altra.commit()
+        finally:
+            altra.close()
+
+    connessione = _ConnessioneSonda(sonda)
+    assert email.elabora_coda(db, connessione, limite=1) == 1
+
+    assert visti == [StatoEmail.IN_INVIO.value]  # Prenotazione già confermata
+    assert connessione.inviati == ["cliente@example.com"]
+    assert db.get(Ordine, ordine.id).email_inviata_il is not None
+
+
+def test_messaggio_prenotato_non_inviato_da_un_altro_processo(db, crea_ordine):
+    ordine = crea_ordine(100)
+    messaggio = email.accoda_email(db, "cliente@example.com", "Ordine", "Corpo", ordine_id=ordine.id)
+    db.commit()
+    messaggio_id = messaggio.id
+
+    # Un altro processo prenota il messaggio e non ha ancora concluso l'invio
+    prenotato = email._prenota_messaggio(db)
+    assert (prenotato.id, prenotato.stato, prenotato.tentativi) == (messaggio_id, StatoEmail.IN_INVIO.value, 1)
+    assert email.email_in_coda(db, ordine.id)
+    db.rollback()
+
+    connessione = _ConnessioneSonda()
+    assert email.elabora_coda(db, connessione) == 0
+    assert connessione.inviati == []
+
+    # Prenotazione scaduta (processo terminato durante l'invio): il messaggio viene ripreso
+    _rendi_scaduti(db)
+    assert email.elabora_coda(db, connessione) == 1
+    assert connessione.inviati == ["cliente@example.com"]
+    messaggio = db.get(EmailOutbox, messaggio_id)
+    assert (messaggio.stato, messaggio.tentativi) == (StatoEmail.INVIATA.value, 2)
+    db.rollback()
+
+    # L'esito del primo processo, arrivato dopo, non sovrascrive quello del secondo
+    assert email._concludi_invio(db, messaggio_id, 1, stato=StatoEmail.IN_CODA.value) is False
+    db.commit()
+    assert db.get(EmailOutbox, messaggio_id).stato == StatoEmail.INVIATA.value
+
+
+def test_backoff_esponenziale_limitato():
+    assert email._backoff(1) == timedelta(seconds=email.EMAIL_BACKOFF_BASE_S)
+    assert email._backoff(3) == timedelta(seconds=4 * email.EMAIL_BACKOFF_BASE_S)
+    assert email._backoff(50) == timedelta(seconds=email.EMAIL_BACKOFF_MAX_S)
@@ -0,0 +1,63 @@
+"""Migrazioni Alembic su un database vuoto"""
+
+import bcrypt
+from alembic import command
+from sqlalchemy import create_engine, text
+
+from app.migrazioni import config_alembic, revisione_head
+
+
+def test_upgrade_head_crea_admin_senza_mostrare_la_password(tmp_path, capsys, caplog):
+    engine = create_engine(f"sqlite:///{tmp_path}/migrazioni.db")
+    with engine.begin() as conn:
+        command.upgrade(config_alembic(conn), "head")
+
+    with engine.connect() as conn:
+        revisione = conn.execute(text("SELECT version_num FROM alembic_version")).scalar()
+        hash_admin = conn.execute(
+            text("SELECT hashed_password FROM utenti WHERE username = 'admin'")
+        ).scalar()
+    engine.dispose()
+
+    assert revisione == revisione_head()
+    assert bcrypt.checkpw(b"admin", hash_admin.encode())
+    assert "password: admin" not in capsys.readouterr().out
+    assert any("admin" in r.getMessage() and r.levelname == "WARNING" for r in caplog.records)
+    assert not any("password: admin" in r.getMessage() for r in caplog.records)
+
+
+def test_migrazioni_riproducono_i_modelli(tmp_path):
+    # Nessuna differenza tra head e modelli: create_all dei test equivale
+    # allo schema migrato e autogenerate non propone operazioni spurie
+    engine = create_engine(f"sqlite:///{tmp_path}/check.db")
+    with engine.begin() as conn:
+        command.upgrade(config_alembic(conn), "head")
+    with engine.connect() as conn:
+        command.check(config_alembic(conn))
+    engine.dispose()
+
+
+def test_0011_popola_ultimo_prezzo_dallo_storico(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/prezzi.db")
+    with engine.begin() as conn:
+        command.upgrade(config_alembic(conn), "0010")
+        conn.execute(text("INSERT INTO clienti (id, nome) VALUES (1, 'Cliente')"))
+        conn.execute(text("INSERT INTO mulini (id, nome) VALUES (1, 'Mulino')"))
+        conn.execute(text("INSERT INTO prodotti (id, nome, mulino_id) VALUES (1, 'A', 1), (2, 'B', 1)"))
+        conn.execute(text("""
+            INSERT INTO storico_prezzi (id, cliente_id, prodotto_id, prezzo, creato_il) VALUES
+                (1, 1, 1, 40, '2025-01-01 10:00:00'),
+                (2, 1, 1, 42, '2025-02-01 10:00:00'),
+                (3, 1, 1, 41, '2025-02-01 10:00:00'),
+                (4, 1, 2, 30, '2025-01-15 10:00:00')
+        """))
+        command.upgrade(config_alembic(conn), "0011")
+
+    with engine.connect() as conn:
+        righe = conn.execute(text(
+            "SELECT prodotto_id, prezzo, num_registrazioni FROM ultimo_prezzo ORDER BY prodotto_id"
+        )).all()
+    engine.dispose()
+
+    # Stessa data: vale la riga con id maggiore
+    assert [(p, float(prezzo), n) for p, prezzo, n in righe] == [(1, 41.0, 3), (2, 30.0, 1)]
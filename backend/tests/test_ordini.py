@@ -0,0 +1,147 @@
+"""Endpoint degli ordini"""
+
+from decimal import Decimal
+
+import pytest
+
+from sqlalchemy import update
+
+from app.models import Carico, Ordine
+from app.services import carico_service, ordine_service
+
+
+def _query_lista(client, conta_query, url: str) -> tuple:
+    """(statement eseguiti, ordini restituiti)"""
+    with conta_query() as conteggio:
+        risposta = client.get(url)
+    assert risposta.status_code == 200
+    return conteggio["query"], risposta.json()
+
+
+@pytest.mark.parametrize("url", ["/api/ordini/", "/api/ordini/?stato=inserito&con_totale=true"])
+def test_lista_ordini_query_costanti(client, conta_query, anagrafiche, crea_ordine, url):
+    prodotto_a, prodotto_b = anagrafiche["prodotti"]
+    crea_ordine([(prodotto_a, 100), (prodotto_b, 50)])
+    query_pochi, ordini = _query_lista(client, conta_query, url)
+    assert len(ordini) == 1
+
+    for i in range(20):
+        crea_ordine([(prodotto_a, 40 + i), (prodotto_b, 10)], giorni=i)
+    query_molti, ordini = _query_lista(client, conta_query, url)
+
+    assert len(ordini) == 21
+    assert all(len(o["righe"]) == 2 for o in ordini)
+    assert query_molti == query_pochi
+
+
+# === MODIFICA DI UN ORDINE IN UN CARICO ===
+
+def _riga(prodotto, quintali, prezzo=40):
+    return {
+        "prodotto_id": prodotto.id, "mulino_id": prodotto.mulino_id, "quintali": str(quintali),
+        "prezzo_quintale": str(prezzo), "prezzo_totale": str(quintali * prezzo),
+    }
+
+
+@pytest.fixture
+def ordine_in_carico(db, crea_ordine):
+    """(id ordine, id carico): carico in BOZZA di due ordini da 100q del Molino A"""
+    ordini = [crea_ordine(100).id, crea_ordine(100).id]
+    carico = carico_service.create_draft_load(db, ordini)
+    db.commit()
+    return ordini[0], carico.id
+
+
+@pytest.mark.parametrize("modifica, errore", [
+    ("mulino", "Mulini diversi"),
+    ("tipo", "Tipi ordine misti"),
+    ("quintali", "Superato limite"),
+])
+def test_modifica_ordine_in_carico_incompatibile_rifiutata(client, db, anagrafiche, ordine_in_carico, modifica, errore):
+    ordine_id, carico_id = ordine_in_carico
+    prodotto_a, prodotto_b = anagrafiche["prodotti"]
+    dati = {
+        "mulino": {"righe": [_riga(prodotto_a, 30), _riga(prodotto_b, 70)]},
+        "tipo": {"tipo_ordine": "pedane"},
+        "quintali": {"righe": [_riga(prodotto_a, 250)]},
+    }[modifica]
+    db.rollback()  # Nessuna lettura aperta: su SQLite bloccherebbe la scrittura
+
+    risposta = client.put(f"/api/ordini/{ordine_id}", json=dati)
+
+    assert risposta.status_code == 400
+    assert errore in risposta.json()["detail"]
+    ordine = db.get(Ordine, ordine_id)
+    assert (ordine.tipo_ordine, ordine.mulino_principale_id) == ("sfuso", prodotto_a.mulino_id)
+    assert ordine.totale_quintali == Decimal("100")
+    assert db.get(Carico, carico_id).total_quantita == Decimal("200")
+
+
+def test_modifica_ordine_in_carico_compatibile_aggiorna_totale(client, db, anagrafiche, ordine_in_carico):
+    ordine_id, carico_id = ordine_in_carico
+    prodotto_a, prodotto_b = anagrafiche["prodotti"]
+
+    # Il mulino principale resta il Molino A (più quintali)
+    dati = {"righe": [_riga(prodotto_a, 120), _riga(prodotto_b, 30)]}
+    db.rollback()
+
+    risposta = client.put(f"/api/ordini/{ordine_id}", json=dati)
+
+    assert risposta.status_code == 200
+    assert db.get(Carico, carico_id).total_quantita == Decimal("250")
+
+
+# === TOTALI DENORMALIZZATI ===
+
+def _totali(db, ordine_id: int) -> tuple:
+    ordine = db.get(Ordine, ordine_id)
+    return ordine.totale_quintali, ordine.totale_importo, ordine.mulino_principale_id
+
+
+def test_totali_corrotti_trovati_e_riparati(db, anagrafiche, crea_ordine):
+    prodotto_a, prodotto_b = anagrafiche["prodotti"]
+    mulino_a, mulino_b = (m.id for m in anagrafiche["mulini"])
+    coerente = crea_ordine([(prodotto_a, 100), (prodotto_b, 50)]).id
+    quintali = crea_ordine(80).id
+    importo = crea_ordine(60).id
+    mulino = crea_ordine([(prodotto_a, 30), (prodotto_b, 70)]).id
+    pari = crea_ordine([(prodotto_b, 50), (prodotto_a, 50)]).id  # A parità vince l'id minore
+    senza_righe = crea_ordine([]).id
+    assert ordine_service.trova_totali_incoerenti(db) == []
+    assert _totali(db, pari)[2] == mulino_a
+
+    # Scritture che scavalcano il service: totali non più allineati alle righe
+    for ordine_id, valori in [
+        (quintali, {"totale_quintali": Decimal("81")}),
+        (importo, {"totale_importo": Decimal("0")}),
+        (mulino, {"mulino_principale_id": mulino_a}),
+        (pari, {"mulino_principale_id": mulino_b}),
+        (senza_righe, {"totale_quintali": Decimal("10"), "totale_importo": Decimal("400")}),
+    ]:
+        db.execute(update(Ordine).where(Ordine.id == ordine_id).values(**valori))
+    db.commit()
+
+    incoerenti = ordine_service.trova_totali_incoerenti(db)
+    assert [i["ordine_id"] for i in incoerenti] == [quintali, importo, mulino, pari, senza_righe]
+    per_ordine = {i["ordine_id"]: i for i in incoerenti}
+    assert per_ordine[quintali]["salvato"] == (Decimal("81"), Decimal("3200"), mulino_a)
+    assert per_ordine[quintali]["calcolato"] == (Decimal("80"), Decimal("3200"), mulino_a)
+    assert per_ordine[mulino]["calcolato"][2] == mulino_b
+    assert per_ordine[senza_righe]["calcolato"] == (Decimal("0"), Decimal("0"), None)
+    # Solo gli ordini richiesti
+    assert [i["ordine_id"] for i in ordine_service.trova_totali_incoerenti(db, [coerente, importo])] == [importo]
+
+    assert ordine_service.ripara_totali_ordini(db, [quintali]) == 1
+    db.commit()
+    assert _totali(db, quintali) == (Decimal("80"), Decimal("3200"), mulino_a)
+    assert len(ordine_service.trova_totali_incoerenti(db)) == 4
+
+    assert ordine_service.ripara_totali_ordini(db) == 4
+    db.commit()
+    assert ordine_service.trova_totali_incoerenti(db) == []
+    assert ordine_service.ripara_totali_ordini(db) == 0
+    assert _totali(db, importo) == (Decimal("60"), Decimal("2400"), mulino_a)
+    assert _totali(db, mulino) == (Decimal("100"), Decimal("4000"), mulino_b)
+    assert _totali(db, pari)[2] == mulino_a
+    assert _totali(db, senza_righe) == (Decimal("0"), Decimal("0"), None)
+    assert _totali(db, coerente) == (Decimal("150"), Decimal("6000"), mulino_a)
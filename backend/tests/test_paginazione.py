@@ -0,0 +1,156 @@
+"""Paginazione keyset: cursore, header e pagine successive"""
+
+import base64
+from datetime import date, datetime, timezone
+from decimal import Decimal
+
+import pytest
+from fastapi import HTTPException
+
+from app.database import engine
+from app.models import Carico, Cliente, Ordine
+from app.services import carico_service, paginazione
+
+
+def _scorri(client, url: str, limit: int, **parametri) -> list:
+    """Tutte le pagine seguendo X-Next-Cursor: lista degli id per pagina"""
+    pagine = []
+    cursore = None
+    while True:
+        risposta = client.get(url, params={**parametri, "limit": limit, **({"cursore": cursore} if cursore else {})})
+        assert risposta.status_code == 200
+        pagine.append([r["id"] for r in risposta.json()])
+        cursore = risposta.headers.get(paginazione.HEADER_CURSORE)
+        if cursore is None:
+            return pagine
+        assert len(pagine) < 100
+
+
+def _verifica_totale(risposta, atteso: int):
+    """COUNT esatto su SQLite; su PostgreSQL stima del planner"""
+    totale = int(risposta.headers[paginazione.HEADER_TOTALE])
+    if engine.dialect.name == "postgresql":
+        assert totale >= 0
+    else:
+        assert totale == atteso
+
+
+def _verifica_pagine(pagine: list, attesi: list, limit: int):
+    """Stesso ordine della lista completa: nessun duplicato, nessun buco"""
+    assert [i for pagina in pagine for i in pagina] == attesi
+    assert all(len(pagina) == limit for pagina in pagine[:-1])
+    assert 0 < len(pagine[-1]) <= limit
+
+
+# === CURSORE ===
+
+@pytest.mark.parametrize("valori, colonne", [
+    ((date(2025, 3, 1), 42), (Ordine.data_ordine, Ordine.id)),
+    ((datetime(2025, 3, 1, 10, 30, 5, 123456, tzinfo=timezone.utc), 7), (Carico.creato_il, Carico.id)),
+    (("Forno Città \"&\" co", 3), (Cliente.nome, Cliente.id)),
+    ((Decimal("280.50"), 1), (Ordine.totale_quintali, Ordine.id)),
+    ((None, 1), (Ordine.data_ritiro, Ordine.id)),
+])
+def test_cursore_andata_e_ritorno(valori, colonne):
+    cursore = paginazione.codifica_cursore(valori)
+
+    assert "=" not in cursore
+    assert paginazione.decodifica_cursore(cursore, colonne) == valori
+
+
+def _cursore_grezzo(testo: str) -> str:
+    return base64.urlsafe_b64encode(testo.encode()).decode()
+
+
+@pytest.mark.parametrize("cursore", [
+    "%%%",
+    _cursore_grezzo("non json"),
+    _cursore_grezzo('{"a": 1}'),
+    _cursore_grezzo('["2025-03-01"]'),  # Un valore solo
+    _cursore_grezzo('["2025-03-01", 1, 2]'),
+    _cursore_grezzo('["non una data", 1]'),
+    _cursore_grezzo('["2025-03-01", "uno"]'),
+])
+def test_cursore_malformato(cursore):
+    with pytest.raises(HTTPException) as errore:
+        paginazione.decodifica_cursore(cursore, (Ordine.data_ordine, Ordine.id))
+    assert errore.value.status_code == 400
+
+
+@pytest.mark.parametrize("url", ["/api/ordini/", "/api/clienti/", "/api/carichi/"])
+def test_cursore_malformato_400_sulle_liste(client, url):
+    risposta = client.get(url, params={"cursore": _cursore_grezzo('["x"]'), "limit": 2})
+    assert risposta.status_code == 400
+    assert risposta.json()["detail"].startswith("Cursore non valido")
+
+
+# === LISTE ===
+
+def test_ordini_a_pagine_con_date_uguali(client, db, crea_ordine):
+    # Sette ordini su tre date: lo spareggio è sull'id
+    giorni = [date(2025, 1, 1), date(2025, 1, 2), date(2025, 1, 1), date(2025, 1, 3),
+              date(2025, 1, 2), date(2025, 1, 1), date(2025, 1, 2)]
+    ordini = [crea_ordine(10) for _ in giorni]
+    for ordine, giorno in zip(ordini, giorni):
+        ordine.data_ordine = giorno
+    db.commit()
+    attesi = [o.id for o in sorted(ordini, key=lambda o: (o.data_ordine, o.id), reverse=True)]
+    db.rollback()
+
+    for limit in (1, 2, 3, 7):
+        _verifica_pagine(_scorri(client, "/api/ordini/", limit), attesi, limit)
+
+    completa = client.get("/api/ordini/", params={"limit": 7, "con_totale": True})
+    assert [o["id"] for o in completa.json()] == attesi
+    assert paginazione.HEADER_CURSORE not in completa.headers
+    _verifica_totale(completa, 7)
+
+    filtrata = client.get("/api/ordini/", params={"limit": 2, "data_a": "2025-01-02", "con_totale": True})
+    _verifica_totale(filtrata, 6)
+    assert paginazione.HEADER_CURSORE in filtrata.headers
+
+
+def test_clienti_a_pagine_con_nomi_uguali(client, db):
+    db.add_all([Cliente(nome=nome) for nome in ["Forno", "Bar", "Forno", "Alba", "Forno", "Bar"]])
+    db.commit()
+    attesi = [c.id for c in sorted(db.query(Cliente).all(), key=lambda c: (c.nome, c.id))]
+    db.rollback()
+
+    for limit in (1, 2, 4):
+        _verifica_pagine(_scorri(client, "/api/clienti/", limit), attesi, limit)
+
+    risposta = client.get("/api/clienti/", params={"limit": 2, "con_totale": True})
+    _verifica_totale(risposta, 6)
+
+
+def test_carichi_a_pagine_con_stessa_data_di_creazione(client, db, crea_ordine):
+    ordini = [crea_ordine(100) for _ in range(5)]
+    for ordine in ordini:
+        carico_service.create_draft_load(db, [ordine.id])
+    db.commit()
+    attesi = sorted((c.id for c in db.query(Carico).all()), reverse=True)
+    db.rollback()
+    # Data di creazione assegnata dall'applicazione
+    for limit in (1, 2, 3):
+        _verifica_pagine(_scorri(client, "/api/carichi/", limit), attesi, limit)
+
+    # Creati nello stesso istante: l'ordine dipende solo dall'id
+    istante = datetime(2025, 3, 1, 8, 0, tzinfo=timezone.utc)
+    db.query(Carico).update({Carico.creato_il: istante})
+    db.commit()
+    for limit in (1, 2, 3):
+        _verifica_pagine(_scorri(client, "/api/carichi/", limit), attesi, limit)
+
+    # Senza limit: tutti i carichi, nessun cursore
+    tutti = client.get("/api/carichi/", params={"con_totale": True})
+    assert [c["id"] for c in tutti.json()] == attesi
+    assert paginazione.HEADER_CURSORE not in tutti.headers
+    _verifica_totale(tutti, 5)
+
+
+def test_header_esposti_al_frontend(client):
+    risposta = client.get(
+        "/api/ordini/", headers={"Origin": "http://localhost:5173"}
+    )
+    esposti = risposta.headers["access-control-expose-headers"]
+    assert paginazione.HEADER_CURSORE in esposti and paginazione.HEADER_TOTALE in esposti
@@ -0,0 +1,76 @@
+"""Telemetria dei checkout del pool di connessioni"""
+
+import threading
+
+import pytest
+from sqlalchemy import create_engine, exc
+
+from app.pool import QueuePoolTelemetria, stato_pool
+
+
+@pytest.fixture
+def engine_piccolo(tmp_path):
+    """Pool da una connessione più una in overflow, timeout breve"""
+    engine = create_engine(
+        f"sqlite:///{tmp_path}/pool.db",
+        poolclass=QueuePoolTelemetria,
+        pool_size=1,
+        max_overflow=1,
+        pool_timeout=0.2,
+    )
+    yield engine
+    engine.dispose()
+
+
+def test_overflow_attese_e_timeout_oltre_la_dimensione(engine_piccolo):
+    pool = engine_piccolo.pool
+    prima = pool.connect()
+    seconda = pool.connect()  # Oltre pool_size: in overflow
+    stato = stato_pool(engine_piccolo)
+    assert (stato["checkout"], stato["overflow"], stato["overflow_attuale"], stato["in_uso"]) == (2, 1, 1, 2)
+    assert stato["attese"] == 0
+
+    # Pool esaurito: attende fino al timeout
+    with pytest.raises(exc.TimeoutError):
+        pool.connect()
+    stato = stato_pool(engine_piccolo)
+    assert (stato["timeout"], stato["checkout"]) == (1, 2)
+
+    # Pool esaurito: attende finché un'altra connessione torna nel pool
+    threading.Timer(0.05, prima.close).start()
+    terza = pool.connect()
+    stato = stato_pool(engine_piccolo)
+    assert (stato["checkout"], stato["attese"], stato["timeout"]) == (3, 1, 1)
+    assert stato["picco_in_uso"] == 2
+    assert stato["latenza_max_ms"] >= 40
+    assert sum(stato["istogramma_latenza"].values()) == 3
+
+    terza.close()
+    seconda.close()
+
+
+def test_contatori_sopravvivono_al_dispose(engine_piccolo):
+    engine_piccolo.pool.connect().close()
+    engine_piccolo.dispose()
+
+    assert isinstance(engine_piccolo.pool, QueuePoolTelemetria)
+    assert stato_pool(engine_piccolo)["checkout"] == 1
+
+
+def test_stato_pool_senza_telemetria():
+    assert stato_pool(None) is None
+    assert stato_pool(create_engine("sqlite://")) is None
+
+
+def test_endpoint_pool(client):
+    assert client.get("/api/clienti/").status_code == 200
+
+    risposta = client.get("/api/internal/pool")
+
+    assert risposta.status_code == 200
+    sincrono = risposta.json()["sincrono"]
+    assert sincrono["checkout"] >= 1
+    assert sincrono["dimensione"] >= 1
+    assert risposta.json()["replica"] is None
+    # Azzeramento non esposto: le finestre di misura sono differenze tra letture
+    assert client.post("/api/internal/pool/azzera").status_code in (404, 405)
@@ -0,0 +1,201 @@
+"""Storico prezzi e ultimo prezzo per cliente/prodotto"""
+
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+
+from sqlalchemy import select, update
+
+from app.models import Ordine, StoricoPrezzo, UltimoPrezzo
+from app.services import prezzi
+
+PASSATO = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def _storico(db, cliente_id, prodotto_id):
+    return [
+        riga.prezzo for riga in db.scalars(
+            select(StoricoPrezzo)
+            .where(StoricoPrezzo.cliente_id == cliente_id, StoricoPrezzo.prodotto_id == prodotto_id)
+            .order_by(StoricoPrezzo.creato_il, StoricoPrezzo.id)
+        )
+    ]
+
+
+def _aggiungi_storico(db, cliente_id, prodotto_id, prezzi_per_giorno):
+    """Righe di storico con data esplicita: giorno 0 = PASSATO"""
+    for giorno, prezzo in prezzi_per_giorno:
+        db.add(StoricoPrezzo(
+            cliente_id=cliente_id, prodotto_id=prodotto_id,
+            prezzo=Decimal(str(prezzo)), creato_il=PASSATO + timedelta(days=giorno)
+        ))
+    db.commit()
+
+
+def _ultimi(db):
+    return {
+        (u.cliente_id, u.prodotto_id): (u.prezzo, u.num_registrazioni, u.registrato_il)
+        for u in db.scalars(select(UltimoPrezzo))
+    }
+
+
+def _invecchia(db):
+    """Sposta al PASSATO le date di ordini, storico e ultimi prezzi"""
+    db.execute(update(Ordine).values(creato_il=PASSATO))
+    db.execute(update(StoricoPrezzo).values(creato_il=PASSATO))
+    db.execute(update(UltimoPrezzo).values(registrato_il=PASSATO))
+    db.commit()
+
+
+def _recente(istante) -> bool:
+    return istante.replace(tzinfo=None) > PASSATO.replace(tzinfo=None) + timedelta(days=1)
+
+
+# === REGISTRAZIONE ===
+
+def test_prezzo_invariato_non_ripetuto_ma_aggiorna_la_data(db, anagrafiche):
+    cliente_id = anagrafiche["cliente"].id
+    prodotto_id = anagrafiche["prodotti"][0].id
+
+    assert prezzi.registra_prezzi(db, cliente_id, [(prodotto_id, Decimal("40.00"))]) == 1
+    db.commit()
+    _invecchia(db)
+
+    assert prezzi.registra_prezzi(db, cliente_id, [(prodotto_id, Decimal("40.00"))]) == 0
+    db.commit()
+
+    assert _storico(db, cliente_id, prodotto_id) == [Decimal("40.00")]
+    ultimo = prezzi.ultimo_prezzo(db, cliente_id, prodotto_id)
+    assert (ultimo.prezzo, ultimo.num_registrazioni) == (Decimal("40.00"), 1)
+    assert _recente(ultimo.registrato_il)  # Data dell'ultimo ordine, non del cambio di prezzo
+
+
+def test_prezzi_ripetuti_nello_stesso_ordine(db, anagrafiche):
+    cliente_id = anagrafiche["cliente"].id
+    prodotto_a, prodotto_b = (p.id for p in anagrafiche["prodotti"])
+
+    inserite = prezzi.registra_prezzi(db, cliente_id, [
+        (prodotto_a, Decimal("40")), (prodotto_a, Decimal("40")),
+        (prodotto_b, Decimal("30")), (prodotto_a, Decimal("42")),
+    ])
+    db.commit()
+
+    assert inserite == 3
+    assert _storico(db, cliente_id, prodotto_a) == [Decimal("40"), Decimal("42")]
+    assert _storico(db, cliente_id, prodotto_b) == [Decimal("30")]
+    ultimi = _ultimi(db)
+    assert ultimi[(cliente_id, prodotto_a)][:2] == (Decimal("42"), 2)
+    assert ultimi[(cliente_id, prodotto_b)][:2] == (Decimal("30"), 1)
+
+
+def test_upsert_ultimo_prezzo_con_prodotti_ripetuti(db, anagrafiche):
+    cliente_id = anagrafiche["cliente"].id
+    prodotto_a, prodotto_b = (p.id for p in anagrafiche["prodotti"])
+
+    prezzi.aggiorna_ultimi_prezzi(db, cliente_id, [(prodotto_a, Decimal("40")), (prodotto_b, Decimal("30"))])
+    prezzi.aggiorna_ultimi_prezzi(db, cliente_id, [
+        (prodotto_a, Decimal("41")), (prodotto_a, Decimal("43")), (prodotto_a, Decimal("42")),
+    ])
+    db.commit()
+
+    ultimi = _ultimi(db)
+    assert ultimi[(cliente_id, prodotto_a)][:2] == (Decimal("42"), 4)  # Vale l'ultimo, una per occorrenza
+    assert ultimi[(cliente_id, prodotto_b)][:2] == (Decimal("30"), 1)
+
+
+# === LETTURA ===
+
+def test_letture_per_chiave_primaria(client, db, anagrafiche):
+    cliente_id = anagrafiche["cliente"].id
+    prodotto_a, prodotto_b = anagrafiche["prodotti"]
+    ids = prodotto_a.id, prodotto_b.id
+    prezzi.registra_prezzi(db, cliente_id, [(ids[0], Decimal("40")), (ids[1], Decimal("30"))])
+    prezzi.registra_prezzi(db, cliente_id, [(ids[0], Decimal("42"))])
+    db.commit()
+
+    assert prezzi.ultimo_prezzo(db, cliente_id, ids[0]).prezzo == Decimal("42")
+    assert prezzi.ultimo_prezzo(db, cliente_id + 1, ids[0]) is None
+
+    righe = db.execute(prezzi.query_prezzi_cliente(cliente_id)).all()
+    assert [(r.mulino_nome, r.prodotto_nome, r.ultimo_prezzo) for r in righe] == [
+        ("Molino A", "Farina 00", Decimal("42")),
+        ("Molino B", "Farina 0", Decimal("30")),
+    ]
+    db.rollback()
+
+    risposta = client.get(f"/api/ordini/ultimo-prezzo/{cliente_id}/{ids[0]}")
+    assert risposta.json()["prezzo"] == 42.0
+    assert client.get(f"/api/ordini/ultimo-prezzo/{cliente_id}/9999").json()["prezzo"] is None
+    risposta = client.get(f"/api/clienti/{cliente_id}/prezzi")
+    assert [r["ultimo_prezzo"] for r in risposta.json()] == ["42.00", "30.00"]
+    assert all(r["data_ultimo_ordine"] for r in risposta.json())
+
+
+# === MANUTENZIONE ===
+
+def test_compatta_storico_tiene_i_cambi_di_prezzo(db, anagrafiche):
+    cliente_id = anagrafiche["cliente"].id
+    prodotto_id = anagrafiche["prodotti"][0].id
+    _aggiungi_storico(db, cliente_id, prodotto_id, [(0, 40), (1, 40), (2, 42), (3, 42), (4, 42), (5, 40)])
+
+    assert prezzi.compatta_storico(db) == 3
+    db.commit()
+
+    assert _storico(db, cliente_id, prodotto_id) == [Decimal("40"), Decimal("42"), Decimal("40")]
+
+
+def test_retenzione_tiene_sempre_l_ultima_riga_della_coppia(db, anagrafiche):
+    cliente_id = anagrafiche["cliente"].id
+    prodotto_a, prodotto_b = (p.id for p in anagrafiche["prodotti"])
+    # Coppia A: tutte righe vecchie; coppia B: ultime due recenti
+    _aggiungi_storico(db, cliente_id, prodotto_a, [(0, 40), (1, 41), (2, 42)])
+    recente = (datetime.now(timezone.utc) - PASSATO).days
+    _aggiungi_storico(db, cliente_id, prodotto_b, [(0, 30), (recente - 2, 31), (recente - 1, 32)])
+
+    assert prezzi.applica_retenzione(db, giorni=30, max_per_coppia=0) == 3
+    db.commit()
+
+    assert _storico(db, cliente_id, prodotto_a) == [Decimal("42")]
+    assert _storico(db, cliente_id, prodotto_b) == [Decimal("31"), Decimal("32")]
+
+    assert prezzi.applica_retenzione(db, giorni=0, max_per_coppia=1) == 1
+    db.commit()
+    assert _storico(db, cliente_id, prodotto_b) == [Decimal("32")]
+    assert prezzi.applica_retenzione(db, giorni=0, max_per_coppia=0) == 0
+
+
+def test_ricostruzione_uguale_agli_aggiornamenti_incrementali(client, db, anagrafiche):
+    cliente_id = anagrafiche["cliente"].id
+    prodotto_a, prodotto_b = ((p.id, p.mulino_id) for p in anagrafiche["prodotti"])
+
+    def ordina(*righe):
+        db.rollback()  # Nessuna lettura aperta: su SQLite bloccherebbe la scrittura
+        risposta = client.post("/api/ordini/", json={
+            "cliente_id": cliente_id, "data_ordine": date.today().isoformat(), "tipo_ordine": "sfuso",
+            "righe": [
+                {
+                    "prodotto_id": prodotto_id, "mulino_id": mulino_id, "quintali": "10",
+                    "prezzo_quintale": str(prezzo), "prezzo_totale": str(prezzo * 10),
+                }
+                for (prodotto_id, mulino_id), prezzo in righe
+            ],
+        })
+        assert risposta.status_code in (200, 201)
+
+    ordina((prodotto_a, 40), (prodotto_b, 30))
+    ordina((prodotto_a, 42))
+    _invecchia(db)
+    ordina((prodotto_a, 42), (prodotto_b, 30))  # Stessi prezzi: solo la data avanza
+    db.rollback()
+
+    incrementali = _ultimi(db)
+    prezzi.ricostruisci_ultimi_prezzi(db)
+    db.commit()
+    ricostruiti = _ultimi(db)
+
+    assert ricostruiti.keys() == incrementali.keys()
+    for coppia, (prezzo, registrazioni, registrato_il) in incrementali.items():
+        assert ricostruiti[coppia][:2] == (prezzo, registrazioni)
+        assert _recente(registrato_il) and _recente(ricostruiti[coppia][2])
+        differenza = ricostruiti[coppia][2].replace(tzinfo=None) - registrato_il.replace(tzinfo=None)
+        assert abs(differenza) <= timedelta(seconds=5)
+    assert incrementali[(cliente_id, prodotto_a[0])][:2] == (Decimal("42"), 2)
@@ -0,0 +1,160 @@
+"""Calcolo e report delle provvigioni"""
+
+import threading
+import time
+from datetime import date
+from decimal import Decimal
+
+import pytest
+
+from app.database import SessionLocal
+from app.models import Ordine, Prodotto
+from app.services import provvigioni
+
+INCASSO = date(2025, 2, 10)  # Primo trimestre 2025
+
+
+@pytest.fixture
+def prodotto_senza_tipo(db, anagrafiche):
+    prodotto = Prodotto(
+        nome="Semola", mulino_id=anagrafiche["mulini"][0].id,
+        tipo_provvigione=None, valore_provvigione=Decimal("2")
+    )
+    db.add(prodotto)
+    db.commit()
+    return prodotto
+
+
+def test_espressione_sql_uguale_a_calcola_provvigione(db, anagrafiche, crea_ordine, prodotto_senza_tipo):
+    percentuale, fisso = anagrafiche["prodotti"]
+    casi = [
+        (percentuale, "100", "45.50"),
+        (percentuale, "37.25", "41.33"),
+        (fisso, "80", "40"),
+        (fisso, "12.75", "39.99"),
+        (prodotto_senza_tipo, "50", "40"),
+    ]
+    for prodotto, quintali, prezzo in casi:
+        crea_ordine([(prodotto, quintali)], prezzo=Decimal(prezzo), data_incasso_mulino=INCASSO)
+
+    righe = db.execute(provvigioni.query_righe_provvigione(date(2025, 1, 1), date(2025, 3, 31))).all()
+    prodotti = {p.nome: p for p in (percentuale, fisso, prodotto_senza_tipo)}
+
+    assert len(righe) == len(casi)
+    for riga in righe:
+        attesa = provvigioni.calcola_provvigione(
+            prodotti[riga.prodotto_nome], riga.quintali, riga.prezzo_quintale
+        )
+        assert riga.provvigione_calcolata == attesa
+
+
+def test_totali_arrotondati_ai_centesimi(client, db, anagrafiche, crea_ordine):
+    percentuale, fisso = anagrafiche["prodotti"]
+    # 3% di 100q a 45,50 = 136,50; 1,5/q su 273q = 409,50
+    crea_ordine([(percentuale, 100)], prezzo=Decimal("45.50"), data_incasso_mulino=INCASSO)
+    crea_ordine([(fisso, 273)], data_incasso_mulino=INCASSO)
+    provvigioni.ricostruisci_rollup(db)
+    db.commit()
+
+    ordini = client.get("/api/pagamenti/provvigioni/ordini?anno=2025&trimestre=1").json()
+    trimestre = client.get("/api/pagamenti/provvigioni/trimestre?anno=2025&trimestre=1").json()
+
+    assert ordini["totale_provvigioni"] == "546.00"
+    assert sorted(o["totale_provvigione"] for o in ordini["ordini"]) == ["136.50", "409.50"]
+    assert trimestre["totale_provvigioni"] == "546.00"
+    assert sorted(m["totale_provvigione"] for m in trimestre["provvigioni_per_mulino"]) == ["136.50", "409.50"]
+
+
+def test_dettaglio_mulino_senza_query_per_riga(client, conta_query, anagrafiche, crea_ordine):
+    percentuale, fisso = anagrafiche["prodotti"]
+    mulino_a = anagrafiche["mulini"][0]
+    url = f"/api/pagamenti/provvigioni/dettaglio-mulino/{mulino_a.id}?anno=2025&trimestre=1"
+
+    crea_ordine([(percentuale, 100), (fisso, 20)], prezzo=Decimal("45.50"), data_incasso_mulino=INCASSO)
+    with conta_query() as pochi:
+        dettaglio = client.get(url).json()
+    assert [(r["cliente_nome"], r["provvigione_calcolata"]) for r in dettaglio] == [("Panificio Rossi", "136.50")]
+
+    for _ in range(10):
+        crea_ordine([(percentuale, 50), (fisso, 20)], data_incasso_mulino=INCASSO)
+    with conta_query() as molti:
+        dettaglio = client.get(url).json()
+
+    assert len(dettaglio) == 11
+    assert {r["prodotto_nome"] for r in dettaglio} == {percentuale.nome}
+    assert molti["query"] == pochi["query"]
+
+
+# === ROLLUP ===
+
+def _rollup(db) -> list:
+    return sorted(
+        (r.mulino_id, r.totale_quintali, r.totale_provvigione, r.num_ordini)
+        for r in db.execute(provvigioni.query_rollup_trimestre(2025, 1))
+    )
+
+
+def _cambia_quintali(db, ordine_id: int, quintali: Decimal):
+    riga = db.get(Ordine, ordine_id).righe[0]
+    riga.quintali = quintali
+    riga.prezzo_totale = quintali * riga.prezzo_quintale
+    provvigioni.aggiorna_rollup_ordini(db, [ordine_id])
+
+
+def test_aggiorna_rollup_uguale_a_ricostruzione(db, anagrafiche, crea_ordine):
+    percentuale, fisso = anagrafiche["prodotti"]
+    ordine = crea_ordine([(percentuale, 100), (fisso, 50)], data_incasso_mulino=INCASSO)
+    crea_ordine([(percentuale, 80)], data_incasso_mulino=INCASSO)
+    provvigioni.ricostruisci_rollup(db)
+    db.commit()
+
+    _cambia_quintali(db, ordine.id, Decimal("60"))
+    db.commit()
+    incrementale = _rollup(db)
+    provvigioni.ricostruisci_rollup(db)
+    db.commit()
+
+    assert incrementale == _rollup(db)
+
+
+@pytest.mark.postgresql
+def test_aggiorna_rollup_concorrente_sulla_stessa_chiave(db, anagrafiche, crea_ordine):
+    percentuale = anagrafiche["prodotti"][0]
+    primo = crea_ordine([(percentuale, 100)], data_incasso_mulino=INCASSO)
+    secondo = crea_ordine([(percentuale, 80)], data_incasso_mulino=INCASSO)
+    provvigioni.ricostruisci_rollup(db)
+    db.commit()
+
+    # Prima transazione: aggiorna la chiave e resta aperta
+    sessione_1 = SessionLocal()
+    _cambia_quintali(sessione_1, primo.id, Decimal("120"))
+
+    # Seconda transazione sulla stessa chiave, in un altro thread: deve attendere
+    errori = []
+
+    def seconda():
+        sessione_2 = SessionLocal()
+        try:
+            _cambia_quintali(sessione_2, secondo.id, Decimal("90"))
+            sessione_2.commit()
+        except Exception as e:
+            errori.append(e)
+        finally:
+            sessione_2.close()
+
+    thread = threading.Thread(target=seconda)
+    thread.start()
+    time.sleep(0.5)
+    assert thread.is_alive()  # In attesa della prima
+    sessione_1.commit()
+    sessione_1.close()
+    thread.join(timeout=10)
+
+    assert not thread.is_alive()
+    assert errori == []
+    db.expire_all()
+    concorrente = _rollup(db)
+    provvigioni.ricostruisci_rollup(db)
+    db.commit()
+    assert concorrente == _rollup(db)
+    assert concorrente[0][1] == Decimal("210")
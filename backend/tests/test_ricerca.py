@@ -0,0 +1,146 @@
+"""Ricerca unificata (/api/search) e filtro search delle liste"""
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from app.database import engine
+from app.models import Cliente, Mulino, Prodotto, Trasportatore
+from app.services import ricerca
+from app.services.ricerca import EntitaRicerca
+
+
+@pytest.fixture
+def funzioni_sql():
+    """
+    PostgreSQL: pg_trgm e normalizza_ricerca come nella migrazione 0012
+    (lo schema dei test viene da create_all). Senza pg_trgm il test è saltato.
+    """
+    if engine.dialect.name != "postgresql":
+        return
+    try:
+        with engine.begin() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.execute(text(f"""
+                CREATE OR REPLACE FUNCTION normalizza_ricerca(testo text)
+                RETURNS text LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE
+                AS $$ SELECT translate(lower(testo), '{ricerca.CARATTERI_ACCENTATI}',
+                                       '{ricerca.CARATTERI_SEMPLICI}') $$
+            """))
+    except DBAPIError:
+        pytest.skip("estensione pg_trgm non disponibile")
+
+
+@pytest.fixture
+def nomi(db, anagrafiche, funzioni_sql):
+    """Oltre alle anagrafiche (Panificio Rossi, Farina 00 / 0, Molino A / B)"""
+    mulino_a = anagrafiche["mulini"][0]
+    db.add_all([
+        Cliente(nome="Forno Città"),
+        Cliente(nome="Forno Bianchi", referente="Mario Verdi"),
+        Cliente(nome="Forno Sud"),
+        Cliente(nome="Forno Rosi"),
+        Prodotto(nome="Farina 100% integrale", mulino_id=mulino_a.id),
+        Prodotto(nome="Farina 1000", mulino_id=mulino_a.id),
+        Mulino(nome="Molino_1"),
+        Mulino(nome="Molino-1"),
+        Trasportatore(nome="Trasporti Rossi"),
+    ])
+    db.commit()
+    db.rollback()
+
+
+def _cerca(client, q, **parametri) -> dict:
+    risposta = client.get("/api/search/", params={"q": q, **parametri})
+    assert risposta.status_code == 200
+    return {entita: [r["nome"] for r in righe] for entita, righe in risposta.json().items()}
+
+
+def _lista(client, entita, search) -> list:
+    risposta = client.get(f"/api/{entita}/", params={"search": search})
+    assert risposta.status_code == 200
+    return [r["nome"] for r in risposta.json()]
+
+
+# === TRIGRAMMI (Python) ===
+
+def test_normalizza_senza_accenti():
+    assert ricerca.normalizza("Forno CITTÀ Più Ñandù") == "forno citta piu nandu"
+    assert ricerca.normalizza(None) is None
+
+
+def test_similarita_come_word_similarity_di_pg_trgm():
+    # Esempio della documentazione di pg_trgm
+    assert ricerca.similarita_parola("word", "two words") == pytest.approx(0.8)
+    assert ricerca.similarita_parola("rosi", "Panificio Rossi") >= ricerca.RICERCA_SOGLIA
+    assert ricerca.similarita_parola("città", "FORNO CITTA") == 1.0
+    assert ricerca.similarita_parola("forno", "Panificio Rossi") == 0.0
+    assert ricerca.similarita_parola("", "Panificio Rossi") == 0.0
+    assert ricerca.similarita_parola("%", "Farina 100%") == 0.0
+
+
+# === RICERCA UNIFICATA ===
+
+def test_senza_distinzione_di_accenti_e_maiuscole(client, nomi):
+    assert _cerca(client, "citta")["clienti"] == ["Forno Città"]
+    assert _cerca(client, "CITTÀ")["clienti"] == ["Forno Città"]
+
+
+def test_tollera_errori_di_battitura(client, nomi):
+    risultati = _cerca(client, "rosi")
+
+    assert "Panificio Rossi" in risultati["clienti"]
+    assert risultati["trasportatori"] == ["Trasporti Rossi"]
+
+
+def test_prima_chi_contiene_il_testo(client, nomi):
+    # "Forno Rosi" somiglia soltanto: viene dopo chi contiene "rossi"
+    assert _cerca(client, "rossi")["clienti"] == ["Panificio Rossi", "Forno Rosi"]
+    # A parità di pertinenza, per nome
+    assert _cerca(client, "forno")["clienti"] == ["Forno Bianchi", "Forno Città", "Forno Rosi", "Forno Sud"]
+
+
+def test_cerca_anche_nel_referente(client, nomi):
+    risposta = client.get("/api/search/", params={"q": "verdi", "entita": "clienti"})
+    assert risposta.json()["clienti"] == [
+        {"id": risposta.json()["clienti"][0]["id"], "nome": "Forno Bianchi", "descrizione": "Mario Verdi"}
+    ]
+
+
+def test_caratteri_jolly_di_like_letterali(client, nomi):
+    assert _cerca(client, "%") == {
+        "clienti": [], "prodotti": ["Farina 100% integrale"], "mulini": [], "trasportatori": [],
+    }
+    # "Molino-1" somiglia ma non contiene "o_1": viene dopo
+    assert _cerca(client, "o_1", entita="mulini")["mulini"] == ["Molino_1", "Molino-1"]
+
+
+def test_limite_per_entita(client, nomi):
+    risultati = _cerca(client, "forno", limite=2)
+    assert risultati["clienti"] == ["Forno Bianchi", "Forno Città"]
+
+    risultati = _cerca(client, "farina", limite=1, entita=["prodotti", "mulini"])
+    assert len(risultati["prodotti"]) == 1
+    assert risultati["clienti"] == [] and risultati["trasportatori"] == []
+
+
+def test_testo_vuoto(client, db, nomi):
+    assert _cerca(client, "   ") == {"clienti": [], "prodotti": [], "mulini": [], "trasportatori": []}
+    assert client.get("/api/search/", params={"q": ""}).status_code == 422
+    assert ricerca.cerca(db, "", [EntitaRicerca.CLIENTI], 5) == {"clienti": []}
+
+
+# === LISTE ===
+
+def test_liste_per_sottostringa_senza_accenti(client, nomi):
+    assert _lista(client, "clienti", "citta") == ["Forno Città"]
+    assert _lista(client, "clienti", "verdi") == ["Forno Bianchi"]
+    # Nessuna tolleranza agli errori di battitura nelle liste
+    assert _lista(client, "clienti", "rossi") == ["Panificio Rossi"]
+    assert _lista(client, "trasportatori", "rosi") == []
+
+
+def test_liste_caratteri_jolly_letterali(client, nomi):
+    assert _lista(client, "prodotti", "100%") == ["Farina 100% integrale"]
+    assert _lista(client, "prodotti", "%") == ["Farina 100% integrale"]
+    assert _lista(client, "mulini", "o_1") == ["Molino_1"]
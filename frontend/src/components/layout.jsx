@@ -33,10 +33,12 @@ export default function Layout() {
     setPwdLoading(true);
     setPwdMsg({ text: '', error: false });
     try {
-      await api.put('/auth/password', {
+      const res = await api.put('/auth/password', {
         current_password: pwdForm.current,
         new_password: pwdForm.next,
       });
+      // Il cambio password revoca i token precedenti
+      localStorage.setItem('token', res.data.access_token);
       setPwdMsg({ text: 'Password aggiornata', error: false });
       setPwdForm({ current: '', next: '' });
       setTimeout(() => setShowPwdModal(false), 1200);
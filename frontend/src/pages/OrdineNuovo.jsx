@@ -104,6 +104,7 @@ export default function OrdineNuovo() {
         // Carica le righe esistenti
         const righeCaricate = ordine.righe.map(riga => ({
           id: riga.id,
+          salvata: true,
           prodotto_id: riga.prodotto_id,
           prodotto_nome: riga.prodotto_nome,
           prodotto_tipologia: riga.prodotto_tipologia,
@@ -389,6 +390,8 @@ export default function OrdineNuovo() {
         data_ritiro: formData.data_ritiro || null,
         data_incasso_mulino: formData.data_incasso_mulino || null,
         righe: righe.map(r => ({
+          // Le righe già salvate mantengono l'id: il backend aggiorna solo quelle cambiate
+          ...(r.salvata && { id: r.id }),
           prodotto_id: r.prodotto_id,
           mulino_id: r.mulino_id,
           pedane: r.pedane ? parseFloat(r.pedane) : null,
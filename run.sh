@@ -41,6 +41,13 @@ cd backend
 if [ -f "venv/bin/activate" ]; then
     source venv/bin/activate
 fi
+# Schema alla head delle migrazioni: l'app non parte con uno schema indietro
+if ! python -m app.manage migra-schema; then
+    echo -e "${RED}Errore: migrazione dello schema non riuscita${NC}"
+    echo "Database creato prima di Alembic: eseguire una volta"
+    echo "  cd backend && python -m app.manage adotta-schema"
+    exit 1
+fi
 uvicorn app.main:app --reload --host 0.0.0.0 --port 8000 &
 BACKEND_PID=$!
 cd ..